@@ -0,0 +1,348 @@
+#!/usr/bin/env python
+"""Times each stage of the median triplet tree pipeline on synthetic GTs.
+
+Usage:
+    python benchmarks/run_benchmarks.py [--suite quick|full] [-o results.json]
+                                        [--compare baseline.json]
+
+Every case is generated from a fixed seed, so runs on the same machine time
+exactly the same inputs, and also check that the best triplet score hasn't
+changed. See benchmarks/README.md for the stages and the cases.
+"""
+import argparse
+import contextlib
+import io
+import json
+import os
+import platform
+import sys
+from time import perf_counter
+
+import mtrip.median_tree_reconstruction as mtr
+import mtrip.triplet_omp as triplet_omp
+from mtrip import __version__
+from mtrip.cli.mtrip_suboptimal_cmd import get_candidates
+from mtrip.shard import merge_shards
+from mtrip.simulate import discordant_nwks, random_nwks
+
+# The weights array of more species doesn't fit in the C code's int
+# indices, or in a benchmarking machine's memory, so only parsing is timed
+__max_species__ = 18
+
+# Fraction of the gene trees' labels swapped away from the species tree
+__discordance__ = 0.3
+
+# (n_species, n_nwks, generator) of each case
+SUITES = {
+    "quick": [
+        (8, 100, "random"),
+        (8, 10000, "discordant"),
+        (10, 1000, "random"),
+        (12, 1000, "discordant"),
+    ],
+    "full": [
+        (8, 100, "random"),
+        (8, 10000, "discordant"),
+        (8, 1000000, "discordant"),
+        (10, 1000, "random"),
+        (12, 1000, "discordant"),
+        (12, 100000, "discordant"),
+        (14, 100, "random"),
+        (14, 10000, "discordant"),
+        (16, 1000, "discordant"),
+        (18, 100, "discordant"),
+        (20, 1000, "discordant"),
+        (22, 100, "discordant"),
+    ],
+}
+
+STAGES = ["parse", "weights", "stack", "trees", "candidates", "combine"]
+
+
+def get_case_name(n_species, n_nwks, generator):
+    return "{}-n{}-{}".format(generator, n_species, n_nwks)
+
+
+def get_nwks(n_species, n_nwks, generator, seed=0):
+    if generator == "random":
+        return random_nwks(n_species, n_nwks, seed=seed)
+
+    return discordant_nwks(n_species, n_nwks, __discordance__, seed=seed)[1]
+
+
+def timed(f, *args, **kwargs):
+    """Returns f's return value and its wall time in seconds. f's output is
+    thrown away, so the progress messages don't clutter the report."""
+    with contextlib.redirect_stdout(io.StringIO()):
+        tic = perf_counter()
+        value = f(*args, **kwargs)
+        toc = perf_counter()
+
+    return value, toc - tic
+
+
+def parse(nwks, n_threads=1):
+    """The Python half of process_nwks: counts the GT bipartitions and
+    arranges them for the C code. Returns the bipartition counts, the reverse
+    dictionary, and the arguments of py_compressed_weight_rep."""
+    weights, _, reverse_dictionary = mtr.get_bipart_counts(
+        nwks, n_threads=n_threads
+    )
+    subsets, start_i, end_i, biparts_a, biparts_b = mtr.get_subset_arrays(
+        weights
+    )
+    bipart_weights = [weights[x] for x in zip(biparts_a, biparts_b)]
+
+    return (
+        weights,
+        reverse_dictionary,
+        (subsets, start_i, end_i, biparts_a, biparts_b, bipart_weights),
+    )
+
+
+def run_case(nwks, n_threads=1):
+    """Runs each stage on the GTs nwks. Returns a dict of the stage times and
+    the best triplet score."""
+    times = {}
+    (weights, reverse_dictionary, arrays), times["parse"] = timed(
+        parse, nwks, n_threads=n_threads
+    )
+    n_species = len(reverse_dictionary)
+    result = {"times": times, "best_score": None, "n_trees": None}
+    if n_species > __max_species__:
+        return result
+
+    triplet_weights, times["weights"] = timed(
+        triplet_omp.py_compressed_weight_rep,
+        *arrays,
+        n_species,
+        n_threads=n_threads,
+        verbose=False,
+    )
+    (stack, best_biparts), times["stack"] = timed(
+        mtr.get_stack, triplet_weights, n_species
+    )
+    universe = 2**n_species - 1
+    trees, times["trees"] = timed(
+        mtr.get_all_trees, universe, reverse_dictionary, best_biparts
+    )
+    _, times["candidates"] = timed(
+        get_candidates,
+        triplet_weights,
+        stack,
+        reverse_dictionary,
+        int(0.99 * stack[universe]),
+        10,
+        40,
+    )
+
+    # mtrip-combine adds up the weights of two halves of the GTs; they have
+    # the same species, so their arrays line up
+    halves = []
+    for part in (nwks[: len(nwks) // 2], nwks[len(nwks) // 2:]):
+        with contextlib.redirect_stdout(io.StringIO()):
+            _, _, half_arrays = parse(part, n_threads=n_threads)
+        halves.append(
+            {
+                "shard": {"index": len(halves) + 1, "count": 2, "key": ""},
+                "triplet_weights": triplet_omp.py_compressed_weight_rep(
+                    *half_arrays,
+                    n_species,
+                    n_threads=n_threads,
+                    verbose=False,
+                ),
+            }
+        )
+    combined, times["combine"] = timed(merge_shards, halves)
+    if list(combined) != list(triplet_weights):
+        raise AssertionError("The combined weights differ from the weights")
+
+    result["best_score"] = stack[universe]
+    result["n_trees"] = len(trees)
+
+    return result
+
+
+def run_suite(suite, n_threads=1, repeat=1, seed=0):
+    cases = []
+    for n_species, n_nwks, generator in SUITES[suite]:
+        name = get_case_name(n_species, n_nwks, generator)
+        print("* Running {}".format(name))
+        nwks = get_nwks(n_species, n_nwks, generator, seed=seed)
+        # Keep the best of the repeats, which is the least noisy
+        best = None
+        for _ in range(repeat):
+            result = run_case(nwks, n_threads=n_threads)
+            if best is not None:
+                for stage, seconds in best["times"].items():
+                    result["times"][stage] = min(
+                        seconds, result["times"][stage]
+                    )
+            best = result
+        cases.append(
+            {
+                "name": name,
+                "n_species": n_species,
+                "n_nwks": n_nwks,
+                "generator": generator,
+                "seed": seed,
+                **best,
+            }
+        )
+        print(
+            "    "
+            + ", ".join(
+                "{} {:.3f} s".format(stage, best["times"][stage])
+                for stage in STAGES
+                if stage in best["times"]
+            )
+        )
+
+    return {
+        "version": __version__,
+        "python": platform.python_version(),
+        "machine": platform.machine(),
+        "cpus": os.cpu_count(),
+        "suite": suite,
+        "threads": n_threads,
+        "simd": triplet_omp.get_simd(),
+        "engine": triplet_omp.get_engine(),
+        "repeat": repeat,
+        "cases": cases,
+    }
+
+
+def compare(results, baseline, tolerance=0.25, min_seconds=0.05):
+    """Compares results with baseline. Returns a list of the lines of the
+    report, and the number of regressions: stages slower than the baseline by
+    more than tolerance (and min_seconds), and changed best scores."""
+    baseline_cases = {case["name"]: case for case in baseline["cases"]}
+    lines = [
+        "{:<28}{:<12}{:>12}{:>12}{:>10}".format(
+            "Case", "Stage", "Baseline", "Now", "Ratio"
+        )
+    ]
+    n_regressions = 0
+    for case in results["cases"]:
+        old = baseline_cases.get(case["name"])
+        if old is None:
+            lines.append("{:<28}not in the baseline".format(case["name"]))
+            continue
+        if old["best_score"] != case["best_score"]:
+            lines.append(
+                "{:<28}best score changed from {} to {}!".format(
+                    case["name"], old["best_score"], case["best_score"]
+                )
+            )
+            n_regressions += 1
+        for stage in STAGES:
+            if stage not in case["times"] or stage not in old["times"]:
+                continue
+            before = old["times"][stage]
+            after = case["times"][stage]
+            ratio = after / before if before > 0 else float("inf")
+            flag = ""
+            if after > before * (1 + tolerance) and after - before > min_seconds:
+                flag = "  slower"
+                n_regressions += 1
+            lines.append(
+                "{:<28}{:<12}{:>10.3f} s{:>10.3f} s{:>9.2f}x{}".format(
+                    case["name"], stage, before, after, ratio, flag
+                )
+            )
+
+    return lines, n_regressions
+
+
+def get_parser():
+    parser = argparse.ArgumentParser(
+        description="Benchmarks the stages of mtrip on synthetic GTs."
+    )
+    parser.add_argument(
+        "--suite",
+        choices=sorted(SUITES),
+        default="quick",
+        help="cases to run (default: quick)",
+    )
+    parser.add_argument(
+        "-o", metavar="FILE", help="write the results to this JSON file"
+    )
+    parser.add_argument(
+        "--compare",
+        metavar="FILE",
+        help="compare the results with a baseline JSON file, and exit with "
+        "status 1 if any stage got slower",
+    )
+    parser.add_argument(
+        "--tolerance",
+        type=float,
+        default=0.25,
+        help="allowed slowdown relative to the baseline (default: 0.25)",
+    )
+    parser.add_argument(
+        "-t", "--threads", type=int, default=1, help="#threads (default: 1)"
+    )
+    parser.add_argument(
+        "--simd",
+        choices=triplet_omp.simd_levels(),
+        default=None,
+        help="instruction set for the weights (default: the fastest this "
+        "CPU has)",
+    )
+    parser.add_argument(
+        "--engine",
+        choices=triplet_omp.ENGINES,
+        default=None,
+        help="engine for the weights (default: {})".format(
+            triplet_omp.get_engine()
+        ),
+    )
+    parser.add_argument(
+        "--repeat",
+        type=int,
+        default=3,
+        help="times to run each case, keeping the fastest (default: 3)",
+    )
+    parser.add_argument(
+        "--seed", type=int, default=0, help="seed of the GTs (default: 0)"
+    )
+
+    return parser
+
+
+def main():
+    args = get_parser().parse_args()
+    if args.simd is not None:
+        triplet_omp.set_simd(args.simd)
+    if args.engine is not None:
+        triplet_omp.set_engine(args.engine)
+    results = run_suite(
+        args.suite, n_threads=args.threads, repeat=args.repeat, seed=args.seed
+    )
+    if args.o is not None:
+        with open(args.o, "w") as f:
+            json.dump(results, f, indent=2)
+            f.write("\n")
+        print("* Wrote the results to {}".format(args.o))
+
+    if args.compare is not None:
+        with open(args.compare) as f:
+            baseline = json.load(f)
+        if baseline["machine"] != results["machine"]:
+            print("* The baseline was made on a different kind of machine.")
+        lines, n_regressions = compare(
+            results, baseline, tolerance=args.tolerance
+        )
+        print()
+        print("\n".join(lines))
+        print()
+        if n_regressions > 0:
+            print("{} regression(s) found.".format(n_regressions))
+            return 1
+        print("No regressions found.")
+
+    return 0
+
+
+if __name__ == "__main__":
+    sys.exit(main())
@@ -0,0 +1,529 @@
+#include "suboptimal.h"
+#include "weights_omp.h"
+#include <limits.h>
+#include <stdlib.h>
+#include <string.h>
+
+#define MAX_SPECIES 32
+
+/* Each candidate (a partially split tree) takes up stride entries of data:
+ * its number of splits, its number of active subsets (subsets with more
+ * than two species which still have to be split), n_species - 1 pairs of
+ * splits, and then the active subsets. Its score is kept separately. */
+struct candidates {
+    long *scores;
+    unsigned int *data;
+    long n;
+    long capacity;
+};
+
+/* The splits a of a subset x, with their bounds (the best score of a tree
+ * on x which splits it into a and x - a), from the highest bound to the
+ * lowest. Only the splits which can be in a tree with the minimum score
+ * are kept. */
+struct split {
+    unsigned int a;
+    int bound;
+};
+
+struct split_list {
+    long n;
+    struct split splits[];
+};
+
+struct sampler {
+    const int *weights;
+    const int *stack;
+    int n_species;
+    long min_score;
+    /* How far below the best score the trees can be */
+    long slack;
+    int stride;
+    /* The base-3 number with a 1 wherever x has a set bit */
+    long long *to_1;
+    /* The sorted splits of each subset, built when they're first needed */
+    struct split_list **index;
+};
+
+static inline unsigned int *candidate_splits(unsigned int *c) { return c + 2; }
+
+static inline unsigned int *candidate_active(const struct sampler *s,
+                                             unsigned int *c) {
+    return c + 2 + 2 * (s->n_species - 1);
+}
+
+/* Index of the split (x, a) in the weights array */
+static inline long split_rep(const struct sampler *s, unsigned int x,
+                             unsigned int a) {
+    unsigned int b = x - a;
+    long long rep_1 = s->to_1[a] + 2 * s->to_1[b];
+    long long rep_2 = s->to_1[b] + 2 * s->to_1[a];
+
+    return rep_1 < rep_2 ? rep_1 : rep_2;
+}
+
+/* The best score of any tree on x which splits it into a and x - a */
+static inline long split_bound(const struct sampler *s, unsigned int x,
+                               unsigned int a) {
+    return (long)s->weights[split_rep(s, x, a)] + s->stack[a] +
+           s->stack[x - a];
+}
+
+/* Finalizer of splitmix64, used to spread out the seeds. */
+static unsigned long long mix(unsigned long long z) {
+    z = (z ^ (z >> 30)) * 0xbf58476d1ce4e5b9ULL;
+    z = (z ^ (z >> 27)) * 0x94d049bb133111ebULL;
+
+    return z ^ (z >> 31);
+}
+
+static unsigned long long next_random(unsigned long long *state) {
+    /* splitmix64 */
+    *state += 0x9e3779b97f4a7c15ULL;
+
+    return mix(*state);
+}
+
+static int compare_splits(const void *p, const void *q) {
+    const struct split *x = p;
+    const struct split *y = q;
+    if (x->bound != y->bound) {
+        return x->bound > y->bound ? -1 : 1;
+    }
+
+    return x->a > y->a ? -1 : (x->a < y->a);
+}
+
+/* Returns the splits of x sorted by their bounds, or NULL if out of memory.
+ * Each list is built once, by whichever thread first needs it. */
+static const struct split_list *get_splits(const struct sampler *s,
+                                           unsigned int x) {
+    struct split_list *list = __atomic_load_n(&s->index[x], __ATOMIC_ACQUIRE);
+    if (list != NULL) {
+        return list;
+    }
+
+    /* a < x - a exactly when a doesn't have the top bit of x */
+    unsigned int low = x ^ (1u << (31 - __builtin_clz(x)));
+    long n = (1L << __builtin_popcount(low)) - 1;
+    list = malloc(sizeof(struct split_list) + n * sizeof(struct split));
+    if (list == NULL) {
+        return NULL;
+    }
+    /* The rest of any tree with the clade x scores at most the best score
+     * minus stack[x], so the splits with lower bounds can't be used */
+    long min_bound = s->stack[x] - s->slack;
+    list->n = 0;
+    for (unsigned int a = low; a > 0; a = low & (a - 1)) {
+        long bound = split_bound(s, x, a);
+        if (bound >= min_bound) {
+            list->splits[list->n].a = a;
+            list->splits[list->n].bound = bound;
+            list->n++;
+        }
+    }
+    qsort(list->splits, list->n, sizeof(struct split), compare_splits);
+    if (list->n < n) {
+        struct split_list *shrunk = realloc(
+            list, sizeof(struct split_list) + list->n * sizeof(struct split));
+        list = shrunk != NULL ? shrunk : list;
+    }
+
+    struct split_list *built = NULL;
+    if (!__atomic_compare_exchange_n(&s->index[x], &built, list, 0,
+                                     __ATOMIC_ACQ_REL, __ATOMIC_ACQUIRE)) {
+        /* Another thread got there first */
+        free(list);
+        list = built;
+    }
+
+    return list;
+}
+
+/* Called with the splits chosen[0], ..., chosen[k-2] of all but the last
+ * active subset, and the n_last splits last[0], ..., last[n_last-1] of the
+ * last one which complete them. */
+typedef int (*visit_fn)(void *ctx, unsigned int *chosen, int k,
+                        const struct split *last, long n_last);
+
+/* Calls visit for each combination of splits chosen[i], ..., chosen[k-2] of
+ * the subsets active[i], ..., active[k-2] which, with some splits of
+ * active[k-1], add up to at least required - bound_sum, where rest[i] is the
+ * sum of the stack over active[i+1], ..., active[k-1]. The splits of each
+ * subset are tried from the highest bound down, so the rest of them are
+ * skipped as soon as one can't reach required even with the best splits of
+ * the later subsets; the splits of the last subset which do are a prefix,
+ * found by bisection. Stops and returns visit's value when it isn't 0, or
+ * -1 if out of memory. */
+static int visit_splits(const struct sampler *s, const unsigned int *active,
+                        const long *rest, int k, int i, long bound_sum,
+                        long required, unsigned int *chosen, visit_fn visit,
+                        void *ctx) {
+    const struct split_list *list = get_splits(s, active[i]);
+    if (list == NULL) {
+        return -1;
+    }
+
+    if (i == k - 1) {
+        long lo = 0;
+        long hi = list->n;
+        while (lo < hi) {
+            long mid = lo + (hi - lo) / 2;
+            if (bound_sum + list->splits[mid].bound >= required) {
+                lo = mid + 1;
+            } else {
+                hi = mid;
+            }
+        }
+        return lo > 0 ? visit(ctx, chosen, k, list->splits, lo) : 0;
+    }
+
+    for (long j = 0; j < list->n; j++) {
+        long sum = bound_sum + list->splits[j].bound;
+        if (sum + rest[i] < required) {
+            break;
+        }
+        chosen[i] = list->splits[j].a;
+        int status = visit_splits(s, active, rest, k, i + 1, sum, required,
+                                  chosen, visit, ctx);
+        if (status) {
+            return status;
+        }
+    }
+
+    return 0;
+}
+
+/* Calls visit for the combinations of splits of the k > 0 subsets active
+ * whose bounds add up to at least required, as in visit_splits. */
+static int visit_combinations(const struct sampler *s,
+                              const unsigned int *active, int k,
+                              long required, visit_fn visit, void *ctx) {
+    unsigned int chosen[MAX_SPECIES];
+    long rest[MAX_SPECIES];
+    long sum = 0;
+    for (int i = k - 1; i >= 0; i--) {
+        rest[i] = sum;
+        sum += s->stack[active[i]];
+    }
+    if (sum < required) {
+        return 0;
+    }
+
+    return visit_splits(s, active, rest, k, 0, 0, required, chosen, visit,
+                        ctx);
+}
+
+/* Writes the candidate c, with its active subsets split by chosen, to
+ * new_c, and returns its score. */
+static long apply_splits(const struct sampler *s, unsigned int *c, long score,
+                         const unsigned int *chosen, unsigned int *new_c) {
+    int n_active = c[1];
+    unsigned int active[MAX_SPECIES];
+    memcpy(active, candidate_active(s, c), n_active * sizeof(unsigned int));
+    if (new_c != c) {
+        memcpy(new_c, c, 2 * s->n_species * sizeof(unsigned int));
+    }
+
+    unsigned int *splits = candidate_splits(new_c);
+    unsigned int *new_active = candidate_active(s, new_c);
+    new_c[1] = 0;
+    for (int i = 0; i < n_active; i++) {
+        unsigned int x = active[i];
+        unsigned int a = chosen[i];
+        score += s->weights[split_rep(s, x, a)];
+        splits[2 * new_c[0]] = x;
+        splits[2 * new_c[0] + 1] = a;
+        new_c[0]++;
+        if (__builtin_popcount(a) > 2) {
+            new_active[new_c[1]++] = a;
+        }
+        if (__builtin_popcount(x - a) > 2) {
+            new_active[new_c[1]++] = x - a;
+        }
+    }
+
+    return score;
+}
+
+/* Makes room for one more candidate. Returns -1 if out of memory. */
+static int grow(const struct sampler *s, struct candidates *cs) {
+    if (cs->n < cs->capacity) {
+        return 0;
+    }
+    long capacity = cs->capacity > 0 ? 2 * cs->capacity : 64;
+    long *scores = realloc(cs->scores, capacity * sizeof(long));
+    if (scores == NULL) {
+        return -1;
+    }
+    cs->scores = scores;
+    unsigned int *data =
+        realloc(cs->data, capacity * s->stride * sizeof(unsigned int));
+    if (data == NULL) {
+        return -1;
+    }
+    cs->data = data;
+    cs->capacity = capacity;
+
+    return 0;
+}
+
+struct burn_in {
+    const struct sampler *s;
+    /* The candidate being split */
+    unsigned int *c;
+    long score;
+    struct candidates *active;
+    struct candidates *finished;
+    /* Stop once there are this many candidates */
+    long cap;
+    int failed;
+};
+
+/* Adds the candidates split by chosen and each of the last splits to the
+ * active or finished ones. */
+static int add_candidates(void *ctx, unsigned int *chosen, int k,
+                          const struct split *last, long n_last) {
+    struct burn_in *b = ctx;
+    const struct sampler *s = b->s;
+    unsigned int new_c[4 * MAX_SPECIES];
+
+    for (long j = 0; j < n_last; j++) {
+        chosen[k - 1] = last[j].a;
+        long score = apply_splits(s, b->c, b->score, chosen, new_c);
+
+        struct candidates *cs = new_c[1] > 0 ? b->active : b->finished;
+        if (grow(s, cs) < 0) {
+            b->failed = 1;
+            return 1;
+        }
+        memcpy(cs->data + cs->n * s->stride, new_c,
+               s->stride * sizeof(unsigned int));
+        cs->scores[cs->n++] = score;
+        if (b->active->n + b->finished->n >= b->cap) {
+            return 1;
+        }
+    }
+
+    return 0;
+}
+
+/* Splits each candidate in level in all the ways which can reach the
+ * minimum score, breadth first, until there are n_burnin candidates or all
+ * of them are finished. The candidates which can still be split are left in
+ * level. Returns -1 if out of memory. */
+static int burn_in(const struct sampler *s, struct candidates *level,
+                   struct candidates *finished, int n_burnin) {
+    /* All the species are split before the candidates are counted */
+    long cap = LONG_MAX;
+
+    while (level->n > 0 &&
+           (cap == LONG_MAX || level->n + finished->n < n_burnin)) {
+        struct candidates next = {0};
+        struct burn_in b = {s, NULL, 0, &next, finished, cap, 0};
+        for (long i = 0; i < level->n; i++) {
+            b.c = level->data + i * s->stride;
+            b.score = level->scores[i];
+            int status = visit_combinations(s, candidate_active(s, b.c),
+                                            b.c[1], s->min_score - b.score,
+                                            add_candidates, &b);
+            if (status < 0) {
+                b.failed = 1;
+            }
+            if (status) {
+                break;
+            }
+        }
+        free(level->scores);
+        free(level->data);
+        *level = next;
+        if (b.failed) {
+            return -1;
+        }
+        cap = n_burnin;
+    }
+
+    return 0;
+}
+
+struct reservoir {
+    unsigned long long *random_state;
+    long count;
+    unsigned int chosen[MAX_SPECIES];
+};
+
+/* Keeps each of the combinations seen so far with the same probability,
+ * n_last of them at a time. */
+static int sample_splits(void *ctx, unsigned int *chosen, int k,
+                         const struct split *last, long n_last) {
+    struct reservoir *r = ctx;
+    r->count += n_last;
+    unsigned long long pick = next_random(r->random_state) % r->count;
+    if (pick < (unsigned long long)n_last) {
+        memcpy(r->chosen, chosen, (k - 1) * sizeof(unsigned int));
+        r->chosen[k - 1] = last[pick].a;
+    }
+
+    return 0;
+}
+
+struct refine_job {
+    const struct sampler *s;
+    const struct candidates *pool;
+    const long *picked;
+    unsigned long long seed;
+    long *scores;
+    unsigned int *splits;
+    int failed;
+};
+
+/* Splits the picked candidate item at random until it's a whole tree, with
+ * its own random numbers, so the trees don't depend on the threads. */
+static void refine_tree(void *data, int item, int thread_id) {
+    struct refine_job *job = data;
+    const struct sampler *s = job->s;
+    unsigned int c[4 * MAX_SPECIES];
+    memcpy(c, job->pool->data + job->picked[item] * s->stride,
+           s->stride * sizeof(unsigned int));
+    long score = job->pool->scores[job->picked[item]];
+    unsigned long long random_state = mix(job->seed + mix(item + 1));
+
+    while (c[1] > 0) {
+        struct reservoir r = {&random_state, 0};
+        if (visit_combinations(s, candidate_active(s, c), c[1],
+                               s->min_score - score, sample_splits,
+                               &r) < 0) {
+            __atomic_store_n(&job->failed, -1, __ATOMIC_RELAXED);
+            break;
+        }
+        if (r.count == 0) {
+            /* Only if the stack doesn't match the weights */
+            __atomic_store_n(&job->failed, -2, __ATOMIC_RELAXED);
+            break;
+        }
+        score = apply_splits(s, c, score, r.chosen, c);
+    }
+
+    job->scores[item] = score;
+    memcpy(job->splits + (long)item * 2 * (s->n_species - 1),
+           candidate_splits(c), 2 * (s->n_species - 1) * sizeof(unsigned int));
+}
+
+/* Samples up to n_trees trees with a score of at least min_score. First,
+ * the candidates are split in all possible ways, breadth first, until there
+ * are n_burnin of them, of which n_trees are picked at random (or all of
+ * them, if there are fewer than n_trees). Then each of these is split at
+ * random until it's a whole tree, on n_threads threads. Their scores and
+ * splits are written to scores and splits (which has 2 * (n_species - 1)
+ * entries per tree), and the number of candidates to n_candidates. The
+ * trees only depend on seed.
+ *
+ * Returns the number of trees, -1 if out of memory, or -2 if a candidate
+ * couldn't be split (the stack doesn't match the weights). */
+long sample_suboptimal(const int *weights, const int *stack, int n_species,
+                       long min_score, int n_trees, int n_burnin,
+                       unsigned long long seed, long *scores,
+                       unsigned int *splits, long *n_candidates,
+                       int n_threads) {
+    *n_candidates = 0;
+    if (n_species < 2 || n_species > MAX_SPECIES) {
+        return 0;
+    }
+
+    unsigned long long size = 1ULL << n_species;
+    struct sampler s = {weights,
+                        stack,
+                        n_species,
+                        min_score,
+                        stack[size - 1] - min_score,
+                        2 + 2 * (n_species - 1) + n_species,
+                        NULL,
+                        NULL};
+    s.to_1 = malloc(size * sizeof(long long));
+    s.index = calloc(size, sizeof(struct split_list *));
+    if (s.to_1 == NULL || s.index == NULL) {
+        free(s.to_1);
+        free(s.index);
+        return -1;
+    }
+    s.to_1[0] = 0;
+    for (unsigned long long x = 1; x < size; x++) {
+        long long power = 1;
+        for (int i = 0; i < __builtin_ctzll(x); i++) {
+            power *= 3;
+        }
+        s.to_1[x] = s.to_1[x & (x - 1)] + power;
+    }
+
+    long status = -1;
+    struct candidates level = {0};
+    struct candidates finished = {0};
+    struct candidates pool = {0};
+    long *picked = NULL;
+
+    /* Start from a single candidate, with all the species to split */
+    if (grow(&s, &level) < 0) {
+        goto done;
+    }
+    memset(level.data, 0, s.stride * sizeof(unsigned int));
+    level.data[1] = 1;
+    candidate_active(&s, level.data)[0] = size - 1;
+    level.scores[0] = 0;
+    level.n = 1;
+    if (burn_in(&s, &level, &finished, n_burnin) < 0) {
+        goto done;
+    }
+
+    /* The active candidates come first */
+    pool.n = level.n + finished.n;
+    pool.scores = malloc((pool.n > 0 ? pool.n : 1) * sizeof(long));
+    pool.data =
+        malloc((pool.n > 0 ? pool.n : 1) * s.stride * sizeof(unsigned int));
+    long n_picked = pool.n < n_trees ? pool.n : n_trees;
+    picked = malloc((n_picked > 0 ? n_picked : 1) * sizeof(long));
+    if (pool.scores == NULL || pool.data == NULL || picked == NULL) {
+        goto done;
+    }
+    for (long i = 0; i < level.n; i++) {
+        pool.scores[i] = level.scores[i];
+    }
+    for (long i = 0; i < finished.n; i++) {
+        pool.scores[level.n + i] = finished.scores[i];
+    }
+    if (level.n > 0) {
+        memcpy(pool.data, level.data,
+               level.n * s.stride * sizeof(unsigned int));
+    }
+    if (finished.n > 0) {
+        memcpy(pool.data + level.n * s.stride, finished.data,
+               finished.n * s.stride * sizeof(unsigned int));
+    }
+    *n_candidates = pool.n;
+
+    /* Pick the candidates (with replacement) */
+    unsigned long long random_state = mix(seed);
+    for (long i = 0; i < n_picked; i++) {
+        picked[i] =
+            pool.n < n_trees ? i : (long)(next_random(&random_state) % pool.n);
+    }
+
+    struct refine_job job = {&s, &pool, picked, seed, scores, splits, 0};
+    parallel_for(n_picked, refine_tree, &job, n_threads);
+    status = job.failed ? job.failed : n_picked;
+
+done:
+    for (unsigned long long x = 0; x < size; x++) {
+        free(s.index[x]);
+    }
+    free(s.index);
+    free(s.to_1);
+    free(level.scores);
+    free(level.data);
+    free(finished.scores);
+    free(finished.data);
+    free(pool.scores);
+    free(pool.data);
+    free(picked);
+
+    return status;
+}
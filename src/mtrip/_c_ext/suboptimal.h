@@ -0,0 +1,19 @@
+#ifndef SUBOPTIMAL_H
+#define SUBOPTIMAL_H
+
+/* Random sampling of trees with at least a given score, given the compressed
+ * weights array and the stack (the best score of each subset of species).
+ *
+ * Subsets of species are bitsets. A split of the subset x is given by a,
+ * where a and x - a are both nonempty and a < x - a. A tree is given by the
+ * splits of its clades with more than two species, as the pairs (x, a), at
+ * splits[2 * j] and splits[2 * j + 1] for j = 0, ..., n_species - 2, with
+ * x = 0 for unused pairs. The first pair splits all the species. */
+
+long sample_suboptimal(const int *weights, const int *stack, int n_species,
+                       long min_score, int n_trees, int n_burnin,
+                       unsigned long long seed, long *scores,
+                       unsigned int *splits, long *n_candidates,
+                       int n_threads);
+
+#endif
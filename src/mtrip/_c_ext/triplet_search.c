@@ -0,0 +1,680 @@
+#include "triplet_search.h"
+#include "weights_omp.h"
+#include <stdlib.h>
+#include <string.h>
+
+long triplet_table_size(int n_species) {
+    long n = n_species;
+
+    return n * (n * (n - 1) / 2);
+}
+
+/* Index of the pair {x, y} of distinct species among the n choose 2 pairs. */
+static inline long pair_index(long x, long y, long n) {
+    if (x > y) {
+        long t = x;
+        x = y;
+        y = t;
+    }
+
+    return x * (2 * n - x - 1) / 2 + (y - x - 1);
+}
+
+struct table_job {
+    const int *offsets;
+    const int *n_left;
+    const int *species;
+    const int *bipart_weights;
+    int n_species;
+    long n_pairs;
+    /* The bipartitions with species k on their left (2*b) or right (2*b+1)
+     * side are sides[side_start[k]] to sides[side_start[k+1]-1] */
+    const int *side_start;
+    const int *sides;
+    int *table;
+};
+
+/* Adds the triplets ij|k of every bipartition to row k of the table, so each
+ * thread writes to its own rows. */
+static void fill_triplet_row(void *data, int k, int thread_id) {
+    const struct table_job *job = data;
+    int *row = job->table + k * job->n_pairs;
+
+    for (int m = job->side_start[k]; m < job->side_start[k + 1]; m++) {
+        int b = job->sides[m] >> 1;
+        int middle = job->offsets[b] + job->n_left[b];
+        /* The pairs on the other side */
+        int start = (job->sides[m] & 1) ? job->offsets[b] : middle;
+        int end = (job->sides[m] & 1) ? middle : job->offsets[b + 1];
+        int w = job->bipart_weights[b];
+        for (int x = start; x < end; x++) {
+            long i = job->species[x];
+            long base = i * (2 * job->n_species - i - 1) / 2 - i - 1;
+            for (int y = x + 1; y < end; y++) {
+                row[base + job->species[y]] += w;
+            }
+        }
+    }
+}
+
+/* Adds the triplets of each bipartition, times its weight, to the table.
+ * Bipartition b has the species species[offsets[b]] to
+ * species[offsets[b+1]-1], the first n_left[b] of which are on its left
+ * side; each side is sorted. Returns 0, or -1 if out of memory. */
+int fill_triplet_table(const int *offsets, const int *n_left,
+                       const int *species, const int *bipart_weights,
+                       int n_biparts, int n_species, int *table,
+                       int n_threads) {
+    int *side_start = calloc(n_species + 1, sizeof(int));
+    int *sides = malloc(((size_t)offsets[n_biparts] + 1) * sizeof(int));
+    if (side_start == NULL || sides == NULL) {
+        free(side_start);
+        free(sides);
+        return -1;
+    }
+
+    for (int x = 0; x < offsets[n_biparts]; x++) {
+        side_start[species[x] + 1]++;
+    }
+    for (int k = 0; k < n_species; k++) {
+        side_start[k + 1] += side_start[k];
+    }
+    /* side_start[k] is the next free slot of species k, until it's shifted
+     * back below */
+    for (int b = 0; b < n_biparts; b++) {
+        for (int x = offsets[b]; x < offsets[b + 1]; x++) {
+            int right = x >= offsets[b] + n_left[b];
+            sides[side_start[species[x]]++] = 2 * b + right;
+        }
+    }
+    for (int k = n_species; k > 0; k--) {
+        side_start[k] = side_start[k - 1];
+    }
+    side_start[0] = 0;
+
+    struct table_job job = {
+        .offsets = offsets,
+        .n_left = n_left,
+        .species = species,
+        .bipart_weights = bipart_weights,
+        .n_species = n_species,
+        .n_pairs = (long)n_species * (n_species - 1) / 2,
+        .side_start = side_start,
+        .sides = sides,
+        .table = table,
+    };
+    parallel_for(n_species, fill_triplet_row, &job, n_threads);
+
+    free(side_start);
+    free(sides);
+
+    return 0;
+}
+
+struct frequency_job {
+    int n_species;
+    long n_pairs;
+    /* The triples starting with a are from index first_triple[a] on */
+    const long *first_triple;
+    int *table;
+    int *counts;
+    int to_table;
+};
+
+/* Copies the triplets of the triples starting with species a between the
+ * table and the frequencies. No two triples share an entry of either. */
+static void copy_triples(void *data, int a, int thread_id) {
+    const struct frequency_job *job = data;
+    long n = job->n_species;
+    int *t = job->counts + 3 * job->first_triple[a];
+
+    for (long b = a + 1; b < n; b++) {
+        int *ab = job->table + pair_index(a, b, n);
+        for (long c = b + 1; c < n; c++, t += 3) {
+            int *entries[3] = {ab + c * job->n_pairs,
+                               job->table + b * job->n_pairs +
+                                   pair_index(a, c, n),
+                               job->table + a * job->n_pairs +
+                                   pair_index(b, c, n)};
+            for (int r = 0; r < 3; r++) {
+                if (job->to_table) {
+                    *entries[r] = t[r];
+                } else {
+                    t[r] = *entries[r];
+                }
+            }
+        }
+    }
+}
+
+static int copy_frequencies(int *table, int n_species, int *counts,
+                            int n_threads, int to_table) {
+    long *first_triple = malloc((n_species + 1) * sizeof(long));
+    if (first_triple == NULL) {
+        return -1;
+    }
+    first_triple[0] = 0;
+    for (long a = 0; a < n_species; a++) {
+        long rest = n_species - a - 1;
+        first_triple[a + 1] = first_triple[a] + rest * (rest - 1) / 2;
+    }
+
+    struct frequency_job job = {
+        .n_species = n_species,
+        .n_pairs = (long)n_species * (n_species - 1) / 2,
+        .first_triple = first_triple,
+        .table = table,
+        .counts = counts,
+        .to_table = to_table,
+    };
+    parallel_for(n_species, copy_triples, &job, n_threads);
+    free(first_triple);
+
+    return 0;
+}
+
+/* Fills the triplet frequencies from the triplet table. Returns 0, or -1 if
+ * out of memory. */
+int fill_triplet_frequencies(const int *table, int n_species, int *counts,
+                             int n_threads) {
+    /* The table is only read */
+    return copy_frequencies((int *)table, n_species, counts, n_threads, 0);
+}
+
+/* Fills the triplet table from the triplet frequencies, leaving its entries
+ * for ij|i and ij|j alone. Returns 0, or -1 if out of memory. */
+int fill_table_from_frequencies(const int *counts, int n_species, int *table,
+                                int n_threads) {
+    /* The frequencies are only read */
+    return copy_frequencies(table, n_species, (int *)counts, n_threads, 1);
+}
+
+/* A tree being searched, with scratch space for scoring it. */
+struct search {
+    const int *table;
+    int n;
+    long n_pairs;
+    int *left;
+    int *right;
+    int *parent;
+    int *root;
+    int has_deadline;
+    double deadline;
+    int timed_out;
+    unsigned int random_state;
+    /* Set by index_tree: the nodes in preorder, the leaves from left to
+     * right, and the leaves below each node v, order[first[v]] to
+     * order[last[v]-1] */
+    int n_nodes;
+    int n_leaves;
+    int *preorder;
+    int *order;
+    int *first;
+    int *last;
+    int *stack;
+    /* pair_index(x, y) is pair_base[x] + y for x < y */
+    long *pair_base;
+    /* For regrafting */
+    int *pruned;
+    long *joined;
+    long *a;
+    long *b_left;
+    long *b_right;
+    long *gain;
+};
+
+static void free_search(struct search *s) {
+    free(s->preorder);
+    free(s->order);
+    free(s->first);
+    free(s->last);
+    free(s->stack);
+    free(s->pruned);
+    free(s->pair_base);
+    free(s->joined);
+    free(s->a);
+    free(s->b_left);
+    free(s->b_right);
+    free(s->gain);
+}
+
+static int init_search(struct search *s, const int *table, int n, int *left,
+                       int *right, int *parent, int *root) {
+    size_t n_nodes = 2 * (size_t)n;
+
+    memset(s, 0, sizeof(*s));
+    s->table = table;
+    s->n = n;
+    s->n_pairs = (long)n * (n - 1) / 2;
+    s->left = left;
+    s->right = right;
+    s->parent = parent;
+    s->root = root;
+    s->preorder = malloc(n_nodes * sizeof(int));
+    s->order = malloc(n_nodes * sizeof(int));
+    s->first = malloc(n_nodes * sizeof(int));
+    s->last = malloc(n_nodes * sizeof(int));
+    s->stack = malloc(n_nodes * sizeof(int));
+    s->pruned = malloc(n_nodes * sizeof(int));
+    s->pair_base = malloc(n_nodes * sizeof(long));
+    s->joined = malloc((size_t)n * n * sizeof(long));
+    s->a = malloc(n_nodes * sizeof(long));
+    s->b_left = malloc(n_nodes * sizeof(long));
+    s->b_right = malloc(n_nodes * sizeof(long));
+    s->gain = malloc(n_nodes * sizeof(long));
+    if (s->preorder == NULL || s->order == NULL || s->first == NULL ||
+        s->last == NULL || s->stack == NULL || s->pruned == NULL ||
+        s->pair_base == NULL || s->joined == NULL || s->a == NULL || s->b_left == NULL ||
+        s->b_right == NULL || s->gain == NULL) {
+        free_search(s);
+        return -1;
+    }
+    for (long x = 0; x < n; x++) {
+        s->pair_base[x] = x * (2 * (long)n - x - 1) / 2 - x - 1;
+    }
+
+    return 0;
+}
+
+/* Whether the time is up. */
+static int out_of_time(struct search *s) {
+    if (s->has_deadline && !s->timed_out && wall_time() > s->deadline) {
+        s->timed_out = 1;
+    }
+
+    return s->timed_out;
+}
+
+static unsigned int next_random(struct search *s) {
+    /* xorshift32 */
+    unsigned int x = s->random_state;
+    x ^= x << 13;
+    x ^= x >> 17;
+    x ^= x << 5;
+    s->random_state = x;
+
+    return x;
+}
+
+/* Fills the preorder, the leaf order and the leaf ranges of the tree. */
+static void index_tree(struct search *s) {
+    int n_nodes = 0;
+    int n_leaves = 0;
+    int top = 0;
+
+    if (*s->root >= 0) {
+        s->stack[top++] = *s->root;
+    }
+    while (top > 0) {
+        int v = s->stack[--top];
+        s->preorder[n_nodes++] = v;
+        s->first[v] = n_leaves;
+        if (v < s->n) {
+            s->order[n_leaves++] = v;
+        } else {
+            s->stack[top++] = s->right[v];
+            s->stack[top++] = s->left[v];
+        }
+    }
+    for (int i = n_nodes - 1; i >= 0; i--) {
+        int v = s->preorder[i];
+        s->last[v] = (v < s->n) ? s->first[v] + 1 : s->last[s->right[v]];
+    }
+    s->n_nodes = n_nodes;
+    s->n_leaves = n_leaves;
+}
+
+/* Number of GTs with xy|z. */
+static inline int count(const struct search *s, int x, int y, int z) {
+    return s->table[z * s->n_pairs + pair_index(x, y, s->n)];
+}
+
+/* Sum of T(xy|z) over the pairs x, y below v and z below w. */
+static long pairs_against(const struct search *s, int v, int w) {
+    long total = 0;
+
+    for (int zi = s->first[w]; zi < s->last[w]; zi++) {
+        const int *row = s->table + s->order[zi] * s->n_pairs;
+        for (int xi = s->first[v]; xi < s->last[v]; xi++) {
+            for (int yi = xi + 1; yi < s->last[v]; yi++) {
+                total += row[pair_index(s->order[xi], s->order[yi], s->n)];
+            }
+        }
+    }
+
+    return total;
+}
+
+/* Sets *score to the number of GT triplets the tree agrees with. Returns 0,
+ * or -1 if out of memory. */
+int triplet_tree_score(const int *table, int n_species, const int *left,
+                       const int *right, int root, long *score) {
+    struct search s;
+    /* The tree is only read */
+    if (init_search(&s, table, n_species, (int *)left, (int *)right, NULL,
+                    &root) < 0) {
+        return -1;
+    }
+
+    index_tree(&s);
+    long total = 0;
+    for (int i = 0; i < s.n_nodes; i++) {
+        int v = s.preorder[i];
+        if (v >= n_species) {
+            total += pairs_against(&s, s.left[v], s.right[v]) +
+                     pairs_against(&s, s.right[v], s.left[v]);
+        }
+    }
+    *score = total;
+    free_search(&s);
+
+    return 0;
+}
+
+/* Puts node x in place of the child old of node v, or makes it the root if
+ * v is -1. */
+static void replace_child(struct search *s, int v, int old, int x) {
+    if (v < 0) {
+        *s->root = x;
+    } else if (s->left[v] == old) {
+        s->left[v] = x;
+    } else {
+        s->right[v] = x;
+    }
+    s->parent[x] = v;
+}
+
+static inline int sibling(const struct search *s, int v) {
+    int u = s->parent[v];
+
+    return (s->left[u] == v) ? s->right[u] : s->left[u];
+}
+
+/* Makes the internal node q the parent of p and v, in v's place. */
+static void attach(struct search *s, int q, int p, int v) {
+    replace_child(s, s->parent[v], v, q);
+    s->left[q] = v;
+    s->right[q] = p;
+    s->parent[v] = q;
+    s->parent[p] = q;
+}
+
+/* Swaps the subtrees x and y, neither of which is below the other. */
+static void swap_subtrees(struct search *s, int x, int y) {
+    int px = s->parent[x];
+    int py = s->parent[y];
+
+    replace_child(s, px, x, y);
+    replace_child(s, py, y, x);
+}
+
+/* Sets gain[v], for each node v of the indexed tree, to the number of
+ * triplets gained by grafting the pruned leaves above v instead of above the
+ * root. Only the triplets with one pruned leaf change: with x and y split
+ * at m, the triplet is xy|p (a[m]) unless p is grafted below m, next to x
+ * (b_left[m]) or y (b_right[m]). */
+static void score_regrafts(struct search *s, int n_pruned) {
+    long n = s->n;
+
+    /* joined[y*n + x] is the number of GTs with px|y, over the pruned p.
+     * Each row of the table is only read for one y at a time, rather than
+     * jumping between the rows for each pair. */
+    for (int yi = 0; yi < s->n_leaves; yi++) {
+        int y = s->order[yi];
+        const int *row_y = s->table + y * s->n_pairs;
+        long *joined_y = s->joined + y * n;
+        for (int xi = 0; xi < s->n_leaves; xi++) {
+            joined_y[s->order[xi]] = 0;
+        }
+        for (int k = 0; k < n_pruned; k++) {
+            int p = s->pruned[k];
+            for (int xi = 0; xi < s->n_leaves; xi++) {
+                int x = s->order[xi];
+                joined_y[x] += row_y[(x < p) ? s->pair_base[x] + p
+                                             : s->pair_base[p] + x];
+            }
+        }
+    }
+
+    for (int i = 0; i < s->n_nodes; i++) {
+        int m = s->preorder[i];
+        if (m < s->n) {
+            continue;
+        }
+        int l = s->left[m];
+        int r = s->right[m];
+        long b_left = 0;
+        long b_right = 0;
+        for (int xi = s->first[l]; xi < s->last[l]; xi++) {
+            int x = s->order[xi];
+            for (int yi = s->first[r]; yi < s->last[r]; yi++) {
+                int y = s->order[yi];
+                b_left += s->joined[y * n + x];
+                b_right += s->joined[x * n + y];
+            }
+        }
+        s->a[m] = 0;
+        s->b_left[m] = b_left;
+        s->b_right[m] = b_right;
+    }
+    for (int k = 0; k < n_pruned; k++) {
+        const int *row_p = s->table + s->pruned[k] * s->n_pairs;
+        for (int i = 0; i < s->n_nodes; i++) {
+            int m = s->preorder[i];
+            if (m < s->n) {
+                continue;
+            }
+            int l = s->left[m];
+            int r = s->right[m];
+            long a = 0;
+            for (int xi = s->first[l]; xi < s->last[l]; xi++) {
+                int x = s->order[xi];
+                for (int yi = s->first[r]; yi < s->last[r]; yi++) {
+                    int y = s->order[yi];
+                    a += row_p[(x < y) ? s->pair_base[x] + y
+                                       : s->pair_base[y] + x];
+                }
+            }
+            s->a[m] += a;
+        }
+    }
+
+    s->gain[*s->root] = 0;
+    for (int i = 0; i < s->n_nodes; i++) {
+        int m = s->preorder[i];
+        if (m >= s->n) {
+            s->gain[s->left[m]] = s->gain[m] + s->b_left[m] - s->a[m];
+            s->gain[s->right[m]] = s->gain[m] + s->b_right[m] - s->a[m];
+        }
+    }
+}
+
+/* The node of the indexed tree with the largest gain, the earliest in
+ * preorder among ties, or v if it's among them. */
+static int best_regraft(const struct search *s, int v) {
+    int best = v;
+
+    for (int i = 0; i < s->n_nodes; i++) {
+        int u = s->preorder[i];
+        if (s->gain[u] > s->gain[best]) {
+            best = u;
+        }
+    }
+
+    return best;
+}
+
+/* Adds each leaf, in turn, where the tree agrees with the most triplets.
+ * Returns 0, or -1 if out of memory. */
+int add_leaves(const int *table, int n_species, int *left, int *right,
+               int *parent, int *root, const int *leaves, int n_leaves) {
+    struct search s;
+    if (init_search(&s, table, n_species, left, right, parent, root) < 0) {
+        return -1;
+    }
+
+    index_tree(&s);
+    int next = n_species + (s.n_leaves > 0 ? s.n_leaves - 1 : 0);
+    for (int i = 0; i < n_leaves; i++) {
+        int t = leaves[i];
+        left[t] = right[t] = -1;
+        if (*root < 0) {
+            *root = t;
+            parent[t] = -1;
+            continue;
+        }
+        index_tree(&s);
+        s.pruned[0] = t;
+        score_regrafts(&s, 1);
+        int q = next++;
+        attach(&s, q, t, best_regraft(&s, *root));
+    }
+    free_search(&s);
+
+    return 0;
+}
+
+/* Swaps a child of each internal node with the node's sibling, whenever
+ * that agrees with more triplets. Only the triplets with a leaf below each
+ * of the three subtrees change. Returns the number of swaps. */
+static long nni_sweep(struct search *s) {
+    long n_moves = 0;
+
+    index_tree(s);
+    for (int v = s->n; v < s->n + s->n_leaves - 1; v++) {
+        if (out_of_time(s)) {
+            break;
+        }
+        if (s->parent[v] < 0) {
+            continue;
+        }
+        int a = s->left[v];
+        int b = s->right[v];
+        int c = sibling(s, v);
+        long ab_c = 0;
+        long ac_b = 0;
+        long bc_a = 0;
+        for (int ai = s->first[a]; ai < s->last[a]; ai++) {
+            int x = s->order[ai];
+            for (int bi = s->first[b]; bi < s->last[b]; bi++) {
+                int y = s->order[bi];
+                for (int ci = s->first[c]; ci < s->last[c]; ci++) {
+                    int z = s->order[ci];
+                    ab_c += count(s, x, y, z);
+                    ac_b += count(s, x, z, y);
+                    bc_a += count(s, y, z, x);
+                }
+            }
+        }
+        if (ac_b > ab_c && ac_b >= bc_a) {
+            swap_subtrees(s, b, c);
+        } else if (bc_a > ab_c) {
+            swap_subtrees(s, a, c);
+        } else {
+            continue;
+        }
+        n_moves++;
+        index_tree(s);
+    }
+
+    return n_moves;
+}
+
+/* Prunes each subtree, in random order, and regrafts it where the tree
+ * agrees with the most triplets. Returns the number of subtrees moved. */
+static long spr_sweep(struct search *s) {
+    int n_nodes = 2 * s->n - 1;
+    long n_moves = 0;
+    /* The nodes, shuffled */
+    int *nodes = malloc(n_nodes * sizeof(int));
+    if (nodes == NULL) {
+        return -1;
+    }
+    for (int i = 0; i < n_nodes; i++) {
+        nodes[i] = i;
+    }
+    for (int i = n_nodes - 1; i > 0; i--) {
+        int j = next_random(s) % (i + 1);
+        int t = nodes[i];
+        nodes[i] = nodes[j];
+        nodes[j] = t;
+    }
+
+    for (int i = 0; i < n_nodes; i++) {
+        int p = nodes[i];
+        if (out_of_time(s)) {
+            break;
+        }
+        int q = s->parent[p];
+        if (q < 0) {
+            continue;
+        }
+        index_tree(s);
+        int n_pruned = s->last[p] - s->first[p];
+        memcpy(s->pruned, s->order + s->first[p], n_pruned * sizeof(int));
+        int v = sibling(s, p);
+        replace_child(s, s->parent[q], q, v);
+        index_tree(s);
+        int best = v;
+        if (s->n_nodes > 1) {
+            score_regrafts(s, n_pruned);
+            best = best_regraft(s, v);
+        }
+        attach(s, q, p, best);
+        if (best != v) {
+            n_moves++;
+        }
+    }
+    free(nodes);
+
+    return n_moves;
+}
+
+/* Improves the tree with NNI and SPR moves until none agrees with more
+ * triplets, or for at most time_limit seconds if it's not negative. The
+ * moves are tried in an order given by seed. Returns 0 if the tree can't be
+ * improved any further, 1 if the time ran out first, or -1 if out of
+ * memory. */
+int improve_tree(const int *table, int n_species, int *left, int *right,
+                 int *parent, int *root, unsigned int seed, double time_limit,
+                 long *n_moves) {
+    struct search s;
+    if (init_search(&s, table, n_species, left, right, parent, root) < 0) {
+        return -1;
+    }
+    if (time_limit >= 0) {
+        s.has_deadline = 1;
+        s.deadline = wall_time() + time_limit;
+    }
+    /* xorshift32 never leaves 0 */
+    s.random_state = seed * 2654435761u + 1;
+    if (s.random_state == 0) {
+        s.random_state = 1;
+    }
+
+    int status = 0;
+    *n_moves = 0;
+    while (1) {
+        long moves;
+        do {
+            moves = nni_sweep(&s);
+            *n_moves += moves;
+        } while (moves > 0 && !s.timed_out);
+        moves = spr_sweep(&s);
+        if (moves < 0) {
+            status = -1;
+            break;
+        }
+        *n_moves += moves;
+        if (s.timed_out) {
+            status = 1;
+            break;
+        }
+        if (moves == 0) {
+            break;
+        }
+    }
+    free_search(&s);
+
+    return status;
+}
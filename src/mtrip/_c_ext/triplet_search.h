@@ -0,0 +1,37 @@
+#ifndef TRIPLET_SEARCH_H
+#define TRIPLET_SEARCH_H
+
+/* Heuristic search for trees agreeing with many GT triplets, for more species
+ * than the weights array can handle.
+ *
+ * The triplet table has the number of GTs displaying ij|k (i < j) at
+ * table[k * n_pairs + pair index of (i, j)], where n_pairs is n choose 2 and
+ * the pairs are ordered (0,1), (0,2), ..., (0,n-1), (1,2), ...
+ *
+ * The triplet frequencies have the numbers of GTs with ab|c, ac|b and bc|a
+ * at counts[3t], counts[3t+1] and counts[3t+2], where t is the index of the
+ * triple a < b < c in (0,1,2), (0,1,3), ..., (0,1,n-1), (0,2,3), ...
+ *
+ * A tree on the species 0..n-1 has the leaves 0..n-1 and the internal nodes
+ * n..2n-2, each with an entry in left, right and parent (-1 if there is
+ * none). A partial tree with k leaves has the internal nodes n..n+k-2, and
+ * the leaves not in it have parent -1. */
+
+long triplet_table_size(int n_species);
+int fill_triplet_table(const int *offsets, const int *n_left,
+                       const int *species, const int *bipart_weights,
+                       int n_biparts, int n_species, int *table,
+                       int n_threads);
+int fill_triplet_frequencies(const int *table, int n_species, int *counts,
+                             int n_threads);
+int fill_table_from_frequencies(const int *counts, int n_species, int *table,
+                                int n_threads);
+int triplet_tree_score(const int *table, int n_species, const int *left,
+                       const int *right, int root, long *score);
+int add_leaves(const int *table, int n_species, int *left, int *right,
+               int *parent, int *root, const int *leaves, int n_leaves);
+int improve_tree(const int *table, int n_species, int *left, int *right,
+                 int *parent, int *root, unsigned int seed, double time_limit,
+                 long *n_moves);
+
+#endif
@@ -1,12 +1,17 @@
 #include "weights_omp.h"
 #include "lookup_table.h"
+#include "weights_simd.h"
 #include <math.h>
 #include <stdio.h>
 #include <stdlib.h>
+#include <string.h>
+#include <time.h>
 
-// Only include OpenMP if not explicitly disabled
+// Only include OpenMP if not explicitly disabled, and use pthreads instead
 #ifndef NO_OMP
 #include <omp.h>
+#else
+#include <pthread.h>
 #endif
 
 /* Calculate n choose 2. */
@@ -63,144 +68,1120 @@ int n_common_triplets(int a, int b, int c, int d) {
     return total;
 }
 
-int n_common_triplets_avx(int a, int b, int c, int d) {
-    int total = 0;
+/* Wall-clock time in seconds, for timing each thread. */
+double wall_time(void) {
+#ifndef NO_OMP
+    return omp_get_wtime();
+#else
+    struct timespec ts;
+    clock_gettime(CLOCK_MONOTONIC, &ts);
+    return ts.tv_sec + 1e-9 * ts.tv_nsec;
+#endif
+}
 
-    int n_ac = __builtin_popcount(a & c);
-    int n_ad = __builtin_popcount(a & d);
-    int n_bc = __builtin_popcount(b & c);
-    int n_bd = __builtin_popcount(b & d);
+/* Atomically adds value to *target. */
+static inline void atomic_add(int *target, int value) {
+#ifndef NO_OMP
+#pragma omp atomic update
+    *target += value;
+#else
+    __atomic_fetch_add(target, value, __ATOMIC_RELAXED);
+#endif
+}
 
-    total = combinations_2(n_ac) * n_bd + combinations_2(n_ad) * n_bc +
-            combinations_2(n_bc) * n_ad + combinations_2(n_bd) * n_ac;
+/* Everything the threads of one weights computation share. The fields after
+ * two2three are only used by some of the kernels. */
+struct weights_job {
+    int *subsets;
+    int *start_i;
+    int *end_i;
+    int *left_sets;
+    int *right_sets;
+    int *bipart_weights;
+    int n_subsets;
+    int n_species;
+    int *weights;
+    int *two2three;
+    /* Adds the contribution of one subset to the weights */
+    void (*process)(struct weights_job *job, int subset_i, int thread_id);
+    /* Finds the weight increment of a block of bipartitions, with the best
+     * instruction set this CPU has */
+    weight_increment_function weight_increment;
+    /* With dynamic set, each thread takes the next subset nobody has taken
+     * yet; otherwise each thread does a contiguous block of subsets. */
+    int dynamic;
+    int next_subset;
+    long *progress;
+    double *thread_times;
+    int n_threads;
+    /* Batch kernel */
+    int n_biparts;
+    int n_replicates;
+    int weights_size;
+    int max_run;
+    int *common_all;
+    int *increments_all;
+    /* Tile kernel */
+    int high_mask;
+    int tile_x;
+    int tile_y;
+    long lo;
+    long tile_size;
+    /* Scatter kernel: sorted offsets of the lowest kernel species, one
+     * table per thread */
+    int *inner_all;
+    /* Transform engine: each thread's triplet counts, and the triplets'
+     * cells sorted by block, with the cells of block b from cell_start[b]
+     * to cell_start[b + 1] - 1 */
+    unsigned int *triplets_all;
+    long *cell_start;
+    int *cell_low;
+    unsigned int *cell_count;
+    unsigned int *scratch_all;
+    long first_block;
+    long block_size;
+    /* parallel_for */
+    void (*callback)(void *data, int item, int thread_id);
+    void *data;
+};
 
-    return total;
+/* Does one thread's share of the subsets of job, out of n_threads
+ * threads. The same load balancing is used with OpenMP and pthreads. */
+static void run_thread(struct weights_job *job, int thread_id,
+                       int n_threads) {
+    double start_time = wall_time();
+    /* Calculate the progress this thread is making, to eventually add to the
+     * shared counter. */
+    long counter_private = 0;
+    /* Update total counter every output_step number of steps */
+    int output_step = round(job->n_subsets / (100 * n_threads));
+    output_step = (output_step > 1) ? output_step : 1;
+
+    int first = (long)job->n_subsets * thread_id / n_threads;
+    int last = (long)job->n_subsets * (thread_id + 1) / n_threads;
+    int subset_i = job->dynamic
+                       ? __atomic_fetch_add(&job->next_subset, 1,
+                                            __ATOMIC_RELAXED)
+                       : first;
+    while (subset_i < (job->dynamic ? job->n_subsets : last)) {
+        job->process(job, subset_i, thread_id);
+        counter_private++;
+
+        if (job->progress != NULL && counter_private % output_step == 0) {
+            /* Update the shared counter, which the caller reads */
+            __atomic_fetch_add(job->progress, counter_private,
+                               __ATOMIC_RELAXED);
+            counter_private = 0;
+        }
+        subset_i = job->dynamic ? __atomic_fetch_add(&job->next_subset, 1,
+                                                     __ATOMIC_RELAXED)
+                                : subset_i + 1;
+    }
+
+    if (job->progress != NULL && counter_private > 0) {
+        __atomic_fetch_add(job->progress, counter_private, __ATOMIC_RELAXED);
+    }
+    if (job->thread_times != NULL && thread_id < job->n_threads) {
+        job->thread_times[thread_id] += wall_time() - start_time;
+    }
 }
 
-void fill_compressed_weight_representation(
-    int *subsets, int *start_i, int *end_i, int *left_sets, int *right_sets,
-    int *bipart_weights, int n_subsets, int n_species,
-    int *weights, /* Must be allocated with 0 in each entry. */
-    int *two2three, int n_threads) {
-    /* Iterate over all the (sub)bi-partitions. */
-    int loop_progress = 0;
-    
-    #ifndef NO_OMP
-    #pragma omp parallel num_threads(n_threads)
+#ifdef NO_OMP
+struct thread_args {
+    struct weights_job *job;
+    int thread_id;
+    int n_threads;
+};
+
+static void *start_thread(void *p) {
+    struct thread_args *args = p;
+    run_thread(args->job, args->thread_id, args->n_threads);
+
+    return NULL;
+}
+#endif
+
+/* Runs job on n_threads threads, with OpenMP if available and pthreads
+ * otherwise. Returns the number of threads used. */
+static int run_job(struct weights_job *job, int n_threads, int verbose) {
+    int n_threads_used = (n_threads > 1) ? n_threads : 1;
+    job->n_threads = n_threads;
+    job->next_subset = 0;
+    job->weight_increment = get_weight_increment_function();
+
+#ifndef NO_OMP
+#pragma omp parallel num_threads(n_threads_used)
     {
         /* Get actual number of threads, and this thread's ID */
         int n_threads_assigned = omp_get_num_threads();
         int thread_id_private = omp_get_thread_num();
         /* Print out number of threads */
         if (thread_id_private == 0) {
-            printf("Using %d threads.\n", n_threads_assigned);
+            n_threads_used = n_threads_assigned;
+            if (verbose) {
+                printf("Using %d threads.\n", n_threads_assigned);
+                fflush(stdout);
+            }
         }
-    #else
-    {
-        /* Single-threaded version */
-        printf("Using 1 thread (OpenMP not available).\n");
-        int n_threads_assigned = 1;
-        int thread_id_private = 0;
-    #endif
-        
-        /* Calculate the progress this thread is making, to eventually add
-         * to the progress bar. */
-        int counter_private = 0;
-        /* Update total counter every output_step number of steps */
-        int output_step = round(n_subsets / (100 * n_threads_assigned));
-        output_step = (output_step > 1) ? output_step : 1;
-        /* This is the binary number with 1s everywhere, which represents the
-         * set of all species in the data. */
-        int universe = (1 << n_species) - 1;
-        /* Iterate over all possible values of a+b, where (a,b) is a bipart. */
-        
-    #ifndef NO_OMP
-    #pragma omp for schedule(static)
-    #endif
-        for (int subset_i = 0; subset_i < n_subsets; subset_i++) {
-            int bitmask = subsets[subset_i];
-            int kernel = universe - bitmask;
-
-            /* This iterates over all numbers with bits set only where
-             * bitmask has set bits, excluding bitmask. */
-            int a_prime = bitmask & (bitmask - 1);
-
-            /* We should iterate over possible a+b sums */
-            for (int a_prime = bitmask & (bitmask - 1); a_prime > 0;
-                 a_prime = bitmask & (a_prime - 1)) {
-                int bitmask_inner = bitmask - a_prime;
-
-                /* This iterates over all numbers with bits set only where
-                 * bitmask_inner set bits, and strictly less than
-                 * a_prime. Includes self. */
-                int b_prime = bitmask_inner;
-                for (int b_prime = bitmask_inner; b_prime > 0;
-                     b_prime = bitmask_inner & (b_prime - 1)) {
-                    if (b_prime < a_prime) {
-                        /* Find the contribution of each bipart which has this
-                         * exact kernel. */
-                        int weight_increment = 0;
-                        for (int i = start_i[subset_i]; i < end_i[subset_i];
-                             i++) {
-                            weight_increment +=
-                                bipart_weights[i] *
-                                n_common_triplets(a_prime, b_prime,
-                                                  left_sets[i], right_sets[i]);
-                        }
+        /* All the threads must know the number of threads before the
+         * subsets are split between them */
+#pragma omp barrier
+        run_thread(job, thread_id_private, n_threads_assigned);
+    }
+#else
+    if (verbose) {
+        printf("Using %d threads (pthreads).\n", n_threads_used);
+        fflush(stdout);
+    }
+    pthread_t *threads = malloc(n_threads_used * sizeof(pthread_t));
+    struct thread_args *args =
+        malloc(n_threads_used * sizeof(struct thread_args));
+    int *started = calloc(n_threads_used, sizeof(int));
+    if (threads == NULL || args == NULL || started == NULL) {
+        free(threads);
+        free(args);
+        free(started);
+        n_threads_used = 1;
+        run_thread(job, 0, 1);
+        return n_threads_used;
+    }
+
+    /* The calling thread is thread 0 */
+    for (int t = 0; t < n_threads_used; t++) {
+        args[t].job = job;
+        args[t].thread_id = t;
+        args[t].n_threads = n_threads_used;
+        if (t > 0) {
+            started[t] =
+                (pthread_create(&threads[t], NULL, start_thread, &args[t]) ==
+                 0);
+        }
+    }
+    run_thread(job, 0, n_threads_used);
+    for (int t = 1; t < n_threads_used; t++) {
+        if (started[t]) {
+            pthread_join(threads[t], NULL);
+        } else {
+            /* Couldn't start this thread, so do its share here */
+            run_thread(job, t, n_threads_used);
+        }
+    }
+    free(threads);
+    free(args);
+    free(started);
+#endif
+
+    return n_threads_used;
+}
+
+/* Most kernel species whose extensions are written as one sorted block, so
+ * that a block has at most 3^7 entries and stays in the cache. */
+#define INNER_SPECIES 7
+#define INNER_SIZE 2187
+
+/* Adds weight_increment to weights[offset + inner[t]] for each of the
+ * n_inner offsets in inner, and each offset = base + sum of digit_j *
+ * pows[j] with digits in {0, 1, 2}. The digits are walked in reflected Gray
+ * code order, so each offset is one addition away from the previous one
+ * (Algorithm H of Knuth, TAOCP 7.2.1.1). */
+static void scatter_gray(int *weights, int base, const int *pows, int n_pows,
+                         const int *inner, int n_inner, int weight_increment,
+                         int atomic) {
+    int digits[32];
+    int directions[32];
+    /* Focus pointers */
+    int focus[33];
+    for (int j = 0; j < n_pows; j++) {
+        digits[j] = 0;
+        directions[j] = 1;
+        focus[j] = j;
+    }
+    focus[n_pows] = n_pows;
+
+    int offset = base;
+    for (;;) {
+        int *block = weights + offset;
+        if (atomic) {
+            for (int t = 0; t < n_inner; t++) {
+                atomic_add(&block[inner[t]], weight_increment);
+            }
+        } else {
+            for (int t = 0; t < n_inner; t++) {
+                block[inner[t]] += weight_increment;
+            }
+        }
+
+        int j = focus[0];
+        focus[0] = 0;
+        if (j == n_pows) {
+            break;
+        }
+        digits[j] += directions[j];
+        offset += directions[j] * pows[j];
+        if (digits[j] == 0 || digits[j] == 2) {
+            directions[j] = -directions[j];
+            focus[j] = focus[j + 1];
+            focus[j + 1] = j + 1;
+        }
+    }
+}
+
+/* Adds the contribution of the bipartitions of one subset to the weights. */
+static void process_subset(struct weights_job *job, int subset_i,
+                           int thread_id) {
+    int *start_i = job->start_i;
+    int *end_i = job->end_i;
+    int *left_sets = job->left_sets;
+    int *right_sets = job->right_sets;
+    int *bipart_weights = job->bipart_weights;
+    int *weights = job->weights;
+    int *two2three = job->two2three;
+    /* This is the binary number with 1s everywhere, which represents the set
+     * of all species in the data. */
+    int universe = (1 << job->n_species) - 1;
+    int bitmask = job->subsets[subset_i];
+    int kernel = universe - bitmask;
+    int start = start_i[subset_i];
+    int n_run = end_i[subset_i] - start;
+    /* Single-threaded runs don't need atomic updates */
+    int atomic = job->n_threads > 1;
 
-                        /* (a'+k1, b'+k2) has the same number of GT triplets
-                         * as (a', b'), so let's update them all in one sweep */
-                        for (int k1 = kernel; k1 >= 0; k1 = kernel & (k1 - 1)) {
-                            for (int k2 = kernel - k1; k2 >= 0;
-                                 k2 = (kernel - k1) & (k2 - 1)) {
-                                int x = a_prime + k1;
-                                int y = b_prime + k2;
-
-                                /* Base-3 representation of bipart */
-                                int rep = compressed_rep(x, y, two2three);
-
-                                /* Update the weights array */
-                                #ifndef NO_OMP
-                                #pragma omp atomic update
-                                #endif
-                                weights[rep] += weight_increment;
-
-                                /* This is necessary to break out of an endless
-                                 * loop! */
-                                if (k2 == 0) {
-                                    break;
-                                }
-                            }
-                            /* This is necessary to break out of an endless
-                             * loop! */
-                            if (k1 == 0) {
-                                break;
-                            }
+    /* The extensions (a'+k1, b'+k2) of (a', b') are written in their
+     * compressed representation, where the set with the highest species is
+     * the one with digit 1. If that species is in a', the digits of the
+     * kernel species are independent, so the base-3 representations are
+     * a_3 + 2 b_3 plus any combination of the kernel species' digits. If
+     * it's a kernel species above a', its digit is 1, the kernel species
+     * above it have digit 0, and a' has digit 1 or 2.
+     *
+     * The kernel species below a' are split into the lowest few, whose
+     * digits are written in increasing order from the inner table, and the
+     * others, which are walked in Gray code order along with the kernel
+     * species above a' below the highest one. */
+    int *inner = job->inner_all + (long)thread_id * INNER_SIZE;
+    int n_inner = 0;
+    /* Powers of 3 of the outer kernel species below a', then of those
+     * above */
+    int pows[32];
+    int n_low = 0;
+    int n_high = 0;
+    int inner_top = -1;
+
+    /* We should iterate over possible a+b sums */
+    for (int a_prime = bitmask & (bitmask - 1); a_prime > 0;
+         a_prime = bitmask & (a_prime - 1)) {
+        int bitmask_inner = bitmask - a_prime;
+        /* Highest species of a', which is higher than those of b' */
+        int top = 31 - __builtin_clz(a_prime);
+
+        /* a' only goes down, so this is only redone a few times */
+        if (top != inner_top) {
+            int low_kernel = kernel & ((1 << top) - 1);
+            inner[0] = 0;
+            n_inner = 1;
+            n_low = 0;
+            for (int k = low_kernel; k > 0; k &= k - 1) {
+                int pow = two2three[k & (-k)];
+                if (n_low == 0 && n_inner * 3 <= INNER_SIZE) {
+                    /* Each power is larger than all the earlier offsets,
+                     * so the table stays sorted */
+                    for (int t = 0; t < n_inner; t++) {
+                        inner[n_inner + t] = inner[t] + pow;
+                        inner[2 * n_inner + t] = inner[t] + 2 * pow;
+                    }
+                    n_inner *= 3;
+                } else {
+                    pows[n_low++] = pow;
+                }
+            }
+            n_high = 0;
+            for (int k = kernel & ~low_kernel; k > 0; k &= k - 1) {
+                pows[n_low + n_high++] = two2three[k & (-k)];
+            }
+            inner_top = top;
+        }
+
+        /* This iterates over all numbers with bits set only where
+         * bitmask_inner set bits, and strictly less than a_prime. Includes
+         * self. */
+        for (int b_prime = bitmask_inner; b_prime > 0;
+             b_prime = bitmask_inner & (b_prime - 1)) {
+            if (b_prime < a_prime) {
+                /* Find the contribution of each bipart which has this exact
+                 * kernel. */
+                int weight_increment = job->weight_increment(
+                    a_prime, b_prime, left_sets + start, right_sets + start,
+                    bipart_weights + start, n_run);
+                if (weight_increment == 0) {
+                    continue;
+                }
+                int a_3 = two2three[a_prime];
+                int b_3 = two2three[b_prime];
+
+                /* (a'+k1, b'+k2) has the same number of GT triplets as
+                 * (a', b'), so let's update them all in one sweep */
+                scatter_gray(weights, a_3 + 2 * b_3, pows, n_low, inner,
+                             n_inner, weight_increment, atomic);
+                for (int h = 0; h < n_high; h++) {
+                    int pow = pows[n_low + h];
+                    scatter_gray(weights, a_3 + 2 * b_3 + pow, pows,
+                                 n_low + h, inner, n_inner,
+                                 weight_increment, atomic);
+                    scatter_gray(weights, 2 * a_3 + b_3 + pow, pows,
+                                 n_low + h, inner, n_inner,
+                                 weight_increment, atomic);
+                }
+            }
+        }
+    }
+}
+
+/* Returns the number of threads used, or -1 if the scratch arrays couldn't
+ * be allocated, in which case weights is unchanged. The number of subsets
+ * done so far is added to *progress as the computation goes on, so that the
+ * caller can report progress from another thread, and the time spent by
+ * each thread is added to thread_times (which must have room for n_threads
+ * entries). Either can be NULL. Nothing is printed unless verbose is set. */
+int fill_compressed_weight_representation(
+    int *subsets, int *start_i, int *end_i, int *left_sets, int *right_sets,
+    int *bipart_weights, int n_subsets, int n_species,
+    int *weights, /* Must be allocated with 0 in each entry. */
+    int *two2three, int n_threads, long *progress, double *thread_times,
+    int verbose) {
+    struct weights_job job = {0};
+    job.subsets = subsets;
+    job.start_i = start_i;
+    job.end_i = end_i;
+    job.left_sets = left_sets;
+    job.right_sets = right_sets;
+    job.bipart_weights = bipart_weights;
+    job.n_subsets = n_subsets;
+    job.n_species = n_species;
+    job.weights = weights;
+    job.two2three = two2three;
+    job.process = process_subset;
+    job.dynamic = 0;
+    job.progress = progress;
+    job.thread_times = thread_times;
+    job.inner_all =
+        malloc((long)((n_threads > 1) ? n_threads : 1) * INNER_SIZE *
+               sizeof(int));
+    if (job.inner_all == NULL) {
+        return -1;
+    }
+
+    int n_threads_used = run_job(&job, n_threads, verbose);
+    free(job.inner_all);
+
+    return n_threads_used;
+}
+
+/* Adds w to the count of each triplet ij|k with i < j in c and k in d. The
+ * count of ij|k is triplets[(i * n + j) * n + k]. */
+static void add_triplet_counts(unsigned int *triplets, int n, int c, int d,
+                               unsigned int w) {
+    for (int ci = c; ci > 0; ci &= ci - 1) {
+        int i = __builtin_ctz(ci);
+        for (int cj = ci & (ci - 1); cj > 0; cj &= cj - 1) {
+            unsigned int *row =
+                triplets + ((long)i * n + __builtin_ctz(cj)) * n;
+            for (int dk = d; dk > 0; dk &= dk - 1) {
+                row[__builtin_ctz(dk)] += w;
+            }
+        }
+    }
+}
+
+/* Adds the triplets of the bipartitions of one subset to this thread's
+ * triplet counts. */
+static void process_subset_triplets(struct weights_job *job, int subset_i,
+                                    int thread_id) {
+    int n = job->n_species;
+    unsigned int *triplets =
+        job->triplets_all + (long)thread_id * n * n * n;
+
+    for (int i = job->start_i[subset_i]; i < job->end_i[subset_i]; i++) {
+        unsigned int w = job->bipart_weights[i];
+        if (w == 0) {
+            continue;
+        }
+        add_triplet_counts(triplets, n, job->left_sets[i],
+                           job->right_sets[i], w);
+        add_triplet_counts(triplets, n, job->right_sets[i],
+                           job->left_sets[i], w);
+    }
+}
+
+/* Number of low species summed over within each block of the transform,
+ * where a block holds the 3^low_species entries sharing the digits of the
+ * other species. Each block stays in the cache. */
+static int transform_low_species(int n_species) {
+    return (n_species - 1 < 9) ? n_species - 1 : 9;
+}
+
+/* The number of blocks the transform splits the weights array of n_species
+ * species into, each of transform_block_size(n_species) entries. */
+long transform_block_count(int n_species) {
+    return 2 * ipow(3, n_species - 1 - transform_low_species(n_species));
+}
+
+long transform_block_size(int n_species) {
+    return ipow(3, transform_low_species(n_species));
+}
+
+/* Adds the triplet counts of the GT bipartitions of the given subsets to
+ * triplets, which has n_species^3 entries, and where the count of ij|k with
+ * i < j is triplets[(i * n_species + j) * n_species + k]. Takes the same
+ * arguments as fill_compressed_weight_representation otherwise. Returns the
+ * number of threads used, or -1 if the threads' tables couldn't be
+ * allocated, in which case triplets is unchanged. */
+int count_triplets(int *subsets, int *start_i, int *end_i, int *left_sets,
+                   int *right_sets, int *bipart_weights, int n_subsets,
+                   int n_species, unsigned int *triplets, int n_threads,
+                   long *progress, double *thread_times, int verbose) {
+    long n_cubed = (long)n_species * n_species * n_species;
+    int max_threads = (n_threads > 1) ? n_threads : 1;
+    unsigned int *triplets_all =
+        calloc((long)max_threads * n_cubed, sizeof(int));
+    if (triplets_all == NULL) {
+        return -1;
+    }
+
+    struct weights_job job = {0};
+    job.subsets = subsets;
+    job.start_i = start_i;
+    job.end_i = end_i;
+    job.left_sets = left_sets;
+    job.right_sets = right_sets;
+    job.bipart_weights = bipart_weights;
+    job.n_subsets = n_subsets;
+    job.n_species = n_species;
+    job.process = process_subset_triplets;
+    job.dynamic = 1;
+    job.progress = progress;
+    job.thread_times = thread_times;
+    job.triplets_all = triplets_all;
+    int n_threads_used = run_job(&job, n_threads, verbose);
+
+    for (int t = 0; t < max_threads; t++) {
+        for (long i = 0; i < n_cubed; i++) {
+            triplets[i] += triplets_all[t * n_cubed + i];
+        }
+    }
+    free(triplets_all);
+
+    return n_threads_used;
+}
+
+/* Adds the cells of the triplets whose digits above the block's low species
+ * are exactly those of high to the block. */
+static void seed_block(struct weights_job *job, unsigned int *block,
+                       long high) {
+    for (long c = job->cell_start[high]; c < job->cell_start[high + 1]; c++) {
+        block[job->cell_low[c]] += job->cell_count[c];
+    }
+}
+
+/* Finds the weights of one block, and adds them to the weights array. The
+ * block gets the cells below it in its high digits, i.e. those whose high
+ * digits are each 0 or the block's own, which are then summed over the
+ * cells below them in the low digits. A cell has at most 3 nonzero digits,
+ * so only the combinations of up to 3 of the block's nonzero high digits
+ * have any cells. */
+static void process_transform_block(struct weights_job *job, int item,
+                                    int thread_id) {
+    long block_i = job->first_block + item;
+    long block_size = job->block_size;
+    /* The block's nonzero high digits, times their powers of 3 */
+    long highs[32];
+    int n_highs = 0;
+    int top_digit = 0;
+    long pow = 1;
+    for (long h = block_i; h > 0; h /= 3, pow *= 3) {
+        if (h % 3 != 0) {
+            top_digit = h % 3;
+            highs[n_highs++] = top_digit * pow;
+        }
+    }
+    /* Entries whose last nonzero digit is 2 aren't the compressed
+     * representation of any bipartition, and are left at 0 */
+    if (top_digit == 2) {
+        return;
+    }
+
+    unsigned int *block = job->scratch_all + (long)thread_id * block_size;
+    memset(block, 0, block_size * sizeof(int));
+    seed_block(job, block, 0);
+    for (int p = 0; p < n_highs; p++) {
+        seed_block(job, block, highs[p]);
+        for (int q = p + 1; q < n_highs; q++) {
+            seed_block(job, block, highs[p] + highs[q]);
+            for (int r = q + 1; r < n_highs; r++) {
+                seed_block(job, block, highs[p] + highs[q] + highs[r]);
+            }
+        }
+    }
+
+    for (long stride = 1; stride < block_size; stride *= 3) {
+        for (long base = 0; base < block_size; base += 3 * stride) {
+            for (long l = 0; l < stride; l++) {
+                unsigned int value = block[base + l];
+                block[base + stride + l] += value;
+                block[base + 2 * stride + l] += value;
+            }
+        }
+    }
+    if (block_i == 0) {
+        for (long stride = 1; stride < block_size; stride *= 3) {
+            memset(block + 2 * stride, 0, stride * sizeof(int));
+        }
+    }
+
+    int *weights = job->weights + block_i * block_size;
+    for (long l = 0; l < block_size; l++) {
+        weights[l] = (int)((unsigned int)weights[l] + block[l]);
+    }
+}
+
+/* Adds the weights of the triplet counts (as made by count_triplets) to
+ * blocks first_block to first_block + n_blocks - 1 of weights, the full
+ * weights array, leaving the other blocks alone.
+ *
+ * The weight of (x, y) is the number of GT triplets ij|k with i, j in x and
+ * k in y, or i, j in y and k in x. Each triplet is put in the (uncompressed)
+ * base-3 cell of the 3 species it has, both as (x, y) and (y, x) where it
+ * fits in the compressed representation, and every entry is the sum of the
+ * cells below it, i.e. those whose x and y are subsets of its own. These
+ * sums are found one block at a time, so the blocks can be split between
+ * threads, or between the shards of a computation. Returns 0, or -1 if the
+ * scratch arrays couldn't be allocated, in which case weights is
+ * unchanged. */
+int transform_triplet_counts(const unsigned int *triplets, int n_species,
+                             int *weights, long first_block, long n_blocks,
+                             int *two2three, int n_threads) {
+    int n = n_species;
+    int max_threads = (n_threads > 1) ? n_threads : 1;
+    long block_size = transform_block_size(n);
+    long size = 2 * ipow(3, n - 1);
+    long n_all_blocks = size / block_size;
+    if (n_blocks <= 0) {
+        return 0;
+    }
+
+    /* The cells, sorted by their high digits, i.e. their block */
+    long *cell_start = calloc(n_all_blocks + 1, sizeof(long));
+    int *cell_low = malloc(2L * n * n * n * sizeof(int));
+    unsigned int *cell_count = malloc(2L * n * n * n * sizeof(int));
+    unsigned int *scratch_all =
+        malloc((long)max_threads * block_size * sizeof(int));
+    if (cell_start == NULL || cell_low == NULL || cell_count == NULL ||
+        scratch_all == NULL) {
+        free(cell_start);
+        free(cell_low);
+        free(cell_count);
+        free(scratch_all);
+        return -1;
+    }
+    /* Counted first, then placed */
+    for (int pass = 0; pass < 2; pass++) {
+        for (int i = 0; i < n; i++) {
+            for (int j = i + 1; j < n; j++) {
+                for (int k = 0; k < n; k++) {
+                    unsigned int count = triplets[((long)i * n + j) * n + k];
+                    if (count == 0) {
+                        continue;
+                    }
+                    long pair = two2three[1 << i] + two2three[1 << j];
+                    long single = two2three[1 << k];
+                    /* ij|k as (x, y) and as (y, x) */
+                    long cells[2] = {pair + 2 * single, 2 * pair + single};
+                    for (int c = 0; c < 2; c++) {
+                        if (cells[c] >= size) {
+                            continue;
+                        }
+                        long high = cells[c] / block_size;
+                        if (pass == 0) {
+                            cell_start[high + 1]++;
+                        } else {
+                            long at = cell_start[high]++;
+                            cell_low[at] = cells[c] % block_size;
+                            cell_count[at] = count;
                         }
                     }
                 }
             }
-            counter_private++;
-
-            if (counter_private % output_step == 0) {
-                /* Update the overall counter one thread at a time */
-                #ifndef NO_OMP
-                #pragma omp atomic update
-                #endif
-                loop_progress = loop_progress + counter_private;
-                counter_private = 0;
-                /* Only update the progress bar by the master thread */
-                if (thread_id_private == 0) {
-                    /* Progress bar temporarily disabled */
-                    fprintf(stderr, "\r%d/%d complete (%.2f%%)", loop_progress,
-                            n_subsets, (100.0 * loop_progress) / n_subsets);
-                    fflush(stderr);
+        }
+        if (pass == 0) {
+            for (long b = 0; b < n_all_blocks; b++) {
+                cell_start[b + 1] += cell_start[b];
+            }
+        } else {
+            /* Each start was moved to the next block's start */
+            for (long b = n_all_blocks; b > 0; b--) {
+                cell_start[b] = cell_start[b - 1];
+            }
+            cell_start[0] = 0;
+        }
+    }
+
+    struct weights_job job = {0};
+    job.n_subsets = n_blocks;
+    job.n_species = n_species;
+    job.weights = weights;
+    job.process = process_transform_block;
+    job.dynamic = 1;
+    job.first_block = first_block;
+    job.block_size = block_size;
+    job.cell_start = cell_start;
+    job.cell_low = cell_low;
+    job.cell_count = cell_count;
+    job.scratch_all = scratch_all;
+    run_job(&job, n_threads, 0);
+
+    free(cell_start);
+    free(cell_low);
+    free(cell_count);
+    free(scratch_all);
+
+    return 0;
+}
+
+/* Computes the same weights as fill_compressed_weight_representation, in
+ * two phases instead of one scatter per (a', b') of each subset: the first
+ * counts each GT triplet once, going through the bipartitions, and the
+ * second adds each triplet's count to all the bipartitions it's a triplet
+ * of, one cache-sized block of the weights at a time (see
+ * transform_triplet_counts). This is much faster than the scattered
+ * updates as soon as there are more than a few subsets.
+ *
+ * Takes the same arguments as fill_compressed_weight_representation, and
+ * scatters instead if the transform's arrays can't be allocated. Returns
+ * -1 if the scatter's can't be allocated either. */
+int fill_compressed_weight_representation_transform(
+    int *subsets, int *start_i, int *end_i, int *left_sets, int *right_sets,
+    int *bipart_weights, int n_subsets, int n_species, int *weights,
+    int *two2three, int n_threads, long *progress, double *thread_times,
+    int verbose) {
+    unsigned int *triplets =
+        calloc((long)n_species * n_species * n_species, sizeof(int));
+    int n_threads_used = -1;
+    if (triplets != NULL) {
+        n_threads_used = count_triplets(
+            subsets, start_i, end_i, left_sets, right_sets, bipart_weights,
+            n_subsets, n_species, triplets, n_threads, progress,
+            thread_times, verbose);
+    }
+    if (n_threads_used < 0 ||
+        transform_triplet_counts(triplets, n_species, weights, 0,
+                                 transform_block_count(n_species), two2three,
+                                 n_threads) < 0) {
+        printf("Failed to allocate the transform arrays, scattering "
+               "instead.\n");
+        free(triplets);
+        if (progress != NULL) {
+            *progress = 0;
+        }
+        return fill_compressed_weight_representation(
+            subsets, start_i, end_i, left_sets, right_sets, bipart_weights,
+            n_subsets, n_species, weights, two2three, n_threads, progress,
+            thread_times, verbose);
+    }
+    free(triplets);
+
+    return n_threads_used;
+}
+
+static void process_callback(struct weights_job *job, int item,
+                             int thread_id) {
+    job->callback(job->data, item, thread_id);
+}
+
+/* Calls process(data, item, thread_id) for each item from 0 to n_items - 1,
+ * on n_threads threads, each taking the next item nobody has taken yet.
+ * Uses OpenMP or pthreads, like the weights kernels. Returns the number of
+ * threads used. */
+int parallel_for(int n_items,
+                 void (*process)(void *data, int item, int thread_id),
+                 void *data, int n_threads) {
+    struct weights_job job = {0};
+    job.n_subsets = n_items;
+    job.process = process_callback;
+    job.dynamic = 1;
+    job.callback = process;
+    job.data = data;
+
+    return run_job(&job, n_threads, 0);
+}
+
+/* Number of entries of the weights array remapped at a time by each thread */
+#define REMAP_BLOCK_SIZE 65536
+
+struct remap_job {
+    const int *old_weights;
+    int *weights;
+    /* The old species of each new species (-1 if none) */
+    int old_of[32];
+    long powers[32];
+    int n_new;
+    long size;
+};
+
+/* Adds the old weights of the block of new bipartitions, each of which has
+ * the weight of its restriction to the old species. Goes through the base-3
+ * digits like a counter, so each bipartition costs O(1) on average. Like
+ * the weights kernels, only writes the entries whose largest species is on
+ * the left, which are the ones ever read. */
+static void remap_block(void *data, int block, int thread_id) {
+    const struct remap_job *job = data;
+    long lo = (long)block * REMAP_BLOCK_SIZE;
+    long hi = lo + REMAP_BLOCK_SIZE < job->size ? lo + REMAP_BLOCK_SIZE
+                                                : job->size;
+    int digits[32];
+    /* The restriction's base-3 number, the sum of the powers of its species,
+     * and the number of its species on each side */
+    long raw = 0, present = 0;
+    int n_left = 0, n_right = 0;
+    /* The largest new species in the bipartition */
+    int top = -1;
+
+    long x = lo;
+    for (int p = 0; p < job->n_new; p++, x /= 3) {
+        digits[p] = x % 3;
+        if (digits[p] > 0) {
+            top = p;
+        }
+        int s = job->old_of[p];
+        if (s >= 0 && digits[p] > 0) {
+            raw += digits[p] * job->powers[s];
+            present += job->powers[s];
+            n_left += digits[p] == 1;
+            n_right += digits[p] == 2;
+        }
+    }
+
+    for (long i = lo; i < hi; i++) {
+        if (n_left > 0 && n_right > 0 && digits[top] == 1) {
+            /* The old representation has its largest species on the left */
+            long swapped = 3 * present - raw;
+            job->weights[i] += job->old_weights[raw < swapped ? raw : swapped];
+        }
+        /* Next bipartition */
+        int p = 0;
+        while (p < job->n_new && digits[p] == 2) {
+            int s = job->old_of[p];
+            if (s >= 0) {
+                raw -= 2 * job->powers[s];
+                present -= job->powers[s];
+                n_right--;
+            }
+            digits[p++] = 0;
+        }
+        if (p == job->n_new) {
+            break;
+        }
+        int s = job->old_of[p];
+        if (s >= 0) {
+            raw += job->powers[s];
+            if (digits[p] == 0) {
+                present += job->powers[s];
+                n_left++;
+            } else {
+                n_left--;
+                n_right++;
+            }
+        }
+        digits[p]++;
+        top = p > top ? p : top;
+    }
+}
+
+/* Adds the weights array of n_old species to the weights array of n_new
+ * species, where the old species s is the new species positions[s]. Each
+ * bipartition of the new species gets the old weight of its restriction to
+ * the old species, i.e. the weight of the triplets in both, and 0 if a side
+ * has no old species. Returns 0, or -1 if the numbers of species are too
+ * large. */
+int add_remapped_weights(const int *old_weights, int n_old,
+                         const int *positions, int *weights, int n_new,
+                         int n_threads) {
+    if (n_new > 32 || n_old > n_new || n_old < 1) {
+        return -1;
+    }
+    struct remap_job job = {0};
+    job.old_weights = old_weights;
+    job.weights = weights;
+    job.n_new = n_new;
+    job.size = 2;
+    for (int p = 0; p < n_new; p++) {
+        job.old_of[p] = -1;
+    }
+    for (int s = 0; s < n_old; s++) {
+        job.old_of[positions[s]] = s;
+        job.powers[s] = s == 0 ? 1 : 3 * job.powers[s - 1];
+    }
+    for (int p = 1; p < n_new; p++) {
+        job.size *= 3;
+    }
+
+    parallel_for((job.size + REMAP_BLOCK_SIZE - 1) / REMAP_BLOCK_SIZE,
+                 remap_block, &job, n_threads);
+
+    return 0;
+}
+
+/* Adds the contribution of one subset to the weights of every replicate of
+ * a batch job. */
+static void process_subset_batch(struct weights_job *job, int subset_i,
+                                 int thread_id) {
+    int *left_sets = job->left_sets;
+    int *right_sets = job->right_sets;
+    int *two2three = job->two2three;
+    int n_replicates = job->n_replicates;
+    /* Scratch space of this thread */
+    int *common = job->common_all + (long)thread_id * job->max_run;
+    int *increments = job->increments_all + (long)thread_id * n_replicates;
+    int universe = (1 << job->n_species) - 1;
+    int bitmask = job->subsets[subset_i];
+    int kernel = universe - bitmask;
+    int start = job->start_i[subset_i];
+    int n_run = job->end_i[subset_i] - start;
+
+    for (int a_prime = bitmask & (bitmask - 1); a_prime > 0;
+         a_prime = bitmask & (a_prime - 1)) {
+        int bitmask_inner = bitmask - a_prime;
+
+        for (int b_prime = bitmask_inner; b_prime > 0;
+             b_prime = bitmask_inner & (b_prime - 1)) {
+            if (b_prime >= a_prime) {
+                continue;
+            }
+            /* Shared by all the replicates */
+            for (int j = 0; j < n_run; j++) {
+                common[j] =
+                    n_common_triplets(a_prime, b_prime, left_sets[start + j],
+                                      right_sets[start + j]);
+            }
+            int any_nonzero = 0;
+            for (int r = 0; r < n_replicates; r++) {
+                int *row =
+                    job->bipart_weights + (long)r * job->n_biparts + start;
+                int weight_increment = 0;
+                for (int j = 0; j < n_run; j++) {
+                    weight_increment += row[j] * common[j];
+                }
+                increments[r] = weight_increment;
+                any_nonzero |= weight_increment;
+            }
+            if (!any_nonzero) {
+                continue;
+            }
+
+            for (int k1 = kernel; k1 >= 0; k1 = kernel & (k1 - 1)) {
+                for (int k2 = kernel - k1; k2 >= 0;
+                     k2 = (kernel - k1) & (k2 - 1)) {
+                    int rep =
+                        compressed_rep(a_prime + k1, b_prime + k2, two2three);
+
+                    for (int r = 0; r < n_replicates; r++) {
+                        atomic_add(
+                            &job->weights[(long)r * job->weights_size + rep],
+                            increments[r]);
+                    }
+
+                    if (k2 == 0) {
+                        break;
+                    }
+                }
+                if (k1 == 0) {
+                    break;
+                }
+            }
+        }
+    }
+}
+
+/* Like fill_compressed_weight_representation, but for many replicates which
+ * share the same bipartitions and only differ in their weights. The weight
+ * of bipartition i in replicate r is bipart_weights[r * n_biparts + i], and
+ * the weights of replicate r are written to weights[r * weights_size + ...].
+ * The number of common triplets of each (a', b') with each bipartition is
+ * only computed once, and then reused by all the replicates. Returns 0, or
+ * -1 if the scratch arrays couldn't be allocated, in which case weights is
+ * unchanged. */
+int fill_compressed_weight_representation_batch(
+    int *subsets, int *start_i, int *end_i, int *left_sets, int *right_sets,
+    int *bipart_weights, int n_subsets, int n_biparts, int n_replicates,
+    int n_species,
+    int *weights, /* Must be allocated with 0 in each entry. */
+    int *two2three, int n_threads) {
+    n_threads = (n_threads > 1) ? n_threads : 1;
+    /* Longest run of bipartitions sharing a subset */
+    int max_run = 1;
+    for (int subset_i = 0; subset_i < n_subsets; subset_i++) {
+        int run = end_i[subset_i] - start_i[subset_i];
+        max_run = (run > max_run) ? run : max_run;
+    }
+
+    /* Scratch space for the common triplet counts and the weight increment
+     * of each replicate, one slice per thread. */
+    int *common_all = malloc((long)n_threads * max_run * sizeof(int));
+    int *increments_all = malloc((long)n_threads * n_replicates * sizeof(int));
+    if (common_all == NULL || increments_all == NULL) {
+        free(common_all);
+        free(increments_all);
+        return -1;
+    }
+
+    struct weights_job job = {0};
+    job.subsets = subsets;
+    job.start_i = start_i;
+    job.end_i = end_i;
+    job.left_sets = left_sets;
+    job.right_sets = right_sets;
+    job.bipart_weights = bipart_weights;
+    job.n_subsets = n_subsets;
+    job.n_species = n_species;
+    job.weights = weights;
+    job.two2three = two2three;
+    job.process = process_subset_batch;
+    job.dynamic = 1;
+    job.n_biparts = n_biparts;
+    job.n_replicates = n_replicates;
+    job.weights_size = 2 * ipow(3, n_species - 1);
+    job.max_run = max_run;
+    job.common_all = common_all;
+    job.increments_all = increments_all;
+    run_job(&job, n_threads, 0);
+
+    free(common_all);
+    free(increments_all);
+
+    return 0;
+}
+
+/* Adds the contribution of one subset to the tile of a tile job. */
+static void process_subset_tile(struct weights_job *job, int subset_i,
+                                int thread_id) {
+    int *start_i = job->start_i;
+    int *end_i = job->end_i;
+    int *left_sets = job->left_sets;
+    int *right_sets = job->right_sets;
+    int *bipart_weights = job->bipart_weights;
+    int *two2three = job->two2three;
+    int high_mask = job->high_mask;
+    int tile_x = job->tile_x;
+    int tile_y = job->tile_y;
+    long lo = job->lo;
+    long tile_size = job->tile_size;
+    int universe = (1 << job->n_species) - 1;
+    int low_mask = universe - high_mask;
+    int bitmask = job->subsets[subset_i];
+    int kernel = universe - bitmask;
+    int kernel_low = kernel & low_mask;
+    int start = start_i[subset_i];
+    int n_run = end_i[subset_i] - start;
+
+    for (int a_prime = bitmask & (bitmask - 1); a_prime > 0;
+         a_prime = bitmask & (a_prime - 1)) {
+        int bitmask_inner = bitmask - a_prime;
+
+        for (int b_prime = bitmask_inner; b_prime > 0;
+             b_prime = bitmask_inner & (b_prime - 1)) {
+            if (b_prime >= a_prime) {
+                continue;
+            }
+            /* Only computed if some extension lies in the tile */
+            int weight_increment = 0;
+            int have_increment = 0;
+
+            /* The extension (a' + k1, b' + k2) is written with either
+             * a' + k1 or b' + k2 first, depending on which way gives the
+             * smaller representation. */
+            for (int orientation = 0; orientation < 2; orientation++) {
+                int u = (orientation == 0) ? a_prime : b_prime;
+                int v = (orientation == 0) ? b_prime : a_prime;
+                int u_high = u & high_mask;
+                int v_high = v & high_mask;
+                /* The high species of the extension must be exactly those
+                 * of the tile */
+                if ((u_high & ~tile_x) || (v_high & ~tile_y)) {
+                    continue;
+                }
+                int ku = tile_x - u_high;
+                int kv = tile_y - v_high;
+                if ((ku | kv) & ~kernel) {
+                    continue;
+                }
+
+                if (!have_increment) {
+                    weight_increment = job->weight_increment(
+                        a_prime, b_prime, left_sets + start,
+                        right_sets + start, bipart_weights + start, n_run);
+                    have_increment = 1;
+                }
+                if (weight_increment == 0) {
+                    break;
+                }
+
+                for (int k1 = kernel_low; k1 >= 0;
+                     k1 = kernel_low & (k1 - 1)) {
+                    for (int k2 = kernel_low - k1; k2 >= 0;
+                         k2 = (kernel_low - k1) & (k2 - 1)) {
+                        int x = u + ku + k1;
+                        int y = v + kv + k2;
+                        long rep = two2three[x] + 2L * two2three[y];
+                        long swapped = two2three[y] + 2L * two2three[x];
+
+                        /* Otherwise it's counted by the other orientation */
+                        if (rep < swapped && rep >= lo &&
+                            rep < lo + tile_size) {
+                            atomic_add(&job->weights[rep - lo],
+                                       weight_increment);
+                        }
+
+                        if (k2 == 0) {
+                            break;
+                        }
+                    }
+                    if (k1 == 0) {
+                        break;
+                    }
                 }
             }
         }
     }
-    fprintf(stderr, "\r");
-    fflush(stderr);
-    printf("%d/%d complete (%.2f%%)\n", n_subsets, n_subsets, 100.0);
-    fflush(stdout);
-}
\ No newline at end of file
+}
+
+/* Like fill_compressed_weight_representation, but only finds the weights
+ * whose compressed representation lies in one tile [lo, lo + tile_size).
+ * The tile consists of the bipartitions (x, y) whose restriction to the
+ * species in high_mask is exactly (tile_x, tile_y), and weights holds just
+ * the tile, so tile_size = 3^(number of species not in high_mask). The
+ * representations are computed with longs, so this also works for 20
+ * species, where they no longer fit in an int. */
+void fill_compressed_weight_representation_tile(
+    int *subsets, int *start_i, int *end_i, int *left_sets, int *right_sets,
+    int *bipart_weights, int n_subsets, int n_species, int high_mask,
+    int tile_x, int tile_y, long lo, long tile_size,
+    int *weights, /* Must be allocated with 0 in each entry. */
+    int *two2three, int n_threads) {
+    struct weights_job job = {0};
+    job.subsets = subsets;
+    job.start_i = start_i;
+    job.end_i = end_i;
+    job.left_sets = left_sets;
+    job.right_sets = right_sets;
+    job.bipart_weights = bipart_weights;
+    job.n_subsets = n_subsets;
+    job.n_species = n_species;
+    job.weights = weights;
+    job.two2three = two2three;
+    job.process = process_subset_tile;
+    job.dynamic = 1;
+    job.high_mask = high_mask;
+    job.tile_x = tile_x;
+    job.tile_y = tile_y;
+    job.lo = lo;
+    job.tile_size = tile_size;
+    run_job(&job, n_threads, 0);
+}
@@ -7,13 +7,41 @@ void get_compressed_weight_representation(int *left_sets, int *right_sets,
                                           int n_threads);
 int compressed_rep(int a, int b, int *two2three);
 int ipow(int a, int b);
-void fill_compressed_weight_representation(int *subsets, int *start_i,
-                                           int *end_i, int *left_sets,
-                                           int *right_sets, int *bipart_weights,
-                                           int n_subsets, int n_species,
-                                           int *weights, int *two2three,
-                                           int n_threads);
-int n_common_triplets_avx(int a, int b, int c, int d);
+double wall_time(void);
+int parallel_for(int n_items,
+                 void (*process)(void *data, int item, int thread_id),
+                 void *data, int n_threads);
+int add_remapped_weights(const int *old_weights, int n_old,
+                         const int *positions, int *weights, int n_new,
+                         int n_threads);
+int fill_compressed_weight_representation(
+    int *subsets, int *start_i, int *end_i, int *left_sets, int *right_sets,
+    int *bipart_weights, int n_subsets, int n_species, int *weights,
+    int *two2three, int n_threads, long *progress, double *thread_times,
+    int verbose);
+int fill_compressed_weight_representation_transform(
+    int *subsets, int *start_i, int *end_i, int *left_sets, int *right_sets,
+    int *bipart_weights, int n_subsets, int n_species, int *weights,
+    int *two2three, int n_threads, long *progress, double *thread_times,
+    int verbose);
+long transform_block_count(int n_species);
+long transform_block_size(int n_species);
+int count_triplets(int *subsets, int *start_i, int *end_i, int *left_sets,
+                   int *right_sets, int *bipart_weights, int n_subsets,
+                   int n_species, unsigned int *triplets, int n_threads,
+                   long *progress, double *thread_times, int verbose);
+int transform_triplet_counts(const unsigned int *triplets, int n_species,
+                             int *weights, long first_block, long n_blocks,
+                             int *two2three, int n_threads);
+int fill_compressed_weight_representation_batch(
+    int *subsets, int *start_i, int *end_i, int *left_sets, int *right_sets,
+    int *bipart_weights, int n_subsets, int n_biparts, int n_replicates,
+    int n_species, int *weights, int *two2three, int n_threads);
+void fill_compressed_weight_representation_tile(
+    int *subsets, int *start_i, int *end_i, int *left_sets, int *right_sets,
+    int *bipart_weights, int n_subsets, int n_species, int high_mask,
+    int tile_x, int tile_y, long lo, long tile_size, int *weights,
+    int *two2three, int n_threads);
 int n_common_triplets(int a, int b, int c, int d);
 int first_n_combo(int universe, int n);
 int snoob(int sub, int universe);
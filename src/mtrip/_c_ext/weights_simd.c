@@ -0,0 +1,272 @@
+#include "weights_simd.h"
+#include "weights_omp.h"
+
+/* The vectorized versions need x86-64 and GCC or Clang, for the target
+ * attributes and __builtin_cpu_supports. Elsewhere only the scalar version
+ * is available. */
+#if defined(__x86_64__) && (defined(__GNUC__) || defined(__clang__))
+#define HAVE_X86_SIMD
+#include <immintrin.h>
+#endif
+
+/* Sum of bipart_weights[i] * n_common_triplets(a, b, left_sets[i],
+ * right_sets[i]) over the n bipartitions. Overflows wrap around, as in the
+ * vectorized versions, so all of them give the same result. */
+static int weight_increment_scalar(int a, int b, const int *left_sets,
+                                   const int *right_sets,
+                                   const int *bipart_weights, int n) {
+    unsigned int total = 0;
+    for (int i = 0; i < n; i++) {
+        total += (unsigned int)bipart_weights[i] *
+                 (unsigned int)n_common_triplets(a, b, left_sets[i],
+                                                 right_sets[i]);
+    }
+
+    return (int)total;
+}
+
+#ifdef HAVE_X86_SIMD
+/* Popcount of each 32-bit lane, looking up each half-byte in a table. */
+__attribute__((target("sse4.2"))) static inline __m128i
+popcount_epi32_sse(__m128i v) {
+    const __m128i lookup =
+        _mm_setr_epi8(0, 1, 1, 2, 1, 2, 2, 3, 1, 2, 2, 3, 2, 3, 3, 4);
+    const __m128i low_mask = _mm_set1_epi8(0x0f);
+    __m128i low = _mm_and_si128(v, low_mask);
+    __m128i high = _mm_and_si128(_mm_srli_epi16(v, 4), low_mask);
+    __m128i bytes = _mm_add_epi8(_mm_shuffle_epi8(lookup, low),
+                                 _mm_shuffle_epi8(lookup, high));
+    /* Add up the four bytes of each lane */
+    __m128i pairs = _mm_maddubs_epi16(bytes, _mm_set1_epi8(1));
+
+    return _mm_madd_epi16(pairs, _mm_set1_epi16(1));
+}
+
+/* n choose 2 of each lane. */
+__attribute__((target("sse4.2"))) static inline __m128i
+combinations_2_sse(__m128i n) {
+    return _mm_srli_epi32(_mm_mullo_epi32(n, _mm_sub_epi32(n, _mm_set1_epi32(1))),
+                          1);
+}
+
+__attribute__((target("sse4.2"))) static int
+weight_increment_sse(int a, int b, const int *left_sets,
+                     const int *right_sets, const int *bipart_weights,
+                     int n) {
+    __m128i va = _mm_set1_epi32(a);
+    __m128i vb = _mm_set1_epi32(b);
+    __m128i totals = _mm_setzero_si128();
+    int i = 0;
+    for (; i + 4 <= n; i += 4) {
+        __m128i c = _mm_loadu_si128((const __m128i *)(left_sets + i));
+        __m128i d = _mm_loadu_si128((const __m128i *)(right_sets + i));
+        __m128i w = _mm_loadu_si128((const __m128i *)(bipart_weights + i));
+        __m128i n_ac = popcount_epi32_sse(_mm_and_si128(va, c));
+        __m128i n_ad = popcount_epi32_sse(_mm_and_si128(va, d));
+        __m128i n_bc = popcount_epi32_sse(_mm_and_si128(vb, c));
+        __m128i n_bd = popcount_epi32_sse(_mm_and_si128(vb, d));
+        __m128i common = _mm_add_epi32(
+            _mm_add_epi32(_mm_mullo_epi32(combinations_2_sse(n_ac), n_bd),
+                          _mm_mullo_epi32(combinations_2_sse(n_ad), n_bc)),
+            _mm_add_epi32(_mm_mullo_epi32(combinations_2_sse(n_bc), n_ad),
+                          _mm_mullo_epi32(combinations_2_sse(n_bd), n_ac)));
+        totals = _mm_add_epi32(totals, _mm_mullo_epi32(common, w));
+    }
+
+    unsigned int lanes[4];
+    _mm_storeu_si128((__m128i *)lanes, totals);
+    unsigned int total = lanes[0] + lanes[1] + lanes[2] + lanes[3];
+
+    return (int)(total + (unsigned int)weight_increment_scalar(
+                             a, b, left_sets + i, right_sets + i,
+                             bipart_weights + i, n - i));
+}
+
+__attribute__((target("avx2"))) static inline __m256i
+popcount_epi32_avx2(__m256i v) {
+    const __m256i lookup = _mm256_setr_epi8(
+        0, 1, 1, 2, 1, 2, 2, 3, 1, 2, 2, 3, 2, 3, 3, 4, 0, 1, 1, 2, 1, 2, 2,
+        3, 1, 2, 2, 3, 2, 3, 3, 4);
+    const __m256i low_mask = _mm256_set1_epi8(0x0f);
+    __m256i low = _mm256_and_si256(v, low_mask);
+    __m256i high = _mm256_and_si256(_mm256_srli_epi16(v, 4), low_mask);
+    __m256i bytes = _mm256_add_epi8(_mm256_shuffle_epi8(lookup, low),
+                                    _mm256_shuffle_epi8(lookup, high));
+    __m256i pairs = _mm256_maddubs_epi16(bytes, _mm256_set1_epi8(1));
+
+    return _mm256_madd_epi16(pairs, _mm256_set1_epi16(1));
+}
+
+__attribute__((target("avx2"))) static inline __m256i
+combinations_2_avx2(__m256i n) {
+    return _mm256_srli_epi32(
+        _mm256_mullo_epi32(n, _mm256_sub_epi32(n, _mm256_set1_epi32(1))), 1);
+}
+
+__attribute__((target("avx2"))) static int
+weight_increment_avx2(int a, int b, const int *left_sets,
+                      const int *right_sets, const int *bipart_weights,
+                      int n) {
+    __m256i va = _mm256_set1_epi32(a);
+    __m256i vb = _mm256_set1_epi32(b);
+    __m256i totals = _mm256_setzero_si256();
+    int i = 0;
+    for (; i + 8 <= n; i += 8) {
+        __m256i c = _mm256_loadu_si256((const __m256i *)(left_sets + i));
+        __m256i d = _mm256_loadu_si256((const __m256i *)(right_sets + i));
+        __m256i w =
+            _mm256_loadu_si256((const __m256i *)(bipart_weights + i));
+        __m256i n_ac = popcount_epi32_avx2(_mm256_and_si256(va, c));
+        __m256i n_ad = popcount_epi32_avx2(_mm256_and_si256(va, d));
+        __m256i n_bc = popcount_epi32_avx2(_mm256_and_si256(vb, c));
+        __m256i n_bd = popcount_epi32_avx2(_mm256_and_si256(vb, d));
+        __m256i common = _mm256_add_epi32(
+            _mm256_add_epi32(
+                _mm256_mullo_epi32(combinations_2_avx2(n_ac), n_bd),
+                _mm256_mullo_epi32(combinations_2_avx2(n_ad), n_bc)),
+            _mm256_add_epi32(
+                _mm256_mullo_epi32(combinations_2_avx2(n_bc), n_ad),
+                _mm256_mullo_epi32(combinations_2_avx2(n_bd), n_ac)));
+        totals = _mm256_add_epi32(totals, _mm256_mullo_epi32(common, w));
+    }
+
+    unsigned int lanes[8];
+    _mm256_storeu_si256((__m256i *)lanes, totals);
+    unsigned int total = 0;
+    for (int j = 0; j < 8; j++) {
+        total += lanes[j];
+    }
+
+    return (int)(total + (unsigned int)weight_increment_scalar(
+                             a, b, left_sets + i, right_sets + i,
+                             bipart_weights + i, n - i));
+}
+
+__attribute__((target("avx512f,avx512vpopcntdq"))) static inline __m512i
+combinations_2_avx512(__m512i n) {
+    return _mm512_srli_epi32(
+        _mm512_mullo_epi32(n, _mm512_sub_epi32(n, _mm512_set1_epi32(1))), 1);
+}
+
+/* With AVX-512, the last partial block is handled with masked loads. */
+__attribute__((target("avx512f,avx512vpopcntdq"))) static int
+weight_increment_avx512(int a, int b, const int *left_sets,
+                        const int *right_sets, const int *bipart_weights,
+                        int n) {
+    __m512i va = _mm512_set1_epi32(a);
+    __m512i vb = _mm512_set1_epi32(b);
+    __m512i totals = _mm512_setzero_si512();
+    for (int i = 0; i < n; i += 16) {
+        __mmask16 mask =
+            (n - i >= 16) ? (__mmask16)0xffff
+                          : (__mmask16)((1u << (n - i)) - 1);
+        __m512i c = _mm512_maskz_loadu_epi32(mask, left_sets + i);
+        __m512i d = _mm512_maskz_loadu_epi32(mask, right_sets + i);
+        __m512i w = _mm512_maskz_loadu_epi32(mask, bipart_weights + i);
+        __m512i n_ac = _mm512_popcnt_epi32(_mm512_and_si512(va, c));
+        __m512i n_ad = _mm512_popcnt_epi32(_mm512_and_si512(va, d));
+        __m512i n_bc = _mm512_popcnt_epi32(_mm512_and_si512(vb, c));
+        __m512i n_bd = _mm512_popcnt_epi32(_mm512_and_si512(vb, d));
+        __m512i common = _mm512_add_epi32(
+            _mm512_add_epi32(
+                _mm512_mullo_epi32(combinations_2_avx512(n_ac), n_bd),
+                _mm512_mullo_epi32(combinations_2_avx512(n_ad), n_bc)),
+            _mm512_add_epi32(
+                _mm512_mullo_epi32(combinations_2_avx512(n_bc), n_ad),
+                _mm512_mullo_epi32(combinations_2_avx512(n_bd), n_ac)));
+        /* The masked-out lanes have zero weight */
+        totals = _mm512_add_epi32(totals, _mm512_mullo_epi32(common, w));
+    }
+
+    unsigned int lanes[16];
+    _mm512_storeu_si512((void *)lanes, totals);
+    unsigned int total = 0;
+    for (int j = 0; j < 16; j++) {
+        total += lanes[j];
+    }
+
+    return (int)total;
+}
+#endif
+
+static const char *simd_names[N_SIMD_LEVELS] = {"scalar", "sse4.2", "avx2",
+                                                "avx512"};
+
+static const weight_increment_function simd_functions[N_SIMD_LEVELS] = {
+    weight_increment_scalar,
+#ifdef HAVE_X86_SIMD
+    weight_increment_sse,
+    weight_increment_avx2,
+    weight_increment_avx512,
+#else
+    NULL,
+    NULL,
+    NULL,
+#endif
+};
+
+/* -1 until the first call to get_simd_level */
+static int simd_level = -1;
+
+const char *simd_level_name(int level) {
+    if (level < 0 || level >= N_SIMD_LEVELS) {
+        return NULL;
+    }
+
+    return simd_names[level];
+}
+
+/* Whether this CPU can run the given level. */
+int simd_level_supported(int level) {
+    if (level == SIMD_SCALAR) {
+        return 1;
+    }
+#ifdef HAVE_X86_SIMD
+    __builtin_cpu_init();
+    switch (level) {
+    case SIMD_SSE42:
+        return __builtin_cpu_supports("sse4.2");
+    case SIMD_AVX2:
+        return __builtin_cpu_supports("avx2");
+    case SIMD_AVX512:
+        return __builtin_cpu_supports("avx512f") &&
+               __builtin_cpu_supports("avx512vpopcntdq");
+    }
+#endif
+
+    return 0;
+}
+
+/* The level in use: the best one this CPU supports, unless set_simd_level
+ * chose another. */
+int get_simd_level(void) {
+    int level = __atomic_load_n(&simd_level, __ATOMIC_RELAXED);
+    if (level < 0) {
+        level = SIMD_SCALAR;
+        for (int l = N_SIMD_LEVELS - 1; l > SIMD_SCALAR; l--) {
+            if (simd_level_supported(l)) {
+                level = l;
+                break;
+            }
+        }
+        __atomic_store_n(&simd_level, level, __ATOMIC_RELAXED);
+    }
+
+    return level;
+}
+
+/* Uses the given level from now on. Returns 0 (and changes nothing) if this
+ * CPU doesn't support it, 1 otherwise. */
+int set_simd_level(int level) {
+    if (level < 0 || level >= N_SIMD_LEVELS ||
+        !simd_level_supported(level)) {
+        return 0;
+    }
+    __atomic_store_n(&simd_level, level, __ATOMIC_RELAXED);
+
+    return 1;
+}
+
+weight_increment_function get_weight_increment_function(void) {
+    return simd_functions[get_simd_level()];
+}
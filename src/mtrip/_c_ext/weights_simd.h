@@ -0,0 +1,24 @@
+#ifndef WEIGHTS_SIMD_H
+#define WEIGHTS_SIMD_H
+
+/* Instruction sets for finding the weight increment of a block of
+ * bipartitions, from slowest to fastest. */
+#define SIMD_SCALAR 0
+#define SIMD_SSE42 1
+#define SIMD_AVX2 2
+#define SIMD_AVX512 3
+#define N_SIMD_LEVELS 4
+
+/* Returns the sum of bipart_weights[i] * n_common_triplets(a, b,
+ * left_sets[i], right_sets[i]) over the n bipartitions. */
+typedef int (*weight_increment_function)(int a, int b, const int *left_sets,
+                                         const int *right_sets,
+                                         const int *bipart_weights, int n);
+
+const char *simd_level_name(int level);
+int simd_level_supported(int level);
+int get_simd_level(void);
+int set_simd_level(int level);
+weight_increment_function get_weight_increment_function(void);
+
+#endif
@@ -0,0 +1,100 @@
+"""Finding the median trees of many small GT files in one run.
+
+Parsing the GTs and finding the best tree from the weights are pure Python,
+so the files are solved in a pool of worker processes, one file per core at
+a time. Each worker has its own MedianTripletSolver, running the C code on a
+single thread, so the lookup tables of each number of species are only
+built once per worker.
+"""
+import os
+from collections import deque
+from concurrent.futures import ProcessPoolExecutor
+
+from mtrip.inputs import open_input
+from mtrip.solver import MedianTripletSolver
+
+
+def read_manifest(filename):
+    """Returns the input files listed in a manifest, one per line. Blank
+    lines and lines starting with # are skipped, and relative paths are taken
+    relative to the manifest's directory."""
+    directory = os.path.dirname(filename)
+    paths = []
+    with open(filename, "r") as f:
+        for line in f:
+            line = line.strip()
+            if line == "" or line[0] == "#":
+                continue
+            paths.append(os.path.join(directory, line))
+
+    return paths
+
+
+def read_nwks(filename, novalidate=False):
+    """Reads the Newick strings of a file, without the comments. Raises
+    ValueError if a line isn't a valid Newick string (unless novalidate is
+    set) or if there are none, and OSError if the file can't be read. The
+    file can be compressed (see mtrip.inputs)."""
+    with open_input(filename) as f:
+        nwks = [line.strip() for line in f]
+    nwks = [s for s in nwks if s != "" and s[0] != "#"]
+
+    if not novalidate:
+        for i, string in enumerate(nwks):
+            if string[-1] != ";":
+                raise ValueError(
+                    "GT {} doesn't end with a semicolon".format(i + 1)
+                )
+            if string.count("(") != string.count(")"):
+                raise ValueError(
+                    "GT {} doesn't have an equal number of left and right "
+                    "brackets".format(i + 1)
+                )
+    if len(nwks) == 0:
+        raise ValueError("No GTs")
+
+    return nwks
+
+
+# The solver of this worker process
+_solver = None
+
+
+def _solve_file(path, novalidate):
+    """Solves one file in a worker process. Returns (result, error), as
+    yielded by solve_files."""
+    global _solver
+    if _solver is None:
+        _solver = MedianTripletSolver(n_threads=1)
+    try:
+        return _solver.solve(read_nwks(path, novalidate)), None
+    except OSError:
+        return None, "Can't read the file"
+    except (ValueError, SyntaxError) as e:
+        return None, str(e)
+
+
+def solve_files(paths, n_workers=1, novalidate=False):
+    """Finds the median trees of each file in paths, n_workers files at a
+    time, each in its own process. Yields a tuple (path, result, error) for
+    each file, in the order of paths, as soon as it and the files before it
+    are done. result is the dict returned by MedianTripletSolver.solve, or
+    None if the file couldn't be solved, in which case error says why."""
+    if n_workers <= 1:
+        for path in paths:
+            yield (path, *_solve_file(path, novalidate))
+        return
+
+    with ProcessPoolExecutor(max_workers=n_workers) as executor:
+        # Only a few files are read ahead, so the results don't pile up
+        pending = deque()
+        for path in paths:
+            pending.append(
+                (path, executor.submit(_solve_file, path, novalidate))
+            )
+            if len(pending) >= 4 * n_workers:
+                path, future = pending.popleft()
+                yield (path, *future.result())
+        while pending:
+            path, future = pending.popleft()
+            yield (path, *future.result())
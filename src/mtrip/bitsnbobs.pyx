@@ -1,7 +1,12 @@
+from array import array
+from functools import lru_cache
+
+
 # Wrapper to access the popcount function provided by gcc
 cdef extern:
     int __builtin_popcount(unsigned int) nogil
     int __builtin_ctz(unsigned int x) nogil
+    int __builtin_ctzll(unsigned long long x) nogil
 
 
 def popcount(unsigned int n):
@@ -40,6 +45,46 @@ def pysnoob(unsigned int sub, unsigned int universe):
     return snoob(sub, universe)
 
 
+cdef class SubsetIterator:
+    """Iterates over the subsets of n in the order of get_binary_subsets,
+    without building a list."""
+    cdef unsigned int n
+    cdef unsigned int i
+    cdef bint include_empty_set
+    cdef bint done
+
+    def __init__(self, unsigned int n, include_self=False,
+                 include_empty_set=False):
+        self.n = n
+        self.include_empty_set = include_empty_set
+        self.done = False
+        # Start one step "before" n, so that n itself is skipped
+        self.i = n if include_self else n & (n - 1)
+        if include_self and n == 0:
+            # Don't include 0 twice
+            self.include_empty_set = True
+            self.i = 0
+
+    def __iter__(self):
+        return self
+
+    def __next__(self):
+        cdef unsigned int i = self.i
+        if i > 0:
+            self.i = self.n & (i - 1)
+            return i
+        if self.include_empty_set and not self.done:
+            self.done = True
+            return 0
+        raise StopIteration
+
+
+def iter_subsets(unsigned int n, include_self=False, include_empty_set=False):
+    """Iterates over the same subsets as get_binary_subsets (in the same
+    order), without building a list."""
+    return SubsetIterator(n, include_self, include_empty_set)
+
+
 def get_binary_subsets(unsigned int n, include_self=False,
                        include_empty_set=False):
     """Generate a list of all numbers with set bits only where n has set bits,
@@ -64,24 +109,51 @@ def get_binary_subsets(unsigned int n, include_self=False,
     subsets - list of integers, each denoting a subset.
 
     """
-    subsets = []
-    cdef unsigned int i = n
+    return list(SubsetIterator(n, include_self, include_empty_set))
+
 
-    if include_self:
-        subsets.append(i)
+cdef class SnoobIterator:
+    """Iterates over the subsets of universe with n_set_bits set bits, in
+    increasing order, using snoob."""
+    cdef unsigned int universe
+    cdef unsigned int combo
+    cdef unsigned long long n_left
 
-    i = n & (i - 1)
+    def __init__(self, unsigned int universe, unsigned int n_set_bits):
+        cdef unsigned int n_universe_bits = __builtin_popcount(universe)
+        cdef unsigned int t = universe
+        cdef unsigned int i
 
-    while i > 0:
-        subsets.append(i)
-        i = n & (i - 1)
+        self.universe = universe
+        if n_set_bits > n_universe_bits:
+            self.n_left = 0
+            return
+        # n choose k; each partial product is itself a binomial coefficient
+        self.n_left = 1
+        for i in range(n_set_bits):
+            self.n_left = self.n_left * (n_universe_bits - i) // (i + 1)
+        # The first combo has the lowest n_set_bits bits of universe
+        for i in range(n_set_bits):
+            t ^= t & (0 - t)
+        self.combo = universe ^ t
 
-    if include_empty_set:
-        # Don't include 0 twice
-        if not (include_self and n==0):
-            subsets.append(0)
+    def __iter__(self):
+        return self
 
-    return subsets
+    def __next__(self):
+        cdef unsigned int combo = self.combo
+        if self.n_left == 0:
+            raise StopIteration
+        self.n_left -= 1
+        if self.n_left > 0:
+            self.combo = snoob(combo, self.universe)
+        return combo
+
+
+def iter_snoobs(unsigned int universe, unsigned int n_set_bits):
+    """Iterates over all integers with n_set_bits set bits, each of which
+    is set in universe, in increasing order, without building a list."""
+    return SnoobIterator(universe, n_set_bits)
 
 
 def replace_2_with_k(unsigned int x, int n):
@@ -102,15 +174,104 @@ def replace_2_with_k(unsigned int x, int n):
     return result
 
 
-def init_bipart_rep_function(n_species):
-    """Initializes a function which transforms a binary-represented
-    bipartition into a base-3 number."""
-    to_1 = [replace_2_with_k(x, 3) for x in range(2 ** n_species - 1 + 1)]
-    to_2 = [2 * x for x in to_1]
+def _as_uint_buffer(x):
+    """Returns x if it's a contiguous buffer of C unsigned ints, and an
+    array('I') copy of it otherwise."""
+    try:
+        view = memoryview(x)
+        if view.format == "I" and view.c_contiguous:
+            return x
+    except TypeError:
+        pass
 
-    def get_bipart_rep(a, b):
+    return array("I", x)
+
+
+cdef class BipartRep:
+    """Transforms a binary-represented bipartition (a, b) of n_species
+    species into a base-3 number, i.e. its index in the weights array.
+
+    The table to_1 sends x = 2^n_0 + ... + 2^n_k to 3^n_0 + ... + 3^n_k, and
+    is a typed array filled in C, so it takes 8 bytes per subset (rather
+    than two lists of boxed ints)."""
+    cdef readonly object to_1
+    cdef readonly unsigned int n_species
+    cdef const long long[::1] table
+
+    def __init__(self, unsigned int n_species):
+        if n_species > 32:
+            raise ValueError("At most 32 species are supported")
+        cdef unsigned long long size = 1ULL << n_species
+        cdef unsigned long long x
+        cdef long long[::1] table
+        cdef long long pows[32]
+        cdef int i
+
+        self.n_species = n_species
+        self.to_1 = array("q", bytes(8 * size))
+        table = self.to_1
+        for i in range(n_species):
+            pows[i] = 1 if i == 0 else 3 * pows[i - 1]
+        with nogil:
+            # Each entry is the one without its lowest set bit, plus a power
+            for x in range(1, size):
+                table[x] = table[x & (x - 1)] + pows[__builtin_ctzll(x)]
+        self.table = table
+
+    def __call__(self, unsigned long long a, unsigned long long b):
         """Does not check if this makes sense"""
-        rep = min(to_1[a] + to_2[b], to_1[b] + to_2[a])
-        return rep
+        cdef long long rep_1 = self.table[a] + 2 * self.table[b]
+        cdef long long rep_2 = self.table[b] + 2 * self.table[a]
+        return min(rep_1, rep_2)
+
+    def reps(self, a, b, out=None):
+        """Batched version of calling this object on the pairs (a[i], b[i]).
 
-    return get_bipart_rep
+        a, b - sequences (ideally array('I')s) of equal length
+        out - optional array('q') to write the representations to
+
+        Returns out, or a new array('q'). Raises ValueError if any of the
+        subsets has species beyond n_species."""
+        a = _as_uint_buffer(a)
+        b = _as_uint_buffer(b)
+        cdef const unsigned int[::1] a_view = a
+        cdef const unsigned int[::1] b_view = b
+        cdef Py_ssize_t n = a_view.shape[0]
+        if b_view.shape[0] != n:
+            raise ValueError("a and b must have the same length")
+        if out is None:
+            out = array("q", bytes(8 * n))
+        cdef long long[::1] out_view = out
+        if out_view.shape[0] < n:
+            raise ValueError("out is too short")
+
+        cdef unsigned long long limit = 1ULL << self.n_species
+        cdef Py_ssize_t i
+        cdef long long rep_1, rep_2
+        cdef bint bad = False
+        with nogil:
+            for i in range(n):
+                if a_view[i] >= limit or b_view[i] >= limit:
+                    bad = True
+                    break
+                rep_1 = self.table[a_view[i]] + 2 * self.table[b_view[i]]
+                rep_2 = self.table[b_view[i]] + 2 * self.table[a_view[i]]
+                out_view[i] = rep_1 if rep_1 < rep_2 else rep_2
+        if bad:
+            raise ValueError(
+                "Subsets must only have the first {} species".format(
+                    self.n_species
+                )
+            )
+
+        return out
+
+
+# One table is kept for each number of species, so runs on many inputs (e.g.
+# mtrip --batch) only build each one once. Each table is half the size of
+# the next, so all of them take up at most twice the largest one.
+@lru_cache(maxsize=None)
+def init_bipart_rep_function(n_species):
+    """Initializes a function (a BipartRep) which transforms a
+    binary-represented bipartition into a base-3 number."""
+    return BipartRep(n_species)
@@ -0,0 +1,187 @@
+"""On-disk cache of weights, stacks and best bipartitions.
+
+Entries are keyed by a hash of the species labels and of the multiset of GT
+bipartitions, so rerunning mtrip on the same (or a reordered) set of gene
+trees finds the previous result. Each entry is stored as two pickles: a
+small one with the labels and bipartition counts, used to find near-identical
+entries, and a large one with the computed arrays. The cache is kept under a
+size bound by evicting the least recently used entries.
+"""
+import hashlib
+import os
+import pickle
+
+# Bump this whenever the format of the cached data changes
+__cache_version__ = 1
+
+_meta_suffix = ".meta.p"
+_data_suffix = ".data.p"
+
+
+def get_cache_key(weights, reverse_dictionary):
+    """Returns a hex digest identifying a set of GT bipartition counts.
+
+    weights - dict sending each GT bipartition (a,b) to its count
+    reverse_dictionary - list of species names, in index order
+    """
+    h = hashlib.sha256()
+    h.update("mtrip-cache-{}\n".format(__cache_version__).encode())
+    h.update("\t".join(reverse_dictionary).encode())
+    h.update(b"\n")
+    for (a, b), w in sorted(weights.items()):
+        if w != 0:
+            h.update("{} {} {}\n".format(a, b, w).encode())
+
+    return h.hexdigest()
+
+
+def get_bipart_delta(weights, cached_weights):
+    """Returns the bipartition counts which must be added to cached_weights
+    to get weights (negative counts remove bipartitions)."""
+    delta = {}
+    for bipart, w in weights.items():
+        d = w - cached_weights.get(bipart, 0)
+        if d != 0:
+            delta[bipart] = d
+    for bipart, w in cached_weights.items():
+        if bipart not in weights and w != 0:
+            delta[bipart] = -w
+
+    return delta
+
+
+class WeightsCache:
+    """A size-bounded, least recently used cache of mtrip results.
+
+    cache_dir - directory holding the cache (created if it doesn't exist)
+    max_bytes - total size of the cache after which old entries are evicted
+    """
+
+    def __init__(self, cache_dir, max_bytes=1024**3):
+        self.cache_dir = cache_dir
+        self.max_bytes = max_bytes
+        os.makedirs(cache_dir, exist_ok=True)
+
+    def _path(self, key, suffix):
+        return os.path.join(self.cache_dir, key + suffix)
+
+    def keys(self):
+        """Returns the keys of all the complete entries in the cache."""
+        keys = []
+        for filename in os.listdir(self.cache_dir):
+            if filename.endswith(_meta_suffix):
+                key = filename[: -len(_meta_suffix)]
+                if os.path.exists(self._path(key, _data_suffix)):
+                    keys.append(key)
+
+        return keys
+
+    def _touch(self, key):
+        for suffix in (_meta_suffix, _data_suffix):
+            try:
+                os.utime(self._path(key, suffix))
+            except OSError:
+                pass
+
+    def _load(self, key, suffix):
+        try:
+            with open(self._path(key, suffix), "rb") as f:
+                return pickle.load(f)
+        except (OSError, pickle.UnpicklingError, EOFError):
+            return None
+
+    def load(self, key):
+        """Returns the cached dict with triplet_weights, stack and
+        best_biparts, or None if there is no such entry."""
+        entry = self._load(key, _data_suffix)
+        if entry is not None:
+            self._touch(key)
+
+        return entry
+
+    def find_nearest(self, weights, reverse_dictionary):
+        """Finds the cached entry for the same species which differs from
+        weights in the fewest bipartitions. Returns a tuple (key, delta),
+        where delta is the change in bipartition counts, or None if no
+        entry is close enough to be worth reusing."""
+        best = None
+        for key in self.keys():
+            meta = self._load(key, _meta_suffix)
+            if meta is None or meta["reverse_dictionary"] != reverse_dictionary:
+                continue
+            delta = get_bipart_delta(weights, meta["weights"])
+            if best is None or len(delta) < len(best[1]):
+                best = (key, delta)
+
+        # Only reuse an entry if the delta is cheaper than starting over
+        if best is None or 2 * len(best[1]) >= len(weights):
+            return None
+
+        return best
+
+    def store(
+        self, key, weights, reverse_dictionary, triplet_weights, stack,
+        best_biparts,
+    ):
+        """Adds an entry to the cache, then evicts old entries if the cache
+        is over its size bound."""
+        entries = [
+            (
+                _data_suffix,
+                {
+                    "triplet_weights": triplet_weights,
+                    "stack": stack,
+                    "best_biparts": best_biparts,
+                },
+            ),
+            # The metadata is written last, so it marks a complete entry
+            (
+                _meta_suffix,
+                {
+                    "reverse_dictionary": reverse_dictionary,
+                    "weights": dict(weights),
+                },
+            ),
+        ]
+        for suffix, entry in entries:
+            path = self._path(key, suffix)
+            with open(path + ".tmp", "wb") as f:
+                pickle.dump(entry, f, protocol=4)
+            os.replace(path + ".tmp", path)
+
+        self.evict(keep=key)
+
+    def size(self, key):
+        total = 0
+        for suffix in (_meta_suffix, _data_suffix):
+            try:
+                total += os.path.getsize(self._path(key, suffix))
+            except OSError:
+                pass
+
+        return total
+
+    def evict(self, keep=None):
+        """Removes the least recently used entries until the cache fits in
+        max_bytes. The entry keep is never removed."""
+        keys = self.keys()
+        sizes = {key: self.size(key) for key in keys}
+        total = sum(sizes.values())
+
+        def last_used(key):
+            try:
+                return os.path.getmtime(self._path(key, _data_suffix))
+            except OSError:
+                return 0
+
+        for key in sorted(keys, key=last_used):
+            if total <= self.max_bytes:
+                break
+            if key == keep:
+                continue
+            for suffix in (_meta_suffix, _data_suffix):
+                try:
+                    os.remove(self._path(key, suffix))
+                except OSError:
+                    pass
+            total -= sizes[key]
@@ -0,0 +1,184 @@
+"""Checkpointing for long weights computations.
+
+The weights are a sum of independent contributions of the subsets, so the
+subsets are processed in chunks, and every so often the partial result is
+saved together with the number of subsets done. A resumed run loads the
+partial result and continues with the next chunk; since integer addition
+doesn't depend on the order, the result is bit-identical to an uninterrupted
+run.
+
+With the transform engine, the partial result is the GT triplet counts of
+the subsets done so far, which only take n_species**3 entries, and the
+weights are found from the counts once all the subsets are done. With the
+scatter engine, it's the partial weights.
+"""
+import hashlib
+import os
+import pickle
+from array import array
+from time import time
+
+import mtrip.triplet_omp as triplet_omp
+
+
+def get_inputs_key(subsets, start_i, end_i, biparts_a, biparts_b,
+                   bipart_weights, n_species):
+    """Returns a hex digest identifying the inputs of the weights kernel, in
+    the order they are processed."""
+    h = hashlib.sha256()
+    h.update("{}\n".format(n_species).encode())
+    for values in (subsets, start_i, end_i, biparts_a, biparts_b,
+                   bipart_weights):
+        h.update(array("i", values).tobytes())
+        h.update(b"\n")
+
+    return h.hexdigest()
+
+
+class Checkpoint:
+    """Periodically saves the partial weights of a computation.
+
+    path - file holding the checkpoint
+    interval - minimal number of seconds between two saves
+    resume - continue from the checkpoint in path, if there is one
+    n_chunks - number of pieces the subsets are split into; a save can
+               only happen between two pieces
+    """
+
+    def __init__(self, path, interval=600, resume=False, n_chunks=100):
+        self.path = path
+        self.interval = interval
+        self.resume = resume
+        self.n_chunks = n_chunks
+
+    def load(self, key):
+        """Returns (n_done, partial) saved in the checkpoint file, or None if
+        there is no checkpoint. Raises ValueError if the checkpoint was made
+        for different inputs."""
+        try:
+            with open(self.path, "rb") as f:
+                saved = pickle.load(f)
+        except FileNotFoundError:
+            return None
+        except (OSError, pickle.UnpicklingError, EOFError):
+            raise ValueError(
+                "Can't read checkpoint file {}".format(self.path)
+            )
+        if saved.get("key") != key:
+            raise ValueError(
+                "Checkpoint file {} was made for different input".format(
+                    self.path
+                )
+            )
+
+        return saved["n_done"], saved["partial"]
+
+    def save(self, key, n_done, partial):
+        """Atomically replaces the checkpoint file, so an interrupted save
+        leaves the previous checkpoint intact."""
+        with open(self.path + ".tmp", "wb") as f:
+            pickle.dump(
+                {"key": key, "n_done": n_done, "partial": partial},
+                f,
+                protocol=4,
+            )
+            f.flush()
+            os.fsync(f.fileno())
+        os.replace(self.path + ".tmp", self.path)
+
+    def remove(self):
+        try:
+            os.remove(self.path)
+        except OSError:
+            pass
+
+    def compressed_weight_rep(self, subsets, start_i, end_i, biparts_a,
+                              biparts_b, bipart_weights, n_species,
+                              n_threads=1, weights=None, engine=None,
+                              blocks=None):
+        """Checkpointed version of triplet_omp.py_compressed_weight_rep.
+        With the transform engine, blocks can be given as a tuple
+        (first_block, n_blocks), to only find those blocks of the weights
+        (see triplet_omp.py_transform_triplet_counts)."""
+        engine = triplet_omp._check_engine(engine)
+        if blocks is not None and engine != "transform":
+            raise ValueError("Only the transform engine computes blocks.")
+        key = get_inputs_key(subsets, start_i, end_i, biparts_a, biparts_b,
+                             bipart_weights, n_species) + "+" + engine
+        if weights is not None and engine == "scatter":
+            # The checkpoint only knows about this computation's part
+            key += "+{}".format(
+                hashlib.sha256(array("i", weights).tobytes()).hexdigest()
+            )
+        n_subsets = len(subsets)
+
+        n_done = 0
+        partial = None
+        saved = self.load(key) if self.resume else None
+        if saved is not None:
+            n_done, partial = saved
+            print(
+                "    Resuming from checkpoint: {}/{} subsets already "
+                "done.".format(n_done, n_subsets)
+            )
+        elif self.resume:
+            print("    No checkpoint found, starting from the beginning.")
+        if engine == "transform":
+            if partial is None:
+                partial = triplet_omp.zero_array(n_species**3, "I")
+        else:
+            if weights is None:
+                weights = triplet_omp.zero_array(2 * 3 ** (n_species - 1), "i")
+            if partial is not None:
+                weights[:] = partial
+            partial = weights
+
+        chunk = max(1, -(-n_subsets // self.n_chunks))
+        last_save = time()
+        while n_done < n_subsets:
+            n_next = min(n_done + chunk, n_subsets)
+            # start_i and end_i index the full bipartition arrays, so only
+            # the subset arrays need to be sliced
+            chunk_arrays = (
+                subsets[n_done:n_next],
+                start_i[n_done:n_next],
+                end_i[n_done:n_next],
+                biparts_a,
+                biparts_b,
+                bipart_weights,
+                n_species,
+            )
+            if engine == "transform":
+                triplet_omp.py_count_triplets(
+                    *chunk_arrays, n_threads=n_threads, triplets=partial
+                )
+            else:
+                triplet_omp.py_compressed_weight_rep(
+                    *chunk_arrays,
+                    n_threads=n_threads,
+                    weights=weights,
+                    verbose=False,
+                    engine=engine,
+                )
+            n_done = n_next
+            if time() - last_save >= self.interval or n_done == n_subsets:
+                self.save(key, n_done, partial)
+                last_save = time()
+                print(
+                    "    Checkpoint saved: {}/{} subsets done.".format(
+                        n_done, n_subsets
+                    )
+                )
+
+        if engine == "transform":
+            first_block, n_blocks = blocks if blocks is not None else (0, None)
+            weights = triplet_omp.py_transform_triplet_counts(
+                partial,
+                n_species,
+                n_threads=n_threads,
+                weights=weights,
+                first_block=first_block,
+                n_blocks=n_blocks,
+            )
+
+        return weights
@@ -3,12 +3,38 @@ import argparse
 import pickle
 import sys
 from datetime import timedelta
-from os import cpu_count
-from os.path import basename
+from os import cpu_count, replace
 from time import time
 
+import mtrip.triplet_omp as triplet_omp
 from mtrip import __version__
-from mtrip.median_tree_reconstruction import median_triplet_trees
+from mtrip.batch import read_manifest, solve_files
+from mtrip.cache import WeightsCache
+from mtrip.checkpoint import Checkpoint
+from mtrip.heuristic import (
+    heuristic_median_tree,
+    heuristic_median_triplet_tree,
+)
+from mtrip.inputs import get_input_name, read_lines
+from mtrip.metrics import Metrics, stage
+from mtrip.median_tree_reconstruction import (
+    TopologyCounter,
+    append_median_triplet_trees,
+    median_triplet_trees,
+    get_present_species,
+    shard_triplet_weights,
+    window_median_triplet_trees,
+)
+from mtrip.planner import format_plan, plan_run
+from mtrip.shard import parse_shard
+from mtrip.tiles import TiledWeights
+from mtrip.support import replicate_clade_support
+from mtrip.triplets import (
+    frequency_median_triplet_trees,
+    load_triplet_frequencies,
+    nwk_triplet_frequencies,
+    save_triplet_frequencies,
+)
 
 # Some fun colors. Should be refactored. Or removed. :-)
 bold = "\033[1m"
@@ -34,9 +60,13 @@ def get_parser():
     )
     parser.add_argument(
         "i",
+        nargs="?",
         action="store",
         type=str,
-        help="input file with one Newick string per line",
+        help="input file with one Newick string per line, which can be "
+             "compressed with gzip, bz2, xz or zstd, or - to read it from "
+             "stdin",
+        default=None,
     )
     parser.add_argument(
         "o",
@@ -63,6 +93,48 @@ def get_parser():
              "CPUs, or 1 if undetermined). Must be a positive integer or -1 "
              "for the default guess",
     )
+    parser.add_argument(
+        "--engine",
+        action="store",
+        choices=["scatter", "transform"],
+        default="transform",
+        help="how the weights are computed: by counting the gene tree "
+             "triplets and summing them over the weights array (transform), "
+             "or by adding each subset's contribution to every bipartition "
+             "it affects (scatter). Both give the same weights, but "
+             "transform is usually much faster. Defaults to transform",
+    )
+    parser.add_argument(
+        "--heuristic",
+        action="store",
+        type=float,
+        default=None,
+        metavar="SECONDS",
+        help="heuristic mode, for more species than the exact algorithm can "
+             "handle (about 20): search for this many seconds for a tree "
+             "agreeing with as many GT triplets as possible, from random "
+             "starts run in parallel, instead of finding all the median "
+             "trees. The output file has the best tree found, which isn't "
+             "guaranteed to be a median tree",
+    )
+    parser.add_argument(
+        "--starts",
+        action="store",
+        type=int,
+        default=None,
+        help="with --heuristic, stop after this many starts of the search, "
+             "even if there's time left",
+    )
+    parser.add_argument(
+        "--exact-clades",
+        action="store",
+        type=int,
+        default=0,
+        help="with --heuristic, replace each clade of at most this many "
+             "species of the trees found with its exact median tree, which "
+             "can only improve them. Up to about 12 is fast. Defaults to 0, "
+             "which doesn't replace any clades",
+    )
     parser.add_argument(
         "--novalidate",
         action="store_true",
@@ -100,10 +172,680 @@ def get_parser():
              "used to find additional trees. Traditionally this file has "
              "the extension .p",
     )
+    parser.add_argument(
+        "--triplets",
+        action="store",
+        type=str,
+        default=None,
+        help="only count the gene trees with each rooted triplet of each "
+             "triple of species, and save these triplet frequencies to this "
+             "file: a tab-separated file if its name ends with .tsv, and a "
+             "binary file otherwise. No median trees are found",
+    )
+    parser.add_argument(
+        "--triplet-input",
+        action="store_true",
+        default=False,
+        help="the input file has triplet frequencies (saved with --triplets, "
+             "or a tab-separated file in the same format) instead of Newick "
+             "strings. They give the same median trees as the gene trees "
+             "they were counted from. The weights file saved with --binary "
+             "has no Newick strings, only their number",
+    )
+    parser.add_argument(
+        "--batch",
+        action="store",
+        type=str,
+        default=None,
+        help="batch mode: find the median trees of each input file listed "
+             "in this manifest file (one per line, relative to the "
+             "manifest's directory), instead of a single input file. The "
+             "files are solved concurrently, one per worker process (see "
+             "-t), and the median trees of each are written to out_<input "
+             "file> as soon as they are found, unless --tsv is given",
+    )
+    parser.add_argument(
+        "--tsv",
+        action="store",
+        type=str,
+        default=None,
+        help="with --batch, write all the median trees to this one "
+             "tab-separated file instead, with the input file, its score "
+             "and a median tree on each line",
+    )
+    parser.add_argument(
+        "--metrics",
+        action="store",
+        type=str,
+        default=None,
+        help="write a JSON report to this file, with the wall and CPU time, "
+             "peak memory and number of items of each stage of the run, and "
+             "the time spent by each thread computing the weights",
+    )
+    parser.add_argument(
+        "--plan",
+        action="store_true",
+        default=False,
+        help="only parse the input, and estimate the time and memory each "
+             "stage of the run would need on this machine, along with the "
+             "recommended --memory and --threads. Nothing is written",
+    )
+    parser.add_argument(
+        "--append-to",
+        action="store",
+        type=str,
+        default=None,
+        help="add the input gene trees to a weights file saved earlier with "
+             "-b, and update that file in place. Only the bipartitions of the "
+             "new gene trees are processed. The new gene trees can only use "
+             "species which appear in the weights file",
+    )
+    parser.add_argument(
+        "--window",
+        action="store",
+        type=int,
+        default=None,
+        help="genome scan mode: find the median trees of each window of this "
+             "many consecutive gene trees. The output file then has one "
+             "tab-separated line per median tree, with the window's first "
+             "and last gene tree (1-based line numbers, not counting "
+             "comments), its score, and the tree",
+    )
+    parser.add_argument(
+        "--step",
+        action="store",
+        type=int,
+        default=None,
+        help="number of gene trees by which the window is moved (used with "
+             "--window). Defaults to the window size",
+    )
+    parser.add_argument(
+        "--replicates",
+        action="store",
+        type=int,
+        default=None,
+        help="clade support mode: find the median trees of this many "
+             "resampled replicates of the gene trees. The output file then "
+             "has one tab-separated line per clade, with the fraction of "
+             "replicates supporting it and its species",
+    )
+    parser.add_argument(
+        "--resample",
+        action="store",
+        choices=["bootstrap", "jackknife"],
+        default="bootstrap",
+        help="how each replicate resamples the gene trees: with replacement "
+             "(bootstrap), or by keeping a random half of them (jackknife). "
+             "Defaults to bootstrap",
+    )
+    parser.add_argument(
+        "--replicate-group",
+        action="store",
+        type=int,
+        default=8,
+        help="number of replicates computed together by --engine scatter. "
+             "Each one needs its own weights array in memory. Defaults to 8",
+    )
+    parser.add_argument(
+        "--seed",
+        action="store",
+        type=int,
+        default=0,
+        help="seed for the random number generator used for resampling, "
+             "and by --heuristic. Defaults to 0",
+    )
+    parser.add_argument(
+        "--checkpoint",
+        action="store",
+        type=str,
+        default=None,
+        help="periodically save the partial result to this file, "
+             "so that an interrupted run can be continued with --resume. The "
+             "file is removed once the run finishes",
+    )
+    parser.add_argument(
+        "--checkpoint-interval",
+        action="store",
+        type=float,
+        default=600,
+        help="minimal number of seconds between two checkpoints. Defaults "
+             "to 600",
+    )
+    parser.add_argument(
+        "--resume",
+        action="store_true",
+        default=False,
+        help="continue from the file given by --checkpoint, if it exists. "
+             "The output is identical to that of an uninterrupted run",
+    )
+    parser.add_argument(
+        "--shard",
+        action="store",
+        type=str,
+        default=None,
+        help="compute only part of the weights, given as i/N for the i-th of "
+             "N shards (1 <= i <= N), and save it to the file given by -b. "
+             "The N shards can be computed on different machines, and are "
+             "added up with mtrip-combine to find the median trees",
+    )
+    parser.add_argument(
+        "--memory",
+        action="store",
+        type=int,
+        default=None,
+        help="memory budget for the weights array in megabytes. If the "
+             "array is larger, it's computed in tiles which are written to a "
+             "memory-mapped file, making runs with more species possible (up "
+             "to 20). Can't be used with --binary. With --plan, the memory to "
+             "plan for instead of this machine's",
+    )
+    parser.add_argument(
+        "--tile-dir",
+        action="store",
+        type=str,
+        default=None,
+        help="directory for the weights file used with --memory. It should "
+             "be on a disk with enough free space for the whole weights "
+             "array. Defaults to the system's temporary directory",
+    )
+    parser.add_argument(
+        "--cache-dir",
+        action="store",
+        type=str,
+        default=None,
+        help="directory for caching weights between runs. A rerun on the "
+             "same gene trees (in any order) skips straight to the output, "
+             "and a run on nearly the same gene trees only computes the "
+             "difference",
+    )
+    parser.add_argument(
+        "--cache-size",
+        action="store",
+        type=int,
+        default=1024,
+        help="maximum size of the cache directory in megabytes; the least "
+             "recently used entries are evicted first. Defaults to 1024",
+    )
 
     return parser
 
 
+def load_weights_pickle(filename):
+    """Loads a weights file written by mtrip -b, or returns None if it
+    doesn't seem to be one."""
+    try:
+        with open(filename, "rb") as f:
+            unpickled = pickle.load(f)
+        if unpickled["abigsecret"] != "ogurets":
+            return None
+    except Exception:
+        return None
+
+    return unpickled
+
+
+def pickled_nwks_count(unpickled):
+    """Returns the number of GTs of a weights pickle. Pickles saved from
+    --triplet-input runs don't have all of their GTs' Newick strings."""
+    return unpickled.get("n_nwks", len(unpickled["nwks"]))
+
+
+def save_weights_pickle(picklename, contents):
+    """Pickles the dict contents to picklename. Writes to a temporary file
+    first, so an existing file (e.g. with --append-to) is never left
+    half-written. Returns True on success."""
+    try:
+        with open(picklename + ".tmp", "wb") as f:
+            pickle.dump(contents, f, protocol=4)
+        replace(picklename + ".tmp", picklename)
+    except IOError:
+        print(f"Can't write to {picklename}. Aborting serializing the "
+              "processed data.")
+        return False
+
+    print(
+        "* {}Pickled weights to {}{}{}{}. 🥒🏋️".format(
+            bold, italics, picklename, end, end
+        )
+    )
+    return True
+
+
+def save_metrics(metrics, filename):
+    """Writes the JSON report of metrics (a mtrip.metrics.Metrics) to
+    filename, unless metrics is None."""
+    if metrics is None:
+        return
+    try:
+        metrics.write_json(filename)
+        print(
+            "* {}Wrote metrics to {}{}{}{}.".format(
+                bold, italics, filename, end, end
+            )
+        )
+    except IOError:
+        print(f"Can't write metrics to {filename}.")
+
+
+def find_median_trees(
+    nwks,
+    n_threads,
+    cache_dir,
+    cache_size,
+    checkpoint,
+    tiling=None,
+    metrics=None,
+    topology_counter=None,
+):
+    """Runs median_triplet_trees, using a cache directory, a checkpoint or
+    tiling if one is given. Returns a tuple of Nones if the cache directory
+    or checkpoint can't be used."""
+    cache = None
+    if cache_dir is not None:
+        try:
+            cache = WeightsCache(cache_dir, max_bytes=cache_size * 1024**2)
+        except OSError:
+            print(f"Can't use {cache_dir} as a cache directory. Aborting.")
+            return (None,) * 5
+
+    try:
+        return median_triplet_trees(
+            nwks,
+            n_threads=n_threads,
+            return_extra=True,
+            cache=cache,
+            checkpoint=checkpoint,
+            tiling=tiling,
+            metrics=metrics,
+            topology_counter=topology_counter,
+        )
+    except (ValueError, OSError) as e:
+        if checkpoint is None:
+            raise
+        # Unusable checkpoint file
+        print("{}. Aborting.".format(e))
+        return (None,) * 5
+
+
+def write_lines(lines, description, out_file, nosave, printflag, tic):
+    """Writes the output of the modes which don't output median trees."""
+    print("")
+    print("{}{}Done!{}{}".format(bold, underline, end, end))
+    if not nosave:
+        try:
+            with open(out_file, "w") as f:
+                f.writelines([s + "\n" for s in lines])
+            print(
+                "* {}Wrote {} to {}{}{}{}.".format(
+                    bold, description, italics, out_file, end, end
+                )
+            )
+        except IOError:
+            print(
+                "Can't write to {}. Outputting to stdout instead.".format(
+                    out_file
+                )
+            )
+            printflag = True
+
+    dt = timedelta(seconds=time() - tic)
+    print(
+        "🤖💬 Beep boop, finished in {:.2f} seconds.".format(dt.total_seconds())
+    )
+
+    if printflag:
+        print("")
+        for line in lines:
+            print(line)
+
+    return 0
+
+
+def run_batch(manifest, tsv, n_threads, novalidate, tic):
+    """Runs the batch mode, writing the median trees of each input file as
+    soon as they're found."""
+    try:
+        paths = read_manifest(manifest)
+    except IOError:
+        print("Can't open manifest {} for reading. Aborting.".format(manifest))
+        return 1
+    out_files = ["out_" + get_input_name(path) for path in paths]
+    if tsv is None and len(set(out_files)) < len(out_files):
+        print(
+            "Some input files have the same name, so their output files "
+            "would overwrite each other. Use --tsv instead. Aborting."
+        )
+        return 1
+    print("* Solving {} input files.".format(len(paths)))
+
+    f = None
+    if tsv is not None:
+        try:
+            f = open(tsv, "w")
+        except IOError:
+            print("Can't write to {}. Aborting.".format(tsv))
+            return 1
+
+    n_failed = 0
+    for (path, result, error), out_file in zip(
+        solve_files(paths, n_workers=n_threads, novalidate=novalidate),
+        out_files,
+    ):
+        if result is None:
+            print("* {}: {}. Skipping.".format(path, error))
+            n_failed += 1
+            continue
+        print(
+            "* {}: {} median trees with score {}.".format(
+                path, len(result["trees"]), result["score"]
+            )
+        )
+        if f is not None:
+            for tree in result["trees"]:
+                f.write("{}\t{}\t{}\n".format(path, result["score"], tree))
+            f.flush()
+            continue
+        try:
+            with open(out_file, "w") as out:
+                out.writelines([s + "\n" for s in result["trees"]])
+        except IOError:
+            print("* Can't write to {}. Skipping.".format(out_file))
+            n_failed += 1
+
+    print("")
+    print("{}{}Done!{}{}".format(bold, underline, end, end))
+    if f is not None:
+        f.close()
+        print(
+            "* {}Wrote the median triplet trees of each input to "
+            "{}{}{}{}.".format(bold, italics, tsv, end, end)
+        )
+    if n_failed > 0:
+        print("* {} of {} input files failed.".format(n_failed, len(paths)))
+
+    dt = timedelta(seconds=time() - tic)
+    print(
+        "🤖💬 Beep boop, finished in {:.2f} seconds.".format(dt.total_seconds())
+    )
+
+    return 0 if n_failed == 0 else 1
+
+
+def write_windows(
+    nwks, window, step, n_threads, out_file, nosave, printflag, tic
+):
+    """Runs the genome scan mode, writing each window's median trees as soon
+    as they're found."""
+    f = None
+    if not nosave:
+        try:
+            f = open(out_file, "w")
+        except IOError:
+            print(
+                "Can't write to {}. Outputting to stdout instead.".format(
+                    out_file
+                )
+            )
+            printflag = True
+
+    lines = []
+    for start, stop, score, trees in window_median_triplet_trees(
+        nwks, window, step, n_threads=n_threads
+    ):
+        print("* Best triplet count in window is {}.".format(score))
+        for tree in trees:
+            line = "{}\t{}\t{}\t{}".format(start + 1, stop, score, tree)
+            lines.append(line)
+            if f is not None:
+                f.write(line + "\n")
+                f.flush()
+
+    print("")
+    print("{}{}Done!{}{}".format(bold, underline, end, end))
+    if f is not None:
+        f.close()
+        print(
+            "* {}Wrote the median triplet trees of each window to "
+            "{}{}{}{}.".format(bold, italics, out_file, end, end)
+        )
+
+    dt = timedelta(seconds=time() - tic)
+    print(
+        "🤖💬 Beep boop, finished in {:.2f} seconds.".format(dt.total_seconds())
+    )
+
+    if printflag:
+        print("")
+        for line in lines:
+            print(line)
+
+    return 0
+
+
+def run_triplet_input(
+    in_file,
+    out_file,
+    n_threads,
+    nosave,
+    printflag,
+    heuristic,
+    max_starts,
+    exact_clades,
+    seed,
+    memory,
+    tile_dir,
+    metrics,
+    metrics_file,
+    tic,
+    picklename=None,
+):
+    """Finds the median trees of the triplet frequencies in in_file, or with
+    --heuristic the best tree found, and writes them like the other modes.
+    With picklename, the weights are pickled like with -b; since there are
+    no Newick strings, the pickle has an empty list of them, and the number
+    of GTs under "n_nwks"."""
+    with stage(metrics, "input") as record:
+        print(underline + "Reading triplet frequency file." + end)
+        try:
+            frequencies = load_triplet_frequencies(in_file)
+        except IOError:
+            print(
+                "Can't open input file {} for reading. Aborting.".format(
+                    in_file
+                )
+            )
+            return 1
+        except ValueError as e:
+            print("{}. Aborting.".format(e))
+            return 1
+        counts = frequencies["triplet_frequencies"]
+        reverse_dictionary = frequencies["reverse_dictionary"]
+        n_nwks = frequencies["n_nwks"]
+        record["items"] = len(counts) // 3
+    n_species = len(reverse_dictionary)
+    if n_species < 3:
+        print("The triplet frequencies need at least 3 species. Aborting.")
+        return 1
+    print(
+        "* Triplet frequencies of {} species, from {} GTs.".format(
+            n_species, n_nwks
+        )
+    )
+    print("")
+
+    if heuristic is not None:
+        print(underline + "Searching for the best tree." + end)
+        table = triplet_omp.py_triplet_table_from_frequencies(
+            counts, n_species, n_threads=n_threads
+        )
+        with stage(metrics, "search") as record:
+            result = heuristic_median_tree(
+                None,
+                reverse_dictionary,
+                time_limit=heuristic,
+                max_starts=max_starts,
+                exact_clades=exact_clades,
+                n_threads=n_threads,
+                seed=seed,
+                table=table,
+            )
+            record["items"] = result["n_starts"]
+        print(
+            "Best triplet count found is {}, after {} start(s), {} of which "
+            "reached a local optimum.".format(
+                result["score"], result["n_starts"], result["n_converged"]
+            )
+        )
+        exit_code = write_lines(
+            [result["tree"]],
+            "the best tree found",
+            out_file,
+            nosave,
+            printflag,
+            tic,
+        )
+        save_metrics(metrics, metrics_file)
+        return exit_code
+
+    tiling = None
+    if memory is not None:
+        tiling = TiledWeights(memory * 1024**2, tile_dir=tile_dir)
+    print(underline + "Finding median tree. This might take a while!" + end)
+    (
+        median_nwks,
+        reverse_dictionary,
+        triplet_weights,
+        stack,
+        best_biparts,
+    ) = frequency_median_triplet_trees(
+        counts,
+        reverse_dictionary,
+        n_nwks,
+        n_threads=n_threads,
+        tiling=tiling,
+        return_extra=True,
+        metrics=metrics,
+    )
+    if picklename is not None:
+        save_weights_pickle(
+            picklename,
+            {
+                "abigsecret": "ogurets",
+                "version": __version__,
+                "nwks": [],
+                "n_nwks": n_nwks,
+                "median_nwks": median_nwks,
+                "reverse_dictionary": reverse_dictionary,
+                "triplet_weights": triplet_weights,
+                "stack": stack,
+                "best_biparts": best_biparts,
+            },
+        )
+    exit_code = write_lines(
+        median_nwks,
+        "all median triplet trees",
+        out_file,
+        nosave,
+        printflag,
+        tic,
+    )
+    save_metrics(metrics, metrics_file)
+    return exit_code
+
+
+# The flags which only work together with another one
+FLAG_REQUIREMENTS = [
+    ("--nosave", "--print"),
+    ("--step", "--window"),
+    ("--resume", "--checkpoint"),
+    ("--shard", "--binary"),
+    ("--tile-dir", "--memory"),
+    ("--starts", "--heuristic"),
+    ("--exact-clades", "--heuristic"),
+    ("--tsv", "--batch"),
+]
+
+# The modes of running mtrip, and the flags each of them can't be used with
+FLAG_CONFLICTS = [
+    ("--append-to", ["--cache-dir"]),
+    ("--window", ["--append-to", "--cache-dir", "--binary"]),
+    ("--replicates", ["--window", "--append-to", "--cache-dir", "--binary"]),
+    (
+        "--checkpoint",
+        ["--window", "--replicates", "--append-to", "--cache-dir"],
+    ),
+    ("--shard", ["--window", "--replicates", "--append-to", "--cache-dir"]),
+    (
+        "--memory",
+        [
+            "--window", "--replicates", "--append-to", "--cache-dir",
+            "--checkpoint", "--shard", "--binary",
+        ],
+    ),
+    (
+        "--heuristic",
+        [
+            "--window", "--replicates", "--append-to", "--cache-dir",
+            "--checkpoint", "--shard", "--memory", "--binary", "--plan",
+            "--batch",
+        ],
+    ),
+    (
+        "--triplets",
+        [
+            "--window", "--replicates", "--append-to", "--cache-dir",
+            "--checkpoint", "--shard", "--memory", "--heuristic", "--binary",
+            "--plan", "--batch", "--triplet-input",
+        ],
+    ),
+    (
+        "--triplet-input",
+        [
+            "--window", "--replicates", "--append-to", "--cache-dir",
+            "--checkpoint", "--shard", "--plan", "--batch",
+        ],
+    ),
+    (
+        "--batch",
+        [
+            "--nosave", "--print", "--binary", "--metrics", "--plan",
+            "--append-to", "--window", "--replicates", "--checkpoint",
+            "--shard", "--memory", "--cache-dir",
+        ],
+    ),
+    (
+        "--plan",
+        [
+            "--nosave", "--print", "--binary", "--metrics", "--append-to",
+            "--cache-dir", "--window", "--replicates", "--checkpoint",
+            "--shard",
+        ],
+    ),
+]
+
+
+def check_flags(given):
+    """Returns the error message for the set of flags given, if one of them
+    is missing the flag it works with or can't be used with another one, or
+    None if they can all be used together."""
+    for flag, required in FLAG_REQUIREMENTS:
+        if flag in given and required not in given:
+            return "The flag {} can only be used with {}.".format(
+                flag, required
+            )
+    for flag, conflicts in FLAG_CONFLICTS:
+        if flag not in given:
+            continue
+        clashes = [other for other in conflicts if other in given]
+        if clashes:
+            if len(clashes) > 1:
+                clashes = [", ".join(clashes[:-1]), clashes[-1]]
+            return "The flag {} cannot be used with {}.".format(
+                flag, " or ".join(clashes)
+            )
+    return None
+
+
 def main():
     tic = time()
 
@@ -118,20 +860,115 @@ def main():
     #onlyweights = result.weights
     printflag = result.print
     picklename = result.binary
+    cache_dir = result.cache_dir
+    cache_size = result.cache_size
+    append_to = result.append_to
+    window = result.window
+    step = result.step
+    n_replicates = result.replicates
+    resample = result.resample
+    replicate_group = result.replicate_group
+    seed = result.seed
+    checkpoint_file = result.checkpoint
+    checkpoint_interval = result.checkpoint_interval
+    resume = result.resume
+    shard = result.shard
+    memory = result.memory
+    plan = result.plan
+    metrics_file = result.metrics
+    tile_dir = result.tile_dir
+    batch = result.batch
+    tsv = result.tsv
+    heuristic = result.heuristic
+    max_starts = result.starts
+    exact_clades = result.exact_clades
+    triplets_file = result.triplets
+    triplet_input = result.triplet_input
+    triplet_omp.set_engine(result.engine)
 
-    if nosave and not printflag:
-        print(
-            "The flag --nosave cannot be used without --print, otherwise "
-            "the output goes nowhere. Aborting."
-        )
+    if batch is None and in_file is None:
+        parser.error("the following arguments are required: i")
+
+    given = {
+        flag
+        for flag, value in [
+            ("--nosave", nosave),
+            ("--print", printflag),
+            ("--binary", picklename is not None),
+            ("--cache-dir", cache_dir is not None),
+            ("--append-to", append_to is not None),
+            ("--window", window is not None),
+            ("--step", step is not None),
+            ("--replicates", n_replicates is not None),
+            ("--checkpoint", checkpoint_file is not None),
+            ("--resume", resume),
+            ("--shard", shard is not None),
+            ("--memory", memory is not None),
+            ("--tile-dir", tile_dir is not None),
+            ("--plan", plan),
+            ("--metrics", metrics_file is not None),
+            ("--batch", batch is not None),
+            ("--tsv", tsv is not None),
+            ("--heuristic", heuristic is not None),
+            ("--starts", max_starts is not None),
+            ("--exact-clades", exact_clades != 0),
+            ("--triplets", triplets_file is not None),
+            ("--triplet-input", triplet_input),
+        ]
+        if value
+    }
+    error = check_flags(given)
+    if error is not None:
+        print(error)
         return 1
 
     if not (n_threads >= 1 or n_threads == -1):
         print("The number of threads must be a positive integer or -1.")
         return 1
 
-    if out_file is None:
-        out_file = "out_" + basename(in_file)
+    if cache_size <= 0:
+        print("The cache size must be a positive integer.")
+        return 1
+
+    if window is not None:
+        if step is None:
+            step = window
+        if window < 1 or step < 1:
+            print("The window and step sizes must be positive integers.")
+            return 1
+
+    if shard is not None:
+        try:
+            shard = parse_shard(shard)
+        except ValueError as e:
+            print("{}.".format(e))
+            return 1
+
+    if memory is not None and memory <= 0:
+        print("The memory budget must be a positive integer.")
+        return 1
+
+    if n_replicates is not None and (n_replicates < 1 or replicate_group < 1):
+        print(
+            "The number of replicates and the replicate group size must "
+            "be positive integers."
+        )
+        return 1
+
+    if heuristic is not None:
+        if heuristic <= 0:
+            print("The time limit of --heuristic must be positive.")
+            return 1
+        if max_starts is not None and max_starts < 1:
+            print("The number of starts must be a positive integer.")
+            return 1
+        if exact_clades < 0:
+            print("The clade size must be a non-negative integer.")
+            return 1
+
+    if batch is not None and in_file is not None:
+        print("An input file cannot be given with --batch.")
+        return 1
 
     # Set default maximum number of threads.
     if n_threads == -1:
@@ -139,9 +976,27 @@ def main():
     if n_threads is None:
         n_threads = 1
 
+    if batch is not None:
+        print(underline + "Input parameters:" + end)
+        print("Manifest: {}".format(batch))
+        if tsv is not None:
+            print("Output file: {}".format(tsv))
+        print("Concurrent inputs: {}".format(n_threads))
+        print("")
+        print(underline + "Finding median trees of each input." + end)
+        return run_batch(batch, tsv, n_threads, novalidate, tic)
+
+    if out_file is None:
+        out_file = "out_" + get_input_name(in_file)
+
     print(underline + "Input parameters:" + end)
-    print("Newick file: {}".format(in_file))
-    if nosave:
+    if triplet_input:
+        print("Triplet frequency file: {}".format(in_file))
+    else:
+        print("Newick file: {}".format(in_file))
+    if triplets_file is not None:
+        print("Triplet frequency output file: {}".format(triplets_file))
+    elif nosave:
         print("Output file: outputting to stdout instead.")
     else:
         print("Output file: {}".format(out_file))
@@ -149,71 +1004,383 @@ def main():
     print("Max threads: {}".format(n_threads))
     if novalidate:
         print("Not validating Newick strings!")
+    if cache_dir is not None:
+        print("Cache directory: {} ({} MB)".format(cache_dir, cache_size))
+    if window is not None:
+        print("Window size: {}, step: {}".format(window, step))
+    if n_replicates is not None:
+        print("Replicates: {} ({}, seed {})".format(n_replicates, resample, seed))
+    if checkpoint_file is not None:
+        print(
+            "Checkpoint file: {} (every {} s{})".format(
+                checkpoint_file,
+                checkpoint_interval,
+                ", resuming" if resume else "",
+            )
+        )
+    if shard is not None:
+        print("Shard: {}/{}".format(*shard))
+    if memory is not None:
+        print("Weights memory budget: {} MB".format(memory))
+    if heuristic is not None:
+        print(
+            "Heuristic search: {} s{}{}, seed {}".format(
+                heuristic,
+                "" if max_starts is None else ", {} starts".format(max_starts),
+                ""
+                if exact_clades == 0
+                else ", exact clades of {} species".format(exact_clades),
+                seed,
+            )
+        )
+    if append_to is not None:
+        print("Appending to weights file: {}".format(append_to))
+        # Save the updated weights in place, unless told otherwise
+        if picklename is None:
+            picklename = append_to
 
     print("")
 
+    metrics = None
+    if metrics_file is not None:
+        metrics = Metrics()
+
+    if triplet_input:
+        return run_triplet_input(
+            in_file,
+            out_file,
+            n_threads,
+            nosave,
+            printflag,
+            heuristic,
+            max_starts,
+            exact_clades,
+            seed,
+            memory,
+            tile_dir,
+            metrics,
+            metrics_file,
+            tic,
+            picklename=picklename,
+        )
+
     # This should be refactored, but will work for now.
-    try:
+    with stage(metrics, "input") as record:
         print(underline + "Parsing input text file." + end)
-        with open(in_file, "r") as f:
-            print("* Stripping Newick strings.")
-            nwks = [line.strip() for line in f]
-    except IOError:
-        print(
-            "Can't open input file {} for reading. Aborting.".format(in_file)
-        )
-        return 1
+        print("* Stripping Newick strings.")
+        if not novalidate:
+            print(
+                "* Checking for matching parentheses and semicolon in each GT."
+            )
+        nwks = []
+        # The modes which find the median trees of the GTs get their
+        # bipartitions as the chunks come in
+        topology_counter = None
+        if not (
+            plan
+            or triplets_file is not None
+            or window is not None
+            or heuristic is not None
+            or n_replicates is not None
+            or append_to is not None
+        ):
+            topology_counter = TopologyCounter()
+        try:
+            # Each chunk is checked while the next ones are read
+            for chunk in read_lines(in_file):
+                first = len(nwks)
+                nwks.extend(line.strip() for line in chunk)
+                if not novalidate:
+                    for i in range(first, len(nwks)):
+                        string = nwks[i]
+                        # Ignore comments
+                        if string[0] == "#":
+                            continue
+                        # Need to put in a stricter validator here
+                        if string[-1] != ";":
+                            print(
+                                f"Line {i+1} doesn't end of a semicolon! "
+                                "Aborting!"
+                            )
+                            return 1
+                        if string.count("(") != string.count(")"):
+                            print(
+                                f"Line {i+1} doesn't have an equal number of "
+                                "left and right brackets! Aborting!"
+                            )
+                            return 1
+                if topology_counter is not None:
+                    topology_counter.add(nwks[first:])
+        except IOError:
+            print(
+                "Can't open input file {} for reading. Aborting.".format(
+                    in_file
+                )
+            )
+            return 1
+        except ValueError as e:
+            print("Can't read input file {}: {}. Aborting.".format(in_file, e))
+            return 1
 
-    if not novalidate:
-        print("* Checking for matching parentheses and semicolon in each GT.")
-        for i, string in enumerate(nwks):
-            # Ignore comments
-            if string[0] == "#":
-                continue
-            # Need to put in a stricter validator here
-            if string[-1] != ";":
-                print(f"Line {i+1} doesn't end of a semicolon! Aborting!")
-                return 1
-            if string.count("(") != string.count(")"):
-                print(
-                    f"Line {i+1} doesn't have an equal number of left and "
-                    "right brackets! Aborting!"
+        # Get rid of comments
+        nwks[:] = [s for s in nwks if s[0] != "#"]
+        record["items"] = len(nwks)
+
+    print("")
+    if plan:
+        print(underline + "Planning the run." + end)
+        max_bytes = None if memory is None else memory * 1024**2
+        lines = format_plan(plan_run(nwks, n_threads, max_bytes=max_bytes))
+        print("")
+        for line in lines:
+            print(line)
+        return 0
+
+    if triplets_file is not None:
+        print(underline + "Counting the triplets." + end)
+        counts, reverse_dictionary = nwk_triplet_frequencies(
+            nwks, n_threads=n_threads, metrics=metrics
+        )
+        print("")
+        print("{}{}Done!{}{}".format(bold, underline, end, end))
+        with stage(metrics, "output", items=len(counts) // 3):
+            try:
+                save_triplet_frequencies(
+                    triplets_file, counts, reverse_dictionary, len(nwks)
                 )
+            except IOError:
+                print("Can't write to {}. Aborting.".format(triplets_file))
                 return 1
+        print(
+            "* {}Wrote the triplet frequencies of {} species to "
+            "{}{}{}{}.".format(
+                bold, len(reverse_dictionary), italics, triplets_file, end, end
+            )
+        )
+        dt = timedelta(seconds=time() - tic)
+        print(
+            "🤖💬 Beep boop, finished in {:.2f} seconds.".format(
+                dt.total_seconds()
+            )
+        )
+        save_metrics(metrics, metrics_file)
+        return 0
 
-    # Get rid of comments
-    nwks[:] = [s for s in nwks if s[0] != "#"]
+    if window is not None:
+        print(underline + "Finding median tree of each window." + end)
+        exit_code = write_windows(
+            nwks, window, step, n_threads, out_file, nosave, printflag, tic
+        )
+        save_metrics(metrics, metrics_file)
+        return exit_code
 
-    print("")
-    print(underline + "Finding median tree. This might take a while!" + end)
-    (
-        median_nwks,
-        reverse_dictionary,
-        triplet_weights,
-        stack,
-        best_biparts,
-    ) = median_triplet_trees(nwks, n_threads=n_threads, return_extra=True)
+    if heuristic is not None:
+        print(underline + "Searching for the best tree." + end)
+        result = heuristic_median_triplet_tree(
+            nwks,
+            time_limit=heuristic,
+            max_starts=max_starts,
+            exact_clades=exact_clades,
+            n_threads=n_threads,
+            seed=seed,
+            metrics=metrics,
+        )
+        exit_code = write_lines(
+            [result["tree"]],
+            "the best tree found",
+            out_file,
+            nosave,
+            printflag,
+            tic,
+        )
+        save_metrics(metrics, metrics_file)
+        return exit_code
 
-    print("")
-    print("{}{}Done!{}{}".format(bold, underline, end, end))
-    # Save output
-    if not nosave:
+    if n_replicates is not None:
+        print(underline + "Finding median trees of replicates." + end)
+        support, reverse_dictionary = replicate_clade_support(
+            nwks,
+            n_replicates,
+            resample=resample,
+            group_size=replicate_group,
+            seed=seed,
+            n_threads=n_threads,
+        )
+        lines = [
+            "{:.4f}\t{}".format(
+                frequency,
+                ",".join(get_present_species(clade, reverse_dictionary)),
+            )
+            for clade, frequency in sorted(
+                support.items(), key=lambda x: (-x[1], x[0])
+            )
+        ]
+        exit_code = write_lines(
+            lines,
+            "the clade support of the replicates",
+            out_file,
+            nosave,
+            printflag,
+            tic,
+        )
+        save_metrics(metrics, metrics_file)
+        return exit_code
+
+    checkpoint = None
+    if checkpoint_file is not None:
+        checkpoint = Checkpoint(
+            checkpoint_file, interval=checkpoint_interval, resume=resume
+        )
+
+    if shard is not None:
+        print(underline + "Finding partial weights of shard." + end)
         try:
-            with open(out_file, "w") as f:
-                f.writelines([s + "\n" for s in median_nwks])
-            print(
-                "* {}Wrote all median triplet trees to {}{}{}{}.".format(
-                    bold, italics, out_file, end, end
-                )
+            triplet_weights, reverse_dictionary, key = shard_triplet_weights(
+                nwks,
+                shard,
+                n_threads=n_threads,
+                checkpoint=checkpoint,
+                metrics=metrics,
+                topology_counter=topology_counter,
             )
-        except IOError:
+        except (ValueError, OSError) as e:
+            # Unusable checkpoint file
+            print("{}. Aborting.".format(e))
+            return 1
+
+        print("")
+        print("{}{}Done!{}{}".format(bold, underline, end, end))
+        with stage(metrics, "output"):
+            saved = save_weights_pickle(
+                picklename,
+                {
+                    "abigsecret": "ogurets",
+                    "version": __version__,
+                    "nwks": nwks,
+                    "reverse_dictionary": reverse_dictionary,
+                    "triplet_weights": triplet_weights,
+                    "shard": {
+                        "index": shard[0],
+                        "count": shard[1],
+                        "key": key,
+                    },
+                },
+            )
+        if not saved:
+            return 1
+        if checkpoint is not None:
+            checkpoint.remove()
+        dt = timedelta(seconds=time() - tic)
+        print(
+            "🤖💬 Beep boop, finished in {:.2f} seconds.".format(
+                dt.total_seconds()
+            )
+        )
+        save_metrics(metrics, metrics_file)
+        return 0
+
+    tiling = None
+    if memory is not None:
+        tiling = TiledWeights(memory * 1024**2, tile_dir=tile_dir)
+
+    if append_to is not None:
+        print(underline + "Loading weights file." + end)
+        old_pickle = load_weights_pickle(append_to)
+        if old_pickle is None:
             print(
-                "Can't write to {}. Outputting to stdout instead.".format(
-                    out_file
+                "Can't load weights file {}. Aborting.".format(append_to)
+            )
+            return 1
+        n_old_nwks = pickled_nwks_count(old_pickle)
+        print(
+            "* Adding {} new GTs to the {} GTs in {}.".format(
+                len(nwks), n_old_nwks, append_to
+            )
+        )
+
+        print("")
+        print(underline + "Finding median tree. This might take a while!" + end)
+        try:
+            (
+                median_nwks,
+                reverse_dictionary,
+                triplet_weights,
+                stack,
+                best_biparts,
+            ) = append_median_triplet_trees(
+                nwks,
+                old_pickle["reverse_dictionary"],
+                old_pickle["triplet_weights"],
+                n_old_nwks=n_old_nwks,
+                n_threads=n_threads,
+                return_extra=True,
+                metrics=metrics,
+            )
+        except ValueError as e:
+            print("{}. Aborting.".format(e))
+            return 1
+        n_nwks = n_old_nwks + len(nwks)
+        nwks = old_pickle["nwks"] + nwks
+    else:
+        print(underline + "Finding median tree. This might take a while!" + end)
+        (
+            median_nwks,
+            reverse_dictionary,
+            triplet_weights,
+            stack,
+            best_biparts,
+        ) = find_median_trees(
+            nwks,
+            n_threads,
+            cache_dir,
+            cache_size,
+            checkpoint,
+            tiling=tiling,
+            metrics=metrics,
+            topology_counter=topology_counter,
+        )
+        if median_nwks is None:
+            return 1
+        n_nwks = len(nwks)
+
+    print("")
+    print("{}{}Done!{}{}".format(bold, underline, end, end))
+    with stage(metrics, "output", items=len(median_nwks)):
+        # Save output
+        if not nosave:
+            try:
+                with open(out_file, "w") as f:
+                    f.writelines([s + "\n" for s in median_nwks])
+                print(
+                    "* {}Wrote all median triplet trees to {}{}{}{}.".format(
+                        bold, italics, out_file, end, end
+                    )
                 )
+            except IOError:
+                print(
+                    "Can't write to {}. Outputting to stdout instead.".format(
+                        out_file
+                    )
+                )
+                # If can't write to file, output to screen as a last resort
+                printflag = True
+
+        # Pickle stuff
+        if picklename is not None:
+            save_weights_pickle(
+                picklename,
+                {
+                    "abigsecret": "ogurets",
+                    "version": __version__,
+                    "nwks": nwks,
+                    "n_nwks": n_nwks,
+                    "median_nwks": median_nwks,
+                    "reverse_dictionary": reverse_dictionary,
+                    "triplet_weights": triplet_weights,
+                    "stack": stack,
+                    "best_biparts": best_biparts,
+                },
             )
-            # If can't write to file, output to screen as a last resort
-            printflag = True
 
     toc = time()
     dt = timedelta(seconds=toc - tic)
@@ -228,45 +1395,11 @@ def main():
             print(s)
         # print("")
 
-    # Pickle stuff
-    if picklename is not None:
-        try:
-            with open(picklename, "wb") as f:
-                labels = [
-                    "abigsecret",
-                    "version",
-                    "nwks",
-                    "median_nwks",
-                    "reverse_dictionary",
-                    "triplet_weights",
-                    "stack",
-                    "best_biparts",
-                ]
-                to_pickle = [
-                    "ogurets",
-                    __version__,
-                    nwks,
-                    median_nwks,
-                    reverse_dictionary,
-                    triplet_weights,
-                    stack,
-                    best_biparts,
-                ]
-
-                pickle.dump(
-                    {l: t for (l, t) in zip(labels, to_pickle)}, f, protocol=4
-                )
+    save_metrics(metrics, metrics_file)
 
-                # for item in to_pickle:
-                #    pickle.dump(item, f, protocol=4)
-            print(
-                "* {}Pickled weights to {}{}{}{}. 🥒🏋️".format(
-                    bold, italics, picklename, end, end
-                )
-            )
-        except IOError:
-            print(f"Can't write to {picklename}. Aborting serializing the "
-                  "processed data.")
+    # The run is complete, so there's nothing left to resume
+    if checkpoint is not None:
+        checkpoint.remove()
 
     return 0
 
@@ -2,17 +2,20 @@
 
 import pickle
 import sys
-from os import path
+from os import cpu_count, path
 from os.path import exists
 
 from mtrip import median_tree_reconstruction as mtr
 from mtrip import __version__
+from mtrip.cli.mtrip_cmd import pickled_nwks_count
+from mtrip.shard import merge_shards
 
 
 def main():
     print("This utility is for combining weight pickles produced by mtrip.")
     print("Usage:\t$ mtrip-combine in_pickle_1.p ... in_pickle_n.p")
     print("The output filename will be printed out at the end of the process.")
+    print("Pickles of different species are combined over all their species.")
     if len(sys.argv) < 2:
         print("Not enough arguments! Exiting.")
         return 1
@@ -22,30 +25,119 @@ def main():
     else:
         pickles = sys.argv[1:]
 
-    with open(pickles[0], 'rb') as f:
-        in_pickle = pickle.load(f)
-        main_reverse_dictionary = in_pickle['reverse_dictionary']
-        main_weights = in_pickle['triplet_weights']
-        n_species = len(main_reverse_dictionary)
-        main_nwks = in_pickle['nwks']
+    in_pickle = load_weights(pickles[0])
+    if in_pickle is None:
+        return 1
+    if 'shard' in in_pickle:
+        return combine_shards(pickles, in_pickle)
+
+    main_reverse_dictionary = in_pickle['reverse_dictionary']
+    main_weights = in_pickle['triplet_weights']
+    main_nwks = in_pickle['nwks']
+    main_n_nwks = pickled_nwks_count(in_pickle)
+    n_threads = cpu_count() or 1
 
     for filename in pickles[1:]:
+        in_pickle = load_weights(filename)
+        if in_pickle is None:
+            return 1
+        reverse_dictionary = in_pickle['reverse_dictionary']
+        weights = in_pickle['triplet_weights']
+        nwks = in_pickle['nwks']
+        n_nwks = pickled_nwks_count(in_pickle)
+
+        if 'shard' in in_pickle:
+            print("Can't combine shards with complete weight pickles! "
+                  "Aborting.")
+            return 1
+
+        # The weights of other species are remapped to all the species
+        # seen so far, which is extended with any new ones
+        union = set(main_reverse_dictionary).union(reverse_dictionary)
+        if len(union) > len(main_reverse_dictionary):
+            union = sorted(union)
+            print(f"Extending the species labels from "
+                  f"{len(main_reverse_dictionary)} to {len(union)} "
+                  "species.")
+            main_weights = mtr.remap_triplet_weights(
+                    main_weights,
+                    main_reverse_dictionary,
+                    union,
+                    n_threads=n_threads,
+                )
+            main_reverse_dictionary = union
+        if reverse_dictionary == main_reverse_dictionary:
+            print(f"Adding weight contributions of {filename}.")
+        else:
+            print(f"Adding weight contributions of {filename}, remapped "
+                  f"from its {len(reverse_dictionary)} species.")
+        mtr.remap_triplet_weights(
+                weights,
+                reverse_dictionary,
+                main_reverse_dictionary,
+                new_weights=main_weights,
+                n_threads=n_threads,
+            )
+
+        main_nwks += nwks
+        main_n_nwks += n_nwks
+
+    return write_combined(
+            main_nwks,
+            main_n_nwks,
+            main_reverse_dictionary,
+            main_weights,
+        )
+
+
+def load_weights(filename):
+    """Returns the contents of the weights pickle filename, or None if it
+    can't be read or isn't a weights pickle (e.g. triplet frequencies)."""
+    try:
         with open(filename, 'rb') as f:
             in_pickle = pickle.load(f)
-            reverse_dictionary = in_pickle['reverse_dictionary']
-            weights = in_pickle['triplet_weights']
-            nwks = in_pickle['nwks']
+    except Exception:
+        in_pickle = None
+    if not isinstance(in_pickle, dict) or 'triplet_weights' not in in_pickle:
+        print(f"{filename} isn't a weights file! Aborting.")
+        return None
+    return in_pickle
+
+
+def combine_shards(pickles, first_pickle):
+    """Reduce step of mtrip --shard: adds up the partial weights of all the
+    shards of one computation."""
+    in_pickles = [first_pickle]
+    for filename in pickles[1:]:
+        in_pickles.append(load_weights(filename))
+        if in_pickles[-1] is None:
+            return 1
+        if 'shard' not in in_pickles[-1]:
+            print("Can't combine shards with complete weight pickles! "
+                  "Aborting.")
+            return 1
 
-            if not reverse_dictionary == main_reverse_dictionary:
-                print("Not the same species labels! Aborting.")
-                return 1
-            else:
-                print(f"Adding weight contributions of {filename}.")
-                for i in range(len(main_weights)):
-                    main_weights[i] += weights[i]
+    try:
+        main_weights = merge_shards(in_pickles, n_threads=cpu_count() or 1)
+    except ValueError as e:
+        print(f"{e}! Aborting.")
+        return 1
+    for filename, in_pickle in zip(pickles, in_pickles):
+        shard = in_pickle['shard']
+        print(f"Added shard {shard['index']}/{shard['count']} from {filename}.")
+
+    # Every shard was computed from all the GTs, so they're only kept once
+    return write_combined(
+            first_pickle['nwks'],
+            pickled_nwks_count(first_pickle),
+            first_pickle['reverse_dictionary'],
+            main_weights,
+        )
 
-                main_nwks += nwks
 
+def write_combined(main_nwks, main_n_nwks, main_reverse_dictionary,
+                   main_weights):
+    n_species = len(main_reverse_dictionary)
     print("Computing stack")
     main_stack, main_best_biparts = mtr.get_stack(main_weights, n_species)
     print("Finding the median trees")
@@ -59,6 +151,7 @@ def main():
             'abigsecret':'ogurets',
             'version':'combined_' + __version__,
             'nwks':main_nwks,
+            'n_nwks':main_n_nwks,
             'median_nwks':main_trees,
             'reverse_dictionary':main_reverse_dictionary,
             'triplet_weights':main_weights,
@@ -1,14 +1,13 @@
 #!/usr/bin/env python
 import argparse
-import itertools
 import pickle
-import random
 import sys
 import textwrap
+from os import cpu_count
 
+import mtrip.triplet_omp as triplet_omp
 from mtrip import __version__
-from mtrip.bitsnbobs import (get_binary_subsets, init_bipart_rep_function,
-                             popcount)
+from mtrip.bitsnbobs import popcount
 
 # Some fun colors. Should be refactored. Or removed. :-)
 bold = "\033[1m"
@@ -57,11 +56,6 @@ def pickle_warning(filename):
         sys.exit(0)
 
 
-def get_biparts(x):
-    """These are just the pairs where a < x-a and x&a=0"""
-    return [(a, x - a) for a in get_binary_subsets(x) if 2 * a < x]
-
-
 def get_candidates(
     triplet_weights,
     stack,
@@ -70,127 +64,28 @@ def get_candidates(
     n_trees,
     n_burnin,
     seed=0,
+    n_threads=1,
 ):
-    rng = random.Random(seed)
-    n_species = len(reverse_dictionary)
-    universe = 2 ** n_species - 1
-    # This is a function which maps (a,b) to the base-3 representation
-    bipart_rep = init_bipart_rep_function(n_species)
-
-    # Just a shorthand for checking if (a,b) can give us a sufficient weight
-    def maximal_val(a, b):
-        return triplet_weights[bipart_rep(a, b)] + stack[a] + stack[b]
-
-    print("* Finding initial splits")
-    # > Find the topmost splits
-    # These are the topmost splits
-    candidates = [
-        {
-            "curscore": triplet_weights[bipart_rep(a, b)],
-            "biparts": {a + b: (a, b)},
-            "active": [],
-        }
-        for (a, b) in get_biparts(2 ** n_species - 1)
-        if maximal_val(a, b) >= min_score
-    ]
+    """Samples up to n_trees trees with a score of at least min_score. The
+    burn-in and the refinement of the chosen candidates are done natively
+    (see mtrip.triplet_omp.py_sample_suboptimal), the latter on n_threads
+    threads; the trees only depend on seed.
 
-    finished_candidates = []
-    # This is a placeholder for all the active (i.e. can be split) candidates
-    new_candidates = []
-
-    for candidate in candidates:
-        for x in candidate["biparts"][universe]:
-            if popcount(x) > 2:
-                candidate["active"].append(x)
-
-        if len(candidate["active"]) > 0:
-            new_candidates.append(candidate)
-        else:
-            finished_candidates.append(candidate)
-
-    # We only want to propagate the active candidates; this should be all
-    # of them unless the trees are very small, or we have candidates with
-    # extra depth levels (i.e. have been preprocessed somewhere, maybe in
-    # future versions of this code).
-    candidates = new_candidates
-
-    # Burn in
-    print("* Beginning burn-in")
-    while (
-        len(candidates) != 0
-        and len(candidates) + len(finished_candidates) < n_burnin
-    ):
-        # We'll fill this up with the new splits
-        new_candidates = []
-
-        for candidate in candidates:
-            # Look at every possible combo of subpartitions
-            potential_splits = itertools.product(
-                *(get_biparts(x) for x in candidate["active"])
-            )
-            # Choose only the ones which could possibly satisfy our constraint
-            possible_splits = list(
-                (
-                    x
-                    for x in potential_splits
-                    if sum(maximal_val(a, b) for (a, b) in x)
-                    >= min_score - candidate["curscore"]
-                )
-            )
-            # Now add this list of possible splits and continue processing them
-
-            for splits in possible_splits:
-                new_candidate = dict()
-                new_candidate["curscore"] = candidate["curscore"]
-                new_candidate["biparts"] = candidate["biparts"].copy()
-                new_candidate["active"] = []
-
-                for (a, b) in splits:
-                    new_candidate["curscore"] += triplet_weights[
-                        bipart_rep(a, b)
-                    ]
-                    new_candidate["biparts"][a + b] = (a, b)
-                    for x in (a, b):
-                        if popcount(x) > 2:
-                            new_candidate["active"].append(x)
-
-                if len(new_candidate["active"]) > 0:
-                    new_candidates.append(new_candidate)
-                    # Stop if we've gathered enough
-                    if (
-                        len(new_candidates) + len(finished_candidates)
-                        >= n_burnin
-                    ):
-                        break
-                # This shouldn't happen if all the candidates were initialized
-                # at the same time + the constants are reasonable
-                else:
-                    finished_candidates.append(new_candidate)
-                    # Stop if we've gathered enough
-                    if (
-                        len(new_candidates) + len(finished_candidates)
-                        >= n_burnin
-                    ):
-                        break
-                # This shouldn't happen if all the candidates were initialized
-                # at the same time + the constants are reasonable
-                # Stop if we've gathered enough
-                if len(new_candidates) + len(finished_candidates) >= n_burnin:
-                    break
-            # This shouldn't happen if all the candidates were initialized at
-            # the same time + the constants are reasonable
-            # Stop if we've gathered enough
-            if len(new_candidates) + len(finished_candidates) >= n_burnin:
-                break
-
-        # Update the list of candidates
-        candidates = new_candidates.copy()
-        if len(candidates) + len(finished_candidates) >= n_burnin:
-            break
-
-    # Now we take a random walk along each started path; choose the starting
-    # paths uniformly
-    n_candidates = len(candidates) + len(finished_candidates)
+    Returns a list of dicts, each with the tree's score ("curscore") and a
+    dictionary sending each clade x to its split ("biparts")."""
+    n_species = len(reverse_dictionary)
+    print("* Splitting candidates and refining them on {} "
+          "thread(s)".format(n_threads))
+    scores, splits, n_candidates = triplet_omp.py_sample_suboptimal(
+        triplet_weights,
+        stack,
+        n_species,
+        min_score,
+        n_trees,
+        n_burnin,
+        seed=seed,
+        n_threads=n_threads,
+    )
     if n_candidates < n_trees:
         print(
             textwrap.fill(
@@ -198,44 +93,25 @@ def get_candidates(
                 "requested)".format(n_candidates, n_trees)
             )
         )
-        chosen_paths = candidates + finished_candidates
-    else:
-        print("* Picking random subset of tree candidates")
-        chosen_paths = rng.choices(
-            candidates + finished_candidates, k=n_trees,
-        )
 
-    # Fully split-up the remaining candidates
-
-    # These are all guaranteed to work out, so let's go through them,
-    # choosing random splits along the way.
-    print("* Refining all splits")
-    for candidate in chosen_paths:
-        while len(candidate["active"]) != 0:
-            # Look at every possible combo of subpartitions
-            potential_splits = itertools.product(
-                *(get_biparts(x) for x in candidate["active"])
-            )
-            # Choose only the ones which could possibly satisfy our constraint
-            possible_splits = list(
-                (
-                    x
-                    for x in potential_splits
-                    if sum(maximal_val(a, b) for (a, b) in x)
-                    >= min_score - candidate["curscore"]
-                )
-            )
-            chosen_splits = rng.choice(possible_splits)
-            candidate["active"] = []
-            for (a, b) in chosen_splits:
-                candidate["curscore"] += triplet_weights[bipart_rep(a, b)]
-                candidate["biparts"][a + b] = (a, b)
-                for x in (a, b):
-                    if popcount(x) > 2:
-                        candidate["active"].append(x)
+    # Each tree has n_species - 1 pairs (x, a), padded with x = 0
+    stride = 2 * (n_species - 1)
+    candidates = []
+    for i, score in enumerate(scores):
+        pairs = splits[i * stride:(i + 1) * stride]
+        candidates.append(
+            {
+                "curscore": score,
+                "biparts": {
+                    x: (a, x - a)
+                    for (x, a) in zip(pairs[::2], pairs[1::2])
+                    if x != 0
+                },
+            }
+        )
 
     # We're done! Return for outputting.
-    return chosen_paths
+    return candidates
 
 
 def get_present_species(x, reverse_dictionary):
@@ -353,9 +229,21 @@ def get_parser():
         "--seed",
         type=int,
         help="seed for the random number generator used in taking a random "
-        "walk along the space of splits. Defaults to 0",
+        "walk along the space of splits. The same seed gives the same trees "
+        "for any number of threads. Defaults to 0",
         default=0,
     )
+    parser.add_argument(
+        "-t",
+        "--threads",
+        action="store",
+        type=int,
+        default=-1,
+        help="maximum number of concurrent threads used to refine the "
+        "candidates (defaults to number of CPUs, or 1 if undetermined). The "
+        "trees don't depend on it. Must be a positive integer or -1 for the "
+        "default guess",
+    )
     parser.add_argument(
         "-y",
         "--yes",
@@ -406,6 +294,12 @@ def main():
         return
     print("Burnin count:", cli_flags.burnin)
     print("RNG seed    :", cli_flags.seed)
+    if not (cli_flags.threads >= 1 or cli_flags.threads == -1):
+        print("The number of threads must be a positive integer or -1.")
+        return 1
+    if cli_flags.threads == -1:
+        cli_flags.threads = cpu_count() or 1
+    print("Threads     :", cli_flags.threads)
 
     # Warn the user about the pickle, it is the moral thing to do!
     if not cli_flags.yes:
@@ -435,11 +329,17 @@ def main():
     # This is just to lower the probability of a nonsense file--not actually
     # for any kind of security, etc.
     try:
-        if unpickled["abigsecret"] != "ogurets":
-            print("This does not seem to be a valid file. Aborting.")
-            return 1
+        is_weights = (
+            unpickled["abigsecret"] == "ogurets"
+            and "triplet_weights" in unpickled
+        )
     except Exception:
-        print("This does not seem to be a valid file. Aborting.")
+        is_weights = False
+    if not is_weights:
+        print(
+            "{} isn't a weights file (write one with mtrip -b). "
+            "Aborting.".format(cli_flags.i)
+        )
         return 1
 
     print(
@@ -479,6 +379,7 @@ def main():
         cli_flags.ntrees,
         cli_flags.burnin,
         seed=cli_flags.seed,
+        n_threads=cli_flags.threads,
     )
     # Sort of descending score
     print("* Sorting by score")
@@ -0,0 +1,384 @@
+"""Heuristic search for trees agreeing with many GT triplets, for more
+species than the exact algorithm can handle.
+
+The exact algorithm needs a weights array of 2*3**(n_species-1) entries, so
+it's limited to about 20 species. Instead, the heuristic counts the GTs
+displaying each triplet ij|k once, in a table of about n_species**3/2 ints
+(250 MB for 500 species), and searches for a tree agreeing with as many of
+them as possible. Each start of the search adds the species in a random order,
+each where the tree agrees with the most triplets, then makes NNI and SPR
+moves until none improves the tree. The starts run in parallel, without the
+GIL, until the time limit. The best tree found has the same kind of triplet
+score as the median trees, but isn't guaranteed to be a median tree.
+
+Optionally, each small enough clade of a tree found is then replaced by its
+exact median tree, computed as usual. Only the triplets inside the clade
+depend on its topology, so this can only improve the tree.
+"""
+import threading
+from array import array
+from concurrent.futures import ThreadPoolExecutor
+from random import Random
+from time import time
+
+import mtrip.triplet_omp as triplet_omp
+from mtrip.median_tree_reconstruction import (
+    get_bipart_counts,
+    get_stack,
+    get_subset_arrays,
+)
+from mtrip.metrics import stage
+from mtrip.triplets import get_triplet_table
+
+
+def get_newick(left, right, root, reverse_dictionary):
+    """Returns the Newick string of the tree with the children left and
+    right (as in triplet_omp.py_triplet_tree_score), rooted at root."""
+    n_species = len(reverse_dictionary)
+    strings = {}
+    # Without recursion, since the trees can be deep
+    stack = [root]
+    while stack:
+        v = stack.pop()
+        if v < n_species:
+            strings[v] = reverse_dictionary[v]
+        elif left[v] in strings and right[v] in strings:
+            strings[v] = "({},{})".format(
+                strings.pop(left[v]), strings.pop(right[v])
+            )
+        else:
+            stack.extend([v, right[v], left[v]])
+
+    return strings[root] + ";"
+
+
+def get_preorder(left, right, root, n_species):
+    """Returns the nodes of the subtree rooted at root, parents first."""
+    preorder = []
+    stack = [root]
+    while stack:
+        v = stack.pop()
+        preorder.append(v)
+        if v >= n_species:
+            stack.extend([right[v], left[v]])
+
+    return preorder
+
+
+def get_clades(left, right, root, n_species, max_size):
+    """Returns the largest clades of the tree with at most max_size species,
+    leaving out those with less than 4, which can't be improved. Each is a
+    tuple of its root, its species and its internal nodes."""
+    sizes = {}
+    for v in reversed(get_preorder(left, right, root, n_species)):
+        if v < n_species:
+            sizes[v] = 1
+        else:
+            sizes[v] = sizes[left[v]] + sizes[right[v]]
+
+    clades = []
+    stack = [root]
+    while stack:
+        v = stack.pop()
+        if sizes[v] > max_size:
+            stack.extend([right[v], left[v]])
+        elif sizes[v] >= 4:
+            nodes = get_preorder(left, right, v, n_species)
+            clades.append(
+                (
+                    v,
+                    [u for u in nodes if u < n_species],
+                    [u for u in nodes if u >= n_species],
+                )
+            )
+
+    return clades
+
+
+def solve_clade(table, n_species, clade_species):
+    """Returns the best bipartition of each subset of the clade's species,
+    as returned by get_stack, for the exact median tree of the clade. Its
+    species are numbered by their position in clade_species."""
+    n_pairs = n_species * (n_species - 1) // 2
+    k = len(clade_species)
+
+    def pair_index(x, y):
+        x, y = min(x, y), max(x, y)
+        return x * (2 * n_species - x - 1) // 2 + (y - x - 1)
+
+    # The clade's triplets, as GT bipartitions of 3 species
+    weights = {}
+    for i in range(k):
+        for j in range(i + 1, k):
+            pair = pair_index(clade_species[i], clade_species[j])
+            for m in range(k):
+                if m == i or m == j:
+                    continue
+                weight = table[clade_species[m] * n_pairs + pair]
+                if weight != 0:
+                    a = 2**i + 2**j
+                    b = 2**m
+                    weights[(min(a, b), max(a, b))] = weight
+
+    subsets, start_i, end_i, biparts_a, biparts_b = get_subset_arrays(
+        weights, verbose=False
+    )
+    triplet_weights = triplet_omp.zero_array(2 * 3 ** (k - 1))
+    if subsets:
+        triplet_omp.compressed_weight_rep_nogil(
+            subsets,
+            start_i,
+            end_i,
+            biparts_a,
+            biparts_b,
+            array("i", [weights[x] for x in zip(biparts_a, biparts_b)]),
+            k,
+            triplet_weights,
+        )
+    _, best_biparts = get_stack(triplet_weights, k, verbose=False)
+
+    return best_biparts
+
+
+def set_clade(left, right, parent, clade, best_biparts):
+    """Replaces the topology of the clade (as returned by get_clades) with
+    the first median tree in best_biparts, reusing its internal nodes."""
+    clade_root, species, nodes = clade
+    universe = 2 ** len(species) - 1
+    free = [v for v in nodes if v != clade_root]
+    node_of = {universe: clade_root}
+    stack = [universe]
+    while stack:
+        x = stack.pop()
+        v = node_of[x]
+        if best_biparts[x]:
+            a, b = best_biparts[x][0]
+        else:
+            # Two species
+            a = x & -x
+            b = x - a
+        children = []
+        for y in (a, b):
+            if y & (y - 1) == 0:
+                child = species[y.bit_length() - 1]
+            else:
+                child = free.pop()
+                node_of[y] = child
+                stack.append(y)
+            parent[child] = v
+            children.append(child)
+        left[v], right[v] = children
+
+
+def polish_clades(table, n_species, left, right, parent, root, max_size):
+    """Replaces each of the largest clades of the tree with at most max_size
+    species with its exact median tree. The tree is updated in place.
+    Returns the number of clades replaced."""
+    clades = get_clades(left, right, root, n_species, max_size)
+    for clade in clades:
+        set_clade(
+            left, right, parent, clade, solve_clade(table, n_species, clade[1])
+        )
+
+    return len(clades)
+
+
+def search_start(
+    table, n_species, start, seed=0, deadline=None, exact_clades=0
+):
+    """Runs one start of the search: adds the species in a random order,
+    improves the tree until no move helps or the deadline (a time() value)
+    passes, and then polishes its clades of at most exact_clades species.
+    The order and moves are given by seed and start. Returns a dict with the
+    tree's children, root and score, and whether it's a local optimum."""
+    rng = Random("{}-{}".format(seed, start))
+    leaves = list(range(n_species))
+    rng.shuffle(leaves)
+    left = array("i", [-1] * (2 * n_species - 1))
+    right = array("i", [-1] * (2 * n_species - 1))
+    parent = array("i", [-1] * (2 * n_species - 1))
+    root = triplet_omp.py_add_leaves(
+        table, n_species, left, right, parent, -1, array("i", leaves)
+    )
+
+    def improve(root):
+        time_limit = -1 if deadline is None else max(deadline - time(), 0)
+        return triplet_omp.py_improve_tree(
+            table,
+            n_species,
+            left,
+            right,
+            parent,
+            root,
+            seed=rng.getrandbits(32),
+            time_limit=time_limit,
+        )
+
+    root, converged, _ = improve(root)
+    if converged and exact_clades >= 4:
+        if polish_clades(
+            table, n_species, left, right, parent, root, exact_clades
+        ):
+            # The new clades might make other moves worthwhile
+            root, converged, _ = improve(root)
+
+    return {
+        "left": left,
+        "right": right,
+        "root": root,
+        "score": triplet_omp.py_triplet_tree_score(
+            table, n_species, left, right, root
+        ),
+        "converged": converged,
+    }
+
+
+def heuristic_median_tree(
+    weights,
+    reverse_dictionary,
+    time_limit=None,
+    max_starts=None,
+    exact_clades=0,
+    n_threads=1,
+    seed=0,
+    verbose=True,
+    table=None,
+):
+    """Searches for a tree agreeing with as many GT triplets as possible.
+    Returns a dict with the best tree found (a Newick string), its triplet
+    score, the number of starts, and how many of them ended in a local
+    optimum, where no NNI or SPR move improves the tree.
+
+    Input:
+    weights - dict sending each GT bipartition (a,b) to its weight
+    reverse_dictionary - the species names
+    time_limit - seconds after which no new start begins, and the running
+                 ones stop improving their trees. The first start always
+                 returns a tree
+    max_starts - maximal number of starts. With no time limit, the result
+                 only depends on seed
+    exact_clades - if at least 4, replace the clades of at most this many
+                   species of each tree with their exact median trees
+    n_threads - n threads to use (default=1), each running its own starts
+    seed - seed of the starts' random species orders and moves
+    verbose - print what is being done
+    table - the triplet table (see mtrip.triplets.get_triplet_table), if
+            it's already known. weights isn't used then
+    """
+    if time_limit is None and max_starts is None:
+        raise ValueError("Need a time limit or a maximal number of starts.")
+    n_species = len(reverse_dictionary)
+    if n_species < 3:
+        tree = ",".join(reverse_dictionary)
+        if n_species == 2:
+            tree = "(" + tree + ")"
+        return {"tree": tree + ";", "score": 0, "n_starts": 0, "n_converged": 0}
+
+    deadline = None if time_limit is None else time() + time_limit
+    if table is None:
+        if verbose:
+            print("* Counting the GTs with each of the triplets.")
+        table = get_triplet_table(weights, n_species, n_threads=n_threads)
+
+    if verbose:
+        print(
+            "* Searching for the best tree with {} thread(s){}.".format(
+                n_threads,
+                "" if time_limit is None else ", for {} s".format(time_limit),
+            )
+        )
+    lock = threading.Lock()
+    best = None
+    n_starts = 0
+    n_converged = 0
+
+    def worker():
+        nonlocal best, n_starts, n_converged
+        while True:
+            with lock:
+                start = n_starts
+                if start > 0 and (
+                    (max_starts is not None and start >= max_starts)
+                    or (deadline is not None and time() >= deadline)
+                ):
+                    return
+                n_starts += 1
+            result = search_start(
+                table,
+                n_species,
+                start,
+                seed=seed,
+                deadline=deadline,
+                exact_clades=exact_clades,
+            )
+            with lock:
+                n_converged += result["converged"]
+                # Among equally good trees, keep the earliest start's
+                if best is None or (result["score"], -start) > (
+                    best["score"],
+                    -best["start"],
+                ):
+                    improved = best is None or result["score"] > best["score"]
+                    result["start"] = start
+                    best = result
+                    if verbose and improved:
+                        print(
+                            "    Start {}: best score so far {}.".format(
+                                start + 1, result["score"]
+                            )
+                        )
+
+    with ThreadPoolExecutor(max_workers=n_threads) as executor:
+        for future in [executor.submit(worker) for _ in range(n_threads)]:
+            future.result()
+
+    return {
+        "tree": get_newick(
+            best["left"], best["right"], best["root"], reverse_dictionary
+        ),
+        "score": best["score"],
+        "n_starts": n_starts,
+        "n_converged": n_converged,
+    }
+
+
+def heuristic_median_triplet_tree(
+    nwks,
+    time_limit=None,
+    max_starts=None,
+    exact_clades=0,
+    n_threads=1,
+    seed=0,
+    metrics=None,
+):
+    """Parses the GTs and runs heuristic_median_tree on them. Returns its
+    result, with the species names added (reverse_dictionary).
+
+    Input:
+    nwks - list of Newick strings
+    metrics - optional mtrip.metrics.Metrics to time the stages with
+    The other inputs are those of heuristic_median_tree.
+    """
+    weights, _, reverse_dictionary = get_bipart_counts(
+        nwks, n_threads=n_threads, metrics=metrics
+    )
+    with stage(metrics, "search") as record:
+        result = heuristic_median_tree(
+            weights,
+            reverse_dictionary,
+            time_limit=time_limit,
+            max_starts=max_starts,
+            exact_clades=exact_clades,
+            n_threads=n_threads,
+            seed=seed,
+        )
+        record["items"] = result["n_starts"]
+    print(
+        "Best triplet count found is {}, after {} start(s), {} of which "
+        "reached a local optimum.".format(
+            result["score"], result["n_starts"], result["n_converged"]
+        )
+    )
+    result["reverse_dictionary"] = reverse_dictionary
+
+    return result
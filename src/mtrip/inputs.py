@@ -0,0 +1,178 @@
+"""Reading GT files, which can be compressed, or come from stdin.
+
+The compression (gzip, bz2, xz or zstd) is recognized by the first bytes of
+the file, whatever its name. A separate thread reads and decompresses the
+file, and puts chunks of its lines in a bounded queue, from which they're
+taken and checked while the next chunks are decompressed. The decompressors
+release the GIL, so the two overlap, and at most a few chunks are ever
+waiting in memory.
+
+zstd needs the zstandard package (or Python 3.14's compression.zstd); the
+other formats are in the standard library.
+"""
+import bz2
+import gzip
+import io
+import lzma
+import os
+import sys
+import threading
+from queue import Empty, Full, Queue
+
+# Number of lines in each chunk, and number of chunks read ahead
+__chunk_lines__ = 10000
+__queue_chunks__ = 16
+
+# First bytes of each compressed format, and the file name suffixes
+__magic__ = [
+    (b"\x1f\x8b", "gzip"),
+    (b"BZh", "bz2"),
+    (b"\xfd7zXZ\x00", "xz"),
+    (b"\x28\xb5\x2f\xfd", "zstd"),
+]
+__suffixes__ = [".gz", ".bz2", ".xz", ".zst", ".zstd"]
+
+
+def get_input_name(filename):
+    """Returns the base name of the GT file filename without its compression
+    suffix, or stdin for -."""
+    if filename == "-":
+        return "stdin"
+    name = os.path.basename(filename)
+    for suffix in __suffixes__:
+        if name.endswith(suffix) and len(name) > len(suffix):
+            return name[: -len(suffix)]
+
+    return name
+
+
+def get_compression(f):
+    """Returns the compression of the binary file f (gzip, bz2, xz or zstd),
+    or None if it isn't compressed, without moving past its first bytes."""
+    start = f.peek(6)[:6]
+    for magic, compression in __magic__:
+        if start.startswith(magic):
+            return compression
+
+    return None
+
+
+def open_zstd(f):
+    """Returns a binary file with the decompressed contents of the zstd file
+    f. Raises ValueError if no zstd decompressor is installed."""
+    try:
+        import zstandard
+    except ImportError:
+        try:
+            from compression import zstd
+        except ImportError:
+            raise ValueError(
+                "Reading zstd files needs the zstandard package (pip install "
+                "zstandard)"
+            )
+        return zstd.ZstdFile(f)
+
+    return zstandard.ZstdDecompressor().stream_reader(
+        f, read_across_frames=True, closefd=True
+    )
+
+
+class KeepOpen(io.RawIOBase):
+    """Reads the binary file f, but leaves it open when closed, like a file
+    opened with closefd=False. Used for stdin, whose reader is closed after
+    reading it like any other file."""
+
+    def __init__(self, f):
+        self.f = f
+
+    def readable(self):
+        return True
+
+    def readinto(self, b):
+        return self.f.readinto(b)
+
+
+def open_input(filename):
+    """Opens the GT file filename, or stdin if it's -, for reading text,
+    decompressing it if needed. Raises OSError if it can't be opened, and
+    ValueError if it can't be decompressed. Closing the returned file
+    doesn't close stdin."""
+    if filename == "-":
+        f = io.BufferedReader(KeepOpen(sys.stdin.buffer))
+    else:
+        f = open(filename, "rb")
+    if not hasattr(f, "peek"):
+        f = io.BufferedReader(f)
+
+    compression = get_compression(f)
+    if compression == "gzip":
+        f = gzip.GzipFile(fileobj=f)
+    elif compression == "bz2":
+        f = bz2.BZ2File(f)
+    elif compression == "xz":
+        f = lzma.LZMAFile(f)
+    elif compression == "zstd":
+        f = open_zstd(f)
+
+    return io.TextIOWrapper(f)
+
+
+def read_lines(
+    filename, chunk_lines=__chunk_lines__, queue_chunks=__queue_chunks__
+):
+    """Yields the lines of the GT file filename (as in open_input) in lists
+    of at most chunk_lines lines, read and decompressed by another thread. At
+    most queue_chunks chunks are read ahead. Raises OSError if the file can't
+    be read, and ValueError if it can't be decompressed or decoded. Any other
+    error of the reading thread is raised too."""
+    f = open_input(filename)
+    chunks = Queue(maxsize=queue_chunks)
+    stop = threading.Event()
+
+    def put(item):
+        # Give up once the lines aren't wanted anymore
+        while not stop.is_set():
+            try:
+                chunks.put(item, timeout=0.1)
+                return True
+            except Full:
+                pass
+        return False
+
+    def reader():
+        try:
+            with f:
+                chunk = []
+                for line in f:
+                    chunk.append(line)
+                    if len(chunk) == chunk_lines:
+                        if not put(chunk):
+                            return
+                        chunk = []
+                if chunk and not put(chunk):
+                    return
+            put(None)
+        except (EOFError, lzma.LZMAError) as e:
+            # Truncated or corrupt compressed file
+            put(OSError(str(e)))
+        except Exception as e:
+            # Raised by the caller's thread instead
+            put(e)
+
+    thread = threading.Thread(target=reader, daemon=True)
+    thread.start()
+    try:
+        while True:
+            try:
+                item = chunks.get(timeout=0.1)
+            except Empty:
+                if not thread.is_alive() and chunks.empty():
+                    raise OSError("Stopped reading {}".format(filename))
+                continue
+            if item is None:
+                return
+            if isinstance(item, Exception):
+                raise item
+            yield item
+    finally:
+        stop.set()
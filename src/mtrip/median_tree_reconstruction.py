@@ -1,13 +1,17 @@
 import re
-from collections import Counter, deque
+from array import array
+from collections import Counter
 from itertools import product
 from multiprocessing import Pool
 from random import Random
 from textwrap import fill
 
-import mtrip.snoob as snoob
 import mtrip.triplet_omp as triplet_omp
-from mtrip.bitsnbobs import get_binary_subsets, init_bipart_rep_function, popcount
+from mtrip.bitsnbobs import (init_bipart_rep_function, iter_snoobs,
+                             iter_subsets, popcount)
+from mtrip.cache import get_cache_key
+from mtrip.metrics import stage
+from mtrip.shard import get_shard_blocks, get_shard_subsets
 
 # I know I shouldn't do this :(
 # Only use multiprocessing for basic parsing if the list of nwks is quite long
@@ -110,7 +114,7 @@ def get_biparts(nwk, dictionary):
 
 def get_subset_biparts(weights):
     biparts_per_set = dict()
-    for a, b in weights.keys():
+    for a, b in weights:
         c = a + b
         if c in biparts_per_set:
             biparts_per_set[c].append((a, b))
@@ -140,28 +144,139 @@ def get_weights(gts_nwks, dictionary):
     return weights
 
 
-def get_weights_parallel(gts_nwks, dictionary, n_threads=1):
-    """Find the weights of the data biparts."""
+def canonical_topology(biparts):
+    """Returns an order-independent key for the bipartition set of a tree.
+
+    Each bipartition is already stored as (smaller, larger), so sorting the
+    list makes trees that only differ in the order of their children (or of
+    the Newick string in general) map to the same key."""
+    return tuple(sorted(biparts))
+
+
+def get_topology_counts(gts_nwks, dictionary, n_threads=1):
+    """Counts the distinct topologies in a list of simplified Newick strings.
+
+    Identical strings are only decomposed once, and strings which describe
+    the same rooted topology are merged through canonical_topology. Returns
+    a Counter sending each canonical topology to its multiplicity."""
+    line_counts = Counter(gts_nwks)
+    unique_nwks = list(line_counts.keys())
+
+    if len(unique_nwks) < 30 * n_threads:
+        all_biparts = [get_biparts(s, dictionary) for s in unique_nwks]
+    else:
+        chunk = len(unique_nwks) // (n_threads * 10)
+        with Pool(n_threads) as p:
+            all_biparts = p.starmap(
+                get_biparts,
+                product(unique_nwks, [dictionary]),
+                chunksize=chunk,
+            )
+
+    topologies = Counter()
+    for s, biparts in zip(unique_nwks, all_biparts):
+        topologies[canonical_topology(biparts)] += line_counts[s]
+
+    return topologies
 
-    if len(gts_nwks) < 30 * n_threads:
-        return get_weights(gts_nwks, dictionary)
 
-    all_biparts = deque()
-    chunk = len(gts_nwks) // (n_threads * 10)
+class TopologyCounter:
+    """Counts the distinct topologies of GTs given a chunk at a time, so that
+    their bipartitions are found while the rest of the input is still being
+    read.
 
-    with Pool(n_threads) as p:
-        for res in p.starmap(
-            get_biparts,
-            product(gts_nwks, [dictionary]),
-            chunksize=chunk,
-        ):
-            all_biparts.extend(res)
+    The numbering of the species (sorted by name) is only known once all the
+    GTs are in, so until then the species are numbered in the order they're
+    first seen, and get_bipart_counts renumbers the bipartitions at the end.
+    Each distinct string is only decomposed once, as in get_topology_counts.
+    """
+
+    def __init__(self):
+        self.n_nwks = 0
+        # Species numbered in the order they're first seen
+        self.dictionary = {}
+        # Topology of each distinct simplified string
+        self.line_topologies = {}
+        self.topologies = Counter()
+
+    def add(self, nwks):
+        """Adds the GTs in the list of Newick strings nwks, skipping empty
+        lines and comments. Raises SyntaxError if a GT has an unlabeled
+        tip."""
+        for nwk in nwks:
+            if nwk == "" or nwk[0] == "#":
+                continue
+            s = simplify_nwk(nwk)
+            topology = self.line_topologies.get(s)
+            if topology is None:
+                for name in get_line_names(self.n_nwks, s):
+                    if name not in self.dictionary:
+                        self.dictionary[name] = len(self.dictionary)
+                topology = canonical_topology(get_biparts(s, self.dictionary))
+                self.line_topologies[s] = topology
+            self.topologies[topology] += 1
+            self.n_nwks += 1
+
+    def get_bipart_counts(self, reverse_dictionary=None):
+        """Returns the weights of the GT bipartitions, dictionary and
+        reverse dictionary of the GTs added so far, like get_bipart_counts.
+        Raises ValueError if reverse_dictionary is given and doesn't have
+        all their species."""
+        names = set(self.dictionary)
+        if reverse_dictionary is None:
+            reverse_dictionary = sorted(names)
+        else:
+            missing = names.difference(reverse_dictionary)
+            if missing:
+                raise ValueError(
+                    "Species not among the existing labels: {}".format(
+                        ", ".join(sorted(missing))
+                    )
+                )
+        dictionary = {name: i for i, name in enumerate(reverse_dictionary)}
+        # The final bit of each species, by its first-seen number
+        bits = [0] * len(self.dictionary)
+        for name, i in self.dictionary.items():
+            bits[i] = 1 << dictionary[name]
+        renumbered = {}
+
+        def renumber(x):
+            if x not in renumbered:
+                renumbered[x] = sum(
+                    bit for i, bit in enumerate(bits) if x >> i & 1
+                )
+            return renumbered[x]
+
+        weights = Counter()
+        for topology, multiplicity in self.topologies.items():
+            for a, b in topology:
+                a, b = renumber(a), renumber(b)
+                weights[(min(a, b), max(a, b))] += multiplicity
+
+        return weights, dictionary, reverse_dictionary
+
+
+def get_weights_from_topologies(topologies):
+    """Find the weights of the data biparts, given the multiplicity of each
+    distinct topology."""
+    weights = Counter()
+    for topology, multiplicity in topologies.items():
+        for bipart in topology:
+            weights[bipart] += multiplicity
+
+    return weights
 
-    return Counter(all_biparts)
 
+def get_weights_parallel(gts_nwks, dictionary, n_threads=1):
+    """Find the weights of the data biparts."""
+    topologies = get_topology_counts(gts_nwks, dictionary, n_threads=n_threads)
+
+    return get_weights_from_topologies(topologies)
 
-def get_stack(bipartition_weights, n_species):
-    print("* Finding maximal possible weight of each bipartition.")
+
+def get_stack(bipartition_weights, n_species, verbose=True):
+    if verbose:
+        print("* Finding maximal possible weight of each bipartition.")
     # The "stack" gives the best weight of each subset
     f = init_bipart_rep_function(n_species)
     # Score of each triple
@@ -174,10 +289,10 @@ def get_stack(bipartition_weights, n_species):
 
     # Fill up the stack
     for n in range(3, n_species + 1):
-        for combo in snoob.get_all_snoobs(universe, n):
+        for combo in iter_snoobs(universe, n):
             best_bipart_list = best_biparts[combo]
             max_score = -1
-            for subset in get_binary_subsets(combo):
+            for subset in iter_subsets(combo):
                 complement = combo - subset
                 if subset < complement:
                     score = (
@@ -198,55 +313,125 @@ def get_stack(bipartition_weights, n_species):
     return stack, best_biparts
 
 
-def process_nwks(nwks, n_threads=1):
-    """Returns weights of bipartitions, dictionary, and reverse dictionary
+def get_bipart_counts(
+    nwks,
+    n_threads=1,
+    reverse_dictionary=None,
+    metrics=None,
+    topology_counter=None,
+):
+    """Returns weights of the GT bipartitions (i.e. how many times each
+    bipartition appears in the GTs), dictionary, and reverse dictionary
 
     Input:
     nwks - list of Newick strings
     n_threads - n threads to use (default=1)
+    reverse_dictionary - if given, use these species labels (e.g. from an
+                         earlier run) instead of the ones found in nwks.
+                         Raises ValueError if nwks has other labels.
+    metrics - optional mtrip.metrics.Metrics to time the stages with
+    topology_counter - optional TopologyCounter to which nwks were already
+                       added (e.g. while they were read), whose bipartitions
+                       are used instead of parsing nwks again
     """
+    if topology_counter is not None:
+        print("* Renumbering the GT bipartitions found while reading.")
+        with stage(metrics, "bipartitions") as record:
+            weights, dictionary, reverse_dictionary = (
+                topology_counter.get_bipart_counts(reverse_dictionary)
+            )
+            record["items"] = len(weights)
+        print(
+            "    {} distinct topologies among {} GTs (deduplication ratio "
+            "{:.2f}).".format(
+                len(topology_counter.topologies),
+                topology_counter.n_nwks,
+                topology_counter.n_nwks
+                / max(len(topology_counter.topologies), 1),
+            )
+        )
+
+        return weights, dictionary, reverse_dictionary
+
     print("* Parsing Newick strings and recording bipartitions in GTs.")
     # Get rid of unnecessary info in Newick string
-    nwks_simplified = []
-    if len(nwks) > __long_nwk_list__:
-        print("    Many Newick strings, so doing this in parallel.")
-        with Pool(n_threads) as p:
-            nwks_simplified.extend(p.map(simplify_nwk, nwks))
-    else:
-        nwks_simplified = [simplify_nwk(s) for s in nwks]
+    with stage(metrics, "parse", items=len(nwks)):
+        nwks_simplified = []
+        if len(nwks) > __long_nwk_list__:
+            print("    Many Newick strings, so doing this in parallel.")
+            with Pool(n_threads) as p:
+                nwks_simplified.extend(p.map(simplify_nwk, nwks))
+        else:
+            nwks_simplified = [simplify_nwk(s) for s in nwks]
     # Map each name to an integer
     print("* Finding all unique names.")
-    names, dictionary, reverse_dictionary = get_names(
-        nwks_simplified, n_threads=n_threads
-    )
-    # Get the number of species across all the GTs
-    n_species = len(names)
-    # Warn user of impeding doom; this is a pretty low bar though, 20 is more
-    # reasonable on modern hardware.
-    if n_species > 18:
-        print(
-            fill(
-                "Warning: attempting to find exact tree with {} tips. The "
-                "computation might run out of memory, or take an unreasonable "
-                "amount of time.".format(n_species)
+    with stage(metrics, "names") as record:
+        if reverse_dictionary is None:
+            names, dictionary, reverse_dictionary = get_names(
+                nwks_simplified, n_threads=n_threads
             )
-        )
+        else:
+            names, _, _ = get_names(nwks_simplified, n_threads=n_threads)
+            missing = names.difference(reverse_dictionary)
+            if missing:
+                raise ValueError(
+                    "Species not among the existing labels: {}".format(
+                        ", ".join(sorted(missing))
+                    )
+                )
+            names = set(reverse_dictionary)
+            dictionary = {
+                name: i for i, name in enumerate(reverse_dictionary)
+            }
+        record["items"] = len(names)
 
     # Get the weights of the bipartitions in the GTs
     print("* Calculating each GT bipartition's weight.")
-    # weights = get_weights(nwks_simplified, dictionary)
-    weights = get_weights_parallel(nwks_simplified, dictionary, n_threads=n_threads)
+    # Only decompose each distinct topology once
+    with stage(metrics, "bipartitions") as record:
+        topologies = get_topology_counts(
+            nwks_simplified, dictionary, n_threads=n_threads
+        )
+        weights = get_weights_from_topologies(topologies)
+        record["items"] = len(weights)
+    print(
+        "    {} distinct topologies among {} GTs (deduplication ratio "
+        "{:.2f}).".format(
+            len(topologies),
+            len(nwks_simplified),
+            len(nwks_simplified) / max(len(topologies), 1),
+        )
+    )
+
+    return weights, dictionary, reverse_dictionary
+
+
+def get_subset_arrays(weights, verbose=True):
+    """Arranges the GT bipartitions by subset, to be easily accessible by C
+    code. Returns subsets, start_i, end_i, biparts_a, biparts_b, where the
+    bipartitions (biparts_a[i], biparts_b[i]) for start_i[j] <= i < end_i[j]
+    are exactly the ones with biparts_a[i] + biparts_b[i] equal to
+    subsets[j]. They are int arrays, which the C code uses without copying,
+    or lists if the bitsets don't fit in a C int.
+
+    Input:
+    weights - dict (or any other collection) whose keys are the GT
+              bipartitions (a,b)
+    verbose - print what is being done
+    """
     # Get the biparts by the subset (i.e. (a+b)->[(a,b),...]
-    print("* Matching bipartitions to subsets.")
+    if verbose:
+        print("* Matching bipartitions to subsets.")
     biparts_by_subset = get_subset_biparts(weights)
     # Arrange data to be easily accessible by C code
-    print("* Forming arrays for computations.")
-    subsets = []
-    start_i = []
-    end_i = []
-    biparts_a = []
-    biparts_b = []
-    bipart_weights = []
+    if verbose:
+        print("* Forming arrays for computations.")
+    if max(biparts_by_subset, default=0) < 2**31:
+        subsets, start_i, end_i, biparts_a, biparts_b = (
+            array("i") for _ in range(5)
+        )
+    else:
+        subsets, start_i, end_i, biparts_a, biparts_b = ([], [], [], [], [])
 
     # Permute the input to make the computations more uniform
     rng = Random(0)
@@ -261,26 +446,279 @@ def process_nwks(nwks, n_threads=1):
         for a, b in biparts:
             biparts_a.append(a)
             biparts_b.append(b)
-            bipart_weights.append(weights[(a, b)])
             position += 1
         end_i.append(position)
-    # Get the weights of all possible bipartitions
-    print("* Finding each possible bipartition's weight:")
-    triplet_weights = triplet_omp.py_compressed_weight_rep(
-        subsets,
-        start_i,
-        end_i,
-        biparts_a,
-        biparts_b,
-        bipart_weights,
-        n_species,
+
+    return subsets, start_i, end_i, biparts_a, biparts_b
+
+
+def get_triplet_weights(
+    weights,
+    n_species,
+    n_threads=1,
+    triplet_weights=None,
+    checkpoint=None,
+    shard=None,
+    tiling=None,
+    metrics=None,
+):
+    """Returns the weight of every possible bipartition, in the compressed
+    base-3 representation.
+
+    Input:
+    weights - dict sending each GT bipartition (a,b) to its weight. Since the
+              output is linear in these, negative weights can be used to
+              remove GTs from an existing result
+    n_species - number of species
+    n_threads - n threads to use (default=1)
+    triplet_weights - if given, the result is added to this array in place
+    checkpoint - optional mtrip.checkpoint.Checkpoint, to periodically save
+                 (or resume from) the partial result
+    shard - optional tuple (i, N), to only compute the i-th of N shards of
+            the weights (see mtrip.shard)
+    tiling - optional mtrip.tiles.TiledWeights, to compute the weights into
+             a memory-mapped file instead. Not used with triplet_weights or
+             checkpoint
+    metrics - optional mtrip.metrics.Metrics to time the computation with.
+              The time spent by each thread of the C code is recorded too
+    """
+    # Warn user of impeding doom; this is a pretty low bar though, 20 is more
+    # reasonable on modern hardware.
+    if n_species > 18:
+        print(
+            fill(
+                "Warning: attempting to find exact tree with {} tips. The "
+                "computation might run out of memory, or take an unreasonable "
+                "amount of time. Run mtrip with --plan to estimate "
+                "both, or with --heuristic to search for a good tree "
+                "instead.".format(n_species)
+            )
+        )
+    with stage(metrics, "weights") as record:
+        subsets, start_i, end_i, biparts_a, biparts_b = get_subset_arrays(
+            weights
+        )
+        blocks = None
+        if shard is not None and triplet_omp.get_engine() == "transform":
+            first_block, n_blocks, fraction = get_shard_blocks(
+                n_species, *shard
+            )
+            blocks = (first_block, n_blocks)
+            print(
+                "* Computing shard {}/{}: blocks {} to {} of {}, {:.1%} of "
+                "the work.".format(
+                    shard[0],
+                    shard[1],
+                    first_block + 1,
+                    first_block + n_blocks,
+                    triplet_omp.py_transform_block_count(n_species),
+                    fraction,
+                )
+            )
+        elif shard is not None:
+            subsets, start_i, end_i, fraction = get_shard_subsets(
+                subsets, start_i, end_i, n_species, *shard
+            )
+            print(
+                "* Computing shard {}/{}: {} subsets, {:.1%} of the "
+                "estimated work.".format(
+                    shard[0], shard[1], len(subsets), fraction
+                )
+            )
+        record["items"] = len(subsets)
+        bipart_weights = array(
+            "i", [weights[bipart] for bipart in zip(biparts_a, biparts_b)]
+        )
+        # Get the weights of all possible bipartitions
+        print("* Finding each possible bipartition's weight:")
+        if tiling is not None:
+            triplet_weights = tiling.compressed_weight_rep(
+                subsets,
+                start_i,
+                end_i,
+                biparts_a,
+                biparts_b,
+                bipart_weights,
+                n_species,
+                n_threads=n_threads,
+            )
+        elif checkpoint is not None:
+            print("    Checkpointing to {}.".format(checkpoint.path))
+            triplet_weights = checkpoint.compressed_weight_rep(
+                subsets,
+                start_i,
+                end_i,
+                biparts_a,
+                biparts_b,
+                bipart_weights,
+                n_species,
+                n_threads=n_threads,
+                weights=triplet_weights,
+                blocks=blocks,
+            )
+        elif blocks is not None:
+            triplets = triplet_omp.py_count_triplets(
+                subsets,
+                start_i,
+                end_i,
+                biparts_a,
+                biparts_b,
+                bipart_weights,
+                n_species,
+                n_threads=n_threads,
+                kernel_stats=record,
+            )
+            triplet_weights = triplet_omp.py_transform_triplet_counts(
+                triplets,
+                n_species,
+                n_threads=n_threads,
+                weights=triplet_weights,
+                first_block=blocks[0],
+                n_blocks=blocks[1],
+            )
+        else:
+            triplet_weights = triplet_omp.py_compressed_weight_rep(
+                subsets,
+                start_i,
+                end_i,
+                biparts_a,
+                biparts_b,
+                bipart_weights,
+                n_species,
+                n_threads=n_threads,
+                weights=triplet_weights,
+                kernel_stats=record,
+            )
+
+    return triplet_weights
+
+
+def remap_triplet_weights(
+    triplet_weights,
+    reverse_dictionary,
+    new_reverse_dictionary,
+    new_weights=None,
+    n_threads=1,
+):
+    """Returns the weights array triplet_weights, of the species in
+    reverse_dictionary, as the weights array of the species in
+    new_reverse_dictionary, which must include them. Since the weights only
+    count the triplets of the GTs, this is the weights array of the same GTs
+    with the new labels.
+
+    Input:
+    triplet_weights - weights array of the old species
+    reverse_dictionary - the old species names
+    new_reverse_dictionary - the new species names
+    new_weights - if given, the result is added to this weights array of the
+                  new species in place
+    n_threads - n threads to use (default=1)
+    """
+    dictionary = {name: i for i, name in enumerate(new_reverse_dictionary)}
+    missing = set(reverse_dictionary).difference(dictionary)
+    if missing:
+        raise ValueError(
+            "Species not among the new labels: {}".format(
+                ", ".join(sorted(missing))
+            )
+        )
+    if new_weights is None:
+        new_weights = triplet_omp.zero_array(
+            2 * 3 ** (len(new_reverse_dictionary) - 1)
+        )
+    triplet_omp.py_add_remapped_weights(
+        triplet_weights,
+        [dictionary[name] for name in reverse_dictionary],
+        new_weights,
+        n_threads=n_threads,
+    )
+
+    return new_weights
+
+
+def process_nwks(
+    nwks,
+    n_threads=1,
+    checkpoint=None,
+    tiling=None,
+    metrics=None,
+    topology_counter=None,
+):
+    """Returns weights of bipartitions, dictionary, and reverse dictionary
+
+    Input:
+    nwks - list of Newick strings
+    n_threads - n threads to use (default=1)
+    checkpoint - optional mtrip.checkpoint.Checkpoint for the weights
+    tiling - optional mtrip.tiles.TiledWeights for the weights
+    metrics - optional mtrip.metrics.Metrics to time the stages with
+    topology_counter - optional TopologyCounter already holding nwks
+    """
+    weights, dictionary, reverse_dictionary = get_bipart_counts(
+        nwks,
+        n_threads=n_threads,
+        metrics=metrics,
+        topology_counter=topology_counter,
+    )
+    triplet_weights = get_triplet_weights(
+        weights,
+        len(reverse_dictionary),
         n_threads=n_threads,
+        checkpoint=checkpoint,
+        tiling=tiling,
+        metrics=metrics,
     )
     # print("Done!")
 
     return triplet_weights, dictionary, reverse_dictionary
 
 
+def shard_triplet_weights(
+    nwks,
+    shard,
+    n_threads=1,
+    checkpoint=None,
+    metrics=None,
+    topology_counter=None,
+):
+    """Computes one shard's contribution to the weights, to be added up with
+    the other shards' by mtrip.shard.merge_shards. Returns a tuple
+    (triplet_weights, reverse_dictionary, key), where key identifies the GT
+    bipartition counts, so that shards of different GTs aren't mixed.
+
+    Input:
+    nwks - list of Newick strings without semicolons
+    shard - tuple (i, N), for the i-th of N shards (1-based)
+    n_threads - #threads to use
+    checkpoint - optional mtrip.checkpoint.Checkpoint for the weights
+    metrics - optional mtrip.metrics.Metrics to time the stages with
+    topology_counter - optional TopologyCounter already holding nwks
+    """
+    weights, dictionary, reverse_dictionary = get_bipart_counts(
+        nwks,
+        n_threads=n_threads,
+        metrics=metrics,
+        topology_counter=topology_counter,
+    )
+    triplet_weights = get_triplet_weights(
+        weights,
+        len(reverse_dictionary),
+        n_threads=n_threads,
+        checkpoint=checkpoint,
+        shard=shard,
+        metrics=metrics,
+    )
+
+    # Shards of the two engines are split differently, and can't be mixed
+    return (
+        triplet_weights,
+        reverse_dictionary,
+        get_cache_key(weights, reverse_dictionary)
+        + "+"
+        + triplet_omp.get_engine(),
+    )
+
+
 def get_present_species(x, reverse_dictionary):
     # Can be optimized with bitwise operations
     return [
@@ -314,7 +752,55 @@ def get_all_trees(x, reverse_dictionary, best_biparts):
     return [t + ";" for t in _get_all_trees(x, reverse_dictionary, best_biparts)]
 
 
-def median_triplet_trees(nwks, n_threads=1, return_extra=False):
+def get_cached_stack(weights, reverse_dictionary, cache, n_threads=1):
+    """Returns the triplet weights, stack and best biparts for the given GT
+    bipartition counts, reusing the results in cache (a
+    mtrip.cache.WeightsCache) where possible and storing new results in it."""
+    n_species = len(reverse_dictionary)
+    key = get_cache_key(weights, reverse_dictionary)
+    entry = cache.load(key)
+    if entry is not None:
+        print("* Found weights, stack and best bipartitions in the cache.")
+        return entry["triplet_weights"], entry["stack"], entry["best_biparts"]
+
+    nearest = cache.find_nearest(weights, reverse_dictionary)
+    if nearest is not None:
+        nearest_key, delta = nearest
+        entry = cache.load(nearest_key)
+    if entry is not None:
+        print(
+            "* Reusing cached weights, only adding the contributions of {} "
+            "changed bipartitions.".format(len(delta))
+        )
+        triplet_weights = get_triplet_weights(
+            delta,
+            n_species,
+            n_threads=n_threads,
+            triplet_weights=entry["triplet_weights"],
+        )
+    else:
+        triplet_weights = get_triplet_weights(
+            weights, n_species, n_threads=n_threads
+        )
+
+    stack, best_biparts = get_stack(triplet_weights, n_species)
+    cache.store(
+        key, weights, reverse_dictionary, triplet_weights, stack, best_biparts
+    )
+
+    return triplet_weights, stack, best_biparts
+
+
+def median_triplet_trees(
+    nwks,
+    n_threads=1,
+    return_extra=False,
+    cache=None,
+    checkpoint=None,
+    tiling=None,
+    metrics=None,
+    topology_counter=None,
+):
     """Computes the stack and the best biparts for each subset, then finds
     all the median trees.
 
@@ -323,28 +809,183 @@ def median_triplet_trees(nwks, n_threads=1, return_extra=False):
     n_threads - #threads to use
     return_extra - set to get stack, lists of best biparts,
                 and reverse dictionary
+    cache - optional mtrip.cache.WeightsCache to reuse earlier results
+    checkpoint - optional mtrip.checkpoint.Checkpoint, to periodically save
+                 (or resume from) the partial weights. Not used with cache.
+    tiling - optional mtrip.tiles.TiledWeights, to keep the weights in a
+             memory-mapped file. Not used with cache or checkpoint.
+    metrics - optional mtrip.metrics.Metrics to time the stages with
+    topology_counter - optional TopologyCounter already holding nwks, e.g.
+                       filled while they were read
     """
-    triplet_weights, dictionary, reverse_dictionary = process_nwks(
-        nwks,
-        n_threads=n_threads,
-    )
-
-    n_species = len(reverse_dictionary)
+    if cache is None:
+        triplet_weights, dictionary, reverse_dictionary = process_nwks(
+            nwks,
+            n_threads=n_threads,
+            checkpoint=checkpoint,
+            tiling=tiling,
+            metrics=metrics,
+            topology_counter=topology_counter,
+        )
+        n_species = len(reverse_dictionary)
+        with stage(metrics, "stack", items=2**n_species):
+            stack, best_biparts = get_stack(triplet_weights, n_species)
+    else:
+        weights, dictionary, reverse_dictionary = get_bipart_counts(
+            nwks,
+            n_threads=n_threads,
+            metrics=metrics,
+            topology_counter=topology_counter,
+        )
+        n_species = len(reverse_dictionary)
+        # Covers both the weights and the stack, whichever aren't cached
+        with stage(metrics, "cache"):
+            triplet_weights, stack, best_biparts = get_cached_stack(
+                weights, reverse_dictionary, cache, n_threads=n_threads
+            )
 
-    stack, best_biparts = get_stack(triplet_weights, n_species)
     # bitset representation of all the tips
+    x = 2**n_species - 1
+    print_best_score(stack, n_species, len(nwks))
+
+    with stage(metrics, "trees") as record:
+        trees = get_all_trees(x, reverse_dictionary, best_biparts)
+        record["items"] = len(trees)
+    if return_extra:
+        return trees, reverse_dictionary, triplet_weights, stack, best_biparts
+    else:
+        return trees
+
+
+def print_best_score(stack, n_species, n_nwks):
     x = 2**n_species - 1
     # This assumes each GT has all the species, so this is actually not a
     # sharp upper bound!
-    theoretical_bound = len(nwks) * n_species * (n_species - 1) * (n_species - 2) // 6
+    theoretical_bound = n_nwks * n_species * (n_species - 1) * (n_species - 2) // 6
     print(
         "Best possible triplet count is {}, out of a maximum of {}.".format(
             stack[x], theoretical_bound
         )
     )
 
-    trees = get_all_trees(x, reverse_dictionary, best_biparts)
+
+def append_median_triplet_trees(
+    nwks,
+    reverse_dictionary,
+    triplet_weights,
+    n_old_nwks=0,
+    n_threads=1,
+    return_extra=False,
+    metrics=None,
+):
+    """Adds the contribution of new GTs to the weights of an earlier run, then
+    finds the median trees of all the GTs together. Only the bipartitions of
+    the new GTs are processed, since the weights are linear in the
+    bipartition counts.
+
+    Input:
+    nwks - list of new Newick strings without semicolons. Must only use
+           species in reverse_dictionary
+    reverse_dictionary - species labels of the earlier run
+    triplet_weights - weights array of the earlier run, updated in place
+    n_old_nwks - number of GTs in the earlier run (only used for reporting)
+    n_threads - #threads to use
+    return_extra - set to get stack, lists of best biparts,
+                and reverse dictionary
+    metrics - optional mtrip.metrics.Metrics to time the stages with
+    """
+    weights, dictionary, reverse_dictionary = get_bipart_counts(
+        nwks,
+        n_threads=n_threads,
+        reverse_dictionary=reverse_dictionary,
+        metrics=metrics,
+    )
+    n_species = len(reverse_dictionary)
+    get_triplet_weights(
+        weights,
+        n_species,
+        n_threads=n_threads,
+        triplet_weights=triplet_weights,
+        metrics=metrics,
+    )
+    with stage(metrics, "stack", items=2**n_species):
+        stack, best_biparts = get_stack(triplet_weights, n_species)
+    print_best_score(stack, n_species, n_old_nwks + len(nwks))
+
+    with stage(metrics, "trees") as record:
+        trees = get_all_trees(
+            2**n_species - 1, reverse_dictionary, best_biparts
+        )
+        record["items"] = len(trees)
     if return_extra:
         return trees, reverse_dictionary, triplet_weights, stack, best_biparts
     else:
         return trees
+
+
+def get_window_bounds(n_nwks, window, step):
+    """Returns the (start, end) GT indices of each window. Only full windows
+    are returned, unless there are fewer than window GTs in total."""
+    if n_nwks <= window:
+        return [(0, n_nwks)]
+
+    return [(i, i + window) for i in range(0, n_nwks - window + 1, step)]
+
+
+def window_median_triplet_trees(nwks, window, step, n_threads=1):
+    """Finds the median trees of consecutive windows of GTs. Yields a tuple
+    (start, end, score, trees) for each window, where start and end are the
+    (0-based, end exclusive) indices of the window's GTs.
+
+    A single weights array is kept throughout: moving the window subtracts
+    the contributions of the GTs leaving it and adds those of the GTs
+    entering it, since the weights are linear in the bipartition counts.
+
+    Input:
+    nwks - list of Newick strings without semicolons, in genome order
+    window - number of GTs in each window
+    step - number of GTs by which the window is moved each time
+    n_threads - #threads to use
+    """
+    print("* Parsing Newick strings and recording bipartitions in GTs.")
+    nwks_simplified = [simplify_nwk(s) for s in nwks]
+    print("* Finding all unique names.")
+    names, dictionary, reverse_dictionary = get_names(
+        nwks_simplified, n_threads=n_threads
+    )
+    n_species = len(reverse_dictionary)
+    universe = 2**n_species - 1
+
+    # Each distinct string is only decomposed once
+    print("* Finding each GT's bipartitions.")
+    line_biparts = {}
+    for s in nwks_simplified:
+        if s not in line_biparts:
+            line_biparts[s] = get_biparts(s, dictionary)
+
+    triplet_weights = triplet_omp.zero_array(2 * 3 ** (n_species - 1), "i")
+    cur_start, cur_end = 0, 0
+
+    for start, end in get_window_bounds(len(nwks), window, step):
+        print("* Moving to window of GTs {} to {}.".format(start + 1, end))
+        delta = Counter()
+        # GTs leaving the window...
+        for i in range(cur_start, min(cur_end, start)):
+            for bipart in line_biparts[nwks_simplified[i]]:
+                delta[bipart] -= 1
+        # ...and GTs entering it
+        for i in range(max(cur_end, start), end):
+            for bipart in line_biparts[nwks_simplified[i]]:
+                delta[bipart] += 1
+        delta = {bipart: w for bipart, w in delta.items() if w != 0}
+        cur_start, cur_end = start, end
+
+        get_triplet_weights(
+            delta,
+            n_species,
+            n_threads=n_threads,
+            triplet_weights=triplet_weights,
+        )
+        stack, best_biparts = get_stack(triplet_weights, n_species)
+        trees = get_all_trees(universe, reverse_dictionary, best_biparts)
+        yield start, end, stack[universe], trees
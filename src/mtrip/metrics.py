@@ -0,0 +1,93 @@
+"""Timing and memory measurements of each stage of a run.
+
+A Metrics object records the wall and CPU time, the peak resident memory and
+the number of items processed by each stage, and can write them out as a
+JSON report. The operating system only keeps the peak resident memory of the
+whole process, so each stage records it as it was at the end of the stage
+(peak_rss_so_far), and how much it grew during the stage (peak_rss_growth).
+A stage whose memory stays below the peak of an earlier stage has a growth
+of 0, even if it used a lot of memory. Functions taking an optional metrics
+argument time their stages with stage(metrics, name), which does nothing if
+metrics is None.
+"""
+import json
+import sys
+from contextlib import contextmanager, nullcontext
+from time import perf_counter, process_time
+
+from mtrip import __version__
+
+try:
+    import resource
+except ImportError:
+    # Not available on Windows
+    resource = None
+
+
+def get_peak_rss():
+    """Returns the peak resident memory of this process in bytes, or None if
+    it can't be found."""
+    if resource is None:
+        return None
+    peak = resource.getrusage(resource.RUSAGE_SELF).ru_maxrss
+    # Linux reports kilobytes, macOS bytes
+    if sys.platform != "darwin":
+        peak *= 1024
+
+    return peak
+
+
+class Metrics:
+    """Measurements of the stages of one run."""
+
+    def __init__(self):
+        self.stages = []
+        self.wall_start = perf_counter()
+        self.cpu_start = process_time()
+
+    @contextmanager
+    def stage(self, name, items=None):
+        """Context manager timing the stage name. It yields the stage's
+        record, a dict to which the stage can add its number of items or
+        other measurements."""
+        record = {"name": name, "items": items}
+        wall_start = perf_counter()
+        cpu_start = process_time()
+        rss_start = get_peak_rss()
+        try:
+            yield record
+        finally:
+            record["wall_time"] = perf_counter() - wall_start
+            record["cpu_time"] = process_time() - cpu_start
+            record["peak_rss_so_far"] = get_peak_rss()
+            record["peak_rss_growth"] = None
+            if rss_start is not None:
+                record["peak_rss_growth"] = (
+                    record["peak_rss_so_far"] - rss_start
+                )
+            self.stages.append(record)
+
+    def report(self):
+        """Returns a dict with the measurements of the whole run and of each
+        stage."""
+        return {
+            "version": __version__,
+            "wall_time": perf_counter() - self.wall_start,
+            "cpu_time": process_time() - self.cpu_start,
+            "peak_rss": get_peak_rss(),
+            "stages": self.stages,
+        }
+
+    def write_json(self, filename):
+        with open(filename, "w") as f:
+            json.dump(self.report(), f, indent=2)
+            f.write("\n")
+
+
+def stage(metrics, name, items=None):
+    """Returns metrics.stage(name, items), or a context manager which does
+    nothing if metrics is None."""
+    if metrics is None:
+        return nullcontext({})
+
+    return metrics.stage(name, items)
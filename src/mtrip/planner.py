@@ -0,0 +1,300 @@
+"""Predicting the time and memory a run needs, without running it.
+
+The GTs are parsed and their bipartitions counted, which is quick, and the
+cost of the later stages is worked out from the bipartitions of each subset.
+The costs are turned into times by timing the same code on a small synthetic
+problem on this machine.
+"""
+import os
+import sys
+from math import comb
+from random import Random
+from time import time
+
+import mtrip.triplet_omp as triplet_omp
+from mtrip.median_tree_reconstruction import (
+    get_bipart_counts,
+    get_stack,
+    get_subset_arrays,
+)
+from mtrip.bitsnbobs import popcount
+from mtrip.shard import get_subset_costs
+from mtrip.simulate import get_names, random_nwk
+from mtrip.tiles import get_n_tile_species, get_tiles
+
+# Most species the C code can handle, with --memory
+__max_species__ = 20
+
+# Fraction of the physical memory a run may plan to use
+__memory_fraction__ = 0.8
+
+
+def get_n_stack_steps(n_species):
+    """Returns the number of (subset, bipartition) pairs looked at by
+    get_stack."""
+    return sum(
+        comb(n_species, k) * (2**k - 2) for k in range(3, n_species + 1)
+    )
+
+
+def get_n_transform_steps(n_species):
+    """Returns the number of additions done by the transform engine's sums
+    over the weights array."""
+    return n_species * 2 * 3 ** (n_species - 1)
+
+
+def time_weights(weights, n_species, engine):
+    """Returns the triplet weights of the GT bipartition counts weights, and
+    the time the C code took to find them with the given engine."""
+    subsets, start_i, end_i, biparts_a, biparts_b = get_subset_arrays(weights)
+    bipart_weights = [weights[x] for x in zip(biparts_a, biparts_b)]
+    tic = time()
+    triplet_weights = triplet_omp.py_compressed_weight_rep(
+        subsets,
+        start_i,
+        end_i,
+        biparts_a,
+        biparts_b,
+        bipart_weights,
+        n_species,
+        verbose=False,
+        engine=engine,
+    )
+
+    return triplet_weights, time() - tic
+
+
+def calibrate(n_species=10, n_nwks=100, seed=0, n_transform_species=14):
+    """Times the weights kernel and the stack on a small synthetic problem,
+    and the transform engine on a larger one, since it's too quick to time
+    on the small one. Returns a dict with the number of kernel, stack and
+    transform steps done per second on one thread."""
+    rng = Random(seed)
+    names = get_names(n_species)
+    nwks = [random_nwk(names, rng) for _ in range(n_nwks)]
+
+    weights, _, _ = get_bipart_counts(nwks)
+    subsets, start_i, end_i, biparts_a, biparts_b = get_subset_arrays(weights)
+    n_kernel_steps = sum(get_subset_costs(subsets, start_i, end_i, n_species))
+    triplet_weights, kernel_time = time_weights(weights, n_species, "scatter")
+
+    tic = time()
+    get_stack(triplet_weights, n_species)
+    stack_time = time() - tic
+
+    names = get_names(n_transform_species)
+    nwks = [random_nwk(names, rng) for _ in range(n_nwks)]
+    weights, _, _ = get_bipart_counts(nwks)
+    _, transform_time = time_weights(
+        weights, n_transform_species, "transform"
+    )
+
+    return {
+        "kernel": n_kernel_steps / max(kernel_time, 1e-6),
+        "stack": get_n_stack_steps(n_species) / max(stack_time, 1e-6),
+        "transform": get_n_transform_steps(n_transform_species)
+        / max(transform_time, 1e-6),
+    }
+
+
+def get_physical_memory():
+    """Returns the physical memory of this machine in bytes, or None if it
+    can't be found."""
+    try:
+        return os.sysconf("SC_PHYS_PAGES") * os.sysconf("SC_PAGE_SIZE")
+    except (AttributeError, OSError, ValueError):
+        return None
+
+
+def get_memory_estimates(n_species, n_biparts):
+    """Returns a dict with the estimated bytes used by each stage. The best
+    bipartitions are estimated assuming each subset has a single best
+    bipartition; ties add to this."""
+    itemsize = triplet_omp.zero_array(0, "i").itemsize
+    n_subsets = 2**n_species
+    int_size = sys.getsizeof(n_subsets)
+    pointer_size = 8
+    # Appending to an empty list over-allocates room for a few items
+    grown_list = []
+    grown_list.append(0)
+
+    return {
+        "itemsize": itemsize,
+        # Bipartition counts (a dict of tuples), and the five lists of ints
+        # handed to the C code
+        "bipartitions": n_biparts
+        * (
+            5 * (pointer_size + int_size)
+            + sys.getsizeof((0, 0))
+            + 3 * pointer_size
+        ),
+        "weights": 2 * 3 ** (n_species - 1) * itemsize,
+        # The stack, plus get_stack's base-3 lookup tables
+        "stack": n_subsets * (itemsize + 2 * (pointer_size + int_size)),
+        "best_biparts": n_subsets * (pointer_size + sys.getsizeof([]))
+        + (n_subsets - n_species - 1)
+        * (
+            sys.getsizeof(grown_list)
+            - sys.getsizeof([])
+            + sys.getsizeof((0, 0))
+            + 2 * int_size
+        ),
+    }
+
+
+def get_tree_bytes(reverse_dictionary):
+    """Returns the estimated size of one median tree's Newick string."""
+    n_chars = sum(len(name) for name in reverse_dictionary)
+    n_chars += 3 * (len(reverse_dictionary) - 1) + 1
+
+    return sys.getsizeof("") + n_chars
+
+
+def plan_run(nwks, n_threads=1, max_bytes=None, rates=None):
+    """Parses the GTs and estimates the time and memory of each stage of a
+    run.
+
+    Input:
+    nwks - list of Newick strings without semicolons
+    n_threads - #threads the run would use
+    max_bytes - memory available to the run. Defaults to this machine's
+                physical memory
+    rates - dict returned by calibrate; calibrates on this machine if None
+
+    Returns a dict with the numbers of species, subsets and bipartitions,
+    a list of (stage, bytes, seconds) tuples (None where unknown), and the
+    recommended options.
+    """
+    tic = time()
+    weights, _, reverse_dictionary = get_bipart_counts(
+        nwks, n_threads=n_threads
+    )
+    n_species = len(reverse_dictionary)
+    subsets, start_i, end_i, _, _ = get_subset_arrays(weights)
+    parse_time = time() - tic
+
+    if rates is None:
+        print("* Timing a small problem on this machine.")
+        rates = calibrate()
+    if max_bytes is None:
+        max_bytes = get_physical_memory()
+
+    memory = get_memory_estimates(n_species, len(weights))
+    n_kernel_steps = sum(get_subset_costs(subsets, start_i, end_i, n_species))
+    if triplet_omp.get_engine() == "transform":
+        kernel_time = get_n_transform_steps(n_species) / rates["transform"]
+    else:
+        kernel_time = n_kernel_steps / rates["kernel"]
+    stack_time = get_n_stack_steps(n_species) / rates["stack"]
+
+    stages = [
+        ("Parsing GTs", memory["bipartitions"], parse_time),
+        ("Weights (C code)", memory["weights"], kernel_time / n_threads),
+        ("Stack", memory["stack"], stack_time),
+        ("Best bipartitions", memory["best_biparts"], None),
+        ("Each median tree", get_tree_bytes(reverse_dictionary), None),
+    ]
+
+    # Recommend a memory strategy
+    budget = None
+    if max_bytes is not None:
+        budget = int(__memory_fraction__ * max_bytes)
+    other_bytes = memory["bipartitions"] + memory["stack"]
+    other_bytes += memory["best_biparts"]
+    if n_species > __max_species__:
+        strategy = (
+            "too many species: at most {} are supported exactly, use "
+            "--heuristic".format(__max_species__)
+        )
+    elif budget is None or other_bytes + memory["weights"] <= budget:
+        strategy = "in memory"
+    else:
+        tile_bytes = budget - other_bytes
+        n_fixed = get_n_tile_species(n_species, tile_bytes)
+        if tile_bytes <= 0 or n_fixed >= n_species:
+            strategy = "won't fit in memory, even with --memory"
+        else:
+            n_tiles = len(list(get_tiles(n_species, n_fixed)))
+            strategy = "--memory {} ({} tiles)".format(
+                tile_bytes // 1024**2, n_tiles
+            )
+            # The tiles are always scattered, and each one goes over the
+            # bipartitions of all the subsets again
+            n_pairs = sum(
+                (3 ** popcount(x) - 2 ** (popcount(x) + 1) + 1) // 2
+                for x in subsets
+            )
+            stages[1] = (
+                "Weights (C code)",
+                3 ** (n_species - n_fixed) * memory["itemsize"],
+                (n_kernel_steps + n_tiles * n_pairs)
+                / rates["kernel"]
+                / n_threads,
+            )
+
+    # A thread needs a few subsets for the load to stay balanced, and short
+    # runs don't gain much from threads at all
+    cpus = os.cpu_count() or 1
+    if kernel_time < 1:
+        threads = 1
+    else:
+        threads = max(1, min(cpus, len(subsets) // 8))
+
+    return {
+        "n_species": n_species,
+        "n_nwks": len(nwks),
+        "n_subsets": len(subsets),
+        "n_biparts": len(weights),
+        "stages": stages,
+        "max_bytes": max_bytes,
+        "strategy": strategy,
+        "threads": threads,
+    }
+
+
+def format_bytes(n_bytes):
+    for unit in ["B", "kB", "MB", "GB"]:
+        if n_bytes < 1024:
+            return "{:.1f} {}".format(n_bytes, unit)
+        n_bytes /= 1024
+
+    return "{:.1f} TB".format(n_bytes)
+
+
+def format_plan(plan):
+    """Returns the lines of a human-readable report of plan_run's output."""
+    lines = [
+        "{} species, {} GTs, {} distinct bipartitions in {} subsets.".format(
+            plan["n_species"], plan["n_nwks"], plan["n_biparts"],
+            plan["n_subsets"],
+        ),
+        "",
+        "{:<20}{:>12}{:>16}".format("Stage", "Memory", "Time"),
+    ]
+    total_bytes = 0
+    total_time = 0
+    for stage, n_bytes, seconds in plan["stages"]:
+        if seconds is None:
+            time_str = "-"
+        else:
+            time_str = "{:.2f} s".format(seconds)
+            total_time += seconds
+        if stage != "Each median tree":
+            total_bytes += n_bytes
+        lines.append(
+            "{:<20}{:>12}{:>16}".format(stage, format_bytes(n_bytes), time_str)
+        )
+    lines.append(
+        "{:<20}{:>12}{:>16}".format(
+            "Total", format_bytes(total_bytes), "{:.2f} s".format(total_time)
+        )
+    )
+    lines.append("")
+    if plan["max_bytes"] is not None:
+        lines.append("Available memory: {}".format(
+            format_bytes(plan["max_bytes"]))
+        )
+    lines.append("Recommended memory strategy: {}".format(plan["strategy"]))
+    lines.append("Recommended threads: {}".format(plan["threads"]))
+
+    return lines
@@ -0,0 +1,168 @@
+"""Splitting the weights computation between several processes.
+
+With the transform engine, every shard counts all the GT triplets, which is
+cheap, and then finds the weights of its own range of blocks of the weights
+array (see triplet_omp.py_transform_triplet_counts), leaving the others at
+0. With the scatter engine, the weights are a sum of independent
+contributions of the subsets a+b of the GT bipartitions (a,b), so the
+subsets are split into shards instead. Either way the shards are computed
+separately (e.g. on different machines) and added up afterwards. Every shard
+computes the same shuffled subset arrays, so only the shard's index and the
+total number of shards need to be agreed on.
+"""
+import heapq
+
+import mtrip.triplet_omp as triplet_omp
+from mtrip.bitsnbobs import popcount
+
+
+def parse_shard(s):
+    """Parses a shard given as "i/N", with 1 <= i <= N, and returns the tuple
+    (i, N). Raises ValueError if s isn't of this form."""
+    try:
+        index, count = (int(t) for t in s.split("/"))
+    except ValueError:
+        raise ValueError("A shard must be given as i/N, not {}".format(s))
+    if not 1 <= index <= count:
+        raise ValueError(
+            "The shard index must be between 1 and the number of shards, "
+            "not {}".format(s)
+        )
+
+    return index, count
+
+
+def get_subset_costs(subsets, start_i, end_i, n_species):
+    """Returns an estimate of the time the C code spends on each subset.
+
+    For a subset of size k, the C code loops over the (3^k - 2^(k+1) + 1)/2
+    bipartitions (a',b') of its subsets, and for each one goes through the GT
+    bipartitions of the subset, then updates the weights of the 3^(n-k)
+    extensions of (a',b') by the kernel.
+    """
+    costs = []
+    for subset, start, end in zip(subsets, start_i, end_i):
+        k = popcount(subset)
+        n_pairs = (3**k - 2 ** (k + 1) + 1) // 2
+        costs.append(n_pairs * (end - start + 3 ** (n_species - k)))
+
+    return costs
+
+
+def get_shard_assignment(costs, n_shards):
+    """Assigns each subset to one of n_shards shards, balancing the total
+    cost of the shards. Returns a list with the (0-based) shard of each
+    subset.
+
+    The subsets are handed out from the most to the least expensive, each to
+    the shard with the smallest total so far; the result only depends on the
+    costs, so every process finds the same assignment.
+    """
+    assignment = [0] * len(costs)
+    totals = [(0, shard) for shard in range(n_shards)]
+    order = sorted(range(len(costs)), key=lambda i: (-costs[i], i))
+    for i in order:
+        total, shard = heapq.heappop(totals)
+        assignment[i] = shard
+        heapq.heappush(totals, (total + costs[i], shard))
+
+    return assignment
+
+
+def get_shard_subsets(
+    subsets, start_i, end_i, n_species, shard_index, n_shards
+):
+    """Returns the subsets, start_i and end_i of the given (1-based) shard,
+    together with the fraction of the total estimated cost it carries. The
+    start and end indices still refer to the full bipartition arrays."""
+    costs = get_subset_costs(subsets, start_i, end_i, n_species)
+    assignment = get_shard_assignment(costs, n_shards)
+    chosen = [
+        i for i, shard in enumerate(assignment) if shard == shard_index - 1
+    ]
+    total = sum(costs)
+    fraction = sum(costs[i] for i in chosen) / total if total > 0 else 0.0
+
+    return (
+        [subsets[i] for i in chosen],
+        [start_i[i] for i in chosen],
+        [end_i[i] for i in chosen],
+        fraction,
+    )
+
+
+def _is_computed_block(block):
+    """Whether the transform finds the weights of the block, i.e. the last
+    nonzero base-3 digit of its high species isn't 2. The other blocks only
+    hold entries which don't represent any bipartition, and are left at 0."""
+    while block >= 3:
+        block //= 3
+
+    return block != 2
+
+
+def get_shard_blocks(n_species, shard_index, n_shards):
+    """Returns the first block and the number of blocks of the weights array
+    which the transform engine computes for the given (1-based) shard,
+    together with the fraction of the work this is. The blocks whose weights
+    are computed are split evenly, and the ranges of the shards cover all
+    the blocks without overlapping."""
+    n_blocks = triplet_omp.py_transform_block_count(n_species)
+    # Block 0 is always computed, so each shard starts at a computed block,
+    # and the last one ends with the array
+    starts = [b for b in range(n_blocks) if _is_computed_block(b)]
+    n_computed = len(starts)
+    starts.append(n_blocks)
+    lo = n_computed * (shard_index - 1) // n_shards
+    hi = n_computed * shard_index // n_shards
+
+    return starts[lo], starts[hi] - starts[lo], (hi - lo) / n_computed
+
+
+def merge_shards(shards, n_threads=1):
+    """Adds up the partial weights of the shards of one computation.
+
+    Input:
+    shards - list of unpickled shard weights files, written by mtrip --shard
+    n_threads - #threads to add the weights with
+
+    Returns the summed weights array. Raises ValueError if the shards weren't
+    made from the same GTs, or if any shard is missing or repeated.
+    """
+    first = shards[0]["shard"]
+    n_shards = first["count"]
+    seen = set()
+    for in_pickle in shards:
+        shard = in_pickle["shard"]
+        if shard["key"] != first["key"] or shard["count"] != n_shards:
+            raise ValueError(
+                "The shards weren't made from the same GTs with the same "
+                "engine"
+            )
+        if shard["index"] in seen:
+            raise ValueError(
+                "Shard {}/{} given twice".format(shard["index"], n_shards)
+            )
+        seen.add(shard["index"])
+    missing = sorted(set(range(1, n_shards + 1)) - seen)
+    if missing:
+        raise ValueError(
+            "Missing shard(s) {} of {}".format(
+                ", ".join(str(i) for i in missing), n_shards
+            )
+        )
+
+    weights = triplet_omp.as_int_buffer(shards[0]["triplet_weights"])
+    n_species = 1
+    while 2 * 3 ** (n_species - 1) < len(weights):
+        n_species += 1
+    # The shards have the same species, so each one is "remapped" to itself
+    for in_pickle in shards[1:]:
+        triplet_omp.py_add_remapped_weights(
+            triplet_omp.as_int_buffer(in_pickle["triplet_weights"]),
+            range(n_species),
+            weights,
+            n_threads=n_threads,
+        )
+
+    return weights
@@ -0,0 +1,85 @@
+"""Seeded synthetic gene trees, for testing and benchmarking.
+
+Trees are built as nested tuples of leaf indices, and written out as Newick
+strings without semicolons, like the ones get_bipart_counts reads. Every
+function takes a random.Random or a seed, so the same seed always gives the
+same trees.
+"""
+from random import Random
+
+
+def get_names(n_species):
+    """Returns the names t0, t1, ... of n_species species."""
+    return ["t{}".format(i) for i in range(n_species)]
+
+
+def random_tree(n_species, rng):
+    """Returns a random binary tree on the leaves 0, ..., n_species-1, as
+    nested tuples. Subtrees are joined in random order, so this isn't uniform
+    over the topologies, but every topology can appear."""
+    subtrees = list(range(n_species))
+    while len(subtrees) > 1:
+        a = subtrees.pop(rng.randrange(len(subtrees)))
+        b = subtrees.pop(rng.randrange(len(subtrees)))
+        subtrees.append((a, b))
+
+    return subtrees[0]
+
+
+def to_nwk(tree, names):
+    """Returns the Newick string, without a semicolon, of a tree of nested
+    tuples whose leaves index names."""
+    if isinstance(tree, tuple):
+        return "({},{})".format(to_nwk(tree[0], names), to_nwk(tree[1], names))
+
+    return names[tree]
+
+
+def random_nwk(names, rng):
+    """Returns a random binary tree on the given names, as a Newick string
+    without a semicolon."""
+    return to_nwk(random_tree(len(names), rng), names)
+
+
+def relabel(tree, labels):
+    """Returns tree with each leaf i replaced by labels[i]."""
+    if isinstance(tree, tuple):
+        return (relabel(tree[0], labels), relabel(tree[1], labels))
+
+    return labels[tree]
+
+
+def discordant_tree(species_tree, n_species, discordance, rng):
+    """Returns a gene tree made from species_tree by swapping the labels of
+    random pairs of leaves. Each leaf is swapped with a random leaf with
+    probability discordance, so 0 gives back the species tree, and 1 gives a
+    tree close to a random one."""
+    labels = list(range(n_species))
+    for i in range(n_species):
+        if rng.random() < discordance:
+            j = rng.randrange(n_species)
+            labels[i], labels[j] = labels[j], labels[i]
+
+    return relabel(species_tree, labels)
+
+
+def random_nwks(n_species, n_nwks, seed=0):
+    """Returns n_nwks random gene trees on n_species species."""
+    rng = Random(seed)
+    names = get_names(n_species)
+
+    return [random_nwk(names, rng) for _ in range(n_nwks)]
+
+
+def discordant_nwks(n_species, n_nwks, discordance, seed=0):
+    """Returns a random species tree, and n_nwks gene trees made from it by
+    discordant_tree, all as Newick strings without semicolons."""
+    rng = Random(seed)
+    names = get_names(n_species)
+    species_tree = random_tree(n_species, rng)
+    nwks = [
+        to_nwk(discordant_tree(species_tree, n_species, discordance, rng), names)
+        for _ in range(n_nwks)
+    ]
+
+    return to_nwk(species_tree, names), nwks
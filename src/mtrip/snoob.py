@@ -1,7 +1,4 @@
-from mtrip.bitsnbobs import popcount, pysnoob
-from mtrip.scipycomb import _comb_int as comb
-
-# from scipy.special import comb
+from mtrip.bitsnbobs import iter_snoobs, popcount
 
 
 def get_first_n_combo(x, n):
@@ -18,20 +15,8 @@ def get_first_n_combo(x, n):
 
 def get_all_snoobs(x, n_set_bits):
     """Get all integers with n_bits set bits. Each set bit must be present in x's binary representation."""
-    # number of set bits in x
-    n_universe_bits = popcount(x)
-    # the length our output should have
-    n_combos = comb(n_universe_bits, n_set_bits)
-
-    combos = []
-    # The first such combo.
-    combo = get_first_n_combo(x, n_set_bits)
-    for _ in range(n_combos):
-        combos.append(combo)
-        # print(combo, ' = ', bin(combo), ' has popcount ', popcount(combo))
-        combo = pysnoob(combo, x)
-
-    return combos
+    # iter_snoobs avoids the list, if it's not needed
+    return list(iter_snoobs(x, n_set_bits))
 
 
 def binary_with_padding(x, padding=8):
@@ -0,0 +1,152 @@
+"""Finding median triplet trees from within a Python program.
+
+Unlike median_triplet_trees, a MedianTripletSolver doesn't print anything,
+and keeps its weights arrays between solves, so it can be used to solve many
+small datasets one after another. The C code runs without the GIL, so
+several solvers in different threads solve their datasets at the same time;
+solve_many does this from asyncio, with a solver per worker thread.
+"""
+import asyncio
+import threading
+from array import array
+from collections import Counter
+from concurrent.futures import ThreadPoolExecutor
+
+import mtrip.triplet_omp as triplet_omp
+from mtrip.median_tree_reconstruction import (
+    canonical_topology,
+    get_all_trees,
+    get_biparts,
+    get_line_names,
+    get_stack,
+    get_subset_arrays,
+    get_weights_from_topologies,
+    simplify_nwk,
+)
+
+
+def get_quiet_bipart_counts(nwks):
+    """Like get_bipart_counts, but without printing, or starting other
+    processes. Returns the weights of the GT bipartitions and the reverse
+    dictionary."""
+    nwks_simplified = [simplify_nwk(s) for s in nwks]
+    line_counts = Counter(nwks_simplified)
+    names = set()
+    for i, nwk in enumerate(nwks_simplified):
+        names.update(get_line_names(i, nwk))
+    # Sorted, as in get_names
+    reverse_dictionary = sorted(names)
+    dictionary = {name: i for i, name in enumerate(reverse_dictionary)}
+
+    # Only decompose each distinct topology once
+    topologies = Counter()
+    for nwk, count in line_counts.items():
+        topologies[canonical_topology(get_biparts(nwk, dictionary))] += count
+
+    return get_weights_from_topologies(topologies), reverse_dictionary
+
+
+class MedianTripletSolver:
+    """Finds the median triplet trees of one dataset at a time, without
+    printing anything.
+
+    n_threads - #threads used by the C code in each solve
+
+    The weights array of each number of species is allocated once and reused
+    by later solves. A solver can be shared between threads, but solves one
+    dataset at a time; use one solver per thread to solve several datasets
+    at once.
+    """
+
+    def __init__(self, n_threads=1):
+        self.n_threads = n_threads
+        self._weights = {}
+        self._lock = threading.Lock()
+
+    def get_weights_buffer(self, n_species):
+        """Returns this solver's zeroed weights array for n_species."""
+        if n_species not in self._weights:
+            self._weights[n_species] = triplet_omp.zero_array(
+                2 * 3 ** (n_species - 1), "i"
+            )
+        else:
+            triplet_omp.zero_fill(self._weights[n_species])
+
+        return self._weights[n_species]
+
+    def solve(self, nwks, return_arrays=False):
+        """Finds the median triplet trees of the GTs nwks, a list of Newick
+        strings. Returns a dict with the median trees (Newick strings), the
+        species names (reverse_dictionary) and the best triplet score.
+
+        With return_arrays, the dict also has the weights array
+        (triplet_weights) and the best score of each subset (stack), as
+        read-only memoryviews of C ints, which e.g. numpy.asarray wraps
+        without copying. The weights are this solver's own array, which its
+        next solve of as many species overwrites, so copy them to keep them.
+        """
+        if len(nwks) == 0:
+            raise ValueError("Need at least one GT")
+        weights, reverse_dictionary = get_quiet_bipart_counts(nwks)
+        n_species = len(reverse_dictionary)
+        subsets, start_i, end_i, biparts_a, biparts_b = get_subset_arrays(
+            weights, verbose=False
+        )
+        bipart_weights = array(
+            "i", [weights[bipart] for bipart in zip(biparts_a, biparts_b)]
+        )
+
+        with self._lock:
+            triplet_weights = self.get_weights_buffer(n_species)
+            triplet_omp.compressed_weight_rep_nogil(
+                subsets,
+                start_i,
+                end_i,
+                biparts_a,
+                biparts_b,
+                bipart_weights,
+                n_species,
+                triplet_weights,
+                n_threads=self.n_threads,
+            )
+            stack, best_biparts = get_stack(
+                triplet_weights, n_species, verbose=False
+            )
+
+        universe = 2**n_species - 1
+        result = {
+            "trees": get_all_trees(universe, reverse_dictionary, best_biparts),
+            "reverse_dictionary": reverse_dictionary,
+            "score": stack[universe],
+        }
+        if return_arrays:
+            result["triplet_weights"] = memoryview(triplet_weights).toreadonly()
+            result["stack"] = memoryview(stack).toreadonly()
+
+        return result
+
+    async def solve_async(self, nwks, executor=None):
+        """Runs solve in an executor (by default the event loop's), so the
+        event loop isn't blocked."""
+        loop = asyncio.get_running_loop()
+
+        return await loop.run_in_executor(executor, self.solve, nwks)
+
+
+async def solve_many(datasets, n_workers=None, n_threads=1):
+    """Solves each list of Newick strings in datasets, n_workers at a time.
+    Each worker thread has its own MedianTripletSolver, so the datasets are
+    solved concurrently. Returns the results of MedianTripletSolver.solve, in
+    the order of datasets."""
+    local = threading.local()
+
+    def solve(nwks):
+        if not hasattr(local, "solver"):
+            local.solver = MedianTripletSolver(n_threads=n_threads)
+        return local.solver.solve(nwks)
+
+    loop = asyncio.get_running_loop()
+    with ThreadPoolExecutor(max_workers=n_workers) as executor:
+        return await asyncio.gather(
+            *(loop.run_in_executor(executor, solve, nwks) for nwks in datasets)
+        )
@@ -0,0 +1,192 @@
+"""Clade support from resampled sets of gene trees.
+
+Each replicate resamples the gene trees, either with replacement (bootstrap)
+or by keeping a random half of them (jackknife), and finds the median trees
+of the resampled set. A replicate only reweights the distinct bipartitions
+of the original gene trees, so the gene trees are parsed once. With the
+transform engine, the GT triplets of each replicate are counted and turned
+into its weights separately; with the scatter engine, the weights of a whole
+group of replicates are computed in a single pass of the C code, which
+shares the common triplet counts between the replicates.
+"""
+from collections import Counter
+from random import Random
+
+import mtrip.triplet_omp as triplet_omp
+from mtrip.bitsnbobs import popcount
+from mtrip.median_tree_reconstruction import (
+    get_biparts,
+    get_names,
+    get_stack,
+    get_subset_arrays,
+    simplify_nwk,
+)
+
+
+def get_clade_counts(x, best_biparts, memo=None):
+    """Returns a tuple (n_trees, counts), where n_trees is the number of
+    median trees of the subset x, and counts is a dict sending each clade to
+    the number of those trees containing it. The clades are given as bitsets,
+    and single species and x itself are left out."""
+    if memo is None:
+        memo = {}
+    if x in memo:
+        return memo[x]
+
+    n_trees = 0
+    counts = Counter()
+    if popcount(x) <= 2:
+        n_trees = 1
+    else:
+        for a, b in best_biparts[x]:
+            n_a, counts_a = get_clade_counts(a, best_biparts, memo)
+            n_b, counts_b = get_clade_counts(b, best_biparts, memo)
+            n_trees += n_a * n_b
+            for child in (a, b):
+                if popcount(child) > 1:
+                    counts[child] += n_a * n_b
+            for clade, count in counts_a.items():
+                counts[clade] += count * n_b
+            for clade, count in counts_b.items():
+                counts[clade] += count * n_a
+
+    memo[x] = (n_trees, counts)
+
+    return n_trees, counts
+
+
+def get_clade_frequencies(x, best_biparts):
+    """Returns a dict sending each clade to the fraction of the median trees
+    of x which contain it, without listing all the median trees."""
+    n_trees, counts = get_clade_counts(x, best_biparts)
+
+    return {clade: count / n_trees for clade, count in counts.items()}
+
+
+def resample_nwks(n_nwks, resample, rng):
+    """Returns a Counter sending the index of each chosen GT to the number of
+    times it was chosen."""
+    if resample == "bootstrap":
+        return Counter(rng.randrange(n_nwks) for _ in range(n_nwks))
+    elif resample == "jackknife":
+        return Counter(rng.sample(range(n_nwks), (n_nwks + 1) // 2))
+    else:
+        raise ValueError("Unknown resampling method {}".format(resample))
+
+
+def replicate_clade_support(
+    nwks,
+    n_replicates,
+    resample="bootstrap",
+    group_size=8,
+    seed=0,
+    n_threads=1,
+):
+    """Finds the support of each clade across resampled replicates of the GTs.
+    A replicate with several median trees splits its vote evenly between
+    them. Returns a tuple (support, reverse_dictionary), where support is a
+    dict sending each clade (a bitset) to the fraction of replicates
+    supporting it.
+
+    Input:
+    nwks - list of Newick strings without semicolons
+    n_replicates - number of resampled replicates
+    resample - "bootstrap" or "jackknife"
+    group_size - number of replicates whose weights are computed (and kept
+                 in memory) at the same time by the scatter engine
+    seed - seed for the random number generator used for resampling
+    n_threads - #threads to use
+    """
+    print("* Parsing Newick strings and recording bipartitions in GTs.")
+    nwks_simplified = [simplify_nwk(s) for s in nwks]
+    print("* Finding all unique names.")
+    names, dictionary, reverse_dictionary = get_names(
+        nwks_simplified, n_threads=n_threads
+    )
+    n_species = len(reverse_dictionary)
+    universe = 2**n_species - 1
+    weights_size = 2 * 3 ** (n_species - 1)
+
+    # Decompose each distinct string once, and lay out all the distinct
+    # bipartitions for the C code
+    print("* Finding the distinct bipartitions.")
+    line_biparts = {}
+    for s in nwks_simplified:
+        if s not in line_biparts:
+            line_biparts[s] = get_biparts(s, dictionary)
+    all_biparts = set()
+    for biparts in line_biparts.values():
+        all_biparts.update(biparts)
+    subsets, start_i, end_i, biparts_a, biparts_b = get_subset_arrays(
+        all_biparts
+    )
+    position = {bipart: i for i, bipart in enumerate(zip(biparts_a, biparts_b))}
+    line_positions = {
+        s: [position[bipart] for bipart in biparts]
+        for s, biparts in line_biparts.items()
+    }
+
+    rng = Random(seed)
+    support = Counter()
+    for group_start in range(0, n_replicates, group_size):
+        group_end = min(group_start + group_size, n_replicates)
+        print(
+            "* Finding the weights of replicates {} to {} of {}.".format(
+                group_start + 1, group_end, n_replicates
+            )
+        )
+        replicate_weights = []
+        for _ in range(group_start, group_end):
+            row = [0] * len(biparts_a)
+            for i, multiplicity in resample_nwks(len(nwks), resample, rng).items():
+                for j in line_positions[nwks_simplified[i]]:
+                    row[j] += multiplicity
+            replicate_weights.append(row)
+
+        if triplet_omp.get_engine() == "scatter":
+            weights = memoryview(
+                triplet_omp.py_compressed_weight_rep_batch(
+                    subsets,
+                    start_i,
+                    end_i,
+                    biparts_a,
+                    biparts_b,
+                    replicate_weights,
+                    n_species,
+                    n_threads=n_threads,
+                )
+            )
+            group_weights = (
+                weights[r * weights_size : (r + 1) * weights_size]
+                for r in range(group_end - group_start)
+            )
+        else:
+            # One at a time, so only one replicate's weights are kept
+            group_weights = (
+                triplet_omp.py_transform_triplet_counts(
+                    triplet_omp.py_count_triplets(
+                        subsets,
+                        start_i,
+                        end_i,
+                        biparts_a,
+                        biparts_b,
+                        row,
+                        n_species,
+                        n_threads=n_threads,
+                    ),
+                    n_species,
+                    n_threads=n_threads,
+                )
+                for row in replicate_weights
+            )
+
+        for triplet_weights in group_weights:
+            stack, best_biparts = get_stack(triplet_weights, n_species)
+            for clade, frequency in get_clade_frequencies(
+                universe, best_biparts
+            ).items():
+                support[clade] += frequency
+
+    support = {clade: s / n_replicates for clade, s in support.items()}
+
+    return support, reverse_dictionary
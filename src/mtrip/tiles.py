@@ -0,0 +1,137 @@
+"""Computing weights arrays which don't fit in memory.
+
+The compressed base-3 representation of a bipartition (x,y) has the digit 1
+for the species in x, 2 for those in y, and 0 for the rest, so fixing the
+digits of the T highest species picks out a contiguous tile of 3^(n-T)
+weights. The tiles are computed one at a time, each in a single pass over
+the subsets which only keeps that tile's updates in memory, and written to a
+file on disk. The finished file is memory-mapped, so get_stack reads the
+weights from it, and the operating system keeps as much of it in memory as
+there is room for.
+"""
+import mmap
+import tempfile
+
+import mtrip.triplet_omp as triplet_omp
+
+
+def get_n_tile_species(n_species, max_bytes, itemsize=4):
+    """Returns the number of highest species whose digits are fixed in each
+    tile, so that a tile takes up at most max_bytes. Returns 0 if the whole
+    weights array fits."""
+    if 2 * 3 ** (n_species - 1) * itemsize <= max_bytes:
+        return 0
+    n_fixed = 1
+    while (
+        n_fixed < n_species
+        and 3 ** (n_species - n_fixed) * itemsize > max_bytes
+    ):
+        n_fixed += 1
+
+    return n_fixed
+
+
+def get_tiles(n_species, n_fixed):
+    """Yields a tuple (high_mask, tile_x, tile_y, lo) for each tile which can
+    hold nonzero weights, where high_mask has the n_fixed highest species,
+    tile_x and tile_y are the species of high_mask with digits 1 and 2, and
+    lo is the position of the tile's first weight.
+
+    In the compressed representation, the highest species of x+y is always
+    in x, so the tiles whose highest nonzero digit is 2 are left out."""
+    first = n_species - n_fixed
+    high_mask = ((1 << n_fixed) - 1) << first
+    tile_size = 3**first
+    for prefix in range(2 * 3 ** (n_fixed - 1)):
+        tile_x = 0
+        tile_y = 0
+        highest_digit = 0
+        p = prefix
+        for j in range(n_fixed):
+            digit = p % 3
+            p //= 3
+            if digit == 1:
+                tile_x |= 1 << (first + j)
+            elif digit == 2:
+                tile_y |= 1 << (first + j)
+            if digit != 0:
+                highest_digit = digit
+        if highest_digit != 2:
+            yield high_mask, tile_x, tile_y, prefix * tile_size
+
+
+class TiledWeights:
+    """Computes the weights array tile by tile into a memory-mapped file.
+
+    max_bytes - memory to use for the tile being computed
+    tile_dir - directory for the weights file, which is removed once it's no
+               longer used. Defaults to the system's temporary directory
+    """
+
+    def __init__(self, max_bytes, tile_dir=None):
+        self.max_bytes = max_bytes
+        self.tile_dir = tile_dir
+
+    def compressed_weight_rep(self, subsets, start_i, end_i, biparts_a,
+                              biparts_b, bipart_weights, n_species,
+                              n_threads=1):
+        """Tiled version of triplet_omp.py_compressed_weight_rep. Returns an
+        int memoryview of the memory-mapped weights, or an array if the whole
+        weights array fits in max_bytes."""
+        n_fixed = get_n_tile_species(n_species, self.max_bytes)
+        if n_fixed == 0:
+            print("    The weights array fits in memory, so not tiling.")
+            return triplet_omp.py_compressed_weight_rep(
+                subsets,
+                start_i,
+                end_i,
+                biparts_a,
+                biparts_b,
+                bipart_weights,
+                n_species,
+                n_threads=n_threads,
+            )
+
+        size = 2 * 3 ** (n_species - 1)
+        tile_size = 3 ** (n_species - n_fixed)
+        tiles = list(get_tiles(n_species, n_fixed))
+        f = tempfile.TemporaryFile(dir=self.tile_dir)
+        itemsize = triplet_omp.zero_array(0, "i").itemsize
+        # The file starts out as zeros, so only the nonzero tiles are written
+        f.truncate(size * itemsize)
+        print(
+            "    Computing {} tiles of {:.1f} MB each, stored in a {:.1f} MB "
+            "file.".format(
+                len(tiles),
+                tile_size * itemsize / 1024**2,
+                size * itemsize / 1024**2,
+            )
+        )
+
+        for i, (high_mask, tile_x, tile_y, lo) in enumerate(tiles):
+            tile = triplet_omp.py_compressed_weight_rep_tile(
+                subsets,
+                start_i,
+                end_i,
+                biparts_a,
+                biparts_b,
+                bipart_weights,
+                n_species,
+                high_mask,
+                tile_x,
+                tile_y,
+                lo,
+                tile_size,
+                n_threads=n_threads,
+            )
+            f.seek(lo * itemsize)
+            # Written straight from the array's buffer, without a copy
+            f.write(tile)
+            print("    Tile {}/{} done.".format(i + 1, len(tiles)))
+        f.flush()
+
+        # The mapping keeps the (already unlinked) file alive
+        weights = mmap.mmap(f.fileno(), 0, access=mmap.ACCESS_READ)
+        f.close()
+
+        return memoryview(weights).cast("i")
@@ -2,8 +2,11 @@
 # cython: language_level=3
 
 from cpython cimport array
+from libc.string cimport memset
 
 import array
+import sys
+import threading
 
 # Define HAVE_CYSIGNALS here
 DEF HAVE_CYSIGNALS = 1
@@ -25,7 +28,7 @@ cdef extern from "weights_omp.h":
 
 
 cdef extern from "weights_omp.h" nogil:
-    void fill_compressed_weight_representation(
+    int fill_compressed_weight_representation(
         int *subsets,
         int *start_i,
         int *end_i,
@@ -37,6 +40,171 @@ cdef extern from "weights_omp.h" nogil:
         int *weights,
         int *two2three,
         int n_threads,
+        long *progress,
+        double *thread_times,
+        int verbose,
+    )
+    int fill_compressed_weight_representation_transform(
+        int *subsets,
+        int *start_i,
+        int *end_i,
+        int *left_sets,
+        int *right_sets,
+        int *bipart_weights,
+        int n_subsets,
+        int n_species,
+        int *weights,
+        int *two2three,
+        int n_threads,
+        long *progress,
+        double *thread_times,
+        int verbose,
+    )
+    long transform_block_count(int n_species)
+    long transform_block_size(int n_species)
+    int count_triplets(
+        int *subsets,
+        int *start_i,
+        int *end_i,
+        int *left_sets,
+        int *right_sets,
+        int *bipart_weights,
+        int n_subsets,
+        int n_species,
+        unsigned int *triplets,
+        int n_threads,
+        long *progress,
+        double *thread_times,
+        int verbose,
+    )
+    int transform_triplet_counts(
+        const unsigned int *triplets,
+        int n_species,
+        int *weights,
+        long first_block,
+        long n_blocks,
+        int *two2three,
+        int n_threads,
+    )
+    int fill_compressed_weight_representation_batch(
+        int *subsets,
+        int *start_i,
+        int *end_i,
+        int *left_sets,
+        int *right_sets,
+        int *bipart_weights,
+        int n_subsets,
+        int n_biparts,
+        int n_replicates,
+        int n_species,
+        int *weights,
+        int *two2three,
+        int n_threads,
+    )
+    void fill_compressed_weight_representation_tile(
+        int *subsets,
+        int *start_i,
+        int *end_i,
+        int *left_sets,
+        int *right_sets,
+        int *bipart_weights,
+        int n_subsets,
+        int n_species,
+        int high_mask,
+        int tile_x,
+        int tile_y,
+        long lo,
+        long tile_size,
+        int *weights,
+        int *two2three,
+        int n_threads,
+    )
+    int add_remapped_weights(
+        const int *old_weights,
+        int n_old,
+        const int *positions,
+        int *weights,
+        int n_new,
+        int n_threads,
+    )
+
+
+cdef extern from "weights_simd.h":
+    int N_SIMD_LEVELS
+    const char *simd_level_name(int level)
+    int simd_level_supported(int level)
+    int get_simd_level()
+    int set_simd_level(int level)
+
+
+cdef extern from "triplet_search.h" nogil:
+    long triplet_table_size(int n_species)
+    int fill_triplet_table(
+        const int *offsets,
+        const int *n_left,
+        const int *species,
+        const int *bipart_weights,
+        int n_biparts,
+        int n_species,
+        int *table,
+        int n_threads,
+    )
+    int fill_triplet_frequencies(
+        const int *table,
+        int n_species,
+        int *counts,
+        int n_threads,
+    )
+    int fill_table_from_frequencies(
+        const int *counts,
+        int n_species,
+        int *table,
+        int n_threads,
+    )
+    int triplet_tree_score(
+        const int *table,
+        int n_species,
+        const int *left,
+        const int *right,
+        int root,
+        long *score,
+    )
+    int add_leaves(
+        const int *table,
+        int n_species,
+        int *left,
+        int *right,
+        int *parent,
+        int *root,
+        const int *leaves,
+        int n_leaves,
+    )
+    int improve_tree(
+        const int *table,
+        int n_species,
+        int *left,
+        int *right,
+        int *parent,
+        int *root,
+        unsigned int seed,
+        double time_limit,
+        long *n_moves,
+    )
+
+
+cdef extern from "suboptimal.h" nogil:
+    long sample_suboptimal(
+        const int *weights,
+        const int *stack,
+        int n_species,
+        long min_score,
+        int n_trees,
+        int n_burnin,
+        unsigned long long seed,
+        long *scores,
+        unsigned int *splits,
+        long *n_candidates,
+        int n_threads,
     )
 
 
@@ -58,6 +226,11 @@ def py_combinations_2(n):
     return combinations_2(n)
 
 
+def py_combinations_3(n):
+    """Return n choose 3, with Python ints, which don't overflow."""
+    return max(n * (n - 1) * (n - 2) // 6, 0)
+
+
 def create_two2three(n):
     """Create an array whose ith element is the number i, with 3^n instead
     of 2^n in the binary expansion of."""
@@ -71,55 +244,861 @@ def create_two2three(n):
     return ar
 
 
+# Lookup tables are reused between calls, e.g. when computing the weights
+# of many windows of the same gene trees.
+_two2three_cache = {}
+
+
+def get_two2three(n):
+    """Like create_two2three, but reuses the table made by an earlier call
+    with the same n. The returned array must not be modified."""
+    if n not in _two2three_cache:
+        _two2three_cache[n] = create_two2three(n)
+
+    return _two2three_cache[n]
+
+
+ctypedef int (*fill_function)(int *, int *, int *, int *, int *, int *, int,
+                              int, int *, int *, int, long *, double *,
+                              int) nogil
+
+
+# Ways of computing the weights, which give the same results: "scatter" adds
+# the contribution of each subset to every bipartition it affects, and
+# "transform" counts the GT triplets first, then sums them over the
+# weights array one species at a time, which is usually much faster.
+ENGINES = ("scatter", "transform")
+_engine = "transform"
+
+
+def get_engine():
+    """Returns the name of the engine used when none is given."""
+    return _engine
+
+
+def set_engine(name):
+    """Uses the named engine (one of ENGINES) when none is given, from now
+    on. Raises ValueError if there is no such engine."""
+    global _engine
+    _engine = _check_engine(name)
+
+
+def _check_engine(name):
+    if name is None:
+        return _engine
+    if name not in ENGINES:
+        raise ValueError("No engine {}; choose from {}".format(
+            name, ", ".join(ENGINES)))
+
+    return name
+
+
+cdef fill_function _get_fill_function(name):
+    if _check_engine(name) == "transform":
+        return fill_compressed_weight_representation_transform
+
+    return fill_compressed_weight_representation
+
+
+def _report_progress(progress, n_subsets, done):
+    """Prints the number of subsets done, read from the counter the C code
+    updates, to stderr until the event done is set."""
+    while not done.wait(0.2):
+        n_done = progress[0]
+        sys.stderr.write("\r{}/{} complete ({:.2f}%)".format(
+            n_done, n_subsets, (100.0 * n_done) / n_subsets))
+        sys.stderr.flush()
+    sys.stderr.write("\r")
+    sys.stderr.flush()
+
+
+def as_int_buffer(x):
+    """Returns x if it's a contiguous buffer of C ints, e.g. an array('i'),
+    a NumPy intc array, or a memoryview (of an mmap, say) cast to 'i', so
+    that the C code uses it without copying. Otherwise returns a copy of it
+    as an array('i')."""
+    cdef const int[::1] view
+    try:
+        view = x
+    except (TypeError, ValueError, BufferError):
+        return array.array('i', x)
+
+    return x
+
+
 def py_compressed_weight_rep(subsets, start_i, end_i, biparts_a, biparts_b,
-                             bipart_weights, n_species, n_threads=1):
-    """Computes the compressed representation of the bipartition weights."""
-    # Copy the lists to arrays, to make them usable in C code
-    ar_subsets = array.array('i', subsets)
-    ar_start_i = array.array('i', start_i)
-    ar_end_i = array.array('i', end_i)
-    ar_biparts_a = array.array('i', biparts_a)
-    ar_biparts_b = array.array('i', biparts_b)
-    ar_bipart_weights = array.array('i', bipart_weights)
-    n_subsets = len(subsets)
+                             bipart_weights, n_species, n_threads=1,
+                             weights=None, verbose=True, kernel_stats=None,
+                             engine=None):
+    """Computes the compressed representation of the bipartition weights.
 
-    two2three = create_two2three(n_species)
+    If weights is given, it must be a writable int array of length
+    2*3**(n_species-1), and the contributions are added to it in place.
+    Set verbose=False to skip printing the number of threads and the
+    progress. If kernel_stats is a dict, the number of threads used and the
+    time spent by each one are stored in it, under n_threads and
+    thread_times. engine is one of ENGINES, by default get_engine(). Raises
+    MemoryError if the C code's scratch arrays can't be allocated.
+
+    The GIL is released while the C code runs."""
+    # Only copied to arrays if they aren't int buffers already
+    ar_subsets = as_int_buffer(subsets)
+    ar_start_i = as_int_buffer(start_i)
+    ar_end_i = as_int_buffer(end_i)
+    ar_biparts_a = as_int_buffer(biparts_a)
+    ar_biparts_b = as_int_buffer(biparts_b)
+    ar_bipart_weights = as_int_buffer(bipart_weights)
+    n_subsets = len(ar_subsets)
+    cdef fill_function fill = _get_fill_function(engine)
+
+    two2three = get_two2three(n_species)
     cdef int[::1] two2three_memview = two2three
 
-    weights = zero_array(2*3**(n_species-1), 'i')
+    if weights is None:
+        weights = zero_array(2*3**(n_species-1), 'i')
     cdef int[::1] weights_memview = weights
+    if weights_memview.shape[0] != 2*3**(n_species-1):
+        raise ValueError("Weights array has the wrong length for "
+                         "{} species.".format(n_species))
+
+    # Nothing to add, and the C code expects non-empty arrays
+    if n_subsets == 0:
+        return weights
 
-    cdef int[::1] subsets_memview = ar_subsets
-    cdef int[::1] start_memview = ar_start_i
-    cdef int[::1] end_memview = ar_end_i
-    cdef int[::1] biparts_a_memview = ar_biparts_a
-    cdef int[::1] biparts_b_memview = ar_biparts_b
-    cdef int[::1] bipart_weights_memview = ar_bipart_weights
+    cdef const int[::1] subsets_memview = ar_subsets
+    cdef const int[::1] start_memview = ar_start_i
+    cdef const int[::1] end_memview = ar_end_i
+    cdef const int[::1] biparts_a_memview = ar_biparts_a
+    cdef const int[::1] biparts_b_memview = ar_biparts_b
+    cdef const int[::1] bipart_weights_memview = ar_bipart_weights
+
+    # Shared with the C code, which adds the number of subsets done to it
+    progress = zero_array(1, 'l')
+    thread_times = zero_array(n_threads, 'd')
+    cdef long[::1] progress_memview = progress
+    cdef double[::1] thread_times_memview = thread_times
+    cdef int c_n_subsets = n_subsets
+    cdef int c_n_species = n_species
+    cdef int c_n_threads = n_threads
+    cdef int c_verbose = verbose
+    cdef int n_threads_used
 
     threads_str = 'thread'
     if n_threads > 1:
         threads_str += 's'
 
-    print("Starting parallel comptuation with a max of "
-          "{} {}.".format(n_threads, threads_str))
-    sig_on()
-    fill_compressed_weight_representation(
-        &subsets_memview[0],
-        &start_memview[0],
-        &end_memview[0],
-        &biparts_a_memview[0],
-        &biparts_b_memview[0],
-        &bipart_weights_memview[0],
-        n_subsets,
-        n_species,
-        &weights_memview[0],
-        &two2three_memview[0],
-        n_threads,
-    )
-    sig_off()
+    reporter = None
+    if verbose:
+        print("Starting parallel comptuation with a max of "
+              "{} {}.".format(n_threads, threads_str))
+        done = threading.Event()
+        reporter = threading.Thread(
+            target=_report_progress, args=(progress, n_subsets, done),
+            daemon=True)
+        reporter.start()
+    try:
+        with nogil:
+            sig_on()
+            n_threads_used = fill(
+                <int *>&subsets_memview[0],
+                <int *>&start_memview[0],
+                <int *>&end_memview[0],
+                <int *>&biparts_a_memview[0],
+                <int *>&biparts_b_memview[0],
+                <int *>&bipart_weights_memview[0],
+                c_n_subsets,
+                c_n_species,
+                &weights_memview[0],
+                &two2three_memview[0],
+                c_n_threads,
+                &progress_memview[0],
+                &thread_times_memview[0],
+                c_verbose,
+            )
+            sig_off()
+    finally:
+        if reporter is not None:
+            done.set()
+            reporter.join()
+    if n_threads_used < 0:
+        raise MemoryError()
+    if verbose:
+        print("{}/{} complete ({:.2f}%)".format(n_subsets, n_subsets, 100.0))
+
+    if kernel_stats is not None:
+        kernel_stats["n_threads"] = n_threads_used
+        kernel_stats["thread_times"] = list(thread_times[:n_threads_used])
 
     return weights
 
 
+def compressed_weight_rep_nogil(const int[::1] subsets,
+                                const int[::1] start_i,
+                                const int[::1] end_i,
+                                const int[::1] biparts_a,
+                                const int[::1] biparts_b,
+                                const int[::1] bipart_weights,
+                                int n_species,
+                                int[::1] weights,
+                                int n_threads=1,
+                                engine=None):
+    """Quiet version of py_compressed_weight_rep, for calling from several
+    Python threads at once. The inputs are int buffers (e.g. array('i')),
+    and the contributions are added to the weights buffer, which must have
+    length 2*3**(n_species-1). engine is one of ENGINES, by default
+    get_engine(). Returns the number of threads used. Raises MemoryError if
+    the C code's scratch arrays can't be allocated.
+
+    The GIL is released while the C code runs. Unlike
+    py_compressed_weight_rep, this doesn't catch interrupts with cysignals,
+    whose handlers can only be used by one thread at a time."""
+    # With Python ints, which don't overflow
+    size = 2*3**(<object>n_species-1)
+    if weights.shape[0] != size:
+        raise ValueError("Weights array has the wrong length for "
+                         "{} species.".format(n_species))
+    cdef int n_subsets = subsets.shape[0]
+    if n_subsets == 0:
+        return 0
+    if start_i.shape[0] != n_subsets or end_i.shape[0] != n_subsets:
+        raise ValueError("Need a start and end index for each subset.")
+    if (biparts_b.shape[0] != biparts_a.shape[0]
+            or bipart_weights.shape[0] != biparts_a.shape[0]):
+        raise ValueError("Need a weight for each bipartition.")
+
+    cdef fill_function fill = _get_fill_function(engine)
+    two2three = get_two2three(n_species)
+    cdef int[::1] two2three_memview = two2three
+    cdef int n_threads_used
+
+    with nogil:
+        # The C code doesn't write to its inputs
+        n_threads_used = fill(
+            <int *>&subsets[0],
+            <int *>&start_i[0],
+            <int *>&end_i[0],
+            <int *>&biparts_a[0],
+            <int *>&biparts_b[0],
+            <int *>&bipart_weights[0],
+            n_subsets,
+            n_species,
+            &weights[0],
+            &two2three_memview[0],
+            n_threads,
+            NULL,
+            NULL,
+            0,
+        )
+    if n_threads_used < 0:
+        raise MemoryError()
+
+    return n_threads_used
+
+
+def py_count_triplets(subsets, start_i, end_i, biparts_a, biparts_b,
+                      bipart_weights, n_species, n_threads=1, triplets=None,
+                      kernel_stats=None):
+    """Counts the GT triplets of the bipartitions of the given subsets, the
+    first phase of the transform engine. Returns an array('I') of length
+    n_species**3, where the count of ij|k (with i < j) is at
+    (i*n_species + j)*n_species + k. If triplets is given, the counts are
+    added to it in place instead. Since the weights are linear in the
+    counts, the counts of separate groups of subsets can be added up before
+    py_transform_triplet_counts turns them into weights. kernel_stats is as
+    in py_compressed_weight_rep.
+
+    The GIL is released while the C code runs."""
+    ar_subsets = as_int_buffer(subsets)
+    ar_start_i = as_int_buffer(start_i)
+    ar_end_i = as_int_buffer(end_i)
+    ar_biparts_a = as_int_buffer(biparts_a)
+    ar_biparts_b = as_int_buffer(biparts_b)
+    ar_bipart_weights = as_int_buffer(bipart_weights)
+    n_subsets = len(ar_subsets)
+
+    if triplets is None:
+        triplets = zero_array(n_species**3, 'I')
+    cdef unsigned int[::1] triplets_memview = triplets
+    if triplets_memview.shape[0] != n_species**3:
+        raise ValueError("Triplet counts array has the wrong length for "
+                         "{} species.".format(n_species))
+    if n_subsets == 0:
+        return triplets
+
+    cdef const int[::1] subsets_memview = ar_subsets
+    cdef const int[::1] start_memview = ar_start_i
+    cdef const int[::1] end_memview = ar_end_i
+    cdef const int[::1] biparts_a_memview = ar_biparts_a
+    cdef const int[::1] biparts_b_memview = ar_biparts_b
+    cdef const int[::1] bipart_weights_memview = ar_bipart_weights
+    thread_times = zero_array(n_threads, 'd')
+    cdef double[::1] thread_times_memview = thread_times
+    cdef int c_n_subsets = n_subsets
+    cdef int c_n_species = n_species
+    cdef int c_n_threads = n_threads
+    cdef int n_threads_used
+
+    with nogil:
+        sig_on()
+        n_threads_used = count_triplets(
+            <int *>&subsets_memview[0],
+            <int *>&start_memview[0],
+            <int *>&end_memview[0],
+            <int *>&biparts_a_memview[0],
+            <int *>&biparts_b_memview[0],
+            <int *>&bipart_weights_memview[0],
+            c_n_subsets,
+            c_n_species,
+            &triplets_memview[0],
+            c_n_threads,
+            NULL,
+            &thread_times_memview[0],
+            0,
+        )
+        sig_off()
+    if n_threads_used < 0:
+        raise MemoryError()
+
+    if kernel_stats is not None:
+        kernel_stats["n_threads"] = n_threads_used
+        kernel_stats["thread_times"] = list(thread_times[:n_threads_used])
+
+    return triplets
+
+
+def py_transform_block_count(n_species):
+    """Returns the number of blocks py_transform_triplet_counts splits the
+    weights array of n_species species into."""
+    return transform_block_count(n_species)
+
+
+def py_transform_triplet_counts(triplets, n_species, n_threads=1,
+                                weights=None, first_block=0, n_blocks=None):
+    """Adds the weights of the triplet counts made by py_count_triplets to
+    weights (by default a new array of zeros), the second phase of the
+    transform engine, and returns it. Only the blocks first_block to
+    first_block+n_blocks-1 of the py_transform_block_count(n_species) blocks
+    are computed, by default all of them, and the other entries of weights
+    are left alone.
+
+    The GIL is released while the C code runs."""
+    cdef const unsigned int[::1] triplets_memview = triplets
+    if triplets_memview.shape[0] != n_species**3:
+        raise ValueError("Triplet counts array has the wrong length for "
+                         "{} species.".format(n_species))
+    if weights is None:
+        weights = zero_array(2*3**(n_species-1), 'i')
+    cdef int[::1] weights_memview = weights
+    if weights_memview.shape[0] != 2*3**(n_species-1):
+        raise ValueError("Weights array has the wrong length for "
+                         "{} species.".format(n_species))
+    n_all_blocks = transform_block_count(n_species)
+    if n_blocks is None:
+        n_blocks = n_all_blocks - first_block
+    if first_block < 0 or n_blocks < 0 or first_block + n_blocks > n_all_blocks:
+        raise ValueError("Blocks {} to {} are out of range.".format(
+            first_block, first_block + n_blocks - 1))
+
+    two2three = get_two2three(n_species)
+    cdef int[::1] two2three_memview = two2three
+    cdef int c_n_species = n_species
+    cdef long c_first_block = first_block
+    cdef long c_n_blocks = n_blocks
+    cdef int c_n_threads = n_threads
+    cdef int status
+
+    with nogil:
+        sig_on()
+        status = transform_triplet_counts(
+            &triplets_memview[0],
+            c_n_species,
+            &weights_memview[0],
+            c_first_block,
+            c_n_blocks,
+            &two2three_memview[0],
+            c_n_threads,
+        )
+        sig_off()
+    if status < 0:
+        raise MemoryError()
+
+    return weights
+
+
+def zero_fill(int[::1] ar):
+    """Sets every entry of the int buffer ar to 0, without the GIL."""
+    if ar.shape[0] > 0:
+        with nogil:
+            memset(&ar[0], 0, ar.shape[0] * sizeof(int))
+
+
+def py_add_remapped_weights(const int[::1] old_weights, positions,
+                           int[::1] weights, int n_threads=1):
+    """Adds the weights array old_weights to the weights array weights, of
+    at least as many species, where the old species s is the new species
+    positions[s]. Each bipartition gets the old weight of its restriction to
+    the old species, which is 0 if a side has none of them. This is the
+    weight of the GT triplets of the old weights, since they only have old
+    species. The GIL is released while the weights are added."""
+    n_species = len(positions)
+    size = 2
+    new_species = 1
+    while size < weights.shape[0]:
+        new_species += 1
+        size *= 3
+    if weights.shape[0] != size:
+        raise ValueError("Weights array has the wrong length.")
+    if n_species < 1 or old_weights.shape[0] != 2 * 3 ** (n_species - 1):
+        raise ValueError("Old weights array has the wrong length for "
+                         "{} species.".format(n_species))
+    if len(set(positions)) != n_species or not all(
+        0 <= p < new_species for p in positions
+    ):
+        raise ValueError("Positions must be distinct new species.")
+
+    cdef int n_old = n_species
+    cdef int n_new = new_species
+    cdef int[::1] positions_memview = array.array('i', positions)
+    cdef int status
+    with nogil:
+        status = add_remapped_weights(
+            &old_weights[0], n_old, &positions_memview[0], &weights[0],
+            n_new, n_threads
+        )
+    if status < 0:
+        raise ValueError("Too many species to remap.")
+
+
+def py_compressed_weight_rep_batch(subsets, start_i, end_i, biparts_a,
+                                   biparts_b, replicate_weights, n_species,
+                                   n_threads=1):
+    """Computes the compressed representation of the bipartition weights of
+    several replicates at once. The replicates share the bipartitions, and
+    replicate_weights[r] holds the weights of the bipartitions in replicate r.
+
+    Returns a single array, with the weights of replicate r in positions
+    r*2*3**(n_species-1) to (r+1)*2*3**(n_species-1). Raises MemoryError if
+    the C code's scratch arrays can't be allocated."""
+    n_subsets = len(subsets)
+    n_biparts = len(biparts_a)
+    n_replicates = len(replicate_weights)
+    weights_size = 2*3**(n_species-1)
+
+    weights = zero_array(n_replicates*weights_size, 'i')
+    if n_subsets == 0 or n_replicates == 0:
+        return weights
+
+    ar_subsets = as_int_buffer(subsets)
+    ar_start_i = as_int_buffer(start_i)
+    ar_end_i = as_int_buffer(end_i)
+    ar_biparts_a = as_int_buffer(biparts_a)
+    ar_biparts_b = as_int_buffer(biparts_b)
+    # Flatten the replicates' weights, one row after another
+    ar_bipart_weights = array.array('i')
+    for row in replicate_weights:
+        if len(row) != n_biparts:
+            raise ValueError("Each replicate needs one weight per "
+                             "bipartition.")
+        ar_bipart_weights.extend(row)
+
+    two2three = get_two2three(n_species)
+    cdef int[::1] two2three_memview = two2three
+    cdef int[::1] weights_memview = weights
+    cdef const int[::1] subsets_memview = ar_subsets
+    cdef const int[::1] start_memview = ar_start_i
+    cdef const int[::1] end_memview = ar_end_i
+    cdef const int[::1] biparts_a_memview = ar_biparts_a
+    cdef const int[::1] biparts_b_memview = ar_biparts_b
+    cdef const int[::1] bipart_weights_memview = ar_bipart_weights
+    cdef int c_n_subsets = n_subsets
+    cdef int c_n_biparts = n_biparts
+    cdef int c_n_replicates = n_replicates
+    cdef int c_n_species = n_species
+    cdef int c_n_threads = n_threads
+    cdef int status
+
+    with nogil:
+        sig_on()
+        status = fill_compressed_weight_representation_batch(
+            <int *>&subsets_memview[0],
+            <int *>&start_memview[0],
+            <int *>&end_memview[0],
+            <int *>&biparts_a_memview[0],
+            <int *>&biparts_b_memview[0],
+            <int *>&bipart_weights_memview[0],
+            c_n_subsets,
+            c_n_biparts,
+            c_n_replicates,
+            c_n_species,
+            &weights_memview[0],
+            &two2three_memview[0],
+            c_n_threads,
+        )
+        sig_off()
+    if status < 0:
+        raise MemoryError()
+
+    return weights
+
+
+def py_compressed_weight_rep_tile(subsets, start_i, end_i, biparts_a,
+                                  biparts_b, bipart_weights, n_species,
+                                  high_mask, tile_x, tile_y, lo, tile_size,
+                                  n_threads=1):
+    """Computes the part of the compressed representation of the bipartition
+    weights in positions lo to lo+tile_size, i.e. the weights of the
+    bipartitions (x,y) with x&high_mask == tile_x and y&high_mask == tile_y.
+    Returns an array of length tile_size."""
+    weights = zero_array(tile_size, 'i')
+    n_subsets = len(subsets)
+    if n_subsets == 0:
+        return weights
+
+    ar_subsets = as_int_buffer(subsets)
+    ar_start_i = as_int_buffer(start_i)
+    ar_end_i = as_int_buffer(end_i)
+    ar_biparts_a = as_int_buffer(biparts_a)
+    ar_biparts_b = as_int_buffer(biparts_b)
+    ar_bipart_weights = as_int_buffer(bipart_weights)
+
+    two2three = get_two2three(n_species)
+    cdef int[::1] two2three_memview = two2three
+    cdef int[::1] weights_memview = weights
+    cdef const int[::1] subsets_memview = ar_subsets
+    cdef const int[::1] start_memview = ar_start_i
+    cdef const int[::1] end_memview = ar_end_i
+    cdef const int[::1] biparts_a_memview = ar_biparts_a
+    cdef const int[::1] biparts_b_memview = ar_biparts_b
+    cdef const int[::1] bipart_weights_memview = ar_bipart_weights
+    cdef int c_n_subsets = n_subsets
+    cdef int c_n_species = n_species
+    cdef int c_high_mask = high_mask
+    cdef int c_tile_x = tile_x
+    cdef int c_tile_y = tile_y
+    cdef long c_lo = lo
+    cdef long c_tile_size = tile_size
+    cdef int c_n_threads = n_threads
+
+    with nogil:
+        sig_on()
+        fill_compressed_weight_representation_tile(
+            <int *>&subsets_memview[0],
+            <int *>&start_memview[0],
+            <int *>&end_memview[0],
+            <int *>&biparts_a_memview[0],
+            <int *>&biparts_b_memview[0],
+            <int *>&bipart_weights_memview[0],
+            c_n_subsets,
+            c_n_species,
+            c_high_mask,
+            c_tile_x,
+            c_tile_y,
+            c_lo,
+            c_tile_size,
+            &weights_memview[0],
+            &two2three_memview[0],
+            c_n_threads,
+        )
+        sig_off()
+
+    return weights
+
+
+def simd_levels():
+    """Returns the names of the instruction sets this CPU can use to find
+    the common triplets of a block of bipartitions, slowest first."""
+    return [simd_level_name(level).decode() for level in range(N_SIMD_LEVELS)
+            if simd_level_supported(level)]
+
+
+def get_simd():
+    """Returns the name of the instruction set in use."""
+    return simd_level_name(get_simd_level()).decode()
+
+
+def set_simd(name):
+    """Uses the named instruction set (one of simd_levels()) from now on.
+    The results are the same with all of them. Raises ValueError if this CPU
+    can't use it."""
+    for level in range(N_SIMD_LEVELS):
+        if simd_level_name(level).decode() == name:
+            if set_simd_level(level):
+                return
+            break
+    raise ValueError("Instruction set {} isn't available; choose from "
+                     "{}".format(name, ", ".join(simd_levels())))
+
+
+def py_triplet_table(const int[::1] offsets,
+                     const int[::1] n_left,
+                     const int[::1] species,
+                     const int[::1] bipart_weights,
+                     int n_species,
+                     int n_threads=1):
+    """Returns the triplet table of the GT bipartitions: an int array with
+    the number of GTs with the triplet ij|k (i < j) at index
+    k*(n_species choose 2) + p, where p is the index of the pair (i, j) in
+    (0,1), (0,2), ..., (0,n_species-1), (1,2), ...
+
+    Bipartition b has the species species[offsets[b]:offsets[b+1]], the
+    first n_left[b] of which are on its left side, each side in increasing
+    order. The inputs are int buffers (e.g. array('i')), and the GIL is
+    released while the table is filled."""
+    cdef int n_biparts = bipart_weights.shape[0]
+    if offsets.shape[0] != n_biparts + 1 or n_left.shape[0] != n_biparts:
+        raise ValueError("Need an offset and a left side for each "
+                         "bipartition.")
+    if species.shape[0] != offsets[n_biparts]:
+        raise ValueError("The last offset must be the number of species "
+                         "entries.")
+    if n_species < 3:
+        raise ValueError("Need at least 3 species for a triplet.")
+    table = zero_array(triplet_table_size(n_species))
+    if n_biparts == 0:
+        return table
+
+    cdef int[::1] table_memview = table
+    cdef int status
+    with nogil:
+        status = fill_triplet_table(
+            &offsets[0],
+            &n_left[0],
+            &species[0],
+            &bipart_weights[0],
+            n_biparts,
+            n_species,
+            &table_memview[0],
+            n_threads,
+        )
+    if status < 0:
+        raise MemoryError()
+
+    return table
+
+
+def py_triplet_frequencies(const int[::1] table, int n_species,
+                           int n_threads=1):
+    """Returns the rooted triplet frequencies of the triplet table of
+    py_triplet_table: an int array with the numbers of GTs with ab|c, ac|b
+    and bc|a at indices 3*t, 3*t+1 and 3*t+2, where t is the index of the
+    triple a < b < c in (0,1,2), (0,1,3), ..., (0,1,n_species-1), (0,2,3),
+    ... The GIL is released while the array is filled."""
+    if table.shape[0] != triplet_table_size(n_species):
+        raise ValueError("Triplet table has the wrong length for "
+                         "{} species.".format(n_species))
+    counts = zero_array(3 * py_combinations_3(n_species))
+    if len(counts) == 0:
+        return counts
+
+    cdef int[::1] counts_memview = counts
+    cdef int status
+    with nogil:
+        status = fill_triplet_frequencies(
+            &table[0], n_species, &counts_memview[0], n_threads
+        )
+    if status < 0:
+        raise MemoryError()
+
+    return counts
+
+
+def py_triplet_table_from_frequencies(const int[::1] counts, int n_species,
+                                      int n_threads=1):
+    """Returns the triplet table (as in py_triplet_table) with the rooted
+    triplet frequencies counts (as in py_triplet_frequencies). The GIL is
+    released while the table is filled."""
+    if counts.shape[0] != 3 * py_combinations_3(n_species):
+        raise ValueError("Triplet frequencies have the wrong length for "
+                         "{} species.".format(n_species))
+    if n_species < 3:
+        raise ValueError("Need at least 3 species for a triplet.")
+    table = zero_array(triplet_table_size(n_species))
+
+    cdef int[::1] table_memview = table
+    cdef int status
+    with nogil:
+        status = fill_table_from_frequencies(
+            &counts[0], n_species, &table_memview[0], n_threads
+        )
+    if status < 0:
+        raise MemoryError()
+
+    return table
+
+
+def _check_tree(const int[::1] table, int n_species, left, right,
+                parent=None):
+    if table.shape[0] != triplet_table_size(n_species):
+        raise ValueError("Triplet table has the wrong length for "
+                         "{} species.".format(n_species))
+    for nodes in [left, right, parent]:
+        if nodes is not None and len(nodes) != 2*n_species - 1:
+            raise ValueError("Need an entry for each of the "
+                             "{} nodes.".format(2*n_species - 1))
+
+
+def py_triplet_tree_score(const int[::1] table,
+                          int n_species,
+                          const int[::1] left,
+                          const int[::1] right,
+                          int root):
+    """Returns the number of GT triplets (from the triplet table of
+    py_triplet_table) which the tree agrees with. The tree has the leaves 0
+    to n_species-1 and the internal nodes n_species to 2*n_species-2, with
+    their children in the int buffers left and right (-1 for none)."""
+    _check_tree(table, n_species, left, right)
+    cdef long score
+    cdef int status
+    with nogil:
+        status = triplet_tree_score(
+            &table[0], n_species, &left[0], &right[0], root, &score
+        )
+    if status < 0:
+        raise MemoryError()
+
+    return score
+
+
+def py_add_leaves(const int[::1] table,
+                  int n_species,
+                  int[::1] left,
+                  int[::1] right,
+                  int[::1] parent,
+                  int root,
+                  const int[::1] leaves):
+    """Adds each of the leaves to the tree in turn, where it agrees with the
+    most GT triplets, and returns the new root. The tree is given by the int
+    buffers left, right and parent, as in py_triplet_tree_score, which are
+    updated in place; root is -1 for an empty tree. A tree with k leaves
+    uses the internal nodes n_species to n_species+k-2.
+
+    The GIL is released while the leaves are added."""
+    _check_tree(table, n_species, left, right, parent)
+    cdef int new_root = root
+    cdef int status = 0
+    if leaves.shape[0] == 0:
+        return root
+    with nogil:
+        status = add_leaves(
+            &table[0],
+            n_species,
+            &left[0],
+            &right[0],
+            &parent[0],
+            &new_root,
+            &leaves[0],
+            leaves.shape[0],
+        )
+    if status < 0:
+        raise MemoryError()
+
+    return new_root
+
+
+def py_improve_tree(const int[::1] table,
+                    int n_species,
+                    int[::1] left,
+                    int[::1] right,
+                    int[::1] parent,
+                    int root,
+                    unsigned int seed=0,
+                    double time_limit=-1):
+    """Improves the tree with NNI and SPR moves until no move agrees with
+    more GT triplets, or for at most time_limit seconds if it isn't
+    negative. The tree is given as in py_add_leaves and updated in place,
+    and the moves are tried in an order given by seed. Returns the new root,
+    whether no move could improve the tree any further, and the number of
+    moves made.
+
+    The GIL is released during the search."""
+    _check_tree(table, n_species, left, right, parent)
+    cdef int new_root = root
+    cdef long n_moves = 0
+    cdef int status
+    with nogil:
+        status = improve_tree(
+            &table[0],
+            n_species,
+            &left[0],
+            &right[0],
+            &parent[0],
+            &new_root,
+            seed,
+            time_limit,
+            &n_moves,
+        )
+    if status < 0:
+        raise MemoryError()
+
+    return new_root, status == 0, n_moves
+
+
+def py_sample_suboptimal(triplet_weights, stack, int n_species,
+                         long min_score, int n_trees, int n_burnin,
+                         seed=0, int n_threads=1):
+    """Samples up to n_trees trees with a score of at least min_score, from
+    the weights array and the stack of n_species species. First the
+    candidates are split in all possible ways, breadth first, until there
+    are n_burnin of them; then n_trees of them are picked at random and
+    split at random until they're whole trees, on n_threads threads. The
+    trees only depend on seed, and not on n_threads.
+
+    Returns the array('l') of the trees' scores, the array('I') of their
+    splits (the pairs (x, a), where the subset x is split into a and x - a,
+    for each tree's clades with more than two species, padded with zeros to
+    n_species - 1 pairs per tree), and the number of candidates.
+
+    The GIL is released during the search."""
+    triplet_weights = as_int_buffer(triplet_weights)
+    stack = as_int_buffer(stack)
+    cdef const int[::1] weights_memview = triplet_weights
+    cdef const int[::1] stack_memview = stack
+    if not 1 <= n_species <= 32:
+        raise ValueError("Need between 1 and 32 species.")
+    if weights_memview.shape[0] != 2 * 3 ** (<object>n_species - 1):
+        raise ValueError("Weights array has the wrong length for "
+                         "{} species.".format(n_species))
+    if stack_memview.shape[0] != 2 ** <object>n_species:
+        raise ValueError("Stack has the wrong length for "
+                         "{} species.".format(n_species))
+    if n_trees < 0 or n_burnin < 0:
+        raise ValueError("Need a nonnegative number of trees and burn-in.")
+
+    cdef int stride = 2 * (n_species - 1)
+    scores = array.array("l", [0]) * n_trees
+    splits = array.array("I", [0]) * (n_trees * stride)
+    cdef long[::1] scores_memview = scores
+    cdef unsigned int[::1] splits_memview = splits
+    cdef long *scores_ptr = NULL
+    cdef unsigned int *splits_ptr = NULL
+    if scores_memview.shape[0] > 0:
+        scores_ptr = &scores_memview[0]
+    if splits_memview.shape[0] > 0:
+        splits_ptr = &splits_memview[0]
+    cdef unsigned long long c_seed = seed & (2**64 - 1)
+    cdef long n_candidates = 0
+    cdef long n_found
+    with nogil:
+        n_found = sample_suboptimal(
+            <int *>&weights_memview[0],
+            <int *>&stack_memview[0],
+            n_species,
+            min_score,
+            n_trees,
+            n_burnin,
+            c_seed,
+            scores_ptr,
+            splits_ptr,
+            &n_candidates,
+            n_threads,
+        )
+    if n_found == -1:
+        raise MemoryError()
+    if n_found == -2:
+        raise ValueError("The stack doesn't match the weights array.")
+
+    return scores[:n_found], splits[:n_found * stride], n_candidates
+
+
 def py_n_common_triplets(int a, int b, int c, int d):
     return n_common_triplets(a, b, c, d)
\ No newline at end of file
@@ -0,0 +1,297 @@
+"""Rooted triplet frequencies of the gene trees.
+
+For each triple of species a < b < c (numbered as in the reverse
+dictionary), the triplet frequencies are the numbers of GTs with each of its
+resolutions ab|c, ac|b and bc|a. The C code counts them in parallel, going
+through each distinct GT bipartition once, into the triplet table, which has
+the same numbers arranged for the heuristic search. The frequencies can be
+saved to a binary or a tab-separated file.
+
+The weights array is linear in the triplets of the GTs, so the frequencies
+alone give the same weights, and so the same median trees, as the GTs they
+were counted from: each triplet ab|c is the GT bipartition ({a,b},{c}).
+"""
+import pickle
+from array import array
+from itertools import combinations
+from os import replace
+
+import mtrip.triplet_omp as triplet_omp
+from mtrip import __version__
+from mtrip.median_tree_reconstruction import (
+    get_all_trees,
+    get_bipart_counts,
+    get_stack,
+    get_triplet_weights,
+    print_best_score,
+)
+from mtrip.metrics import stage
+
+# Column names of the tab-separated files
+__tsv_header__ = ["a", "b", "c", "ab|c", "ac|b", "bc|a"]
+
+
+def get_species(x):
+    """Returns the species in the bitset x, in increasing order."""
+    return [i for i, bit in enumerate(reversed(bin(x)[2:])) if bit == "1"]
+
+
+def get_triplet_table(weights, n_species, n_threads=1):
+    """Returns the triplet table (see triplet_omp.py_triplet_table) of the GT
+    bipartitions.
+
+    Input:
+    weights - dict sending each GT bipartition (a,b) to its weight, where a
+              and b are bitsets of any size
+    n_species - number of species
+    n_threads - n threads to use (default=1)
+    """
+    offsets = array("i", [0])
+    n_left = array("i")
+    species = array("i")
+    bipart_weights = array("i")
+    for (a, b), weight in weights.items():
+        if weight == 0:
+            continue
+        left = get_species(a)
+        species.extend(left)
+        species.extend(get_species(b))
+        offsets.append(len(species))
+        n_left.append(len(left))
+        bipart_weights.append(weight)
+
+    return triplet_omp.py_triplet_table(
+        offsets, n_left, species, bipart_weights, n_species,
+        n_threads=n_threads,
+    )
+
+
+def get_triplet_frequencies(weights, n_species, n_threads=1):
+    """Returns the triplet frequencies of the GT bipartitions, an int array
+    with the numbers of GTs with ab|c, ac|b and bc|a for each triple a < b <
+    c, in the order of itertools.combinations(range(n_species), 3).
+
+    Input:
+    weights - dict sending each GT bipartition (a,b) to its weight
+    n_species - number of species
+    n_threads - n threads to use (default=1)
+    """
+    if n_species < 3:
+        return triplet_omp.zero_array(0)
+    table = get_triplet_table(weights, n_species, n_threads=n_threads)
+
+    return triplet_omp.py_triplet_frequencies(
+        table, n_species, n_threads=n_threads
+    )
+
+
+def nwk_triplet_frequencies(nwks, n_threads=1, metrics=None):
+    """Parses the GTs and returns their triplet frequencies (see
+    get_triplet_frequencies) and the reverse dictionary.
+
+    Input:
+    nwks - list of Newick strings
+    n_threads - n threads to use (default=1)
+    metrics - optional mtrip.metrics.Metrics to time the stages with
+    """
+    weights, _, reverse_dictionary = get_bipart_counts(
+        nwks, n_threads=n_threads, metrics=metrics
+    )
+    n_species = len(reverse_dictionary)
+    print("* Counting the GTs with each of the triplets.")
+    with stage(metrics, "triplets") as record:
+        counts = get_triplet_frequencies(
+            weights, n_species, n_threads=n_threads
+        )
+        record["items"] = len(counts) // 3
+
+    return counts, reverse_dictionary
+
+
+def get_frequency_bipart_counts(counts, n_species):
+    """Returns the triplet frequencies counts as GT bipartition counts: a
+    dict sending each bipartition ({a,b},{c}) to the number of GTs with
+    ab|c, which can be used in place of the GTs' bipartition counts."""
+    weights = {}
+    for t, (a, b, c) in enumerate(combinations(range(n_species), 3)):
+        for pair, single, count in [
+            (2**a + 2**b, 2**c, counts[3 * t]),
+            (2**a + 2**c, 2**b, counts[3 * t + 1]),
+            (2**b + 2**c, 2**a, counts[3 * t + 2]),
+        ]:
+            if count != 0:
+                weights[(min(pair, single), max(pair, single))] = count
+
+    return weights
+
+
+def save_triplet_frequencies(filename, counts, reverse_dictionary, n_nwks):
+    """Writes the triplet frequencies of n_nwks GTs to filename: a
+    tab-separated file if its name ends with .tsv, leaving out the triples
+    no GT has, and a pickle otherwise. Writes to a temporary file first, so
+    that a half-written file is never left behind."""
+    with open(filename + ".tmp", "wb") as f:
+        if filename.endswith(".tsv"):
+            lines = [
+                "# gene trees: {}\n".format(n_nwks),
+                "\t".join(__tsv_header__) + "\n",
+            ]
+            triples = combinations(reverse_dictionary, 3)
+            for t, names in enumerate(triples):
+                row = counts[3 * t:3 * t + 3]
+                if any(row):
+                    lines.append("\t".join(list(names) + list(map(str, row))))
+                    lines[-1] += "\n"
+            f.write("".join(lines).encode())
+        else:
+            pickle.dump(
+                {
+                    "kind": "triplet_frequencies",
+                    "version": __version__,
+                    "reverse_dictionary": reverse_dictionary,
+                    "n_nwks": n_nwks,
+                    "triplet_frequencies": counts,
+                },
+                f,
+                protocol=4,
+            )
+    replace(filename + ".tmp", filename)
+
+
+def read_triplet_tsv(f):
+    """Reads the tab-separated triplet frequencies in the text file f, whose
+    triples can be in any order, and with their species in any order.
+    Returns the frequencies, the reverse dictionary, and the number of GTs.
+    If the number of GTs isn't given, the most GTs any triple is in is used
+    instead."""
+    n_nwks = None
+    rows = []
+    for line_number, line in enumerate(f, 1):
+        line = line.strip()
+        if line.startswith("# gene trees:"):
+            n_nwks = int(line.split(":")[1])
+        if not line or line[0] == "#" or line.split("\t") == __tsv_header__:
+            continue
+        fields = line.split("\t")
+        if len(fields) != 6:
+            raise ValueError(
+                "Line {} doesn't have 6 tab-separated fields".format(
+                    line_number
+                )
+            )
+        rows.append((fields[:3], [int(x) for x in fields[3:]]))
+
+    reverse_dictionary = sorted({name for names, _ in rows for name in names})
+    n_species = len(reverse_dictionary)
+    dictionary = {name: i for i, name in enumerate(reverse_dictionary)}
+    counts = triplet_omp.zero_array(3 * triplet_omp.py_combinations_3(n_species))
+    for names, row in rows:
+        ids = [dictionary[name] for name in names]
+        if len(set(ids)) != 3:
+            raise ValueError("A triple has the same species twice")
+        # Each resolution is given by the species left out of the pair
+        by_single = dict(zip(reversed(ids), row))
+        a, b, c = sorted(ids)
+        # The triples before a's, then the ones starting with a before b's
+        t = triplet_omp.py_combinations_3(n_species) - (
+            triplet_omp.py_combinations_3(n_species - a)
+        )
+        t += (n_species - a - 1) * (n_species - a - 2) // 2 - (
+            (n_species - b) * (n_species - b - 1) // 2
+        )
+        t += c - b - 1
+        for r, single in enumerate([c, b, a]):
+            counts[3 * t + r] += by_single[single]
+    if n_nwks is None:
+        n_nwks = max([sum(row) for _, row in rows], default=0)
+
+    return counts, reverse_dictionary, n_nwks
+
+
+def load_triplet_frequencies(filename):
+    """Reads a triplet frequency file written by save_triplet_frequencies.
+    Returns a dict with the frequencies (triplet_frequencies), the species
+    names (reverse_dictionary) and the number of GTs they were counted from
+    (n_nwks). Raises ValueError if the file isn't a triplet
+    frequency file."""
+    with open(filename, "rb") as f:
+        is_pickle = f.read(1) == b"\x80"
+    if is_pickle:
+        try:
+            with open(filename, "rb") as f:
+                unpickled = pickle.load(f)
+            if unpickled["kind"] != "triplet_frequencies":
+                raise ValueError
+            return {
+                "triplet_frequencies": unpickled["triplet_frequencies"],
+                "reverse_dictionary": unpickled["reverse_dictionary"],
+                "n_nwks": unpickled["n_nwks"],
+            }
+        except Exception:
+            raise ValueError(
+                "{} isn't a triplet frequency file".format(filename)
+            )
+
+    try:
+        with open(filename, "r") as f:
+            counts, reverse_dictionary, n_nwks = read_triplet_tsv(f)
+    except UnicodeDecodeError:
+        raise ValueError(
+            "{} isn't a triplet frequency file".format(filename)
+        )
+
+    return {
+        "triplet_frequencies": counts,
+        "reverse_dictionary": reverse_dictionary,
+        "n_nwks": n_nwks,
+    }
+
+
+def frequency_median_triplet_trees(
+    counts,
+    reverse_dictionary,
+    n_nwks,
+    n_threads=1,
+    return_extra=False,
+    tiling=None,
+    metrics=None,
+):
+    """Finds all the median trees of the GTs with the triplet frequencies
+    counts, like median_triplet_trees does for the GTs themselves.
+
+    Input:
+    counts - triplet frequencies, as returned by get_triplet_frequencies
+    reverse_dictionary - the species names
+    n_nwks - number of GTs (only used for reporting)
+    n_threads - #threads to use
+    return_extra - set to get stack, lists of best biparts,
+                and reverse dictionary
+    tiling - optional mtrip.tiles.TiledWeights, to keep the weights in a
+             memory-mapped file
+    metrics - optional mtrip.metrics.Metrics to time the stages with
+    """
+    n_species = len(reverse_dictionary)
+    print("* Recording each triplet as a GT bipartition.")
+    with stage(metrics, "bipartitions") as record:
+        weights = get_frequency_bipart_counts(counts, n_species)
+        record["items"] = len(weights)
+    triplet_weights = get_triplet_weights(
+        weights,
+        n_species,
+        n_threads=n_threads,
+        tiling=tiling,
+        metrics=metrics,
+    )
+    with stage(metrics, "stack", items=2**n_species):
+        stack, best_biparts = get_stack(triplet_weights, n_species)
+    print_best_score(stack, n_species, n_nwks)
+
+    with stage(metrics, "trees") as record:
+        trees = get_all_trees(
+            2**n_species - 1, reverse_dictionary, best_biparts
+        )
+        record["items"] = len(trees)
+    if return_extra:
+        return trees, reverse_dictionary, triplet_weights, stack, best_biparts
+    else:
+        return trees
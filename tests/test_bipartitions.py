@@ -1,10 +1,18 @@
 """Tests for bipartition functionality in mtrip."""
 
 import unittest
+from io import StringIO
+from unittest.mock import patch
+
 from mtrip.median_tree_reconstruction import (
+    TopologyCounter,
+    canonical_topology,
+    get_bipart_counts,
     get_biparts,
     get_subset_biparts,
+    get_topology_counts,
     get_weights,
+    get_weights_parallel,
 )
 
 
@@ -114,6 +122,68 @@ class TestBipartitions(unittest.TestCase):
         self.assertEqual(weights_dup[(5, 10)], 1)
         self.assertEqual(weights_dup[(1, 14)], 1)
 
+    def test_canonical_topology(self):
+        """Test trees differing only in child order get the same key."""
+        swapped = "((D,C),(B,A))"
+        key1 = canonical_topology(get_biparts(self.newick1, self.dictionary))
+        key2 = canonical_topology(get_biparts(swapped, self.dictionary))
+        key3 = canonical_topology(get_biparts(self.newick3, self.dictionary))
+
+        self.assertEqual(key1, key2)
+        self.assertNotEqual(key1, key3)
+
+    def test_get_topology_counts(self):
+        """Test get_topology_counts merges identical topologies."""
+        nwks = [
+            self.newick1,
+            "((D,C),(B,A))",
+            self.newick1,
+            self.newick2,
+            "(((D,C),B),A)",
+        ]
+
+        topologies = get_topology_counts(nwks, self.dictionary)
+
+        self.assertEqual(len(topologies), 2)
+        self.assertEqual(sum(topologies.values()), len(nwks))
+        key1 = canonical_topology(get_biparts(self.newick1, self.dictionary))
+        key2 = canonical_topology(get_biparts(self.newick2, self.dictionary))
+        self.assertEqual(topologies[key1], 3)
+        self.assertEqual(topologies[key2], 2)
+
+    def test_get_weights_parallel_matches_serial(self):
+        """Test deduplicated weights match counting every line."""
+        nwks = [self.newick1, "((D,C),(B,A))", self.newick2, self.newick3] * 20
+
+        serial = get_weights(nwks, self.dictionary)
+        deduplicated = get_weights_parallel(nwks, self.dictionary, n_threads=2)
+
+        self.assertEqual(dict(serial), dict(deduplicated))
+
+    def test_topology_counter(self):
+        """Test counting the topologies a chunk at a time gives the same
+        bipartition weights, with the species seen in another order."""
+        nwks = [
+            "((D:1,C:2)x:1,(B,A));",
+            "# A comment",
+            "((A,B),(C,D));",
+            "(A,(B,(C,(E,D))));",
+            "((A,C),(B,D));",
+        ] * 3
+        counter = TopologyCounter()
+        for start in range(0, len(nwks), 4):
+            counter.add(nwks[start : start + 4])
+        gts = [s for s in nwks if s[0] != "#"]
+        with patch("sys.stdout", new=StringIO()):
+            expected = get_bipart_counts(gts)
+            result = get_bipart_counts(gts, topology_counter=counter)
+
+        self.assertEqual(counter.n_nwks, len(gts))
+        self.assertEqual(len(counter.topologies), 3)
+        self.assertEqual(result, expected)
+        with self.assertRaises(ValueError):
+            counter.get_bipart_counts(["A", "B", "C", "D"])
+
 
 if __name__ == "__main__":
     unittest.main()
\ No newline at end of file
@@ -0,0 +1,89 @@
+"""Tests for the bitset helpers in mtrip.bitsnbobs."""
+
+import unittest
+from array import array
+from itertools import combinations
+
+from mtrip.bitsnbobs import (get_binary_subsets, init_bipart_rep_function,
+                             iter_snoobs, iter_subsets, replace_2_with_k)
+from mtrip.snoob import get_all_snoobs
+
+
+class TestBitsnbobs(unittest.TestCase):
+    """Test cases for the bipartition tables and subset iterators."""
+
+    def test_bipart_rep(self):
+        """The table gives the same representations as replace_2_with_k,
+        one at a time and in a batch."""
+        n_species = 6
+        bipart_rep = init_bipart_rep_function(n_species)
+        self.assertIs(bipart_rep, init_bipart_rep_function(n_species))
+        self.assertEqual(bipart_rep.to_1.typecode, "q")
+        self.assertEqual(
+            list(bipart_rep.to_1),
+            [replace_2_with_k(x, 3) for x in range(2**n_species)],
+        )
+
+        universe = 2**n_species - 1
+        pairs = [
+            (a, x - a)
+            for x in range(1, universe + 1)
+            for a in get_binary_subsets(x)
+        ]
+        expected = [
+            min(
+                replace_2_with_k(a, 3) + 2 * replace_2_with_k(b, 3),
+                replace_2_with_k(b, 3) + 2 * replace_2_with_k(a, 3),
+            )
+            for (a, b) in pairs
+        ]
+        self.assertEqual([bipart_rep(a, b) for (a, b) in pairs], expected)
+
+        a, b = zip(*pairs)
+        reps = bipart_rep.reps(array("I", a), array("I", b))
+        self.assertEqual(reps.typecode, "q")
+        self.assertEqual(list(reps), expected)
+        # Other sequences are converted, and out is reused
+        out = array("q", [0] * len(pairs))
+        self.assertIs(bipart_rep.reps(list(a), list(b), out=out), out)
+        self.assertEqual(list(out), expected)
+
+        with self.assertRaises(ValueError):
+            bipart_rep.reps([1], [2**n_species])
+        with self.assertRaises(ValueError):
+            bipart_rep.reps([1, 2], [4])
+
+    def test_iter_subsets(self):
+        """iter_subsets gives the same subsets as get_binary_subsets."""
+        for n in [0, 1, 5, 0b101101]:
+            for include_self in [False, True]:
+                for include_empty_set in [False, True]:
+                    subsets = list(
+                        iter_subsets(n, include_self, include_empty_set)
+                    )
+                    self.assertEqual(
+                        subsets,
+                        get_binary_subsets(n, include_self, include_empty_set),
+                    )
+                    self.assertEqual(len(subsets), len(set(subsets)))
+
+        self.assertEqual(get_binary_subsets(0b101), [0b100, 0b001])
+        self.assertEqual(get_binary_subsets(0, True, True), [0])
+
+    def test_iter_snoobs(self):
+        """iter_snoobs gives all subsets of a given size in increasing
+        order."""
+        universe = 0b1101101
+        bits = [1 << i for i in range(7) if universe & (1 << i)]
+        for k in range(len(bits) + 2):
+            expected = sorted(sum(c) for c in combinations(bits, k))
+            self.assertEqual(list(iter_snoobs(universe, k)), expected)
+            self.assertEqual(get_all_snoobs(universe, k), expected)
+
+        # All 32 bits
+        self.assertEqual(list(iter_snoobs(2**32 - 1, 32)), [2**32 - 1])
+        self.assertEqual(len(list(iter_snoobs(2**32 - 1, 2))), 496)
+
+
+if __name__ == "__main__":
+    unittest.main()
@@ -0,0 +1,105 @@
+"""Tests for the on-disk weights cache in mtrip."""
+
+import os
+import shutil
+import sys
+import tempfile
+import unittest
+from io import StringIO
+from unittest.mock import patch
+
+from mtrip.cache import WeightsCache, get_bipart_delta, get_cache_key
+from mtrip.median_tree_reconstruction import median_triplet_trees
+
+
+class TestWeightsCache(unittest.TestCase):
+    """Test cases for mtrip.cache."""
+
+    def setUp(self):
+        """Set up test environment."""
+        self.temp_dir = tempfile.mkdtemp()
+        self.nwks = [
+            "((A,B),(C,D))",
+            "(A,(B,(C,D)))",
+            "((A,C),(B,D))",
+            "((A,B),(C,(D,E)))",
+        ]
+
+    def tearDown(self):
+        """Clean up after tests."""
+        shutil.rmtree(self.temp_dir)
+
+    def test_cache_key(self):
+        """Test the key only depends on the bipartition multiset and labels."""
+        weights = {(1, 2): 3, (3, 12): 1}
+        reordered = {(3, 12): 1, (1, 2): 3}
+        labels = ["A", "B", "C", "D"]
+
+        self.assertEqual(
+            get_cache_key(weights, labels), get_cache_key(reordered, labels)
+        )
+        self.assertNotEqual(
+            get_cache_key(weights, labels),
+            get_cache_key({(1, 2): 2, (3, 12): 1}, labels),
+        )
+        self.assertNotEqual(
+            get_cache_key(weights, labels),
+            get_cache_key(weights, ["A", "B", "C", "E"]),
+        )
+
+    def test_bipart_delta(self):
+        """Test the delta turns the cached counts into the new counts."""
+        delta = get_bipart_delta({(1, 2): 3, (4, 8): 1}, {(1, 2): 1, (3, 12): 2})
+
+        self.assertEqual(delta, {(1, 2): 2, (4, 8): 1, (3, 12): -2})
+
+    def test_eviction(self):
+        """Test the least recently used entry is evicted first."""
+        cache = WeightsCache(self.temp_dir)
+        for i in range(3):
+            cache.store(str(i), {(1, 2): i}, ["A", "B"], [0] * 1000, [], [])
+            os.utime(
+                os.path.join(self.temp_dir, "{}.data.p".format(i)),
+                (i, i),
+            )
+        # Using an entry makes it the most recently used one
+        cache.load("0")
+        cache.max_bytes = cache.size("0") + cache.size("1")
+        cache.evict()
+
+        self.assertEqual(sorted(cache.keys()), ["0", "2"])
+
+    def test_cached_median_trees(self):
+        """Test cached and near-identical runs give the same results."""
+        cache = WeightsCache(self.temp_dir)
+        with patch("sys.stdout", new=StringIO()):
+            expected = median_triplet_trees(self.nwks, return_extra=True)
+            first = median_triplet_trees(
+                self.nwks, return_extra=True, cache=cache
+            )
+            # Same trees in a different order hit the cache
+            second = median_triplet_trees(
+                self.nwks[::-1], return_extra=True, cache=cache
+            )
+            output = sys.stdout.getvalue()
+
+        self.assertIn("Found weights, stack and best bipartitions", output)
+        for result in (first, second):
+            self.assertEqual(result[0], expected[0])
+            self.assertEqual(list(result[2]), list(expected[2]))
+            self.assertEqual(list(result[3]), list(expected[3]))
+
+        # One more tree only adds its contribution to the cached weights
+        nwks = self.nwks + ["((A,E),(B,(C,D)))"]
+        with patch("sys.stdout", new=StringIO()):
+            expected = median_triplet_trees(nwks, return_extra=True)
+            near = median_triplet_trees(nwks, return_extra=True, cache=cache)
+            output = sys.stdout.getvalue()
+
+        self.assertIn("Reusing cached weights", output)
+        self.assertEqual(near[0], expected[0])
+        self.assertEqual(list(near[2]), list(expected[2]))
+
+
+if __name__ == "__main__":
+    unittest.main()
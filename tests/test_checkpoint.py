@@ -0,0 +1,126 @@
+"""Tests for checkpointing the weights computation in mtrip."""
+
+import os
+import pickle
+import shutil
+import tempfile
+import unittest
+from io import StringIO
+from unittest.mock import patch
+
+from mtrip import triplet_omp
+from mtrip.checkpoint import Checkpoint
+from mtrip.median_tree_reconstruction import (
+    get_bipart_counts,
+    get_subset_arrays,
+)
+
+
+class TestCheckpoint(unittest.TestCase):
+    """Test cases for mtrip.checkpoint."""
+
+    def setUp(self):
+        """Set up test data."""
+        self.temp_dir = tempfile.mkdtemp()
+        self.path = os.path.join(self.temp_dir, "checkpoint.p")
+        nwks = [
+            "((A,B),(C,(D,E)))",
+            "(((A,C),B),(D,E))",
+            "(((A,D),B),(C,E))",
+            "((A,(B,E)),(C,D))",
+            "(E,((A,D),(B,C)))",
+        ]
+        with patch("sys.stdout", new=StringIO()):
+            weights, _, reverse_dictionary = get_bipart_counts(nwks)
+            arrays = get_subset_arrays(weights)
+        subsets, start_i, end_i, biparts_a, biparts_b = arrays
+        bipart_weights = [weights[b] for b in zip(biparts_a, biparts_b)]
+        self.inputs = arrays + (bipart_weights, len(reverse_dictionary))
+        self.expected = triplet_omp.py_compressed_weight_rep(*self.inputs)
+
+    def tearDown(self):
+        """Clean up after tests."""
+        shutil.rmtree(self.temp_dir)
+
+    def test_uninterrupted(self):
+        """Test checkpointed weights match the plain computation."""
+        checkpoint = Checkpoint(self.path, interval=0, n_chunks=3)
+        with patch("sys.stdout", new=StringIO()):
+            weights = checkpoint.compressed_weight_rep(*self.inputs)
+
+        self.assertEqual(list(weights), list(self.expected))
+        self.assertTrue(os.path.exists(self.path))
+        checkpoint.remove()
+        self.assertFalse(os.path.exists(self.path))
+
+    def test_resume(self):
+        """Test resuming after an interruption gives identical weights."""
+        # The function each engine calls once per chunk
+        chunk_functions = {
+            "transform": "py_count_triplets",
+            "scatter": "py_compressed_weight_rep",
+        }
+        for engine, name in chunk_functions.items():
+            with self.subTest(engine=engine):
+                checkpoint = Checkpoint(self.path, interval=0, n_chunks=4)
+                calls = []
+                original = getattr(triplet_omp, name)
+
+                def interrupted(*args, **kwargs):
+                    # Pretend the job is killed during the third chunk
+                    if len(calls) == 2:
+                        raise KeyboardInterrupt
+                    calls.append(args)
+                    return original(*args, **kwargs)
+
+                with patch("sys.stdout", new=StringIO()):
+                    with patch.object(triplet_omp, name, interrupted):
+                        with self.assertRaises(KeyboardInterrupt):
+                            checkpoint.compressed_weight_rep(
+                                *self.inputs, engine=engine
+                            )
+                    with open(self.path, "rb") as f:
+                        n_done = pickle.load(f)["n_done"]
+
+                    resumed = Checkpoint(self.path, interval=0, resume=True)
+                    weights = resumed.compressed_weight_rep(
+                        *self.inputs, engine=engine
+                    )
+
+                self.assertGreater(n_done, 0)
+                self.assertLess(n_done, len(self.inputs[0]))
+                self.assertEqual(list(weights), list(self.expected))
+                checkpoint.remove()
+
+    def test_transform_saves_triplet_counts(self):
+        """Test the transform engine only saves the triplet counts, and
+        adds to the given weights."""
+        n_species = self.inputs[-1]
+        checkpoint = Checkpoint(self.path, interval=0, n_chunks=2)
+        with patch("sys.stdout", new=StringIO()):
+            weights = triplet_omp.py_compressed_weight_rep(*self.inputs)
+            checkpoint.compressed_weight_rep(
+                *self.inputs, weights=weights, engine="transform"
+            )
+        with open(self.path, "rb") as f:
+            saved = pickle.load(f)
+
+        self.assertEqual(len(saved["partial"]), n_species**3)
+        self.assertEqual(list(weights), [2 * w for w in self.expected])
+
+    def test_resume_different_input(self):
+        """Test a checkpoint made for other inputs is refused."""
+        with patch("sys.stdout", new=StringIO()):
+            Checkpoint(self.path, interval=0).compressed_weight_rep(
+                *self.inputs
+            )
+            other = list(self.inputs)
+            other[5] = [2 * w for w in other[5]]
+            with self.assertRaises(ValueError):
+                Checkpoint(self.path, resume=True).compressed_weight_rep(
+                    *other
+                )
+
+
+if __name__ == "__main__":
+    unittest.main()
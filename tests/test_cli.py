@@ -1,14 +1,20 @@
 """Tests for the command-line interface of mtrip."""
 
 import unittest
+import gzip
+import io
+import json
 import os
+import pickle
 import sys
 import tempfile
 import shutil
 from unittest.mock import patch
 from io import StringIO
 
-from mtrip.cli.mtrip_cmd import main as mtrip_main
+from mtrip.cli.mtrip_cmd import check_flags, main as mtrip_main
+from mtrip.cli.mtrip_combine_cmd import main as combine_main
+from mtrip.cli.mtrip_suboptimal_cmd import main as suboptimal_main
 
 
 class TestCLI(unittest.TestCase):
@@ -118,6 +124,520 @@ class TestCLI(unittest.TestCase):
         # require importing pickle and handling version compatibility issues)
         self.assertGreater(os.path.getsize(self.pickle_file), 0)
 
+    def test_cache_dir_option(self):
+        """Test a rerun with --cache-dir uses the cached results."""
+        cache_dir = os.path.join(self.temp_dir, "cache")
+        testargs = ["mtrip", self.input_file, self.output_file,
+                    "--cache-dir", cache_dir]
+
+        outputs = []
+        for _ in range(2):
+            with patch.object(sys, "argv", testargs):
+                with patch("sys.stdout", new=StringIO()) as fake_out:
+                    exit_code = mtrip_main()
+            self.assertEqual(exit_code, 0)
+            with open(self.output_file, "r") as f:
+                outputs.append(f.read())
+
+        self.assertIn("Found weights, stack and best bipartitions",
+                      fake_out.getvalue())
+        self.assertEqual(outputs[0], outputs[1])
+        self.assertGreater(len(os.listdir(cache_dir)), 0)
+
+    def test_append_to_option(self):
+        """Test --append-to matches a run over all the gene trees at once."""
+        new_file = os.path.join(self.temp_dir, "new.nwk")
+        with open(new_file, "w") as f:
+            f.write("((A,D),(B,C));\n")
+            f.write("(((A,B),C),D);\n")
+        all_file = os.path.join(self.temp_dir, "all.nwk")
+        with open(all_file, "w") as f:
+            for filename in (self.input_file, new_file):
+                with open(filename, "r") as g:
+                    f.write(g.read())
+        all_pickle = os.path.join(self.temp_dir, "all.p")
+        appended_output = os.path.join(self.temp_dir, "appended.nwk")
+
+        runs = [
+            ["mtrip", self.input_file, self.output_file,
+             "-b", self.pickle_file],
+            ["mtrip", new_file, appended_output,
+             "--append-to", self.pickle_file],
+            ["mtrip", all_file, self.output_file, "-b", all_pickle],
+        ]
+        for testargs in runs:
+            with patch.object(sys, "argv", testargs):
+                with patch("sys.stdout", new=StringIO()):
+                    self.assertEqual(mtrip_main(), 0)
+
+        with open(self.pickle_file, "rb") as f:
+            appended = pickle.load(f)
+        with open(all_pickle, "rb") as f:
+            expected = pickle.load(f)
+        for key in ["nwks", "median_nwks", "triplet_weights", "stack"]:
+            self.assertEqual(list(appended[key]), list(expected[key]))
+        with open(appended_output, "r") as f:
+            self.assertEqual(
+                [s.strip() for s in f], list(expected["median_nwks"])
+            )
+
+    def test_append_to_new_species(self):
+        """Test --append-to refuses gene trees with unknown species."""
+        new_file = os.path.join(self.temp_dir, "new.nwk")
+        with open(new_file, "w") as f:
+            f.write("((A,E),(B,C));\n")
+
+        runs = [
+            (["mtrip", self.input_file, self.output_file,
+              "-b", self.pickle_file], 0),
+            (["mtrip", new_file, "--append-to", self.pickle_file], 1),
+        ]
+        for testargs, expected_code in runs:
+            with patch.object(sys, "argv", testargs):
+                with patch("sys.stdout", new=StringIO()):
+                    self.assertEqual(mtrip_main(), expected_code)
+
+    def test_window_option(self):
+        """Test --window writes the median trees of each window."""
+        testargs = ["mtrip", self.input_file, self.output_file,
+                    "--window", "2", "--step", "1"]
+
+        with patch.object(sys, "argv", testargs):
+            with patch("sys.stdout", new=StringIO()):
+                exit_code = mtrip_main()
+
+        self.assertEqual(exit_code, 0)
+        with open(self.output_file, "r") as f:
+            rows = [line.rstrip("\n").split("\t") for line in f]
+        self.assertEqual({(row[0], row[1]) for row in rows},
+                         {("1", "2"), ("2", "3")})
+        for row in rows:
+            self.assertEqual(len(row), 4)
+            self.assertTrue(row[3].endswith(";"))
+
+    def test_replicates_option(self):
+        """Test --replicates writes a clade support table."""
+        testargs = ["mtrip", self.input_file, self.output_file,
+                    "--replicates", "4", "--seed", "2"]
+
+        with patch.object(sys, "argv", testargs):
+            with patch("sys.stdout", new=StringIO()):
+                exit_code = mtrip_main()
+
+        self.assertEqual(exit_code, 0)
+        with open(self.output_file, "r") as f:
+            rows = [line.rstrip("\n").split("\t") for line in f]
+        self.assertGreater(len(rows), 0)
+        for support, clade in rows:
+            self.assertTrue(0 < float(support) <= 1)
+            self.assertGreater(len(clade.split(",")), 1)
+
+
+    def test_shard_option(self):
+        """Test shards combined by mtrip-combine give the same median trees."""
+        testargs = ["mtrip", self.input_file, self.output_file]
+        with patch.object(sys, "argv", testargs):
+            with patch("sys.stdout", new=StringIO()):
+                mtrip_main()
+        with open(self.output_file, "r") as f:
+            expected = sorted(f.readlines())
+
+        n_shards = 3
+        shard_files = []
+        for i in range(1, n_shards + 1):
+            shard_file = os.path.join(self.temp_dir, "shard{}.p".format(i))
+            testargs = ["mtrip", self.input_file, "--shard",
+                        "{}/{}".format(i, n_shards), "-b", shard_file]
+            with patch.object(sys, "argv", testargs):
+                with patch("sys.stdout", new=StringIO()):
+                    exit_code = mtrip_main()
+            self.assertEqual(exit_code, 0)
+            shard_files.append(shard_file)
+
+        cwd = os.getcwd()
+        os.chdir(self.temp_dir)
+        try:
+            # A missing shard is refused
+            with patch.object(sys, "argv", ["mtrip-combine"] + shard_files[:2]):
+                with patch("sys.stdout", new=StringIO()):
+                    self.assertEqual(combine_main(), 1)
+            with patch.object(sys, "argv", ["mtrip-combine"] + shard_files):
+                with patch("sys.stdout", new=StringIO()):
+                    exit_code = combine_main()
+        finally:
+            os.chdir(cwd)
+
+        self.assertEqual(exit_code, 0)
+        with open(os.path.join(self.temp_dir, "combined_weights.p"), "rb") as f:
+            combined = pickle.load(f)
+        self.assertEqual(sorted(s + "\n" for s in combined["median_nwks"]),
+                         expected)
+        self.assertEqual(len(combined["nwks"]), 3)
+
+    def test_combine_species(self):
+        """Test mtrip-combine adds up weights of different species like
+        one run on all the gene trees."""
+        inputs = [
+            ["((A,B),(C,D));", "(A,(B,(C,D)));"],
+            ["((B,E),(C,D));", "((E,(C,B)),D);"],
+            ["((A,C),(B,D));"],
+        ]
+        with open(self.output_file + ".all", "w") as f:
+            f.writelines(nwk + "\n" for nwks in inputs for nwk in nwks)
+        testargs = ["mtrip", self.output_file + ".all", self.output_file]
+        with patch.object(sys, "argv", testargs):
+            with patch("sys.stdout", new=StringIO()):
+                mtrip_main()
+        with open(self.output_file, "r") as f:
+            expected = sorted(f.read().split())
+
+        pickle_files = []
+        for i, nwks in enumerate(inputs):
+            input_file = os.path.join(self.temp_dir, "part{}.nwk".format(i))
+            with open(input_file, "w") as f:
+                f.writelines(nwk + "\n" for nwk in nwks)
+            pickle_files.append(input_file + ".p")
+            testargs = ["mtrip", input_file, "-b", pickle_files[-1], "-n",
+                        "-p"]
+            with patch.object(sys, "argv", testargs):
+                with patch("sys.stdout", new=StringIO()):
+                    self.assertEqual(mtrip_main(), 0)
+
+        cwd = os.getcwd()
+        os.chdir(self.temp_dir)
+        try:
+            with patch.object(sys, "argv", ["mtrip-combine"] + pickle_files):
+                with patch("sys.stdout", new=StringIO()) as fake_out:
+                    exit_code = combine_main()
+        finally:
+            os.chdir(cwd)
+
+        self.assertEqual(exit_code, 0)
+        self.assertIn("from 4 to 5 species", fake_out.getvalue())
+        with open(os.path.join(self.temp_dir, "combined_weights.p"), "rb") as f:
+            combined = pickle.load(f)
+        self.assertEqual(combined["reverse_dictionary"], list("ABCDE"))
+        self.assertEqual(sorted(combined["median_nwks"]), expected)
+        self.assertEqual(len(combined["nwks"]), 5)
+
+    def test_compressed_input(self):
+        """Test compressed input files and stdin give the same median trees,
+        and the default output file drops the compression suffix."""
+        testargs = ["mtrip", self.input_file, self.output_file]
+        with patch.object(sys, "argv", testargs):
+            with patch("sys.stdout", new=StringIO()):
+                mtrip_main()
+        with open(self.input_file, "rb") as f:
+            text = f.read()
+        with open(self.output_file, "r") as f:
+            expected = f.read()
+
+        gz_file = os.path.join(self.temp_dir, "genes.nwk.gz")
+        with gzip.open(gz_file, "wb") as f:
+            f.write(text)
+        cwd = os.getcwd()
+        os.chdir(self.temp_dir)
+        try:
+            with patch.object(sys, "argv", ["mtrip", gz_file]):
+                with patch("sys.stdout", new=StringIO()):
+                    self.assertEqual(mtrip_main(), 0)
+            with open("out_genes.nwk", "r") as f:
+                self.assertEqual(f.read(), expected)
+
+            stdin = io.TextIOWrapper(io.BufferedReader(io.BytesIO(text)))
+            with patch.object(sys, "argv", ["mtrip", "-"]):
+                with patch.object(sys, "stdin", stdin):
+                    with patch("sys.stdout", new=StringIO()):
+                        self.assertEqual(mtrip_main(), 0)
+            with open("out_stdin", "r") as f:
+                self.assertEqual(f.read(), expected)
+        finally:
+            os.chdir(cwd)
+
+    def test_plan_option(self):
+        """Test --plan reports estimates without writing any output."""
+        testargs = ["mtrip", self.input_file, self.output_file, "--plan"]
+
+        with patch.object(sys, "argv", testargs):
+            with patch("sys.stdout", new=StringIO()) as fake_out:
+                exit_code = mtrip_main()
+                output = fake_out.getvalue()
+
+        self.assertEqual(exit_code, 0)
+        self.assertFalse(os.path.exists(self.output_file))
+        self.assertIn("Recommended memory strategy", output)
+
+    def test_metrics_option(self):
+        """Test --metrics writes a JSON report of every stage."""
+        metrics_file = os.path.join(self.temp_dir, "metrics.json")
+        testargs = ["mtrip", self.input_file, self.output_file,
+                    "--metrics", metrics_file]
+
+        with patch.object(sys, "argv", testargs):
+            with patch("sys.stdout", new=StringIO()):
+                exit_code = mtrip_main()
+
+        self.assertEqual(exit_code, 0)
+        with open(metrics_file, "r") as f:
+            report = json.load(f)
+        names = [s["name"] for s in report["stages"]]
+        self.assertEqual(names[0], "input")
+        self.assertEqual(names[-1], "output")
+        self.assertIn("weights", names)
+        self.assertGreater(report["wall_time"], 0)
+
+    def test_batch_option(self):
+        """Test --batch solves each listed file, as separate runs would."""
+        second_file = os.path.join(self.temp_dir, "second.nwk")
+        with open(second_file, "w") as f:
+            f.write("((A,B),(C,(D,E)));\n")
+            f.write("(((A,B),C),(D,E));\n")
+        bad_file = os.path.join(self.temp_dir, "bad.nwk")
+        with open(bad_file, "w") as f:
+            f.write("((A,B),C\n")
+        manifest = os.path.join(self.temp_dir, "manifest.txt")
+        with open(manifest, "w") as f:
+            f.write("# Comments are skipped\ninput.nwk\nsecond.nwk\n")
+
+        expected = []
+        for in_file in [self.input_file, second_file]:
+            with patch.object(sys, "argv", ["mtrip", in_file, self.output_file]):
+                with patch("sys.stdout", new=StringIO()):
+                    mtrip_main()
+            with open(self.output_file, "r") as f:
+                expected.append(f.readlines())
+
+        cwd = os.getcwd()
+        os.chdir(self.temp_dir)
+        try:
+            with patch.object(sys, "argv", ["mtrip", "--batch", manifest]):
+                with patch("sys.stdout", new=StringIO()):
+                    exit_code = mtrip_main()
+        finally:
+            os.chdir(cwd)
+        self.assertEqual(exit_code, 0)
+        for name, trees in zip(["out_input.nwk", "out_second.nwk"], expected):
+            with open(os.path.join(self.temp_dir, name), "r") as f:
+                self.assertEqual(f.readlines(), trees)
+
+        # A bad file doesn't stop the others
+        with open(manifest, "a") as f:
+            f.write("bad.nwk\n")
+        tsv_file = os.path.join(self.temp_dir, "all.tsv")
+        testargs = ["mtrip", "--batch", manifest, "--tsv", tsv_file, "-t", "2"]
+        with patch.object(sys, "argv", testargs):
+            with patch("sys.stdout", new=StringIO()):
+                exit_code = mtrip_main()
+        self.assertEqual(exit_code, 1)
+        with open(tsv_file, "r") as f:
+            rows = [line.rstrip("\n").split("\t") for line in f]
+        self.assertEqual(
+            [row[2] + "\n" for row in rows],
+            expected[0] + expected[1],
+        )
+        self.assertEqual(rows[0][0], self.input_file)
+        self.assertEqual(rows[-1][0], second_file)
+
+    def test_engine_option(self):
+        """Test both engines give the same weights and median trees."""
+        results = []
+        for engine in ["scatter", "transform"]:
+            testargs = [
+                "mtrip", self.input_file, self.output_file,
+                "--binary", self.pickle_file, "--engine", engine,
+            ]
+            with patch.object(sys, "argv", testargs):
+                with patch("sys.stdout", new=StringIO()):
+                    self.assertEqual(mtrip_main(), 0)
+            with open(self.pickle_file, "rb") as f:
+                weights = list(pickle.load(f)["triplet_weights"])
+            with open(self.output_file, "r") as f:
+                results.append((weights, f.read()))
+
+        self.assertEqual(results[0], results[1])
+        self.assertTrue(any(results[0][0]))
+
+    def test_heuristic_option(self):
+        """Test --heuristic writes one tree with all the species."""
+        testargs = [
+            "mtrip", self.input_file, self.output_file,
+            "--heuristic", "10", "--starts", "2", "--exact-clades", "4",
+        ]
+        with patch.object(sys, "argv", testargs):
+            with patch("sys.stdout", new=StringIO()) as fake_out:
+                exit_code = mtrip_main()
+        self.assertEqual(exit_code, 0)
+        self.assertIn("after 2 start(s)", fake_out.getvalue())
+        with open(self.output_file, "r") as f:
+            trees = f.read().split()
+        self.assertEqual(len(trees), 1)
+        for name in "ABCD":
+            self.assertIn(name, trees[0])
+
+        testargs = ["mtrip", self.input_file, "--starts", "2"]
+        with patch.object(sys, "argv", testargs):
+            with patch("sys.stdout", new=StringIO()):
+                self.assertEqual(mtrip_main(), 1)
+
+    def test_triplets_option(self):
+        """Test --triplets saves triplet frequencies which give the same
+        median trees with --triplet-input."""
+        testargs = ["mtrip", self.input_file, self.output_file]
+        with patch.object(sys, "argv", testargs):
+            with patch("sys.stdout", new=StringIO()):
+                self.assertEqual(mtrip_main(), 0)
+        with open(self.output_file, "r") as f:
+            trees = f.read().split()
+
+        for name in ["triplets.p", "triplets.tsv"]:
+            triplets_file = os.path.join(self.temp_dir, name)
+            testargs = ["mtrip", self.input_file, "--triplets", triplets_file]
+            with patch.object(sys, "argv", testargs):
+                with patch("sys.stdout", new=StringIO()):
+                    self.assertEqual(mtrip_main(), 0)
+
+            os.remove(self.output_file)
+            testargs = [
+                "mtrip", triplets_file, self.output_file, "--triplet-input",
+            ]
+            with patch.object(sys, "argv", testargs):
+                with patch("sys.stdout", new=StringIO()) as fake_out:
+                    self.assertEqual(mtrip_main(), 0)
+            self.assertIn("from 3 GTs", fake_out.getvalue())
+            with open(self.output_file, "r") as f:
+                self.assertEqual(f.read().split(), trees)
+
+        testargs = [
+            "mtrip", triplets_file, "--triplet-input", "--heuristic", "5",
+            "--starts", "1", "--nosave", "--print",
+        ]
+        with patch.object(sys, "argv", testargs):
+            with patch("sys.stdout", new=StringIO()) as fake_out:
+                self.assertEqual(mtrip_main(), 0)
+        self.assertIn("after 1 start(s)", fake_out.getvalue())
+
+        # The weights pickle has the same weights as one from the gene
+        # trees, and more gene trees can be added to it
+        testargs = ["mtrip", self.input_file, "-n", "-p", "-b",
+                    self.pickle_file]
+        with patch.object(sys, "argv", testargs):
+            with patch("sys.stdout", new=StringIO()):
+                self.assertEqual(mtrip_main(), 0)
+        with open(self.pickle_file, "rb") as f:
+            expected = pickle.load(f)
+        testargs = ["mtrip", triplets_file, "--triplet-input", "-n", "-p",
+                    "-b", self.pickle_file]
+        with patch.object(sys, "argv", testargs):
+            with patch("sys.stdout", new=StringIO()):
+                self.assertEqual(mtrip_main(), 0)
+        with open(self.pickle_file, "rb") as f:
+            unpickled = pickle.load(f)
+        self.assertEqual(unpickled["nwks"], [])
+        self.assertEqual(unpickled["n_nwks"], 3)
+        self.assertEqual(list(unpickled["triplet_weights"]),
+                         list(expected["triplet_weights"]))
+
+        testargs = ["mtrip", self.input_file, "-n", "-p", "--append-to",
+                    self.pickle_file]
+        with patch.object(sys, "argv", testargs):
+            with patch("sys.stdout", new=StringIO()) as fake_out:
+                self.assertEqual(mtrip_main(), 0)
+        self.assertIn("to the 3 GTs", fake_out.getvalue())
+        with open(self.pickle_file, "rb") as f:
+            unpickled = pickle.load(f)
+        self.assertEqual(len(unpickled["nwks"]), 3)
+        self.assertEqual(unpickled["n_nwks"], 6)
+
+
+    def test_triplets_not_weights(self):
+        """Test mtrip-suboptimal and mtrip-combine refuse a triplet
+        frequency file in place of a weights file."""
+        triplets_file = os.path.join(self.temp_dir, "triplets.p")
+        testargs = ["mtrip", self.input_file, "--triplets", triplets_file]
+        with patch.object(sys, "argv", testargs):
+            with patch("sys.stdout", new=StringIO()):
+                self.assertEqual(mtrip_main(), 0)
+        testargs = ["mtrip", self.input_file, "-n", "-p", "-b",
+                    self.pickle_file]
+        with patch.object(sys, "argv", testargs):
+            with patch("sys.stdout", new=StringIO()):
+                self.assertEqual(mtrip_main(), 0)
+
+        testargs = ["mtrip-suboptimal", "-y", triplets_file, self.output_file]
+        with patch.object(sys, "argv", testargs):
+            with patch("sys.stdout", new=StringIO()) as fake_out:
+                self.assertEqual(suboptimal_main(), 1)
+        self.assertIn("isn't a weights file", fake_out.getvalue())
+
+        for pickles in [
+            [self.pickle_file, triplets_file],
+            [triplets_file, self.pickle_file],
+        ]:
+            with patch.object(sys, "argv", ["mtrip-combine"] + pickles):
+                with patch("sys.stdout", new=StringIO()) as fake_out:
+                    self.assertEqual(combine_main(), 1)
+            self.assertIn("isn't a weights file", fake_out.getvalue())
+
+    def test_check_flags(self):
+        """Test the flags are checked against the flags they need and the
+        flags they can't be used with."""
+        self.assertIsNone(check_flags(set()))
+        self.assertIsNone(check_flags({"--shard", "--binary", "--metrics"}))
+        self.assertEqual(
+            check_flags({"--step"}),
+            "The flag --step can only be used with --window.",
+        )
+        self.assertEqual(
+            check_flags({"--window", "--binary"}),
+            "The flag --window cannot be used with --binary.",
+        )
+        self.assertEqual(
+            check_flags({"--batch", "--nosave", "--print", "--plan"}),
+            "The flag --batch cannot be used with --nosave, --print or "
+            "--plan.",
+        )
+
+        testargs = ["mtrip", self.input_file, "--window", "2", "-b",
+                    self.pickle_file]
+        with patch.object(sys, "argv", testargs):
+            with patch("sys.stdout", new=StringIO()) as fake_out:
+                self.assertEqual(mtrip_main(), 1)
+        self.assertIn("--window cannot be used with --binary",
+                      fake_out.getvalue())
+
+        # --plan is a dry run, so the flags of a real run are refused
+        testargs = ["mtrip", self.input_file, "--plan", "-b",
+                    self.pickle_file, "--metrics", self.output_file]
+        with patch.object(sys, "argv", testargs):
+            with patch("sys.stdout", new=StringIO()) as fake_out:
+                self.assertEqual(mtrip_main(), 1)
+        self.assertIn("--plan cannot be used with --binary or --metrics",
+                      fake_out.getvalue())
+        self.assertFalse(os.path.exists(self.pickle_file))
+
+    def test_suboptimal_threads(self):
+        """Test mtrip-suboptimal gives the same trees for a seed, whatever
+        the number of threads."""
+        testargs = ["mtrip", self.input_file, "--nosave", "--print", "-b",
+                    self.pickle_file]
+        with patch.object(sys, "argv", testargs):
+            with patch("sys.stdout", new=StringIO()):
+                self.assertEqual(mtrip_main(), 0)
+
+        outputs = []
+        for n_threads in ["1", "2"]:
+            testargs = [
+                "mtrip-suboptimal", "-y", self.pickle_file, self.output_file,
+                "-f", "0.5", "-n", "5", "-b", "5", "-s", "3", "-t", n_threads,
+            ]
+            with patch.object(sys, "argv", testargs):
+                with patch("sys.stdout", new=StringIO()):
+                    suboptimal_main()
+            with open(self.output_file, "r") as f:
+                outputs.append(f.read())
+        self.assertEqual(outputs[0], outputs[1])
+        self.assertEqual(outputs[0].count(";"), 5)
+
 
 if __name__ == "__main__":
     unittest.main()
\ No newline at end of file
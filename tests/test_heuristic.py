@@ -0,0 +1,170 @@
+"""Tests for the heuristic search in mtrip."""
+
+import unittest
+from array import array
+from itertools import combinations
+
+from mtrip import triplet_omp
+from mtrip.heuristic import heuristic_median_tree, polish_clades, search_start
+from mtrip.median_tree_reconstruction import get_biparts, simplify_nwk
+from mtrip.simulate import discordant_nwks, random_nwks
+from mtrip.solver import MedianTripletSolver, get_quiet_bipart_counts
+from mtrip.triplets import get_triplet_table
+
+
+def get_triplets(nwk, reverse_dictionary):
+    """Returns the triplets (i, j, k) of the tree, meaning ij|k with i < j."""
+    dictionary = {name: i for i, name in enumerate(reverse_dictionary)}
+    triplets = set()
+    for a, b in get_biparts(simplify_nwk(nwk), dictionary):
+        for x, y in [(a, b), (b, a)]:
+            x_species = [i for i in range(len(dictionary)) if x >> i & 1]
+            y_species = [i for i in range(len(dictionary)) if y >> i & 1]
+            for i, j in combinations(x_species, 2):
+                triplets.update((i, j, k) for k in y_species)
+
+    return triplets
+
+
+class TestHeuristic(unittest.TestCase):
+    """Test cases for mtrip.heuristic."""
+
+    def test_tree_score(self):
+        """Test a tree's score is the number of GT triplets it agrees
+        with."""
+        nwks = discordant_nwks(12, 30, 0.3, seed=1)[1]
+        weights, reverse_dictionary = get_quiet_bipart_counts(nwks)
+        result = heuristic_median_tree(
+            weights, reverse_dictionary, max_starts=2, verbose=False
+        )
+
+        triplets = get_triplets(result["tree"], reverse_dictionary)
+        self.assertEqual(len(triplets), 12 * 11 * 10 // 6)
+        self.assertEqual(
+            result["score"],
+            sum(
+                len(triplets & get_triplets(nwk, reverse_dictionary))
+                for nwk in nwks
+            ),
+        )
+
+    def test_finds_median_score(self):
+        """Test the search finds the median trees' score on small inputs."""
+        solver = MedianTripletSolver()
+        for seed in range(4):
+            nwks = random_nwks(9, 25, seed=seed)
+            weights, reverse_dictionary = get_quiet_bipart_counts(nwks)
+            result = heuristic_median_tree(
+                weights, reverse_dictionary, max_starts=4, verbose=False
+            )
+            self.assertEqual(result["score"], solver.solve(nwks)["score"])
+            self.assertEqual(result["n_starts"], 4)
+
+    def test_local_optimum(self):
+        """Test improving a tree never lowers its score, and stops at a tree
+        no move improves."""
+        nwks = discordant_nwks(30, 20, 0.5, seed=2)[1]
+        weights, reverse_dictionary = get_quiet_bipart_counts(nwks)
+        n_species = len(reverse_dictionary)
+        table = get_triplet_table(weights, n_species)
+
+        left = array("i", [-1] * (2 * n_species - 1))
+        right = array("i", [-1] * (2 * n_species - 1))
+        parent = array("i", [-1] * (2 * n_species - 1))
+        root = triplet_omp.py_add_leaves(
+            table, n_species, left, right, parent, -1,
+            array("i", range(n_species)),
+        )
+        added = triplet_omp.py_triplet_tree_score(
+            table, n_species, left, right, root
+        )
+        root, converged, _ = triplet_omp.py_improve_tree(
+            table, n_species, left, right, parent, root, seed=1
+        )
+        self.assertTrue(converged)
+        improved = triplet_omp.py_triplet_tree_score(
+            table, n_species, left, right, root
+        )
+        self.assertGreaterEqual(improved, added)
+
+        root, converged, n_moves = triplet_omp.py_improve_tree(
+            table, n_species, left, right, parent, root, seed=2
+        )
+        self.assertTrue(converged)
+        self.assertEqual(n_moves, 0)
+        self.assertEqual(
+            triplet_omp.py_triplet_tree_score(
+                table, n_species, left, right, root
+            ),
+            improved,
+        )
+
+    def test_exact_clades(self):
+        """Test replacing a clade with its exact median tree gives the median
+        score when the clade is the whole tree, and never lowers it
+        otherwise."""
+        nwks = random_nwks(10, 20, seed=5)
+        weights, reverse_dictionary = get_quiet_bipart_counts(nwks)
+        table = get_triplet_table(weights, 10)
+        median_score = MedianTripletSolver().solve(nwks)["score"]
+
+        for max_size in [5, 10]:
+            result = search_start(table, 10, 0)
+            left, right, root = result["left"], result["right"], result["root"]
+            parent = array("i", [-1] * 19)
+            for v in range(10, 19):
+                parent[left[v]] = parent[right[v]] = v
+            polish_clades(table, 10, left, right, parent, root, max_size)
+            score = triplet_omp.py_triplet_tree_score(
+                table, 10, left, right, root
+            )
+            self.assertGreaterEqual(score, result["score"])
+            if max_size == 10:
+                self.assertEqual(score, median_score)
+
+        result = heuristic_median_tree(
+            weights,
+            reverse_dictionary,
+            max_starts=1,
+            exact_clades=10,
+            verbose=False,
+        )
+        self.assertEqual(result["score"], median_score)
+
+    def test_reproducible(self):
+        """Test a number of starts gives the same tree with any number of
+        threads."""
+        nwks = discordant_nwks(40, 10, 0.5, seed=3)[1]
+        weights, reverse_dictionary = get_quiet_bipart_counts(nwks)
+        results = [
+            heuristic_median_tree(
+                weights,
+                reverse_dictionary,
+                max_starts=4,
+                n_threads=n_threads,
+                seed=7,
+                verbose=False,
+            )
+            for n_threads in [1, 3]
+        ]
+        self.assertEqual(results[0], results[1])
+
+    def test_time_limit(self):
+        """Test the first start returns a tree even with no time left."""
+        nwks = discordant_nwks(60, 5, 0.5, seed=4)[1]
+        weights, reverse_dictionary = get_quiet_bipart_counts(nwks)
+        result = heuristic_median_tree(
+            weights, reverse_dictionary, time_limit=0, verbose=False
+        )
+        self.assertEqual(result["n_starts"], 1)
+        self.assertEqual(
+            len(get_triplets(result["tree"], reverse_dictionary)),
+            60 * 59 * 58 // 6,
+        )
+
+        with self.assertRaises(ValueError):
+            heuristic_median_tree(weights, reverse_dictionary)
+
+
+if __name__ == "__main__":
+    unittest.main()
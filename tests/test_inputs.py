@@ -0,0 +1,109 @@
+"""Tests for reading compressed GT files in mtrip."""
+
+import bz2
+import gzip
+import io
+import lzma
+import os
+import shutil
+import sys
+import tempfile
+import unittest
+from unittest.mock import patch
+
+from mtrip.inputs import get_input_name, open_input, read_lines
+
+try:
+    import zstandard
+except ImportError:
+    zstandard = None
+
+
+class TestInputs(unittest.TestCase):
+    """Test cases for mtrip.inputs."""
+
+    def setUp(self):
+        self.temp_dir = tempfile.mkdtemp()
+        self.lines = ["((A,B),(C,D));\n", "# A comment\n", "(A,(B,C));\n"]
+        self.lines *= 7
+        self.text = "".join(self.lines).encode()
+
+    def tearDown(self):
+        shutil.rmtree(self.temp_dir)
+
+    def write(self, name, data):
+        filename = os.path.join(self.temp_dir, name)
+        with open(filename, "wb") as f:
+            f.write(data)
+        return filename
+
+    def test_compressed(self):
+        """Test each compression is recognized from the file's contents, and
+        the lines come in chunks of the given size."""
+        contents = [
+            ("genes.nwk", self.text),
+            ("genes.nwk.gz", gzip.compress(self.text)),
+            ("genes.nwk.bz2", bz2.compress(self.text)),
+            ("genes.nwk.xz", lzma.compress(self.text)),
+            # Not named like a compressed file
+            ("genes.txt", gzip.compress(self.text)),
+        ]
+        if zstandard is not None:
+            contents.append(
+                ("genes.nwk.zst", zstandard.ZstdCompressor().compress(self.text))
+            )
+        for name, data in contents:
+            filename = self.write(name, data)
+            with open_input(filename) as f:
+                self.assertEqual(f.readlines(), self.lines)
+            chunks = list(read_lines(filename, chunk_lines=4, queue_chunks=2))
+            self.assertEqual([len(chunk) for chunk in chunks], [4] * 5 + [1])
+            self.assertEqual(sum(chunks, []), self.lines)
+
+    def test_stdin(self):
+        """Test - reads stdin, compressed or not, and leaves it open."""
+        for data in [self.text, gzip.compress(self.text)]:
+            stdin = io.TextIOWrapper(io.BufferedReader(io.BytesIO(data)))
+            with patch.object(sys, "stdin", stdin):
+                self.assertEqual(sum(read_lines("-"), []), self.lines)
+            self.assertFalse(stdin.closed)
+            self.assertFalse(stdin.buffer.closed)
+
+    def test_errors(self):
+        """Test unreadable files raise OSError or ValueError, also when the
+        reading stops early."""
+        with self.assertRaises(OSError):
+            list(read_lines(os.path.join(self.temp_dir, "missing.nwk")))
+        truncated = self.write("cut.nwk.gz", gzip.compress(self.text)[:-10])
+        with self.assertRaises(OSError):
+            list(read_lines(truncated))
+        not_text = self.write("bad.nwk", b"\xff\xfe\xfa\n")
+        with self.assertRaises(ValueError):
+            list(read_lines(not_text))
+
+        # Other errors of the reader thread aren't lost
+        class Broken(io.StringIO):
+            def __next__(self):
+                raise RuntimeError
+
+        with patch("mtrip.inputs.open_input", return_value=Broken()):
+            with self.assertRaises(RuntimeError):
+                list(read_lines("genes.nwk"))
+
+        # The reader thread stops when the lines aren't wanted anymore
+        filename = self.write("genes.nwk.gz", gzip.compress(self.text))
+        chunks = read_lines(filename, chunk_lines=1, queue_chunks=1)
+        self.assertEqual(next(chunks), self.lines[:1])
+        chunks.close()
+
+    def test_input_name(self):
+        """Test the compression suffixes are removed from the names."""
+        self.assertEqual(get_input_name("data/genes.nwk.gz"), "genes.nwk")
+        self.assertEqual(get_input_name("genes.zst"), "genes")
+        self.assertEqual(get_input_name("genes.nwk"), "genes.nwk")
+        self.assertEqual(get_input_name(".gz"), ".gz")
+        self.assertEqual(get_input_name("-"), "stdin")
+
+
+if __name__ == "__main__":
+    unittest.main()
@@ -3,7 +3,16 @@
 import unittest
 import os
 import array
-from mtrip.median_tree_reconstruction import median_triplet_trees
+from io import StringIO
+from unittest.mock import patch
+
+from mtrip import triplet_omp
+from mtrip.median_tree_reconstruction import (
+    append_median_triplet_trees,
+    get_window_bounds,
+    median_triplet_trees,
+    window_median_triplet_trees,
+)
 
 
 class TestMedianReconstruction(unittest.TestCase):
@@ -96,6 +105,46 @@ class TestMedianReconstruction(unittest.TestCase):
         # Verify best_biparts has expected structure
         self.assertEqual(len(best_biparts), 2**len(reverse_dict))
 
+    def test_window_bounds(self):
+        """Test only full windows are used, unless there are too few GTs."""
+        self.assertEqual(get_window_bounds(7, 3, 2), [(0, 3), (2, 5), (4, 7)])
+        self.assertEqual(get_window_bounds(6, 2, 3), [(0, 2), (3, 5)])
+        self.assertEqual(get_window_bounds(2, 3, 1), [(0, 2)])
+
+    def test_window_median_triplet_trees(self):
+        """Test incrementally updated windows match fresh computations."""
+        nwks = [
+            "((A,B),(C,D))",
+            "(A,(B,(C,D)))",
+            "((A,C),(B,D))",
+            "((A,B),(C,(D,E)))",
+            "(((A,E),B),(C,D))",
+            "((A,(B,E)),(C,D))",
+            "(E,((A,D),(B,C)))",
+        ]
+        # Overlapping windows, and windows with gaps between them
+        for window, step in [(3, 1), (2, 3), (4, 2)]:
+            with patch("sys.stdout", new=StringIO()):
+                results = list(
+                    window_median_triplet_trees(nwks, window, step)
+                )
+                # The windows use the labels of all the GTs
+                expected = [
+                    append_median_triplet_trees(
+                        nwks[start:stop],
+                        ["A", "B", "C", "D", "E"],
+                        triplet_omp.zero_array(2 * 3**4),
+                        return_extra=True,
+                    )
+                    for start, stop in get_window_bounds(
+                        len(nwks), window, step
+                    )
+                ]
+
+            self.assertEqual(len(results), len(expected))
+            for (start, stop, score, trees), result in zip(results, expected):
+                self.assertEqual(trees, result[0])
+                self.assertEqual(score, result[3][-1])
 
 if __name__ == "__main__":
     unittest.main()
\ No newline at end of file
@@ -0,0 +1,97 @@
+"""Tests for the per-stage metrics of mtrip."""
+
+import unittest
+from io import StringIO
+from unittest.mock import patch
+
+from mtrip.median_tree_reconstruction import median_triplet_trees
+from mtrip.metrics import Metrics, stage
+
+
+class TestMetrics(unittest.TestCase):
+    """Test cases for mtrip.metrics."""
+
+    def setUp(self):
+        """Set up test data."""
+        self.nwks = [
+            "((A,B),(C,(D,E)))",
+            "(((A,C),B),(D,E))",
+            "(((A,D),B),(C,E))",
+            "((A,(B,E)),(C,D))",
+        ]
+
+    def test_stage(self):
+        """Test a stage records its name, items and measurements."""
+        metrics = Metrics()
+        with stage(metrics, "first", items=3):
+            pass
+        with stage(metrics, "second") as record:
+            record["items"] = 5
+
+        report = metrics.report()
+        self.assertEqual(
+            [(s["name"], s["items"]) for s in report["stages"]],
+            [("first", 3), ("second", 5)],
+        )
+        for record in report["stages"]:
+            self.assertGreaterEqual(record["wall_time"], 0)
+            self.assertGreaterEqual(record["cpu_time"], 0)
+        self.assertGreaterEqual(report["wall_time"], 0)
+
+    def test_peak_rss(self):
+        """Test a stage records how much the peak memory grew while it
+        ran, as well as the peak so far."""
+        metrics = Metrics()
+        with patch(
+            "mtrip.metrics.get_peak_rss", side_effect=[100, 150, 150, 150, 150]
+        ):
+            with stage(metrics, "allocate"):
+                pass
+            with stage(metrics, "idle"):
+                pass
+            report = metrics.report()
+
+        allocate, idle = report["stages"]
+        self.assertEqual(allocate["peak_rss_growth"], 50)
+        self.assertEqual(allocate["peak_rss_so_far"], 150)
+        self.assertEqual(idle["peak_rss_growth"], 0)
+        self.assertEqual(idle["peak_rss_so_far"], 150)
+        self.assertEqual(report["peak_rss"], 150)
+
+        # Without the resource module nothing is measured
+        metrics = Metrics()
+        with patch("mtrip.metrics.get_peak_rss", return_value=None):
+            with stage(metrics, "stage"):
+                pass
+        self.assertIsNone(metrics.stages[0]["peak_rss_so_far"])
+        self.assertIsNone(metrics.stages[0]["peak_rss_growth"])
+
+    def test_no_metrics(self):
+        """Test stages do nothing without a Metrics object."""
+        with stage(None, "stage") as record:
+            record["items"] = 1
+
+    def test_median_triplet_trees(self):
+        """Test every stage of a run is recorded, with the kernel's threads."""
+        metrics = Metrics()
+        with patch("sys.stdout", new=StringIO()):
+            with patch("sys.stderr", new=StringIO()):
+                trees = median_triplet_trees(
+                    self.nwks, n_threads=2, metrics=metrics
+                )
+
+        stages = {s["name"]: s for s in metrics.report()["stages"]}
+        self.assertEqual(
+            list(stages),
+            ["parse", "names", "bipartitions", "weights", "stack", "trees"],
+        )
+        self.assertEqual(stages["parse"]["items"], len(self.nwks))
+        self.assertEqual(stages["names"]["items"], 5)
+        self.assertEqual(stages["trees"]["items"], len(trees))
+        weights = stages["weights"]
+        self.assertGreaterEqual(weights["n_threads"], 1)
+        self.assertEqual(len(weights["thread_times"]), weights["n_threads"])
+
+
+if __name__ == "__main__":
+    unittest.main()
@@ -0,0 +1,73 @@
+"""Tests for estimating the time and memory of a run in mtrip."""
+
+import unittest
+from io import StringIO
+from random import Random
+from unittest.mock import patch
+
+from mtrip.planner import (
+    format_plan,
+    get_n_stack_steps,
+    plan_run,
+    random_nwk,
+)
+
+
+class TestPlanner(unittest.TestCase):
+    """Test cases for mtrip.planner."""
+
+    def setUp(self):
+        """Set up test data."""
+        rng = Random(0)
+        self.names = ["t{}".format(i) for i in range(8)]
+        self.nwks = [random_nwk(self.names, rng) for _ in range(20)]
+        # Fixed rates, so the tests don't depend on the machine
+        self.rates = {"kernel": 1e8, "stack": 1e6, "transform": 1e8}
+
+    def test_random_nwk(self):
+        """Test random trees have every name exactly once."""
+        nwk = random_nwk(self.names, Random(1))
+        leaves = nwk.replace("(", "").replace(")", "").split(",")
+
+        self.assertEqual(sorted(leaves), sorted(self.names))
+        self.assertEqual(nwk.count("("), len(self.names) - 1)
+
+    def test_stack_steps(self):
+        """Test the stack step count matches a direct count."""
+        n = 5
+        expected = 0
+        for combo in range(2**n):
+            k = bin(combo).count("1")
+            if k >= 3:
+                expected += 2**k - 2
+
+        self.assertEqual(get_n_stack_steps(n), expected)
+
+    def test_plan_in_memory(self):
+        """Test a small run is planned in memory."""
+        with patch("sys.stdout", new=StringIO()):
+            plan = plan_run(self.nwks, max_bytes=1024**3, rates=self.rates)
+
+        self.assertEqual(plan["n_species"], 8)
+        self.assertEqual(plan["strategy"], "in memory")
+        self.assertEqual(plan["threads"], 1)
+        stages = {stage: (n_bytes, t) for stage, n_bytes, t in plan["stages"]}
+        self.assertEqual(stages["Weights (C code)"][0], 2 * 3**7 * 4)
+        self.assertGreater(stages["Weights (C code)"][1], 0)
+        lines = format_plan(plan)
+        self.assertIn("Recommended memory strategy: in memory", lines)
+
+    def test_plan_tiled(self):
+        """Test tiling is recommended when the weights don't fit."""
+        with patch("sys.stdout", new=StringIO()):
+            plan = plan_run(self.nwks, max_bytes=1024**3, rates=self.rates)
+            total = sum(n_bytes for _, n_bytes, _ in plan["stages"][:4])
+            # Leave room for everything but half the weights
+            max_bytes = (total - 2 * 3**7 * 2) / 0.8
+            plan = plan_run(self.nwks, max_bytes=max_bytes, rates=self.rates)
+
+        self.assertTrue(plan["strategy"].startswith("--memory"))
+
+
+if __name__ == "__main__":
+    unittest.main()
@@ -0,0 +1,133 @@
+"""Tests for splitting the weights computation into shards in mtrip."""
+
+import unittest
+from io import StringIO
+from unittest.mock import patch
+
+from mtrip import triplet_omp
+from mtrip.median_tree_reconstruction import (
+    get_bipart_counts,
+    get_subset_arrays,
+    get_triplet_weights,
+    shard_triplet_weights,
+)
+from mtrip.shard import (
+    get_shard_assignment,
+    get_shard_blocks,
+    get_subset_costs,
+    merge_shards,
+    parse_shard,
+)
+
+
+class TestShard(unittest.TestCase):
+    """Test cases for mtrip.shard."""
+
+    def setUp(self):
+        """Set up test data."""
+        self.nwks = [
+            "((A,B),(C,(D,E)))",
+            "(((A,C),B),(D,E))",
+            "(((A,D),B),(C,(E,F)))",
+            "((A,(B,E)),(C,(D,F)))",
+            "(E,((A,D),(B,(C,F))))",
+        ]
+
+    def test_parse_shard(self):
+        """Test shards are parsed as 1-based i/N."""
+        self.assertEqual(parse_shard("2/4"), (2, 4))
+        for s in ["0/4", "5/4", "2", "a/b", "1/2/3"]:
+            with self.assertRaises(ValueError):
+                parse_shard(s)
+
+    def test_balanced_assignment(self):
+        """Test each shard gets some of the work, and none gets too much."""
+        with patch("sys.stdout", new=StringIO()):
+            weights, _, reverse_dictionary = get_bipart_counts(self.nwks)
+            subsets, start_i, end_i, _, _ = get_subset_arrays(weights)
+        costs = get_subset_costs(
+            subsets, start_i, end_i, len(reverse_dictionary)
+        )
+        n_shards = 3
+        assignment = get_shard_assignment(costs, n_shards)
+        totals = [0] * n_shards
+        for cost, shard in zip(costs, assignment):
+            totals[shard] += cost
+
+        self.assertEqual(set(assignment), set(range(n_shards)))
+        # Greedy assignment is within the largest cost of the ideal split
+        self.assertLessEqual(max(totals), sum(costs) / n_shards + max(costs))
+
+    def test_shard_blocks(self):
+        """Test the shards' blocks cover the weights array, and split the
+        computed blocks evenly."""
+        for n_species, n_shards in [(5, 3), (13, 4), (14, 5)]:
+            n_blocks = triplet_omp.py_transform_block_count(n_species)
+            end = 0
+            fractions = []
+            for i in range(1, n_shards + 1):
+                first, count, fraction = get_shard_blocks(
+                    n_species, i, n_shards
+                )
+                self.assertEqual(first, end)
+                end = first + count
+                fractions.append(fraction)
+            self.assertEqual(end, n_blocks)
+            self.assertAlmostEqual(sum(fractions), 1)
+            if n_blocks > n_shards:
+                self.assertLess(max(fractions) - min(fractions), 0.1)
+
+    def test_shards_add_up(self):
+        """Test the shards add up to the weights of the full computation,
+        with either engine."""
+        n_shards = 3
+        for engine in triplet_omp.ENGINES:
+            with patch.object(triplet_omp, "_engine", engine):
+                with patch("sys.stdout", new=StringIO()):
+                    weights, _, reverse_dictionary = get_bipart_counts(
+                        self.nwks
+                    )
+                    expected = get_triplet_weights(
+                        weights, len(reverse_dictionary)
+                    )
+                    shards = []
+                    for i in range(1, n_shards + 1):
+                        triplet_weights, _, key = shard_triplet_weights(
+                            self.nwks, (i, n_shards)
+                        )
+                        shards.append(
+                            {
+                                "triplet_weights": triplet_weights,
+                                "shard": {
+                                    "index": i,
+                                    "count": n_shards,
+                                    "key": key,
+                                },
+                            }
+                        )
+
+            # The order the shards are given in doesn't matter
+            merged = merge_shards(shards[::-1])
+
+            self.assertEqual(list(merged), list(expected))
+
+    def test_bad_shards(self):
+        """Test missing, repeated and mismatched shards are refused."""
+        shards = [
+            {
+                "triplet_weights": [0],
+                "shard": {"index": i, "count": 3, "key": "x"},
+            }
+            for i in range(1, 4)
+        ]
+        with self.assertRaises(ValueError):
+            merge_shards(shards[:2])
+        with self.assertRaises(ValueError):
+            merge_shards(shards + shards[:1])
+        shards[1]["shard"]["key"] = "y"
+        with self.assertRaises(ValueError):
+            merge_shards(shards)
+
+
+if __name__ == "__main__":
+    unittest.main()
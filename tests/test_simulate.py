@@ -0,0 +1,49 @@
+"""Tests for the synthetic gene tree generators in mtrip."""
+
+import unittest
+from io import StringIO
+from unittest.mock import patch
+
+from mtrip.median_tree_reconstruction import median_triplet_trees
+from mtrip.simulate import discordant_nwks, get_names, random_nwks
+
+
+class TestSimulate(unittest.TestCase):
+    """Test cases for mtrip.simulate."""
+
+    def leaves(self, nwk):
+        return sorted(nwk.replace("(", "").replace(")", "").split(","))
+
+    def test_random_nwks(self):
+        """Test random trees are binary, on every name, and seeded."""
+        nwks = random_nwks(7, 10, seed=3)
+
+        self.assertEqual(len(nwks), 10)
+        for nwk in nwks:
+            self.assertEqual(self.leaves(nwk), sorted(get_names(7)))
+            self.assertEqual(nwk.count("("), 6)
+        self.assertEqual(nwks, random_nwks(7, 10, seed=3))
+        self.assertNotEqual(nwks, random_nwks(7, 10, seed=4))
+
+    def test_no_discordance(self):
+        """Test gene trees without discordance are the species tree."""
+        species_nwk, nwks = discordant_nwks(6, 5, 0.0, seed=1)
+
+        self.assertEqual(nwks, [species_nwk] * 5)
+
+    def test_discordance(self):
+        """Test the species tree is the median of mildly discordant trees."""
+        species_nwk, nwks = discordant_nwks(6, 50, 0.1, seed=2)
+
+        self.assertGreater(len(set(nwks)), 1)
+        for nwk in nwks:
+            self.assertEqual(self.leaves(nwk), sorted(get_names(6)))
+        with patch("sys.stdout", new=StringIO()):
+            trees = median_triplet_trees(nwks)
+        with patch("sys.stdout", new=StringIO()):
+            expected = median_triplet_trees([species_nwk])
+        self.assertEqual(trees, expected)
+
+
+if __name__ == "__main__":
+    unittest.main()
@@ -0,0 +1,125 @@
+"""Tests for the quiet, reusable solver in mtrip."""
+
+import asyncio
+import threading
+import unittest
+from array import array
+from io import StringIO
+from unittest.mock import patch
+
+import mtrip.median_tree_reconstruction as mtr
+from mtrip import triplet_omp
+from mtrip.simulate import discordant_nwks, random_nwks
+from mtrip.solver import MedianTripletSolver, solve_many
+
+
+class TestSolver(unittest.TestCase):
+    """Test cases for mtrip.solver."""
+
+    def setUp(self):
+        """Set up test data."""
+        self.datasets = [
+            random_nwks(6, 15, seed=0),
+            discordant_nwks(8, 30, 0.3, seed=1)[1],
+            random_nwks(6, 10, seed=2),
+            discordant_nwks(7, 20, 0.2, seed=3)[1],
+        ]
+        with patch("sys.stdout", new=StringIO()):
+            self.expected = [
+                mtr.median_triplet_trees(nwks, return_extra=True)
+                for nwks in self.datasets
+            ]
+
+    def assertSolved(self, result, expected):
+        trees, reverse_dictionary, _, stack, _ = expected
+        self.assertEqual(result["trees"], trees)
+        self.assertEqual(result["reverse_dictionary"], reverse_dictionary)
+        self.assertEqual(
+            result["score"], stack[2 ** len(reverse_dictionary) - 1]
+        )
+
+    def test_nogil_kernel(self):
+        """Test the nogil kernel matches py_compressed_weight_rep."""
+        with patch("sys.stdout", new=StringIO()):
+            weights, _, reverse_dictionary = mtr.get_bipart_counts(
+                self.datasets[1]
+            )
+        n_species = len(reverse_dictionary)
+        arrays = mtr.get_subset_arrays(weights, verbose=False)
+        bipart_weights = [weights[x] for x in zip(arrays[3], arrays[4])]
+        expected = triplet_omp.py_compressed_weight_rep(
+            *arrays, bipart_weights, n_species, verbose=False
+        )
+
+        result = triplet_omp.zero_array(2 * 3 ** (n_species - 1), "i")
+        triplet_omp.compressed_weight_rep_nogil(
+            *(array("i", a) for a in arrays),
+            array("i", bipart_weights),
+            n_species,
+            result,
+            n_threads=2,
+        )
+        self.assertEqual(list(result), list(expected))
+
+        with self.assertRaises(ValueError):
+            triplet_omp.compressed_weight_rep_nogil(
+                *(array("i", a) for a in arrays),
+                array("i", bipart_weights),
+                n_species,
+                triplet_omp.zero_array(10, "i"),
+            )
+
+    def test_solve_is_quiet(self):
+        """Test solving prints nothing, and reuses the weights arrays."""
+        solver = MedianTripletSolver()
+        with patch("sys.stdout", new=StringIO()) as fake_out:
+            results = [solver.solve(nwks) for nwks in self.datasets]
+        self.assertEqual(fake_out.getvalue(), "")
+        for result, expected in zip(results, self.expected):
+            self.assertSolved(result, expected)
+        # One array for each number of species
+        self.assertEqual(sorted(solver._weights), [6, 7, 8])
+
+    def test_return_arrays(self):
+        """Test the weights and stack are returned as read-only views."""
+        solver = MedianTripletSolver()
+        result = solver.solve(self.datasets[1], return_arrays=True)
+        _, _, triplet_weights, stack, _ = self.expected[1]
+        self.assertEqual(result["triplet_weights"].format, "i")
+        self.assertTrue(result["triplet_weights"].readonly)
+        self.assertEqual(list(result["triplet_weights"]), list(triplet_weights))
+        self.assertEqual(list(result["stack"]), list(stack))
+        # A view of the solver's own weights array
+        self.assertIs(result["triplet_weights"].obj, solver._weights[8])
+
+    def test_threads(self):
+        """Test solvers in several threads give the same results."""
+        results = [None] * len(self.datasets)
+
+        def solve(i):
+            results[i] = MedianTripletSolver().solve(self.datasets[i])
+
+        threads = [
+            threading.Thread(target=solve, args=(i,))
+            for i in range(len(self.datasets))
+        ]
+        for thread in threads:
+            thread.start()
+        for thread in threads:
+            thread.join()
+        for result, expected in zip(results, self.expected):
+            self.assertSolved(result, expected)
+
+    def test_async(self):
+        """Test solve_async and solve_many."""
+        solver = MedianTripletSolver()
+        result = asyncio.run(solver.solve_async(self.datasets[0]))
+        self.assertSolved(result, self.expected[0])
+
+        results = asyncio.run(solve_many(self.datasets, n_workers=2))
+        for result, expected in zip(results, self.expected):
+            self.assertSolved(result, expected)
+
+
+if __name__ == "__main__":
+    unittest.main()
@@ -0,0 +1,108 @@
+"""Tests for clade support from resampled replicates in mtrip."""
+
+import unittest
+from io import StringIO
+from random import Random
+from unittest.mock import patch
+
+from mtrip import triplet_omp
+from mtrip.median_tree_reconstruction import (
+    get_biparts,
+    median_triplet_trees,
+    simplify_nwk,
+)
+from mtrip.support import (
+    get_clade_frequencies,
+    replicate_clade_support,
+    resample_nwks,
+)
+
+
+class TestSupport(unittest.TestCase):
+    """Test cases for mtrip.support."""
+
+    def setUp(self):
+        """Set up test data."""
+        self.nwks = [
+            "((A,B),(C,D))",
+            "(A,(B,(C,D)))",
+            "((A,C),(B,D))",
+            "((A,B),(C,(D,E)))",
+            "(((A,E),B),(C,D))",
+        ]
+
+    def test_clade_frequencies(self):
+        """Test the clade frequencies match counting over all median trees."""
+        with patch("sys.stdout", new=StringIO()):
+            trees, reverse_dictionary, _, _, best_biparts = (
+                median_triplet_trees(self.nwks, return_extra=True)
+            )
+        n_species = len(reverse_dictionary)
+        dictionary = {name: i for i, name in enumerate(reverse_dictionary)}
+
+        expected = {}
+        for tree in trees:
+            for a, b in get_biparts(simplify_nwk(tree), dictionary):
+                for clade in (a, b):
+                    if bin(clade).count("1") > 1 and clade != 2**n_species - 1:
+                        expected[clade] = expected.get(clade, 0) + 1 / len(trees)
+
+        frequencies = get_clade_frequencies(2**n_species - 1, best_biparts)
+
+        self.assertEqual(frequencies.keys(), expected.keys())
+        for clade in expected:
+            self.assertAlmostEqual(frequencies[clade], expected[clade])
+
+    def test_resample_nwks(self):
+        """Test bootstrap and jackknife replicates have the expected sizes."""
+        rng = Random(0)
+        bootstrap = resample_nwks(10, "bootstrap", rng)
+        jackknife = resample_nwks(10, "jackknife", rng)
+
+        self.assertEqual(sum(bootstrap.values()), 10)
+        self.assertEqual(len(jackknife), 5)
+        self.assertEqual(set(jackknife.values()), {1})
+        with self.assertRaises(ValueError):
+            resample_nwks(10, "foo", rng)
+
+    def test_replicate_clade_support(self):
+        """Test support is full for identical GTs, and reproducible."""
+        with patch("sys.stdout", new=StringIO()):
+            support, reverse_dictionary = replicate_clade_support(
+                ["((A,B),(C,(D,E)))"] * 4, 5, group_size=2
+            )
+        # AB, CDE and DE
+        self.assertEqual(support, {3: 1.0, 28: 1.0, 24: 1.0})
+
+        with patch("sys.stdout", new=StringIO()):
+            results = [
+                replicate_clade_support(
+                    self.nwks, 6, resample=resample, group_size=group_size,
+                    seed=1, n_threads=2,
+                )[0]
+                for resample in ["bootstrap", "jackknife"]
+                for group_size in [1, 4]
+            ]
+        # Group sizes don't change the results
+        self.assertEqual(results[0], results[1])
+        self.assertEqual(results[2], results[3])
+        for support in results:
+            for frequency in support.values():
+                self.assertTrue(0 < frequency <= 1 + 1e-12)
+
+    def test_engines_agree(self):
+        """Test the replicates get the same support with both engines."""
+        results = []
+        for engine in triplet_omp.ENGINES:
+            with patch.object(triplet_omp, "_engine", engine):
+                with patch("sys.stdout", new=StringIO()):
+                    results.append(
+                        replicate_clade_support(
+                            self.nwks, 4, group_size=3, seed=2
+                        )[0]
+                    )
+        self.assertEqual(results[0], results[1])
+
+
+if __name__ == "__main__":
+    unittest.main()
@@ -0,0 +1,81 @@
+"""Tests for computing the weights array in tiles in mtrip."""
+
+import unittest
+from io import StringIO
+from unittest.mock import patch
+
+from mtrip.median_tree_reconstruction import (
+    get_bipart_counts,
+    get_stack,
+    get_triplet_weights,
+    median_triplet_trees,
+)
+from mtrip.tiles import TiledWeights, get_n_tile_species, get_tiles
+
+
+class TestTiles(unittest.TestCase):
+    """Test cases for mtrip.tiles."""
+
+    def setUp(self):
+        """Set up test data."""
+        self.nwks = [
+            "((A,B),(C,(D,E)))",
+            "(((A,C),B),(D,E))",
+            "(((A,D),B),(C,(E,F)))",
+            "((A,(B,E)),(C,(D,F)))",
+            "(E,((A,D),(B,(C,F))))",
+            "((A,F),(B,C))",
+        ]
+
+    def test_n_tile_species(self):
+        """Test tiles are only used when the array doesn't fit."""
+        # 2*3^4 ints for 5 species
+        self.assertEqual(get_n_tile_species(5, 4 * 162), 0)
+        self.assertEqual(get_n_tile_species(5, 4 * 81), 1)
+        self.assertEqual(get_n_tile_species(5, 4 * 80), 2)
+        self.assertEqual(get_n_tile_species(5, 1), 5)
+
+    def test_tiles_cover_canonical_reps(self):
+        """Test the tiles are disjoint and cover the canonical positions."""
+        n_species, n_fixed = 4, 2
+        tile_size = 3 ** (n_species - n_fixed)
+        starts = [lo for _, _, _, lo in get_tiles(n_species, n_fixed)]
+
+        self.assertEqual(len(starts), len(set(starts)))
+        for (_, tile_x, tile_y, lo) in get_tiles(n_species, n_fixed):
+            self.assertEqual(lo % tile_size, 0)
+            self.assertEqual(tile_x & tile_y, 0)
+            # The highest species of the tile, if any, is in tile_x
+            if tile_x | tile_y:
+                self.assertGreater(tile_x, tile_y)
+
+    def test_tiled_weights(self):
+        """Test the tiled weights equal the in-memory weights."""
+        with patch("sys.stdout", new=StringIO()):
+            weights, _, reverse_dictionary = get_bipart_counts(self.nwks)
+            n_species = len(reverse_dictionary)
+            expected = get_triplet_weights(weights, n_species)
+            for max_bytes in [4 * 81, 4 * 27, 4 * 3, 4]:
+                tiled = get_triplet_weights(
+                    weights, n_species, tiling=TiledWeights(max_bytes)
+                )
+                self.assertEqual(list(tiled), list(expected))
+
+                stack, best_biparts = get_stack(tiled, n_species)
+                expected_stack, expected_best = get_stack(expected, n_species)
+                self.assertEqual(list(stack), list(expected_stack))
+                self.assertEqual(best_biparts, expected_best)
+
+    def test_tiled_median_trees(self):
+        """Test tiling doesn't change the median trees."""
+        with patch("sys.stdout", new=StringIO()):
+            expected = median_triplet_trees(self.nwks)
+            trees = median_triplet_trees(
+                self.nwks, tiling=TiledWeights(4 * 27)
+            )
+
+        self.assertEqual(sorted(trees), sorted(expected))
+
+
+if __name__ == "__main__":
+    unittest.main()
@@ -2,7 +2,12 @@
 
 import unittest
 import array
+import mmap
 from mtrip import triplet_omp
+from mtrip.median_tree_reconstruction import get_subset_arrays
+from mtrip.simulate import random_nwks
+from mtrip.bitsnbobs import init_bipart_rep_function, iter_subsets
+from mtrip.solver import MedianTripletSolver, get_quiet_bipart_counts
 
 
 class TestTripletOmp(unittest.TestCase):
@@ -104,6 +109,323 @@ class TestTripletOmp(unittest.TestCase):
         # verify that the array has non-zero values where we'd expect them.
         self.assertTrue(any(w > 0 for w in weights))
 
+    def test_py_compressed_weight_rep_batch(self):
+        """Test batched replicates match computing each one on its own."""
+        # Bipartitions AB|C and A|BC over {A,B,C}, and C|D over {A,B,C,D}
+        subsets = [7, 12]
+        start_i = [0, 2]
+        end_i = [2, 3]
+        biparts_a = [3, 1, 4]
+        biparts_b = [4, 6, 8]
+        replicate_weights = [[1, 0, 2], [0, 3, 1], [2, 2, 0]]
+        n_species = 4
+        size = 2 * 3**(n_species - 1)
+
+        weights = triplet_omp.py_compressed_weight_rep_batch(
+            subsets, start_i, end_i, biparts_a, biparts_b,
+            replicate_weights, n_species, n_threads=2,
+        )
+
+        self.assertEqual(len(weights), 3 * size)
+        for r, row in enumerate(replicate_weights):
+            expected = triplet_omp.py_compressed_weight_rep(
+                subsets, start_i, end_i, biparts_a, biparts_b, row, n_species
+            )
+            self.assertEqual(
+                list(weights[r * size:(r + 1) * size]), list(expected)
+            )
+
+    def test_simd_levels_agree(self):
+        """Test every instruction set gives the same weights as plain C."""
+        self.assertEqual(triplet_omp.simd_levels()[0], "scalar")
+        with self.assertRaises(ValueError):
+            triplet_omp.set_simd("bogus")
+
+        # One subset with 37 bipartitions, so every vector width has a
+        # partial last block, and some negative weights
+        n_species = 7
+        universe = 2**n_species - 1
+        biparts_a = []
+        biparts_b = []
+        for a in range(1, universe):
+            b = universe ^ a
+            if a < b:
+                biparts_a.append(a)
+                biparts_b.append(b)
+        biparts_a = biparts_a[:37]
+        biparts_b = biparts_b[:37]
+        bipart_weights = [(i * 7) % 11 - 3 for i in range(37)]
+        arrays = ([universe], [0], [37], biparts_a, biparts_b, bipart_weights)
+
+        default = triplet_omp.get_simd()
+        try:
+            triplet_omp.set_simd("scalar")
+            expected = list(
+                triplet_omp.py_compressed_weight_rep(
+                    *arrays, n_species, engine="scatter"
+                )
+            )
+            self.assertTrue(any(w < 0 for w in expected))
+            for level in triplet_omp.simd_levels():
+                triplet_omp.set_simd(level)
+                self.assertEqual(triplet_omp.get_simd(), level)
+                weights = triplet_omp.py_compressed_weight_rep(
+                    *arrays, n_species, engine="scatter"
+                )
+                self.assertEqual(list(weights), expected, level)
+        finally:
+            triplet_omp.set_simd(default)
+
+    def test_engines_agree(self):
+        """Test the transform engine gives the same weights as scattering,
+        also when adding to existing weights."""
+        self.assertIn(triplet_omp.get_engine(), triplet_omp.ENGINES)
+        with self.assertRaises(ValueError):
+            triplet_omp.set_engine("bogus")
+
+        # All the bipartitions of ((A,B),(C,(D,E))) and (A,(B,C)), with a
+        # negative weight
+        subsets = [3, 6, 7, 24, 28, 31]
+        start_i = [0, 1, 2, 3, 4, 5]
+        end_i = [1, 2, 3, 4, 5, 6]
+        biparts_a = [1, 2, 1, 8, 4, 3]
+        biparts_b = [2, 4, 6, 16, 24, 28]
+        bipart_weights = [2, 1, 1, 2, -1, 2]
+        arrays = (subsets, start_i, end_i, biparts_a, biparts_b,
+                  bipart_weights)
+        n_species = 5
+
+        scattered = triplet_omp.py_compressed_weight_rep(
+            *arrays, n_species, verbose=False, engine="scatter"
+        )
+        transformed = triplet_omp.py_compressed_weight_rep(
+            *arrays, n_species, n_threads=2, verbose=False,
+            engine="transform"
+        )
+        self.assertEqual(list(transformed), list(scattered))
+        self.assertTrue(any(w < 0 for w in scattered))
+
+        triplet_omp.py_compressed_weight_rep(
+            *arrays, n_species, weights=transformed, verbose=False,
+            engine="transform"
+        )
+        self.assertEqual(list(transformed), [2 * w for w in scattered])
+
+    def test_engines_agree_many_species(self):
+        """Test the engines agree with kernels of more species than fit in
+        one block of the scatter engine, with and without atomic updates."""
+        weights, reverse_dictionary = get_quiet_bipart_counts(
+            random_nwks(11, 10, seed=3)
+        )
+        n_species = len(reverse_dictionary)
+        arrays = get_subset_arrays(weights, verbose=False)
+        bipart_weights = [weights[x] for x in zip(*arrays[3:])]
+
+        expected = list(triplet_omp.py_compressed_weight_rep(
+            *arrays, bipart_weights, n_species, verbose=False,
+            engine="transform"
+        ))
+        for n_threads in [1, 2]:
+            scattered = triplet_omp.py_compressed_weight_rep(
+                *arrays, bipart_weights, n_species, n_threads=n_threads,
+                verbose=False, engine="scatter"
+            )
+            self.assertEqual(list(scattered), expected)
+
+    def test_transform_in_pieces(self):
+        """Test the triplet counts of groups of subsets add up, and the
+        blocks of the transform can be found separately."""
+        weights, reverse_dictionary = get_quiet_bipart_counts(
+            random_nwks(13, 10, seed=4)
+        )
+        n_species = len(reverse_dictionary)
+        arrays = get_subset_arrays(weights, verbose=False)
+        bipart_weights = [weights[x] for x in zip(*arrays[3:])]
+        expected = list(triplet_omp.py_compressed_weight_rep(
+            *arrays, bipart_weights, n_species, verbose=False,
+            engine="scatter"
+        ))
+
+        subsets, start_i, end_i = arrays[:3]
+        triplets = triplet_omp.py_count_triplets(
+            subsets[:5], start_i[:5], end_i[:5], *arrays[3:],
+            bipart_weights, n_species
+        )
+        triplet_omp.py_count_triplets(
+            subsets[5:], start_i[5:], end_i[5:], *arrays[3:],
+            bipart_weights, n_species, n_threads=2, triplets=triplets
+        )
+        n_blocks = triplet_omp.py_transform_block_count(n_species)
+        self.assertGreater(n_blocks, 3)
+        result = triplet_omp.zero_array(len(expected), 'i')
+        for i in range(3):
+            first = n_blocks * i // 3
+            triplet_omp.py_transform_triplet_counts(
+                triplets, n_species, n_threads=2, weights=result,
+                first_block=first, n_blocks=n_blocks * (i + 1) // 3 - first
+            )
+        self.assertEqual(list(result), expected)
+
+        with self.assertRaises(ValueError):
+            triplet_omp.py_transform_triplet_counts(
+                triplets, n_species, first_block=1, n_blocks=n_blocks
+            )
+
+    def test_buffers(self):
+        """Test int buffers are used without copying, also read-only ones
+        and mmaps, and give the same weights as lists."""
+        ints = array.array('i', [1, 2, 3])
+        self.assertIs(triplet_omp.as_int_buffer(ints), ints)
+        view = memoryview(bytes(ints)).cast('i')
+        self.assertIs(triplet_omp.as_int_buffer(view), view)
+        copied = triplet_omp.as_int_buffer([1, 2, 3])
+        self.assertEqual(copied, ints)
+        # Not C ints, so copied
+        self.assertEqual(
+            triplet_omp.as_int_buffer(array.array('q', [1, 2, 3])), ints
+        )
+
+        weights, reverse_dictionary = get_quiet_bipart_counts(
+            random_nwks(6, 10, seed=5)
+        )
+        n_species = len(reverse_dictionary)
+        arrays = get_subset_arrays(weights, verbose=False)
+        bipart_weights = [weights[x] for x in zip(*arrays[3:])]
+        expected = triplet_omp.py_compressed_weight_rep(
+            *[list(x) for x in arrays], bipart_weights, n_species,
+            verbose=False
+        )
+
+        size = 2 * 3 ** (n_species - 1)
+        with mmap.mmap(-1, 4 * size) as buffer:
+            out = memoryview(buffer).cast('i')
+            result = triplet_omp.py_compressed_weight_rep(
+                *[memoryview(bytes(x)).cast('i') for x in arrays],
+                array.array('i', bipart_weights), n_species, weights=out,
+                verbose=False
+            )
+            self.assertIs(result, out)
+            self.assertEqual(list(out), list(expected))
+            out.release()
+
+    def test_py_add_remapped_weights(self):
+        """Test remapping weights to more species gives the weights of the
+        same GTs with the new labels, over several blocks and threads."""
+        weights, reverse_dictionary = get_quiet_bipart_counts(
+            random_nwks(9, 10, seed=4)
+        )
+        # The new species 0 and 5 aren't in the GTs, and the old species 1
+        # and 2 swap places
+        positions = [1, 3, 2, 4, 6, 7, 8, 9, 10]
+
+        def relabel(x):
+            return sum(2**p for s, p in enumerate(positions) if x >> s & 1)
+
+        new_weights = {}
+        for (a, b), weight in weights.items():
+            a, b = sorted([relabel(a), relabel(b)])
+            new_weights[(a, b)] = weight
+        expected = []
+        for bipart_counts, n_species in [(weights, 9), (new_weights, 11)]:
+            arrays = get_subset_arrays(bipart_counts, verbose=False)
+            expected.append(triplet_omp.py_compressed_weight_rep(
+                *arrays, [bipart_counts[x] for x in zip(*arrays[3:])],
+                n_species, verbose=False
+            ))
+
+        for n_threads in [1, 3]:
+            remapped = triplet_omp.zero_array(len(expected[1]))
+            triplet_omp.py_add_remapped_weights(
+                expected[0], positions, remapped, n_threads=n_threads
+            )
+            self.assertEqual(list(remapped), list(expected[1]))
+        triplet_omp.py_add_remapped_weights(
+            expected[0], positions, remapped
+        )
+        self.assertEqual(list(remapped), [2 * w for w in expected[1]])
+
+        with self.assertRaises(ValueError):
+            triplet_omp.py_add_remapped_weights(
+                expected[0], [0] * 9, remapped
+            )
+        with self.assertRaises(ValueError):
+            triplet_omp.py_add_remapped_weights(
+                expected[0], positions[:8], remapped
+            )
+
+
+    def test_py_sample_suboptimal(self):
+        """Test py_sample_suboptimal finds all the trees above the minimum
+        score, and samples the same trees on any number of threads."""
+        n_species = 6
+        result = MedianTripletSolver().solve(
+            random_nwks(n_species, 30, seed=1), return_arrays=True
+        )
+        weights, stack = result["triplet_weights"], result["stack"]
+        bipart_rep = init_bipart_rep_function(n_species)
+
+        def get_trees(x):
+            """All the trees on x, as their scores and splits."""
+            if bin(x).count("1") <= 2:
+                return [(0, ())]
+            trees = []
+            for a in iter_subsets(x):
+                if 2 * a < x:
+                    for score_a, splits_a in get_trees(a):
+                        for score_b, splits_b in get_trees(x - a):
+                            trees.append((
+                                weights[bipart_rep(a, x - a)] + score_a
+                                + score_b,
+                                ((x, a),) + splits_a + splits_b,
+                            ))
+            return trees
+
+        universe = 2**n_species - 1
+        min_score = stack[universe] - 20
+        expected = sorted(
+            (score, sorted(splits))
+            for score, splits in get_trees(universe)
+            if score >= min_score
+        )
+        self.assertGreater(len(expected), 1)
+
+        # With a large enough burn-in, every tree is a candidate
+        scores, splits, n_candidates = triplet_omp.py_sample_suboptimal(
+            weights, stack, n_species, min_score, 1000, 1000
+        )
+        self.assertEqual(n_candidates, len(expected))
+        stride = 2 * (n_species - 1)
+        found = []
+        for i, score in enumerate(scores):
+            pairs = splits[i * stride:(i + 1) * stride]
+            found.append((score, sorted(
+                (x, a) for x, a in zip(pairs[::2], pairs[1::2]) if x != 0
+            )))
+        self.assertEqual(sorted(found), expected)
+
+        # Only the median trees have the best score
+        scores, _, n_candidates = triplet_omp.py_sample_suboptimal(
+            weights, stack, n_species, stack[universe], 1000, 1000
+        )
+        self.assertEqual(n_candidates, len(result["trees"]))
+        self.assertEqual(set(scores), {stack[universe]})
+
+        samples = [
+            triplet_omp.py_sample_suboptimal(
+                weights, stack, n_species, min_score, 20, 20, seed=5,
+                n_threads=n_threads,
+            )
+            for n_threads in [1, 3]
+        ]
+        self.assertEqual(samples[0], samples[1])
+        self.assertEqual(len(samples[0][0]), 20)
+        self.assertTrue(all(score >= min_score for score in samples[0][0]))
+
+        with self.assertRaises(ValueError):
+            triplet_omp.py_sample_suboptimal(
+                weights, stack[:-1], n_species, min_score, 1, 1
+            )
+
 
 if __name__ == "__main__":
     unittest.main()
\ No newline at end of file
@@ -0,0 +1,149 @@
+"""Tests for the rooted triplet frequencies in mtrip."""
+
+import os
+import shutil
+import tempfile
+import unittest
+from itertools import combinations
+
+from mtrip import triplet_omp
+from mtrip.median_tree_reconstruction import (
+    get_biparts,
+    median_triplet_trees,
+    simplify_nwk,
+)
+from mtrip.simulate import discordant_nwks, random_nwks
+from mtrip.solver import get_quiet_bipart_counts
+from mtrip.triplets import (
+    frequency_median_triplet_trees,
+    get_triplet_frequencies,
+    get_triplet_table,
+    load_triplet_frequencies,
+    save_triplet_frequencies,
+)
+
+
+def get_triplets(nwk, reverse_dictionary):
+    """Returns the triplets (i, j, k) of the tree, meaning ij|k with i < j."""
+    dictionary = {name: i for i, name in enumerate(reverse_dictionary)}
+    triplets = set()
+    for a, b in get_biparts(simplify_nwk(nwk), dictionary):
+        for x, y in [(a, b), (b, a)]:
+            x_species = [i for i in range(len(dictionary)) if x >> i & 1]
+            y_species = [i for i in range(len(dictionary)) if y >> i & 1]
+            for i, j in combinations(x_species, 2):
+                triplets.update((i, j, k) for k in y_species)
+
+    return triplets
+
+
+class TestTriplets(unittest.TestCase):
+    """Test cases for mtrip.triplets."""
+
+    def setUp(self):
+        self.temp_dir = tempfile.mkdtemp()
+
+    def tearDown(self):
+        shutil.rmtree(self.temp_dir)
+
+    def test_triplet_table(self):
+        """Test the table counts the GTs with each triplet."""
+        nwks = random_nwks(7, 12, seed=0) + ["((t0,t1),(t2,t3));"]
+        weights, reverse_dictionary = get_quiet_bipart_counts(nwks)
+        n_species = len(reverse_dictionary)
+        table = get_triplet_table(weights, n_species, n_threads=2)
+
+        pairs = list(combinations(range(n_species), 2))
+        expected = [0] * len(table)
+        for nwk in nwks:
+            for i, j, k in get_triplets(nwk, reverse_dictionary):
+                expected[k * len(pairs) + pairs.index((i, j))] += 1
+        self.assertEqual(list(table), expected)
+
+    def test_triplet_frequencies(self):
+        """Test the frequencies count the GTs with each resolution of each
+        triple, and convert back to the table."""
+        nwks = random_nwks(8, 15, seed=1) + ["((t0,t1),(t2,t3));"]
+        weights, reverse_dictionary = get_quiet_bipart_counts(nwks)
+        n_species = len(reverse_dictionary)
+        counts = get_triplet_frequencies(weights, n_species, n_threads=3)
+
+        expected = []
+        for a, b, c in combinations(range(n_species), 3):
+            for triplet in [(a, b, c), (a, c, b), (b, c, a)]:
+                expected.append(
+                    sum(
+                        triplet in get_triplets(nwk, reverse_dictionary)
+                        for nwk in nwks
+                    )
+                )
+        self.assertEqual(list(counts), expected)
+
+        table = get_triplet_table(weights, n_species)
+        self.assertEqual(
+            list(
+                triplet_omp.py_triplet_table_from_frequencies(
+                    counts, n_species, n_threads=2
+                )
+            ),
+            list(table),
+        )
+        with self.assertRaises(ValueError):
+            triplet_omp.py_triplet_frequencies(table[1:], n_species)
+
+    def test_save_load(self):
+        """Test the binary and tab-separated files give back the
+        frequencies, whatever the order of the tab-separated lines."""
+        nwks = discordant_nwks(9, 20, 0.5, seed=2)[1]
+        weights, reverse_dictionary = get_quiet_bipart_counts(nwks)
+        counts = get_triplet_frequencies(weights, len(reverse_dictionary))
+
+        for name in ["triplets.p", "triplets.tsv"]:
+            filename = os.path.join(self.temp_dir, name)
+            save_triplet_frequencies(
+                filename, counts, reverse_dictionary, len(nwks)
+            )
+            frequencies = load_triplet_frequencies(filename)
+            self.assertEqual(
+                list(frequencies["triplet_frequencies"]), list(counts)
+            )
+            self.assertEqual(
+                frequencies["reverse_dictionary"], reverse_dictionary
+            )
+            self.assertEqual(frequencies["n_nwks"], len(nwks))
+
+        # The same triplets, written by another tool
+        filename = os.path.join(self.temp_dir, "other.tsv")
+        with open(filename, "w") as f:
+            f.write("c\tb\ta\t1\t2\t3\n")
+            f.write("a\td\tb\t0\t0\t4\n")
+        frequencies = load_triplet_frequencies(filename)
+        self.assertEqual(frequencies["reverse_dictionary"], list("abcd"))
+        # abc, abd, acd, bcd: cb|a is bc|a, ca|b is ac|b, and ba|c is ab|c
+        self.assertEqual(
+            list(frequencies["triplet_frequencies"]),
+            [3, 2, 1, 0, 0, 4] + [0] * 6,
+        )
+        self.assertEqual(frequencies["n_nwks"], 6)
+
+        with open(filename, "w") as f:
+            f.write("a\tb\t1\t2\n")
+        with self.assertRaises(ValueError):
+            load_triplet_frequencies(filename)
+
+    def test_median_trees(self):
+        """Test the frequencies give the same median trees as the GTs."""
+        for seed in range(3):
+            nwks = random_nwks(7, 10, seed=seed)
+            weights, reverse_dictionary = get_quiet_bipart_counts(nwks)
+            counts = get_triplet_frequencies(weights, len(reverse_dictionary))
+            self.assertEqual(
+                frequency_median_triplet_trees(
+                    counts, reverse_dictionary, len(nwks)
+                ),
+                median_triplet_trees(nwks),
+            )
+
+
+if __name__ == "__main__":
+    unittest.main()